@@ -8,10 +8,18 @@ Amazon Bedrock LLM統合ハンドラー
 import json
 import boto3
 import logging
+import time
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 import os
 
+# レイテンシ認識型モデルルーティング
+from model_router import get_model_router
+
+# 埋め込み処理と共有するBedrockレート制限・サーキットブレーカー（共有レイヤー lambda/layers/bedrock-common）
+from bedrock_rate_limiter import get_bedrock_rate_limiter, estimate_tokens, limiter_client_config
+from resilience import get_resilient_caller
+
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,7 +29,9 @@ class BedrockLLMHandler:
     
     def __init__(self):
         """初期化"""
-        self.bedrock_client = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+        # リトライはレート制限側で行うため、SDKのリトライは無効化
+        self.bedrock_client = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+                                           config=limiter_client_config())
         self.model_id = os.environ.get('BEDROCK_MODEL_ID', 'amazon.nova-pro-v1:0')
         
         # 入力値検証とセキュリティ強化
@@ -36,7 +46,16 @@ class BedrockLLMHandler:
         # サポートされているモデルの検証
         self._validate_model_id()
         
-    def generate_response(self, query: str, context: List[Dict[str, Any]], user_id: str = None) -> Dict[str, Any]:
+        # リクエスト単位のモデルルーティング（無効時はBEDROCK_MODEL_IDに固定）
+        self.model_router = None
+        if os.environ.get('MODEL_ROUTING_ENABLED', 'true').lower() == 'true':
+            try:
+                self.model_router = get_model_router()
+            except Exception as e:
+                logger.warning(f"モデルルーターの初期化に失敗しました。固定モデルを使用します: {e}")
+        
+    def generate_response(self, query: str, context: List[Dict[str, Any]], user_id: str = None,
+                          latency_slo_ms: Optional[float] = None) -> Dict[str, Any]:
         """
         RAG応答を生成
         
@@ -44,6 +63,7 @@ class BedrockLLMHandler:
             query: ユーザーの質問
             context: 検索された関連文書
             user_id: ユーザーID（権限チェック用）
+            latency_slo_ms: レイテンシSLOヒント（ミリ秒、モデル選択に使用）
             
         Returns:
             生成された応答とメタデータ
@@ -65,13 +85,37 @@ class BedrockLLMHandler:
             # プロンプトを構築
             prompt = self._build_prompt(query, context_text)
             
+            # モデルを選択
+            routing_decision = None
+            model_id = self.model_id
+            if self.model_router:
+                routing_decision = self.model_router.route(query, context_text, len(context or []), latency_slo_ms)
+                model_id = routing_decision.model_id
+            
             # Bedrockに送信
-            response = self._invoke_bedrock(prompt)
+            invoke_start = time.time()
+            try:
+                response = self._invoke_bedrock(prompt, model_id)
+            except Exception:
+                if routing_decision:
+                    latency_ms = (time.time() - invoke_start) * 1000
+                    self.model_router.record_latency(model_id, latency_ms, success=False)
+                    self.model_router.export_decision(routing_decision, latency_ms, success=False)
+                raise
+            latency_ms = (time.time() - invoke_start) * 1000
             
             # 応答を整形
-            formatted_response = self._format_response(response, context, query)
+            formatted_response = self._format_response(response, context, query, model_id)
             
-            logger.info(f"RAG応答生成完了 - ユーザー: {user_id}, クエリ: {query[:50]}...")
+            if routing_decision:
+                self.model_router.record_latency(model_id, latency_ms, success=True)
+                self.model_router.export_decision(routing_decision, latency_ms, success=True)
+                formatted_response['routing'] = {
+                    **routing_decision.to_dict(),
+                    'latency_ms': latency_ms
+                }
+            
+            logger.info(f"RAG応答生成完了 - ユーザー: {user_id}, モデル: {model_id}, クエリ: {query[:50]}...")
             
             return formatted_response
             
@@ -123,11 +167,12 @@ class BedrockLLMHandler:
         
         return prompt
     
-    def _invoke_bedrock(self, prompt: str) -> Dict[str, Any]:
+    def _invoke_bedrock(self, prompt: str, model_id: Optional[str] = None) -> Dict[str, Any]:
         """Bedrockモデルを呼び出し（モデル別対応）"""
+        model_id = model_id or self.model_id
         try:
             # モデル別のリクエスト形式を選択
-            if self.model_id.startswith('amazon.nova'):
+            if model_id.startswith('amazon.nova'):
                 # Nova Pro用のリクエスト形式（正しいフォーマット）
                 request_body = {
                     "messages": [
@@ -145,7 +190,7 @@ class BedrockLLMHandler:
                         "temperature": self.temperature
                     }
                 }
-            elif self.model_id.startswith('anthropic.claude'):
+            elif model_id.startswith('anthropic.claude'):
                 # Claude 3用のリクエスト形式
                 request_body = {
                     "anthropic_version": "bedrock-2023-05-31",
@@ -168,10 +213,15 @@ class BedrockLLMHandler:
                     }
                 }
             
-            response = self.bedrock_client.invoke_model(
-                modelId=self.model_id,
+            # モデル単位のレート制限・同時実行制御・リトライの各試行にブレーカーを適用
+            # （生成は高コストのためヘッジしない）
+            response = get_bedrock_rate_limiter(model_id).execute(
+                get_resilient_caller('bedrock-runtime', model_id).call,
+                self.bedrock_client.invoke_model,
+                modelId=model_id,
                 body=json.dumps(request_body),
-                contentType='application/json'
+                contentType='application/json',
+                estimated_tokens=estimate_tokens(prompt) + self.max_tokens
             )
             
             response_body = json.loads(response['body'].read())
@@ -181,11 +231,13 @@ class BedrockLLMHandler:
             logger.error(f"Bedrock呼び出しエラー: {str(e)}")
             raise
     
-    def _format_response(self, bedrock_response: Dict[str, Any], context: List[Dict[str, Any]], query: str) -> Dict[str, Any]:
+    def _format_response(self, bedrock_response: Dict[str, Any], context: List[Dict[str, Any]], query: str,
+                         model_id: Optional[str] = None) -> Dict[str, Any]:
         """応答を整形"""
+        model_id = model_id or self.model_id
         try:
             # モデル別の応答形式に対応
-            if self.model_id.startswith('amazon.nova'):
+            if model_id.startswith('amazon.nova'):
                 # Nova Pro の応答形式
                 output = bedrock_response.get('output', {})
                 message = output.get('message', {})
@@ -194,7 +246,7 @@ class BedrockLLMHandler:
                     answer = content[0].get('text', '')
                 else:
                     answer = "申し訳ございませんが、回答を生成できませんでした。"
-            elif self.model_id.startswith('anthropic.claude'):
+            elif model_id.startswith('anthropic.claude'):
                 # Claude 3の応答形式
                 content = bedrock_response.get('content', [])
                 if content and len(content) > 0:
@@ -220,8 +272,8 @@ class BedrockLLMHandler:
                 ],
                 'query': query,
                 'timestamp': datetime.now().isoformat(),
-                'model_used': self.model_id,
-                'tokens_used': self._extract_token_usage(bedrock_response)
+                'model_used': model_id,
+                'tokens_used': self._extract_token_usage(bedrock_response, model_id)
             }
             
         except Exception as e:
@@ -232,13 +284,14 @@ class BedrockLLMHandler:
                 'timestamp': datetime.now().isoformat()
             }
     
-    def _extract_token_usage(self, bedrock_response: Dict[str, Any]) -> int:
+    def _extract_token_usage(self, bedrock_response: Dict[str, Any], model_id: Optional[str] = None) -> int:
         """モデル別のトークン使用量を抽出"""
-        if self.model_id.startswith('amazon.nova'):
+        model_id = model_id or self.model_id
+        if model_id.startswith('amazon.nova'):
             # Nova Pro のトークン使用量
             usage = bedrock_response.get('usage', {})
             return usage.get('outputTokens', 0)
-        elif self.model_id.startswith('anthropic.claude'):
+        elif model_id.startswith('anthropic.claude'):
             # Claude 3のトークン使用量
             usage = bedrock_response.get('usage', {})
             return usage.get('output_tokens', 0)
@@ -285,6 +338,7 @@ def lambda_handler(event, context):
         query = body.get('query', '')
         context_docs = body.get('context', [])
         user_id = body.get('user_id', 'anonymous')
+        latency_slo_ms = body.get('latency_slo_ms')
         
         if not query:
             return {
@@ -301,7 +355,12 @@ def lambda_handler(event, context):
         
         # BedrockハンドラーでRAG応答を生成
         handler = BedrockLLMHandler()
-        result = handler.generate_response(query, context_docs, user_id)
+        try:
+            latency_slo_ms = float(latency_slo_ms) if latency_slo_ms is not None else None
+        except (ValueError, TypeError):
+            logger.warning(f"無効なレイテンシSLOヒントを無視します: {latency_slo_ms}")
+            latency_slo_ms = None
+        result = handler.generate_response(query, context_docs, user_id, latency_slo_ms)
         
         return {
             'statusCode': 200 if result.get('success') else 500,
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レイテンシ認識型モデルルーター
+質問の特徴とモデル別のレイテンシ統計に基づき、リクエスト単位でBedrockモデルを選択
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelProfile:
+    """モデルプロファイル"""
+    model_id: str
+    quality_tier: int  # 1: 軽量, 2: 標準, 3: 高品質
+    baseline_p95_ms: float  # 統計が不足している間に使用する想定p95レイテンシ
+
+
+@dataclass
+class QueryFeatures:
+    """ルーティング判定に使用するリクエスト特徴量"""
+    query_length: int
+    context_length: int
+    context_documents: int
+    question_type: str  # 'lookup' or 'synthesis'
+    required_tier: int
+    latency_slo_ms: Optional[float] = None
+
+
+@dataclass
+class RoutingDecision:
+    """ルーティング判定結果"""
+    model_id: str
+    reason: str  # 'quality_tier', 'latency_slo', 'slo_unattainable', 'p95_degraded', 'probe', 'routing_disabled'
+    estimated_p95_ms: float
+    features: QueryFeatures
+    candidates: Dict[str, float] = field(default_factory=dict)
+    decided_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書形式に変換"""
+        return asdict(self)
+
+
+# サポートされているモデルのデフォルトプロファイル
+DEFAULT_MODEL_PROFILES = {
+    'amazon.nova-lite-v1:0': ModelProfile('amazon.nova-lite-v1:0', 1, 1500.0),
+    'anthropic.claude-3-haiku-20240307-v1:0': ModelProfile('anthropic.claude-3-haiku-20240307-v1:0', 1, 2000.0),
+    'amazon.nova-pro-v1:0': ModelProfile('amazon.nova-pro-v1:0', 2, 3500.0),
+    'anthropic.claude-3-sonnet-20240229-v1:0': ModelProfile('anthropic.claude-3-sonnet-20240229-v1:0', 3, 6000.0),
+}
+
+# 要約・比較・理由付けなど複数文書の統合が必要な質問のパターン
+SYNTHESIS_PATTERNS = [
+    r'比較', r'違い', r'なぜ', r'理由', r'まとめ', r'要約', r'説明して', r'教えて', r'メリット', r'デメリット',
+    r'どのように', r'方法', r'手順', r'設計', r'分析', r'評価',
+    r'(?i)\bcompare\b', r'(?i)\bdifference', r'(?i)\bwhy\b', r'(?i)\bhow\b', r'(?i)\bsummar',
+    r'(?i)\bexplain\b', r'(?i)\bpros\b', r'(?i)\bcons\b'
+]
+
+# 単一事実の参照で答えられる質問のパターン
+LOOKUP_PATTERNS = [
+    r'とは', r'何ですか', r'いつ', r'どこ', r'誰', r'いくつ', r'何個', r'何日', r'URL', r'名前',
+    r'(?i)\bwhat is\b', r'(?i)\bwhen\b', r'(?i)\bwhere\b', r'(?i)\bwho\b', r'(?i)\bwhich\b', r'(?i)\bhow many\b'
+]
+
+
+class LatencyAwareModelRouter:
+    """レイテンシ認識型モデルルータークラス"""
+
+    # クラス定数
+    DEFAULT_WINDOW_SIZE = 100
+    MIN_SAMPLES = 10
+    DEFAULT_DEGRADATION_FACTOR = 1.5
+    DEFAULT_MAX_ERROR_RATE = 0.3
+    # この秒数より古い観測は統計から除外（劣化したモデルも時間経過で復帰できる）
+    DEFAULT_SAMPLE_TTL_SECONDS = 300.0
+    # 劣化中のモデルに回復確認のため振り分けるリクエストの割合
+    DEFAULT_PROBE_FRACTION = 0.05
+    # ベースラインプロファイルがないモデル（BEDROCK_MODEL_ID等）の想定値
+    UNKNOWN_MODEL_TIER = 2
+    UNKNOWN_MODEL_BASELINE_P95_MS = 4000.0
+    LONG_QUERY_LENGTH = 300
+    LARGE_CONTEXT_LENGTH = 6000
+    SHORT_QUERY_LENGTH = 80
+
+    def __init__(self,
+                 model_profiles: Optional[Dict[str, ModelProfile]] = None,
+                 window_size: int = None,
+                 degradation_factor: float = None,
+                 max_error_rate: float = None,
+                 sample_ttl_seconds: float = None,
+                 probe_fraction: float = None,
+                 rng: Optional[random.Random] = None):
+        """
+        初期化
+
+        Args:
+            model_profiles: ルーティング候補のモデルプロファイル
+            window_size: モデル別に保持するレイテンシ観測数
+            degradation_factor: 想定p95に対してこの倍率を超えたら劣化とみなす
+            max_error_rate: この割合を超えてエラーが発生したら劣化とみなす
+            sample_ttl_seconds: 観測の有効期間（秒、0で無期限）
+            probe_fraction: 劣化中のモデルに振り分けるリクエストの割合（0で振り分けない）
+            rng: 回復確認の振り分けに使用する乱数生成器
+        """
+        self.model_profiles = model_profiles or dict(DEFAULT_MODEL_PROFILES)
+        self.window_size = window_size or self.DEFAULT_WINDOW_SIZE
+        self.degradation_factor = degradation_factor or self.DEFAULT_DEGRADATION_FACTOR
+        self.max_error_rate = max_error_rate if max_error_rate is not None else self.DEFAULT_MAX_ERROR_RATE
+        self.sample_ttl_seconds = (sample_ttl_seconds if sample_ttl_seconds is not None
+                                   else self.DEFAULT_SAMPLE_TTL_SECONDS)
+        self.probe_fraction = probe_fraction if probe_fraction is not None else self.DEFAULT_PROBE_FRACTION
+        self._rng = rng or random.Random()
+
+        # モデル別のローリング統計（(観測時刻, 値)、ウォームスタート間で保持される）
+        self._latencies: Dict[str, deque] = {
+            model_id: deque(maxlen=self.window_size) for model_id in self.model_profiles
+        }
+        self._outcomes: Dict[str, deque] = {
+            model_id: deque(maxlen=self.window_size) for model_id in self.model_profiles
+        }
+        self._lock = threading.Lock()
+
+        logger.info(f"モデルルーターを初期化: candidates={list(self.model_profiles.keys())}")
+
+    def extract_features(self,
+                         query: str,
+                         context_text: str,
+                         context_documents: int = 0,
+                         latency_slo_ms: Optional[float] = None) -> QueryFeatures:
+        """
+        リクエストから安価に計算できる特徴量を抽出
+
+        Args:
+            query: ユーザーの質問
+            context_text: 整形済みコンテキスト
+            context_documents: コンテキスト文書数
+            latency_slo_ms: リクエスト単位のレイテンシSLOヒント
+
+        Returns:
+            QueryFeatures: 特徴量
+        """
+        question_type = self._classify_question(query)
+
+        # 質問タイプとサイズから必要な品質ティアを決定
+        required_tier = 1
+        if question_type == 'synthesis':
+            required_tier += 1
+        if len(context_text) > self.LARGE_CONTEXT_LENGTH or len(query) > self.LONG_QUERY_LENGTH:
+            required_tier += 1
+
+        return QueryFeatures(
+            query_length=len(query),
+            context_length=len(context_text),
+            context_documents=context_documents,
+            question_type=question_type,
+            required_tier=min(required_tier, 3),
+            latency_slo_ms=latency_slo_ms
+        )
+
+    def route(self,
+              query: str,
+              context_text: str,
+              context_documents: int = 0,
+              latency_slo_ms: Optional[float] = None) -> RoutingDecision:
+        """
+        リクエストに使用するモデルを選択
+
+        Args:
+            query: ユーザーの質問
+            context_text: 整形済みコンテキスト
+            context_documents: コンテキスト文書数
+            latency_slo_ms: リクエスト単位のレイテンシSLOヒント
+
+        Returns:
+            RoutingDecision: ルーティング判定結果
+        """
+        features = self.extract_features(query, context_text, context_documents, latency_slo_ms)
+
+        with self._lock:
+            self._expire_samples()
+            estimates = {model_id: self._estimate_p95(model_id) for model_id in self.model_profiles}
+            degraded = {model_id for model_id in self.model_profiles if self._is_degraded(model_id)}
+            probe = bool(degraded) and self._rng.random() < self.probe_fraction
+
+        # 品質ティアを満たす候補（ティアの低い順、同ティアは推定p95の小さい順）
+        ranked = sorted(
+            self.model_profiles.values(),
+            key=lambda p: (p.quality_tier, estimates[p.model_id])
+        )
+        qualified = [p for p in ranked if p.quality_tier >= features.required_tier] or ranked[-1:]
+        healthy = [p for p in qualified if p.model_id not in degraded]
+        pool = healthy or qualified
+
+        reason = 'quality_tier'
+        if healthy and qualified[0].model_id in degraded:
+            reason = 'p95_degraded'
+
+        selected = pool[0]
+        probe_targets = [p for p in qualified if p.model_id in degraded]
+        if probe and probe_targets and not latency_slo_ms:
+            # 劣化中のモデルにも一部のリクエストを送り、観測を更新して回復を検知する（ハーフオープン）
+            selected = probe_targets[0]
+            reason = 'probe'
+        elif latency_slo_ms:
+            within_slo = [p for p in pool if estimates[p.model_id] <= latency_slo_ms]
+            if within_slo:
+                if within_slo[0].model_id != selected.model_id:
+                    reason = 'latency_slo'
+                selected = within_slo[0]
+            else:
+                # SLOを満たせるモデルがない場合は品質ティアを緩めて最速のモデルを選択
+                selected = min(
+                    [p for p in ranked if p.model_id not in degraded] or ranked,
+                    key=lambda p: estimates[p.model_id]
+                )
+                reason = 'slo_unattainable'
+
+        decision = RoutingDecision(
+            model_id=selected.model_id,
+            reason=reason,
+            estimated_p95_ms=estimates[selected.model_id],
+            features=features,
+            candidates=estimates
+        )
+
+        logger.info(
+            f"モデルルーティング: {decision.model_id} (理由: {reason}, "
+            f"質問タイプ: {features.question_type}, 必要ティア: {features.required_tier}, "
+            f"推定p95: {decision.estimated_p95_ms:.0f}ms)"
+        )
+        return decision
+
+    def record_latency(self, model_id: str, latency_ms: float, success: bool = True) -> None:
+        """
+        モデル呼び出しの結果を記録
+
+        Args:
+            model_id: モデルID
+            latency_ms: 呼び出しレイテンシ（ミリ秒）
+            success: 成功フラグ
+        """
+        with self._lock:
+            if model_id not in self._latencies:
+                return
+            now = time.monotonic()
+            if success:
+                self._latencies[model_id].append((now, latency_ms))
+            self._outcomes[model_id].append((now, success))
+
+    def export_decision(self, decision: RoutingDecision, latency_ms: float, success: bool) -> Dict[str, Any]:
+        """
+        ルーティング判定と実測レイテンシをCloudWatch Embedded Metric Formatで出力
+
+        Args:
+            decision: ルーティング判定結果
+            latency_ms: 実測レイテンシ（ミリ秒）
+            success: 成功フラグ
+
+        Returns:
+            Dict: 出力したEMFレコード
+        """
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': os.environ.get('MODEL_ROUTING_NAMESPACE', 'RAG/BedrockLLM/ModelRouting'),
+                    'Dimensions': [['ModelId'], ['ModelId', 'RoutingReason']],
+                    'Metrics': [
+                        {'Name': 'GenerationLatency', 'Unit': 'Milliseconds'},
+                        {'Name': 'EstimatedP95Latency', 'Unit': 'Milliseconds'},
+                        {'Name': 'GenerationSuccess', 'Unit': 'Count'}
+                    ]
+                }]
+            },
+            'ModelId': decision.model_id,
+            'RoutingReason': decision.reason,
+            'GenerationLatency': latency_ms,
+            'EstimatedP95Latency': decision.estimated_p95_ms,
+            'GenerationSuccess': 1 if success else 0,
+            'QuestionType': decision.features.question_type,
+            'RequiredTier': decision.features.required_tier,
+            'LatencySloMs': decision.features.latency_slo_ms,
+            'SloMet': (latency_ms <= decision.features.latency_slo_ms) if decision.features.latency_slo_ms else None
+        }
+
+        # EMFはログ行全体がJSONである必要があるため、ロガーのフォーマットを経由しない
+        print(json.dumps(record, ensure_ascii=False))
+        return record
+
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """
+        モデル別のローリング統計を取得
+
+        Returns:
+            Dict: モデル別統計
+        """
+        with self._lock:
+            self._expire_samples()
+            stats = {}
+            for model_id, profile in self.model_profiles.items():
+                latencies = sorted(value for _, value in self._latencies[model_id])
+                outcomes = [success for _, success in self._outcomes[model_id]]
+                stats[model_id] = {
+                    'quality_tier': profile.quality_tier,
+                    'samples': len(latencies),
+                    'p50_ms': self._percentile(latencies, 0.50),
+                    'p95_ms': self._percentile(latencies, 0.95),
+                    'baseline_p95_ms': profile.baseline_p95_ms,
+                    'error_rate': (outcomes.count(False) / len(outcomes)) if outcomes else 0.0,
+                    'degraded': self._is_degraded(model_id)
+                }
+            return stats
+
+    def _classify_question(self, query: str) -> str:
+        """質問を参照型（lookup）と統合型（synthesis）に分類"""
+        synthesis_hits = sum(1 for pattern in SYNTHESIS_PATTERNS if re.search(pattern, query))
+        lookup_hits = sum(1 for pattern in LOOKUP_PATTERNS if re.search(pattern, query))
+
+        if synthesis_hits > lookup_hits:
+            return 'synthesis'
+        if lookup_hits > synthesis_hits:
+            return 'lookup'
+
+        # 判定できない場合は質問の長さで判断
+        return 'lookup' if len(query) <= self.SHORT_QUERY_LENGTH else 'synthesis'
+
+    def _expire_samples(self) -> None:
+        """有効期間を過ぎた観測を削除（呼び出し元でロック取得済み）"""
+        if not self.sample_ttl_seconds:
+            return
+        cutoff = time.monotonic() - self.sample_ttl_seconds
+        for samples in list(self._latencies.values()) + list(self._outcomes.values()):
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+
+    def _estimate_p95(self, model_id: str) -> float:
+        """推定p95レイテンシ（呼び出し元でロック取得済み）"""
+        latencies = [value for _, value in self._latencies[model_id]]
+        if len(latencies) < self.MIN_SAMPLES:
+            return self.model_profiles[model_id].baseline_p95_ms
+        return self._percentile(sorted(latencies), 0.95)
+
+    def _is_degraded(self, model_id: str) -> bool:
+        """p95またはエラー率が劣化しているか（呼び出し元でロック取得済み）"""
+        latencies = [value for _, value in self._latencies[model_id]]
+        outcomes = [success for _, success in self._outcomes[model_id]]
+
+        if len(outcomes) >= self.MIN_SAMPLES and outcomes.count(False) / len(outcomes) > self.max_error_rate:
+            return True
+
+        if len(latencies) < self.MIN_SAMPLES:
+            return False
+
+        baseline = self.model_profiles[model_id].baseline_p95_ms
+        return self._percentile(sorted(latencies), 0.95) > baseline * self.degradation_factor
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], percentile: float) -> float:
+        """ソート済みリストからパーセンタイルを計算（最近傍法）"""
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, max(0, int(round(percentile * len(sorted_values))) - 1))
+        return sorted_values[index]
+
+
+# ウォームスタート間で統計を共有するためのモジュールレベルインスタンス
+_model_router: Optional[LatencyAwareModelRouter] = None
+_model_router_lock = threading.Lock()
+
+
+def create_model_router(config: Dict[str, Any]) -> LatencyAwareModelRouter:
+    """
+    モデルルーターインスタンスを作成
+
+    Args:
+        config: 設定辞書
+
+    Returns:
+        LatencyAwareModelRouter: ルーターインスタンス
+    """
+    candidates = config.get('candidates')
+    profiles = None
+    if candidates:
+        # IAMで許可されていないモデルに振り分けないよう、候補は指定されたモデルのみ
+        profiles = {
+            model_id: DEFAULT_MODEL_PROFILES.get(model_id) or ModelProfile(
+                model_id,
+                LatencyAwareModelRouter.UNKNOWN_MODEL_TIER,
+                LatencyAwareModelRouter.UNKNOWN_MODEL_BASELINE_P95_MS
+            )
+            for model_id in candidates
+        }
+
+    return LatencyAwareModelRouter(
+        model_profiles=profiles,
+        window_size=config.get('window_size'),
+        degradation_factor=config.get('degradation_factor'),
+        max_error_rate=config.get('max_error_rate'),
+        sample_ttl_seconds=config.get('sample_ttl_seconds'),
+        probe_fraction=config.get('probe_fraction')
+    )
+
+
+def get_model_router() -> LatencyAwareModelRouter:
+    """
+    環境変数の設定に基づく共有モデルルーターを取得
+
+    MODEL_ROUTING_CANDIDATES 未指定時の候補は BEDROCK_MODEL_ID のみ（Lambdaの実行ロールが
+    呼び出しを許可しているモデル）。複数モデルへ振り分ける場合は候補とIAMポリシーの両方に追加する。
+
+    Returns:
+        LatencyAwareModelRouter: 共有ルーターインスタンス
+    """
+    global _model_router
+
+    with _model_router_lock:
+        if _model_router is None:
+            try:
+                candidates = [
+                    c.strip() for c in os.environ.get('MODEL_ROUTING_CANDIDATES', '').split(',') if c.strip()
+                ]
+                config = {
+                    'candidates': candidates or [os.environ.get('BEDROCK_MODEL_ID', 'amazon.nova-pro-v1:0')],
+                    'window_size': int(os.environ.get('MODEL_ROUTING_WINDOW', '100')),
+                    'degradation_factor': float(os.environ.get('MODEL_ROUTING_DEGRADATION_FACTOR', '1.5')),
+                    'sample_ttl_seconds': float(os.environ.get('MODEL_ROUTING_SAMPLE_TTL_SECONDS', '300')),
+                    'probe_fraction': float(os.environ.get('MODEL_ROUTING_PROBE_FRACTION', '0.05'))
+                }
+            except (ValueError, TypeError) as e:
+                logger.warning(f"ルーティング設定値が無効です。デフォルト値を使用します: {e}")
+                config = {}
+            _model_router = create_model_router(config)
+        return _model_router
+
+
+# テスト用のサンプル関数
+def test_model_router():
+    """
+    モデルルーターのテスト
+    """
+    router = LatencyAwareModelRouter(probe_fraction=0.0)
+
+    # 参照型の短い質問は軽量モデルへ
+    decision = router.route('FSx for ONTAPとは？', '短いコンテキスト', 1)
+    print(f"参照型: {decision.model_id} ({decision.reason})")
+
+    # 統合型の質問は標準以上のモデルへ
+    decision = router.route('FSx for ONTAPとEFSの違いを比較して説明してください', 'x' * 3000, 5)
+    print(f"統合型: {decision.model_id} ({decision.reason})")
+
+    # Nova Proのp95が劣化した場合は同ティア以上の別モデルへ移行
+    for _ in range(20):
+        router.record_latency('amazon.nova-pro-v1:0', 9000.0)
+    decision = router.route('FSx for ONTAPとEFSの違いを比較して説明してください', 'x' * 3000, 5)
+    print(f"劣化時: {decision.model_id} ({decision.reason})")
+
+    # 厳しいSLOヒントがある場合は最速モデルへ
+    decision = router.route('FSx for ONTAPとEFSの違いを比較して説明してください', 'x' * 3000, 5, latency_slo_ms=1600)
+    print(f"SLO指定: {decision.model_id} ({decision.reason})")
+
+    # 劣化中のモデルにも一部のリクエストを振り分け、古い観測は有効期間後に除外
+    router.probe_fraction = 1.0
+    decision = router.route('FSx for ONTAPとEFSの違いを比較して説明してください', 'x' * 3000, 5)
+    print(f"回復確認: {decision.model_id} ({decision.reason})")
+    router.probe_fraction = 0.0
+    router.sample_ttl_seconds = 1e-9
+    decision = router.route('FSx for ONTAPとEFSの違いを比較して説明してください', 'x' * 3000, 5)
+    print(f"観測の期限切れ後: {decision.model_id} ({decision.reason})")
+
+    print(json.dumps(router.get_routing_stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    test_model_router()
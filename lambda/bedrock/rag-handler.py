@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+検索・生成統合RAGハンドラー
+ベクトル検索とBedrock応答生成を単一のLambda呼び出しで実行
+"""
+
+import json
+import boto3
+import logging
+import time
+import importlib.util
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+from datetime import datetime
+import os
+
+# ログ設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_module(module_name: str, file_name: str, search_dirs: List[str]):
+    """ハイフン付きファイル名のハンドラーモジュールを読み込み"""
+    for directory in search_dirs:
+        path = os.path.join(directory, file_name)
+        if os.path.exists(path):
+            spec = importlib.util.spec_from_file_location(module_name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+    raise ImportError(f"{file_name} が見つかりません: {search_dirs}")
+
+
+# 同一デプロイパッケージ内、共有レイヤー（/opt/python）、またはリポジトリ構成（lambda/vector-search）から読み込み
+_vector_search_module = _load_module(
+    'vector_search_handler_impl', 'vector-search-handler.py',
+    [_HERE, '/opt/python', os.path.join(_HERE, '..', 'vector-search')]
+)
+_bedrock_module = _load_module('bedrock_handler_impl', 'bedrock-handler.py', [_HERE])
+
+VectorSearchHandler = _vector_search_module.VectorSearchHandler
+BedrockLLMHandler = _bedrock_module.BedrockLLMHandler
+
+# 共有レイヤー（lambda/layers/bedrock-common）のサーキットブレーカー
+from resilience import get_resilient_caller
+
+
+class RAGHandler:
+    """検索・生成統合ハンドラークラス"""
+
+    # コンテキストに詰める最大文字数（BedrockLLMHandler._format_contextの文書あたり上限と整合）
+    DEFAULT_CONTEXT_CHAR_BUDGET = 6000
+    MAX_CHARS_PER_DOCUMENT = 500
+    # 縮退応答用に保持する直近の埋め込み・検索結果の件数
+    DEGRADED_CACHE_SIZE = 256
+
+    def __init__(self, search_handler: Optional[Any] = None, llm_handler: Optional[Any] = None):
+        """
+        初期化
+
+        Args:
+            search_handler: VectorSearchHandlerインスタンス（省略時は生成）
+            llm_handler: BedrockLLMHandlerインスタンス（省略時は生成）
+        """
+        self.search_handler = search_handler or VectorSearchHandler()
+        self.llm_handler = llm_handler or BedrockLLMHandler()
+
+        self.permission_table = os.environ.get('PERMISSION_TABLE', '')
+        self.dynamodb = None
+        if self.permission_table:
+            self.dynamodb = boto3.resource('dynamodb', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+
+        try:
+            self.context_char_budget = int(os.environ.get('RAG_CONTEXT_CHAR_BUDGET', str(self.DEFAULT_CONTEXT_CHAR_BUDGET)))
+        except (ValueError, TypeError):
+            self.context_char_budget = self.DEFAULT_CONTEXT_CHAR_BUDGET
+
+        # 埋め込み生成と権限解決を並行実行するためのワーカー（ウォームスタート間で再利用）
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        
+        # 冪等な埋め込み・検索はヘッジ送信、連続失敗時はブレーカーで即時失敗
+        self.embedding_caller = get_resilient_caller('bedrock-runtime', self.search_handler.embedding_model)
+        self.search_caller = get_resilient_caller('opensearch', self.search_handler.index_name)
+        
+        # ブレーカーOPEN時に返す直近の結果
+        self._embedding_cache: OrderedDict = OrderedDict()
+        self._search_cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # 正常時のキャッシュ利用（既定は無効。有効時、同一クエリの埋め込みは決定的なため再利用し、
+        # 検索結果はTTL内のみ再利用・0で無効）
+        self.embedding_cache_enabled = os.environ.get('RAG_EMBEDDING_CACHE_ENABLED', 'false').lower() == 'true'
+        try:
+            self.search_cache_ttl = max(0.0, float(os.environ.get('RAG_SEARCH_CACHE_TTL_SECONDS', '0')))
+        except (ValueError, TypeError):
+            self.search_cache_ttl = 0.0
+        self._cache_stats = {'embedding_hits': 0, 'embedding_misses': 0, 'search_hits': 0, 'search_misses': 0}
+
+    def retrieve_and_generate(self, query: str, user_id: str, top_k: int = 5, min_score: float = 0.7,
+                              latency_slo_ms: Optional[float] = None) -> Dict[str, Any]:
+        """
+        検索から応答生成までを実行
+
+        Args:
+            query: ユーザーの質問
+            user_id: ユーザーID（権限フィルタリング用）
+            top_k: 取得する文書数
+            min_score: 最小関連度スコア
+            latency_slo_ms: レイテンシSLOヒント（ミリ秒）
+
+        Returns:
+            生成された応答、検索結果、ステージ別処理時間
+        """
+        timings: Dict[str, float] = {}
+        degraded: List[str] = []
+        total_start = time.time()
+
+        try:
+            # クエリ埋め込みと権限解決を並行実行
+            embedding_future = self._executor.submit(self._timed, self._embed_query, query, degraded)
+            permission_future = self._executor.submit(self._timed, self._resolve_permission_filter, user_id)
+
+            query_vector, timings['embedding_ms'] = embedding_future.result()
+            permission_filter, timings['permission_ms'] = permission_future.result()
+
+            # ベクトル検索（失敗時は同一クエリの直近結果で縮退）
+            stage_start = time.time()
+            search_key = (query, user_id, top_k, min_score)
+            formatted = self._cached_search(search_key)
+            try:
+                if formatted is None:
+                    search_results = self.search_caller.call(
+                        self.search_handler._execute_vector_search,
+                        query_vector, permission_filter, top_k, min_score,
+                        hedge=True
+                    )
+                    formatted = self.search_handler._format_search_results(search_results, query)
+                    self._cache_put(self._search_cache, search_key, (formatted, time.time()))
+            except Exception as e:
+                entry = self._search_cache.get(search_key)
+                if entry is None:
+                    raise
+                formatted = entry[0]
+                logger.warning(f"検索に失敗したためキャッシュ済み結果を返します: {e}")
+                degraded.append('cached_retrieval')
+            timings['retrieval_ms'] = (time.time() - stage_start) * 1000
+
+            # 検索結果をそのままコンテキストに詰める
+            stage_start = time.time()
+            documents = formatted.get('documents', [])
+            context_docs = self._pack_context(documents)
+            timings['packing_ms'] = (time.time() - stage_start) * 1000
+
+            # 応答生成（失敗時は検索結果のみの応答で縮退）
+            stage_start = time.time()
+            result = self.llm_handler.generate_response(query, context_docs, user_id, latency_slo_ms)
+            timings['generation_ms'] = (time.time() - stage_start) * 1000
+
+            if not result.get('success') and context_docs:
+                logger.warning(f"応答生成に失敗したため検索結果のみを返します: {result.get('error')}")
+                degraded.append('retrieval_only')
+                result = self._retrieval_only_response(query, context_docs, result.get('error'))
+
+            timings['total_ms'] = (time.time() - total_start) * 1000
+
+            result['retrieval'] = {
+                'total_hits': formatted.get('total_hits', 0),
+                'documents_retrieved': len(documents),
+                'documents_in_context': len(context_docs)
+            }
+            result['timings'] = timings
+            if degraded:
+                result['degraded'] = degraded
+
+            logger.info(f"RAG処理完了 - ユーザー: {user_id}, 文書数: {len(context_docs)}, "
+                        f"合計: {timings['total_ms']:.1f}ms")
+
+            return result
+
+        except Exception as e:
+            timings['total_ms'] = (time.time() - total_start) * 1000
+            logger.error(f"RAG処理エラー: {str(e)}")
+            return {
+                'success': False,
+                'error': f'検索・応答生成中にエラーが発生しました: {str(e)}',
+                'timings': timings,
+                'timestamp': datetime.now().isoformat()
+            }
+
+    def _embed_query(self, query: str, degraded: List[str]) -> List[float]:
+        """クエリ埋め込みを生成（失敗時は同一クエリの直近結果で縮退）"""
+        if self.embedding_cache_enabled:
+            with self._cache_lock:
+                vector = self._embedding_cache.get(query)
+                if vector is not None:
+                    self._embedding_cache.move_to_end(query)
+                self._cache_stats['embedding_hits' if vector is not None else 'embedding_misses'] += 1
+            if vector is not None:
+                return vector
+        try:
+            vector = self.embedding_caller.call(self.search_handler._generate_embedding, query, hedge=True)
+            self._cache_put(self._embedding_cache, query, vector)
+            return vector
+        except Exception as e:
+            vector = self._embedding_cache.get(query)
+            if vector is None:
+                raise
+            logger.warning(f"埋め込み生成に失敗したためキャッシュ済みベクトルを使用します: {e}")
+            degraded.append('cached_embedding')
+            return vector
+
+    def _cached_search(self, search_key: Any) -> Optional[Dict[str, Any]]:
+        """TTL内の検索結果を取得（TTL 0の場合は常にNone）"""
+        if self.search_cache_ttl <= 0:
+            return None
+        with self._cache_lock:
+            entry = self._search_cache.get(search_key)
+            hit = entry is not None and time.time() - entry[1] <= self.search_cache_ttl
+            if hit:
+                self._search_cache.move_to_end(search_key)
+            self._cache_stats['search_hits' if hit else 'search_misses'] += 1
+        return entry[0] if hit else None
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        正常時のキャッシュ利用状況を取得
+
+        Returns:
+            Dict: 埋め込み・検索結果のヒット数、ミス数、ヒット率
+        """
+        with self._cache_lock:
+            stats = dict(self._cache_stats)
+        for name in ('embedding', 'search'):
+            lookups = stats[f'{name}_hits'] + stats[f'{name}_misses']
+            stats[f'{name}_hit_rate'] = stats[f'{name}_hits'] / lookups if lookups else None
+        return stats
+
+    def _cache_put(self, cache: OrderedDict, key: Any, value: Any) -> None:
+        """LRUキャッシュに追加"""
+        with self._cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.DEGRADED_CACHE_SIZE:
+                cache.popitem(last=False)
+
+    def _retrieval_only_response(self, query: str, context_docs: List[Dict[str, Any]],
+                                 generation_error: Optional[str]) -> Dict[str, Any]:
+        """応答生成を行わず検索結果のみを返す縮退応答"""
+        return {
+            'success': True,
+            'answer': '現在、回答の生成を一時的に利用できません。関連する文書を以下に示します。',
+            'sources': [
+                {
+                    'title': doc.get('title', ''),
+                    'source': doc.get('source', ''),
+                    'score': doc.get('score', 0.0)
+                }
+                for doc in context_docs
+            ],
+            'documents': context_docs,
+            'query': query,
+            'generation_error': generation_error,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def _timed(self, func, *args):
+        """関数を実行し、結果と処理時間（ミリ秒）を返す"""
+        start = time.time()
+        result = func(*args)
+        return result, (time.time() - start) * 1000
+
+    def _resolve_permission_filter(self, user_id: str) -> Dict[str, Any]:
+        """ユーザー権限を解決して検索フィルターを構築"""
+        permission_filter = self.search_handler._build_permission_filter(user_id)
+
+        if not self.dynamodb:
+            return permission_filter
+
+        try:
+            table = self.dynamodb.Table(self.permission_table)
+            item = table.get_item(Key={'userId': user_id}).get('Item', {})
+            groups = list(item.get('groups', []))
+            if groups:
+                permission_filter['bool']['should'].append({"terms": {"permissions.groups": groups}})
+        except Exception as e:
+            # 権限テーブルが利用できない場合は基本フィルターのみで検索
+            logger.warning(f"権限情報の取得に失敗しました。基本フィルターを使用します: {e}")
+
+        return permission_filter
+
+    def _pack_context(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """スコア順に重複を除いて文字数予算内でコンテキスト文書を選択"""
+        packed = []
+        seen_contents = set()
+        remaining = self.context_char_budget
+
+        for doc in sorted(documents, key=lambda d: d.get('score', 0.0), reverse=True):
+            content = doc.get('content', '')
+            key = content[:200]
+            if not content or key in seen_contents:
+                continue
+            if remaining <= 0:
+                break
+
+            seen_contents.add(key)
+            content = content[:min(self.MAX_CHARS_PER_DOCUMENT, remaining)]
+            remaining -= len(content)
+            packed.append({**doc, 'content': content})
+
+        return packed
+
+
+# ウォームスタート時はクライアント・ルーター統計を再利用
+_rag_handler: Optional[RAGHandler] = None
+
+
+def get_rag_handler() -> RAGHandler:
+    """RAGハンドラーのシングルトンを取得"""
+    global _rag_handler
+    if _rag_handler is None:
+        _rag_handler = RAGHandler()
+    return _rag_handler
+
+
+def lambda_handler(event, context):
+    """Lambda関数のエントリーポイント"""
+    try:
+        # リクエストデータを解析
+        body = json.loads(event.get('body', '{}'))
+        query = body.get('query', '')
+        user_id = body.get('user_id', 'anonymous')
+
+        if not query:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json; charset=utf-8',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': False,
+                    'error': 'クエリが指定されていません'
+                }, ensure_ascii=False)
+            }
+
+        try:
+            top_k = int(body.get('top_k', 5))
+            min_score = float(body.get('min_score', 0.7))
+            latency_slo_ms = body.get('latency_slo_ms')
+            latency_slo_ms = float(latency_slo_ms) if latency_slo_ms is not None else None
+        except (ValueError, TypeError):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json; charset=utf-8',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': False,
+                    'error': '検索パラメータが無効です'
+                }, ensure_ascii=False)
+            }
+
+        result = get_rag_handler().retrieve_and_generate(query, user_id, top_k, min_score, latency_slo_ms)
+
+        return {
+            'statusCode': 200 if result.get('success') else 500,
+            'headers': {
+                'Content-Type': 'application/json; charset=utf-8',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(result, ensure_ascii=False)
+        }
+
+    except Exception as e:
+        logger.error(f"Lambda実行エラー: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json; charset=utf-8',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': f'内部エラーが発生しました: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }, ensure_ascii=False)
+        }
+
+if __name__ == "__main__":
+    # テスト用
+    test_event = {
+        'body': json.dumps({
+            'query': 'FSx for NetApp ONTAPの設定方法',
+            'user_id': 'test-user',
+            'top_k': 3,
+            'min_score': 0.7
+        })
+    }
+
+    result = lambda_handler(test_event, None)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
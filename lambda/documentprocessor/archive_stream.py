@@ -0,0 +1,322 @@
+"""
+ZIPアーカイブの逐次展開
+セントラルディレクトリのみで展開前にメンバー数・展開後サイズ・圧縮率を検証し（ZIP爆弾対策）、
+処理対象のメンバーを1件ずつメモリ上に展開する（ディスクには書き出さない）。
+前回取り込み時のメンバーごとのSHA-256をマニフェストとして保存し、変更のないメンバーを判別する。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, BinaryIO, Callable, Iterator, List, Optional
+
+import boto3
+
+from error_handler import ProcessingError, ErrorType
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_INGEST_ENABLED = os.environ.get('ARCHIVE_INGEST_ENABLED', 'true').lower() == 'true'
+ARCHIVE_FORMATS = frozenset(['zip'])
+
+# ZIP爆弾対策の既定値（security.maxArchive* で上書き）
+DEFAULT_MAX_MEMBERS = 1000
+DEFAULT_MAX_EXPANDED_BYTES = 500 * 1024 * 1024
+DEFAULT_MAX_COMPRESSION_RATIO = 100
+# 圧縮率を判定しない小さなメンバー（空白の多いテキスト等で誤検知しないため）
+RATIO_EXEMPT_BYTES = 64 * 1024
+# メンバーを展開する際の読み込み単位
+READ_CHUNK_BYTES = 1024 * 1024
+
+# OS・アーカイバーが追加する処理不要のメンバー
+IGNORED_MEMBER_PATTERN = re.compile(r'(^|/)(__MACOSX/|\._|\.DS_Store$|Thumbs\.db$|desktop\.ini$)', re.IGNORECASE)
+
+
+@dataclass
+class ArchiveLimits:
+    """アーカイブ展開の上限"""
+    max_members: int = DEFAULT_MAX_MEMBERS
+    max_expanded_bytes: int = DEFAULT_MAX_EXPANDED_BYTES
+    max_compression_ratio: float = DEFAULT_MAX_COMPRESSION_RATIO
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> 'ArchiveLimits':
+        """Markitdown設定のsecurityセクションから作成"""
+        security = (config or {}).get('security', {})
+        return cls(
+            max_members=security.get('maxArchiveMembers', DEFAULT_MAX_MEMBERS),
+            max_expanded_bytes=security.get('maxArchiveExpandedSizeBytes', DEFAULT_MAX_EXPANDED_BYTES),
+            max_compression_ratio=security.get('maxArchiveCompressionRatio', DEFAULT_MAX_COMPRESSION_RATIO)
+        )
+
+
+@dataclass
+class ArchiveMember:
+    """展開したアーカイブメンバー"""
+    path: str
+    file_size: int
+    compress_size: int
+    sha256: str
+    content: bytes = field(default=b'', repr=False)
+
+
+def archive_source_uri(archive_uri: str, member_path: str) -> str:
+    """アーカイブメンバーのソースURI（アーカイブのURIとアーカイブ内のパスを保持）"""
+    return f"{archive_uri}!/{member_path}"
+
+
+def normalize_member_path(name: str) -> Optional[str]:
+    """
+    メンバー名を正規化（アーカイブ外を指すパスはNone）
+
+    Args:
+        name: ZIP内のメンバー名
+
+    Returns:
+        Optional[str]: 正規化したパス
+    """
+    path = name.replace('\\', '/')
+    if path.startswith('/') or re.match(r'^[A-Za-z]:', path):
+        return None
+    normalized = posixpath.normpath(path)
+    if normalized in ('.', '') or normalized == '..' or normalized.startswith('../'):
+        return None
+    return normalized
+
+
+class ArchiveReader:
+    """セントラルディレクトリを検証してからメンバーを1件ずつ展開するリーダー"""
+
+    def __init__(self, source: BinaryIO, archive_name: str, limits: Optional[ArchiveLimits] = None,
+                 is_supported: Optional[Callable[[str], bool]] = None):
+        """
+        初期化（セントラルディレクトリの検証まで行う）
+
+        Args:
+            source: ZIPファイル（シーク可能なファイルオブジェクト）
+            archive_name: アーカイブのファイル名
+            limits: 展開の上限
+            is_supported: メンバーのパスを受け取り処理対象かを返す関数
+
+        Raises:
+            ProcessingError: ZIPとして読めない場合、または上限を超える場合
+        """
+        self.archive_name = archive_name
+        self.limits = limits or ArchiveLimits()
+        self.skipped: List[Dict[str, Any]] = []
+        self.expanded_bytes = 0
+        try:
+            self._archive = zipfile.ZipFile(source)
+        except zipfile.BadZipFile as e:
+            raise ProcessingError(ErrorType.INVALID_FILE_CONTENT,
+                                  f"ZIPアーカイブを読み込めません: {archive_name}", {'reason': str(e)})
+        self._members = self._plan(is_supported or (lambda path: True))
+
+    @property
+    def planned_members(self) -> int:
+        return len(self._members)
+
+    @property
+    def declared_bytes(self) -> int:
+        return sum(info.file_size for _, info in self._members)
+
+    def _violation(self, message: str, details: Dict[str, Any]) -> ProcessingError:
+        self.close()
+        return ProcessingError(ErrorType.SECURITY_VIOLATION, f"{message}: {self.archive_name}", details)
+
+    def _plan(self, is_supported: Callable[[str], bool]) -> List[tuple]:
+        """展開前にセントラルディレクトリの宣言値で上限を検証し、処理対象を決定"""
+        entries = [info for info in self._archive.infolist() if not info.is_dir()]
+        if len(entries) > self.limits.max_members:
+            raise self._violation("アーカイブのメンバー数が上限を超えています",
+                                  {'members': len(entries), 'maxMembers': self.limits.max_members})
+
+        members = []
+        declared = 0
+        for info in entries:
+            path = normalize_member_path(info.filename)
+            if path is None:
+                self.skipped.append({'path': info.filename, 'reason': 'unsafePath'})
+            elif IGNORED_MEMBER_PATTERN.search(path):
+                continue
+            elif info.flag_bits & 0x1:
+                self.skipped.append({'path': path, 'reason': 'encrypted'})
+            elif not is_supported(path):
+                self.skipped.append({'path': path, 'reason': 'unsupportedFormat'})
+            else:
+                self._check_ratio(path, info.file_size, info.compress_size)
+                declared += info.file_size
+                members.append((path, info))
+
+        if declared > self.limits.max_expanded_bytes:
+            raise self._violation("アーカイブの展開後サイズが上限を超えています",
+                                  {'expandedBytes': declared, 'maxExpandedBytes': self.limits.max_expanded_bytes})
+        return members
+
+    def _check_ratio(self, path: str, expanded: int, compressed: int) -> None:
+        if expanded <= RATIO_EXEMPT_BYTES:
+            return
+        ratio = expanded / max(compressed, 1)
+        if ratio > self.limits.max_compression_ratio:
+            raise self._violation("アーカイブメンバーの圧縮率が上限を超えています", {
+                'path': path, 'ratio': round(ratio, 1), 'maxCompressionRatio': self.limits.max_compression_ratio
+            })
+
+    def _read(self, path: str, info: zipfile.ZipInfo) -> bytes:
+        """メンバーを展開（宣言サイズを偽装したメンバーは実際の展開量で打ち切る）"""
+        remaining_budget = self.limits.max_expanded_bytes - self.expanded_bytes
+        limit = min(info.file_size, remaining_budget)
+        buffer = bytearray()
+        with self._archive.open(info) as member:
+            while True:
+                block = member.read(min(READ_CHUNK_BYTES, limit + 1 - len(buffer)))
+                if not block:
+                    break
+                buffer.extend(block)
+                if len(buffer) > limit:
+                    raise self._violation("アーカイブメンバーの展開サイズが宣言値または上限を超えています", {
+                        'path': path, 'declaredBytes': info.file_size, 'maxExpandedBytes': self.limits.max_expanded_bytes
+                    })
+        self._check_ratio(path, len(buffer), info.compress_size)
+        self.expanded_bytes += len(buffer)
+        return bytes(buffer)
+
+    def iter_members(self) -> Iterator[ArchiveMember]:
+        """
+        処理対象のメンバーを1件ずつ展開
+
+        Yields:
+            ArchiveMember: 展開したメンバー（呼び出し側が参照を手放せば次のメンバーの展開前に解放される）
+        """
+        try:
+            for path, info in self._members:
+                content = self._read(path, info)
+                yield ArchiveMember(path=path, file_size=len(content), compress_size=info.compress_size,
+                                    sha256=hashlib.sha256(content).hexdigest(), content=content)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._archive.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """統計情報を取得"""
+        return {
+            'plannedMembers': self.planned_members,
+            'declaredBytes': self.declared_bytes,
+            'expandedBytes': self.expanded_bytes,
+            'skippedMembers': len(self.skipped)
+        }
+
+
+class ArchiveManifestStore:
+    """
+    アーカイブごとのメンバーのSHA-256マニフェスト保存（S3、未設定時は/tmp）
+
+    マニフェストはアーカイブのURI（S3オブジェクトはバケット・フルキー）で区別し、
+    別のプレフィックスにある同名のアーカイブとは共有しない。
+    """
+
+    def __init__(self, bucket: Optional[str] = None, prefix: str = 'archive-manifests/',
+                 local_dir: str = '/tmp/markitdown-archive-manifests'):
+        """
+        初期化
+
+        Args:
+            bucket: 保存先S3バケット（省略時はCHECKPOINT_BUCKET環境変数）
+            prefix: S3キープレフィックス
+            local_dir: S3未設定時の保存先ディレクトリ
+        """
+        self.bucket = bucket or os.environ.get('CHECKPOINT_BUCKET')
+        self.prefix = prefix
+        self.local_dir = local_dir
+        self.s3_client = boto3.client('s3') if self.bucket else None
+
+    @staticmethod
+    def _manifest_id(archive_uri: str) -> str:
+        return hashlib.sha256(archive_uri.encode('utf-8')).hexdigest()
+
+    def load(self, archive_uri: str) -> Dict[str, str]:
+        """
+        前回取り込み時のマニフェストを読み込み
+
+        Args:
+            archive_uri: アーカイブのURI（例: s3://bucket/path/to/archive.zip）
+
+        Returns:
+            Dict[str, str]: メンバーのパス → SHA-256（存在しない場合は空）
+        """
+        manifest_id = self._manifest_id(archive_uri)
+        try:
+            if self.s3_client:
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{manifest_id}.json")
+                return json.loads(response['Body'].read()).get('members', {})
+            path = os.path.join(self.local_dir, f"{manifest_id}.json")
+            if not os.path.exists(path):
+                return {}
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('members', {})
+        except Exception as e:
+            # 読み込めない場合は全メンバーを変更ありとして処理
+            logger.warning(f"アーカイブマニフェストの読み込みに失敗: {archive_uri} - {e}")
+            return {}
+
+    def save(self, archive_uri: str, members: Dict[str, str]) -> None:
+        """
+        マニフェストを保存
+
+        Args:
+            archive_uri: アーカイブのURI（例: s3://bucket/path/to/archive.zip）
+            members: メンバーのパス → SHA-256
+        """
+        manifest_id = self._manifest_id(archive_uri)
+        body = json.dumps({'archiveUri': archive_uri, 'members': members,
+                           'updatedAt': datetime.now().isoformat()}, ensure_ascii=False)
+        try:
+            if self.s3_client:
+                self.s3_client.put_object(Bucket=self.bucket, Key=f"{self.prefix}{manifest_id}.json",
+                                          Body=body.encode('utf-8'), ContentType='application/json')
+            else:
+                os.makedirs(self.local_dir, exist_ok=True)
+                with open(os.path.join(self.local_dir, f"{manifest_id}.json"), 'w', encoding='utf-8') as f:
+                    f.write(body)
+        except Exception as e:
+            logger.warning(f"アーカイブマニフェストの保存に失敗: {archive_uri} - {e}")
+
+
+# テスト用のサンプル関数
+def test_archive_stream():
+    """
+    アーカイブ展開のテスト
+    """
+    import io
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('docs/readme.html', '<h1>概要</h1><p>サンプル</p>')
+        archive.writestr('data/table.csv', 'name,value\nA,1\n')
+        archive.writestr('__MACOSX/docs/._readme.html', b'\x00')
+        archive.writestr('../escape.txt', 'x')
+        archive.writestr('bomb.csv', b'0' * (20 * 1024 * 1024))
+
+    try:
+        ArchiveReader(io.BytesIO(buffer.getvalue()), 'sample.zip')
+    except ProcessingError as e:
+        print(f"ZIP爆弾を検出: {e.message} {e.details}")
+
+    reader = ArchiveReader(io.BytesIO(buffer.getvalue()), 'sample.zip',
+                           is_supported=lambda path: path != 'bomb.csv')
+    for member in reader.iter_members():
+        print(f"{archive_source_uri('s3://sample-bucket/archives/sample.zip', member.path)}: {member.file_size}バイト {member.sha256[:12]}")
+    print(f"スキップ: {reader.skipped}")
+    print(f"統計: {reader.get_stats()}")
+
+
+if __name__ == "__main__":
+    test_archive_stream()
@@ -0,0 +1,534 @@
+"""
+Bedrock呼び出し用の適応型レート制限・同時実行制御
+
+トークンバケットによるリクエスト数/トークン数クォータ制御と、
+AIMD（加算増加・乗算減少）による同時実行数制御を組み合わせ、
+エラー分類に基づくジッター付きリトライと観測レイテンシに応じた
+バッチサイズ調整を提供する。埋め込み生成・応答生成・品質分析で共有する。
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, Optional
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorClass(Enum):
+    """リトライ判定用のエラー分類"""
+    THROTTLED = "throttled"      # クォータ超過：同時実行数を減らしてリトライ
+    TRANSIENT = "transient"      # 一時的な障害：同時実行数は維持してリトライ
+    FATAL = "fatal"              # 入力不正・権限エラー：リトライしない
+
+
+THROTTLE_ERROR_CODES = {
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException',
+    'ProvisionedThroughputExceededException', 'RequestLimitExceeded'
+}
+TRANSIENT_ERROR_CODES = {
+    'ServiceUnavailableException', 'InternalServerException', 'ModelNotReadyException',
+    'ModelTimeoutException', 'RequestTimeout', 'RequestTimeoutException', 'InternalFailure'
+}
+
+
+def limiter_client_config(**kwargs: Any) -> Config:
+    """
+    レート制限を通して呼び出すクライアントの設定
+
+    SDKのリトライを無効化し（1回のみ試行）、リトライをBedrockRateLimiterに一本化する。
+    SDKのリトライが残っていると試行回数が掛け算で増え、スロットリングもSDKが諦めるまで
+    AIMD制御に伝わらない。
+
+    Args:
+        kwargs: Configに渡す追加の設定（read_timeout等）
+
+    Returns:
+        Config: botocoreのクライアント設定
+    """
+    return Config(retries={'mode': 'standard', 'total_max_attempts': 1}, **kwargs)
+
+
+def classify_error(error: Exception) -> ErrorClass:
+    """
+    例外をリトライ分類に変換
+
+    Args:
+        error: 発生した例外
+
+    Returns:
+        ErrorClass: エラー分類
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        if code in THROTTLE_ERROR_CODES or status == 429:
+            return ErrorClass.THROTTLED
+        if code in TRANSIENT_ERROR_CODES or status >= 500:
+            return ErrorClass.TRANSIENT
+        return ErrorClass.FATAL
+
+    # 接続断・読み取りタイムアウト等のネットワーク系例外
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return ErrorClass.TRANSIENT
+    name = type(error).__name__
+    if name in ('ReadTimeoutError', 'ConnectTimeoutError', 'EndpointConnectionError', 'ConnectionClosedError'):
+        return ErrorClass.TRANSIENT
+
+    return ErrorClass.FATAL
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    サービスが返したリトライ待機時間のヒント（秒）を取得
+
+    Args:
+        error: 発生した例外
+
+    Returns:
+        Optional[float]: 待機秒数（ヒントがない場合はNone）
+    """
+    if not isinstance(error, ClientError):
+        return None
+    headers = error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {}) or {}
+    try:
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+        if 'x-amz-retry-after' in headers:
+            # x-amz-retry-after はミリ秒
+            return float(headers['x-amz-retry-after']) / 1000.0
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    入力トークン数の概算（日本語は1文字≒1トークン、英語は4文字≒1トークン）
+
+    Args:
+        text: 入力テキスト
+
+    Returns:
+        int: 推定トークン数
+    """
+    if not text:
+        return 1
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return max(1, (len(text) - ascii_chars) + ascii_chars // 4)
+
+
+class TokenBucket:
+    """トークンバケット（スレッドセーフ）"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        """
+        初期化
+
+        Args:
+            rate_per_second: 1秒あたりの補充量（0以下で無制限）
+            capacity: バケット容量（バースト許容量）
+        """
+        self.rate = rate_per_second
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, amount: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        トークンを取得（不足時は補充を待機）
+
+        Args:
+            amount: 取得量（容量を超える場合は容量に丸める）
+            timeout: 最大待機秒数（Noneで無期限）
+
+        Returns:
+            bool: 取得できた場合True
+        """
+        if self.rate <= 0:
+            return True
+
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return True
+                wait = (amount - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    @property
+    def available(self) -> float:
+        """現在の残量"""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class AIMDConcurrencyController:
+    """AIMD方式の同時実行数制御"""
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 increase_step: float = 1.0, decrease_factor: float = 0.5,
+                 success_window: int = 10):
+        """
+        初期化
+
+        Args:
+            initial_limit: 初期同時実行数
+            min_limit: 最小同時実行数
+            max_limit: 最大同時実行数
+            increase_step: 健全時の加算増加量
+            decrease_factor: スロットリング時の乗算減少率
+            success_window: 増加判定に必要な連続成功数
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.success_window = max(1, success_window)
+
+        self._in_flight = 0
+        self._successes = 0
+        self._saturated = False
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        実行枠を取得
+
+        Args:
+            timeout: 最大待機秒数（Noneで無期限）
+
+        Returns:
+            bool: 取得できた場合True
+        """
+        with self._condition:
+            acquired = self._condition.wait_for(lambda: self._in_flight < int(self.limit), timeout=timeout)
+            if acquired:
+                self._in_flight += 1
+                if self._in_flight >= int(self.limit):
+                    self._saturated = True
+            return acquired
+
+    def release(self, error_class: Optional[ErrorClass] = None, latency_ms: Optional[float] = None) -> None:
+        """
+        実行枠を解放し、結果に応じて同時実行数を調整
+
+        Args:
+            error_class: エラー分類（成功時はNone）
+            latency_ms: 呼び出しレイテンシ（ミリ秒）
+        """
+        with self._condition:
+            self._in_flight = max(0, self._in_flight - 1)
+
+            if error_class == ErrorClass.THROTTLED:
+                # 同一バーストでの連続減少を防ぐため、直近の減少から1秒は据え置く
+                now = time.monotonic()
+                if now - self._last_decrease >= 1.0:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.info(f"同時実行数を縮小: {self.limit:.1f}")
+                self._successes = 0
+            elif error_class is None:
+                self._successes += 1
+                if self._successes >= self.success_window:
+                    # 直近の窓で上限まで使い切っていた場合のみ増加を試行
+                    if self._saturated:
+                        self.limit = min(float(self.max_limit), self.limit + self.increase_step)
+                    self._successes = 0
+                    self._saturated = False
+
+            self._condition.notify_all()
+
+    @property
+    def in_flight(self) -> int:
+        """実行中の呼び出し数"""
+        with self._condition:
+            return self._in_flight
+
+
+class AdaptiveBatchSizer:
+    """観測レイテンシに基づくバッチサイズ調整"""
+
+    def __init__(self, initial_size: int = 25, min_size: int = 1, max_size: int = 50,
+                 target_latency_ms: float = 5000.0):
+        """
+        初期化
+
+        Args:
+            initial_size: 初期バッチサイズ
+            min_size: 最小バッチサイズ
+            max_size: 最大バッチサイズ
+            target_latency_ms: バッチあたりの目標処理時間（ミリ秒）
+        """
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = min(max(initial_size, self.min_size), self.max_size)
+        self.target_latency_ms = target_latency_ms
+        self._lock = threading.Lock()
+
+    def record(self, batch_size: int, latency_ms: float, throttled: bool = False) -> int:
+        """
+        バッチ処理結果を記録して次のバッチサイズを返す
+
+        Args:
+            batch_size: 処理したバッチサイズ
+            latency_ms: バッチ処理時間（ミリ秒）
+            throttled: バッチ中にスロットリングが発生したか
+
+        Returns:
+            int: 次のバッチサイズ
+        """
+        with self._lock:
+            if throttled or latency_ms > self.target_latency_ms:
+                self.size = max(self.min_size, self.size // 2)
+            elif latency_ms < self.target_latency_ms / 2 and batch_size >= self.size:
+                self.size = min(self.max_size, self.size + max(1, self.size // 4))
+            return self.size
+
+
+@dataclass
+class RateLimiterConfig:
+    """レート制限設定"""
+    requests_per_second: float = 10.0
+    tokens_per_minute: float = 0.0          # 0で無制限
+    initial_concurrency: int = 4
+    max_concurrency: int = 16
+    max_retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    batch_size: int = 25
+    max_batch_size: int = 50
+    batch_target_latency_ms: float = 5000.0
+
+    @classmethod
+    def from_env(cls) -> 'RateLimiterConfig':
+        """環境変数から設定を作成"""
+        try:
+            return cls(
+                requests_per_second=float(os.environ.get('BEDROCK_REQUESTS_PER_SECOND', '10')),
+                tokens_per_minute=float(os.environ.get('BEDROCK_TOKENS_PER_MINUTE', '0')),
+                initial_concurrency=int(os.environ.get('BEDROCK_INITIAL_CONCURRENCY', '4')),
+                max_concurrency=int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '16')),
+                max_retries=int(os.environ.get('BEDROCK_MAX_RETRIES', '3')),
+                base_delay=float(os.environ.get('BEDROCK_RETRY_BASE_DELAY', '0.5')),
+                max_delay=float(os.environ.get('BEDROCK_RETRY_MAX_DELAY', '20')),
+                batch_target_latency_ms=float(os.environ.get('BEDROCK_BATCH_TARGET_MS', '5000'))
+            )
+        except (ValueError, TypeError) as e:
+            logger.warning(f"レート制限設定が無効です。デフォルト値を使用します: {e}")
+            return cls()
+
+
+class BedrockRateLimiter:
+    """トークンバケット・AIMD同時実行制御・分類リトライを統合したリミッター"""
+
+    def __init__(self, config: Optional[RateLimiterConfig] = None, name: str = 'bedrock'):
+        """
+        初期化
+
+        Args:
+            config: レート制限設定（省略時は環境変数から作成）
+            name: リミッター名（ログ・統計用）
+        """
+        self.config = config or RateLimiterConfig.from_env()
+        self.name = name
+
+        self.request_bucket = TokenBucket(
+            self.config.requests_per_second, max(1.0, self.config.requests_per_second)
+        )
+        self.token_bucket = TokenBucket(
+            self.config.tokens_per_minute / 60.0, self.config.tokens_per_minute
+        )
+        self.concurrency = AIMDConcurrencyController(
+            initial_limit=self.config.initial_concurrency,
+            max_limit=self.config.max_concurrency
+        )
+        self.batch_sizer = AdaptiveBatchSizer(
+            initial_size=self.config.batch_size,
+            max_size=self.config.max_batch_size,
+            target_latency_ms=self.config.batch_target_latency_ms
+        )
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'retries': 0, 'throttles': 0, 'transient_errors': 0, 'failures': 0}
+
+    def execute(self, func: Callable[..., Any], *args, estimated_tokens: int = 0,
+                deadline: Optional[Any] = None, **kwargs) -> Any:
+        """
+        レート制限・同時実行制御・リトライを適用して関数を実行
+
+        Args:
+            func: 実行する関数（boto3クライアントメソッド等）
+            *args: 関数の位置引数
+            estimated_tokens: 推定トークン数（トークンクォータ用）
+            deadline: 実行期限（Deadline）。期限を超える待機・リトライは行わない
+            **kwargs: 関数のキーワード引数
+
+        Returns:
+            Any: 関数の戻り値
+
+        Raises:
+            Exception: リトライ不能、またはリトライ上限到達時の最後の例外
+        """
+        attempt = 0
+        while True:
+            self._acquire_within(lambda timeout: self.request_bucket.acquire(timeout=timeout), deadline)
+            if estimated_tokens:
+                self._acquire_within(lambda timeout: self.token_bucket.acquire(estimated_tokens, timeout), deadline)
+            self._acquire_within(self.concurrency.acquire, deadline)
+
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                error_class = classify_error(e)
+                self.concurrency.release(error_class)
+                self._record(error_class)
+
+                if error_class == ErrorClass.FATAL or attempt >= self.config.max_retries:
+                    with self._stats_lock:
+                        self._stats['failures'] += 1
+                    raise
+
+                delay = self._backoff_delay(attempt, get_retry_after(e))
+                # 待機後の再試行が期限内に終わらない場合はリトライせず失敗させる
+                if deadline is not None and not deadline.can_afford(delay + (time.monotonic() - start)):
+                    logger.warning(f"{self.name}: 残り時間不足のためリトライを中止します "
+                                   f"(残り {deadline.remaining():.2f}秒)")
+                    with self._stats_lock:
+                        self._stats['failures'] += 1
+                    raise
+
+                attempt += 1
+                logger.warning(f"{self.name}: {error_class.value}エラーのため{delay:.2f}秒後にリトライします "
+                               f"(試行 {attempt}/{self.config.max_retries})")
+                if deadline is not None:
+                    deadline.wait(delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            self.concurrency.release(None, (time.monotonic() - start) * 1000)
+            self._record(None)
+            return result
+
+    def _acquire_within(self, acquire: Callable[[Optional[float]], bool], deadline: Optional[Any]) -> None:
+        """期限内で枠を取得（期限切れ・キャンセル時はdeadline.checkが例外を送出）"""
+        if deadline is None:
+            acquire(None)
+            return
+        while not acquire(deadline.remaining()):
+            deadline.check(self.name)
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        """フルジッター付き指数バックオフ（サービスのヒントを下限とする）"""
+        cap = min(self.config.max_delay, self.config.base_delay * (2 ** attempt))
+        delay = random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.config.max_delay))
+        return delay
+
+    def _record(self, error_class: Optional[ErrorClass]) -> None:
+        with self._stats_lock:
+            self._stats['calls'] += 1
+            if error_class == ErrorClass.THROTTLED:
+                self._stats['throttles'] += 1
+                self._stats['retries'] += 1
+            elif error_class == ErrorClass.TRANSIENT:
+                self._stats['transient_errors'] += 1
+                self._stats['retries'] += 1
+
+    def throttle_count(self) -> int:
+        """累積スロットリング回数"""
+        with self._stats_lock:
+            return self._stats['throttles']
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        リミッター統計を取得
+
+        Returns:
+            Dict: 統計情報
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'name': self.name,
+            'concurrency_limit': int(self.concurrency.limit),
+            'in_flight': self.concurrency.in_flight,
+            'batch_size': self.batch_sizer.size,
+            'request_tokens_available': self.request_bucket.available
+        })
+        return stats
+
+
+# モデルIDごとに共有（Bedrockのクォータはモデル単位）
+_limiters: Dict[str, BedrockRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_bedrock_rate_limiter(model_id: str, config: Optional[RateLimiterConfig] = None) -> BedrockRateLimiter:
+    """
+    モデル単位で共有されるリミッターを取得
+
+    Args:
+        model_id: BedrockモデルID
+        config: 初回作成時の設定（省略時は環境変数から作成）
+
+    Returns:
+        BedrockRateLimiter: 共有リミッター
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(model_id)
+        if limiter is None:
+            limiter = BedrockRateLimiter(config, name=model_id)
+            _limiters[model_id] = limiter
+        return limiter
+
+
+# テスト用のサンプル関数
+def test_bedrock_rate_limiter():
+    """
+    レート制限・リトライ動作のテスト
+    """
+    limiter = BedrockRateLimiter(RateLimiterConfig(requests_per_second=50, base_delay=0.01), name='sample')
+    calls = {'count': 0}
+
+    def flaky_call():
+        calls['count'] += 1
+        if calls['count'] < 3:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'InvokeModel')
+        return 'ok'
+
+    print(f"結果: {limiter.execute(flaky_call)}")
+    print(f"統計: {limiter.get_stats()}")
+
+
+if __name__ == "__main__":
+    test_bedrock_rate_limiter()
@@ -49,7 +49,8 @@ DEFAULT_MARKITDOWN_CONFIG = {
             "processingStrategy": "both-compare",
             "useMarkitdown": True,
             "useLangChain": True,
-            "enableQualityComparison": True
+            "enableQualityComparison": True,
+            "pageBatchSize": 10
         },
         "png": {
             "enabled": True,
@@ -98,7 +99,8 @@ DEFAULT_MARKITDOWN_CONFIG = {
             "processingStrategy": "langchain-first",
             "useMarkitdown": True,
             "useLangChain": True,
-            "enableQualityComparison": False
+            "enableQualityComparison": False,
+            "chunkBoundaryElements": ["article", "section", "h1", "h2"]
         },
         "xml": {
             "enabled": True,
@@ -107,7 +109,8 @@ DEFAULT_MARKITDOWN_CONFIG = {
             "processingStrategy": "langchain-first",
             "useMarkitdown": True,
             "useLangChain": True,
-            "enableQualityComparison": False
+            "enableQualityComparison": False,
+            "chunkBoundaryElements": []
         },
         "csv": {
             "enabled": True,
@@ -147,7 +150,10 @@ DEFAULT_MARKITDOWN_CONFIG = {
         "validateFileSize": True,
         "encryptTempFiles": True,
         "autoDeleteTempFiles": True,
-        "tempFileRetentionMinutes": 30
+        "tempFileRetentionMinutes": 30,
+        "maxArchiveMembers": 1000,
+        "maxArchiveExpandedSizeBytes": 524288000,
+        "maxArchiveCompressionRatio": 100
     },
     "logging": {
         "level": "info",
@@ -159,7 +165,9 @@ DEFAULT_MARKITDOWN_CONFIG = {
         "ocrAccuracy": "high",
         "textExtractionQuality": "high",
         "preserveFormatting": True,
-        "preserveImages": False
+        "preserveImages": False,
+        "earlyAcceptEnabled": False,
+        "earlyAcceptQualityScore": 90
     }
 }
 
@@ -0,0 +1,354 @@
+"""
+マジックバイトによるファイル内容の判定
+拡張子ではなく先頭・末尾の数KBからコンテナ形式（ZIP/OOXML, PDF, 画像, テキスト）を判定し、
+適切な形式プロセッサーへ振り分ける。判定できないバイナリは変換を試行する前に拒否する。
+"""
+
+import codecs
+import csv
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 判定に使用する先頭・末尾のバイト数
+SNIFF_HEAD_BYTES = 8192
+SNIFF_TAIL_BYTES = 1024
+# ZIPの中央ディレクトリ（メンバー名の一覧）を探す末尾の範囲
+ZIP_DIRECTORY_BYTES = 65536
+# PDFのテキスト層判定に使用する範囲（オブジェクト辞書のみ走査）
+PDF_PROBE_BYTES = 65536
+
+CONTENT_SNIFFING_ENABLED = os.environ.get('CONTENT_SNIFFING_ENABLED', 'true').lower() == 'true'
+
+# テキストとして扱う形式（内容がテキストであれば拡張子の指定を尊重する）
+TEXT_FORMATS = ('html', 'xml', 'csv', 'tsv')
+
+# 同一形式の別名
+FORMAT_ALIASES = {'jpeg': 'jpg'}
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+# 未サポートの既知バイナリ形式（テキストとしてデコードできない場合の拒否理由の表示用）
+UNSUPPORTED_SIGNATURES = (
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole2'),  # 旧形式のOffice文書（doc/xls/ppt）
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'BM', 'bmp'),
+    (b'\x1f\x8b', 'gzip'),
+    (b'7z\xbc\xaf\x27\x1c', '7z'),
+    (b'Rar!\x1a\x07', 'rar'),
+    (b'\x7fELF', 'elf'),
+    (b'MZ', 'exe'),
+)
+
+# OOXMLのメンバー名（ローカルヘッダー・中央ディレクトリ上は非圧縮）
+OOXML_MEMBERS = (
+    (b'word/document', 'docx'),
+    (b'xl/workbook', 'xlsx'),
+    (b'ppt/presentation', 'pptx'),
+)
+
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+# BOMなしテキストで試行するエンコーディング（順に判定）
+FALLBACK_ENCODINGS = ('cp932', 'euc_jp')
+
+# テキストとみなす制御文字の上限割合
+MAX_CONTROL_CHAR_RATIO = 0.01
+
+PDF_FONT_PATTERN = re.compile(rb'/Type\s*/Font\b|/FontDescriptor\b')
+PDF_IMAGE_PATTERN = re.compile(rb'/Subtype\s*/Image\b')
+
+
+@dataclass
+class SniffResult:
+    """内容判定結果"""
+    container: str  # zip / pdf / image / text / binary / empty
+    detected_format: Optional[str] = None
+    encoding: Optional[str] = None
+    csv_dialect: Optional[Dict[str, Any]] = None
+    pdf_layout: Optional[str] = None  # text / scanned / mixed / unknown
+    pdf_complete: Optional[bool] = None
+    signature: Optional[str] = None
+    sniff_ms: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """メタデータ用の辞書表現"""
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+
+def sniff_content(file_content: bytes) -> SniffResult:
+    """
+    ファイル内容の先頭・末尾からコンテナ形式を判定
+
+    Args:
+        file_content: ファイル内容
+
+    Returns:
+        SniffResult: 判定結果
+    """
+    start = time.perf_counter()
+    result = _sniff(file_content)
+    result.sniff_ms = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+def route_content(sniff: SniffResult, declared_format: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    判定結果と拡張子から処理する形式を決定
+
+    Args:
+        sniff: 内容判定結果
+        declared_format: 拡張子から判定した形式
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: (処理する形式, 拒否理由)
+    """
+    if sniff.container == 'empty':
+        # 空ファイルは既存の内容検証でエラーにする
+        return declared_format, None
+
+    if sniff.detected_format:
+        if declared_format and FORMAT_ALIASES.get(declared_format, declared_format) == sniff.detected_format:
+            return declared_format, None
+        if declared_format:
+            logger.info(f"内容に基づき形式を変更: {declared_format} -> {sniff.detected_format}")
+        return sniff.detected_format, None
+
+    if sniff.container == 'text':
+        if declared_format in TEXT_FORMATS or declared_format is None:
+            return declared_format, None
+        return None, f"テキストファイルが{declared_format}形式として指定されています"
+
+    if sniff.container == 'zip':
+        if declared_format in (None, 'zip'):
+            # OOXML以外のZIPはアーカイブとしてメンバーごとに処理
+            return 'zip', None
+        return None, f"OOXML以外のZIPアーカイブが{declared_format}形式として指定されています"
+
+    if sniff.signature:
+        return None, f"サポートされていないファイル形式です: {sniff.signature}"
+
+    return None, "ファイル内容を判別できません（デコード不能なバイナリ）"
+
+
+def preferred_method(sniff: Optional[SniffResult]) -> Optional[str]:
+    """
+    内容に応じて優先する変換方法（テキスト層のあるPDFはOCRを使わない変換を優先）
+
+    Args:
+        sniff: 内容判定結果
+
+    Returns:
+        Optional[str]: 優先する処理方法（指定なしの場合None）
+    """
+    if not sniff or sniff.container != 'pdf':
+        return None
+    if sniff.pdf_layout == 'text':
+        return 'langchain'
+    if sniff.pdf_layout in ('scanned', 'mixed'):
+        return 'markitdown'
+    return None
+
+
+def _sniff(file_content: bytes) -> SniffResult:
+    if not file_content:
+        return SniffResult(container='empty')
+
+    head = file_content[:SNIFF_HEAD_BYTES]
+
+    if head.startswith(b'PK\x03\x04') or head.startswith(b'PK\x05\x06'):
+        return _sniff_zip(file_content, head)
+
+    # PDFは先頭1KB以内にヘッダーがあればよい（仕様上の許容範囲）
+    pdf_offset = head.find(b'%PDF-', 0, 1024)
+    if pdf_offset >= 0:
+        return _sniff_pdf(file_content, pdf_offset)
+
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return SniffResult(container='image', detected_format=image_format, signature=image_format)
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return SniffResult(container='image', signature='webp')
+
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return _sniff_text(head, len(file_content) > len(head), encoding)
+
+    result = _sniff_text(head, len(file_content) > len(head), None)
+    if result.container == 'binary':
+        # 短い署名はテキストの先頭と一致し得るため、デコードできない場合のみ照合
+        result.signature = next((name for signature, name in UNSUPPORTED_SIGNATURES
+                                 if head.startswith(signature)), None)
+    return result
+
+
+def _sniff_zip(file_content: bytes, head: bytes) -> SniffResult:
+    """ZIPのメンバー名からOOXML形式を判定"""
+    tail = file_content[-ZIP_DIRECTORY_BYTES:] if len(file_content) > SNIFF_HEAD_BYTES else b''
+    for member, ooxml_format in OOXML_MEMBERS:
+        if member in head or member in tail:
+            return SniffResult(container='zip', detected_format=ooxml_format, signature='ooxml')
+    return SniffResult(container='zip', signature='zip')
+
+
+def _sniff_pdf(file_content: bytes, header_offset: int) -> SniffResult:
+    """PDFのトレーラーとテキスト層の有無を判定"""
+    tail = file_content[-SNIFF_TAIL_BYTES:]
+    probe = file_content[header_offset:header_offset + PDF_PROBE_BYTES]
+    if len(file_content) > PDF_PROBE_BYTES:
+        probe += file_content[-PDF_PROBE_BYTES:]
+
+    has_fonts = PDF_FONT_PATTERN.search(probe) is not None
+    has_images = PDF_IMAGE_PATTERN.search(probe) is not None
+    if has_fonts and has_images:
+        layout = 'mixed'
+    elif has_fonts:
+        layout = 'text'
+    elif has_images:
+        layout = 'scanned'
+    else:
+        # オブジェクトストリーム内に圧縮されている場合は判定しない
+        layout = 'unknown'
+
+    return SniffResult(
+        container='pdf',
+        detected_format='pdf',
+        signature='pdf',
+        pdf_layout=layout,
+        pdf_complete=b'%%EOF' in tail
+    )
+
+
+def _sniff_text(head: bytes, truncated: bool, bom_encoding: Optional[str]) -> SniffResult:
+    """テキストのエンコーディング・構造（HTML/XML/CSV）を判定"""
+    text, encoding = _decode_head(head, truncated, bom_encoding)
+    if text is None:
+        return SniffResult(container='binary')
+
+    stripped = text.lstrip('\ufeff \t\r\n')
+    lowered = stripped[:1024].lower()
+    if lowered.startswith('<!doctype html') or lowered.startswith('<html') or '<html' in lowered:
+        return SniffResult(container='text', detected_format='html', encoding=encoding)
+    if lowered.startswith('<?xml') or (lowered.startswith('<') and not lowered.startswith('<!--')):
+        return SniffResult(container='text', detected_format='xml', encoding=encoding)
+
+    dialect = _sniff_csv_dialect(text, truncated)
+    if dialect:
+        detected = 'tsv' if dialect['delimiter'] == '\t' else 'csv'
+        return SniffResult(container='text', detected_format=detected, encoding=encoding, csv_dialect=dialect)
+
+    return SniffResult(container='text', encoding=encoding)
+
+
+def _decode_head(head: bytes, truncated: bool, bom_encoding: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """先頭バイトをデコード（末尾で途切れたマルチバイト文字は許容）"""
+    if bom_encoding:
+        candidates: List[str] = [bom_encoding]
+    elif b'\x00' in head:
+        # BOMなしのUTF-16のみ許容（それ以外のNULを含む内容はバイナリ）
+        candidates = [_guess_utf16(head)] if _guess_utf16(head) else []
+    else:
+        candidates = ['utf-8', *FALLBACK_ENCODINGS]
+
+    for encoding in candidates:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            text = decoder.decode(head, final=not truncated)
+        except UnicodeDecodeError:
+            continue
+        if _control_char_ratio(text) <= MAX_CONTROL_CHAR_RATIO:
+            return text, encoding
+    return None, None
+
+
+def _guess_utf16(head: bytes) -> Optional[str]:
+    """NULバイトの位置からBOMなしUTF-16のバイト順を推定"""
+    sample = head[:512]
+    even_nuls = sample[0::2].count(0)
+    odd_nuls = sample[1::2].count(0)
+    half = len(sample) // 2
+    if half and odd_nuls >= half * 0.8 and even_nuls == 0:
+        return 'utf-16-le'
+    if half and even_nuls >= half * 0.8 and odd_nuls == 0:
+        return 'utf-16-be'
+    return None
+
+
+def _control_char_ratio(text: str) -> float:
+    if not text:
+        return 0.0
+    controls = sum(1 for ch in text if (ord(ch) < 32 and ch not in '\t\n\r\f\v') or ch == '\x7f')
+    return controls / len(text)
+
+
+def _sniff_csv_dialect(text: str, truncated: bool) -> Optional[Dict[str, Any]]:
+    """CSVの区切り文字・引用符・ヘッダー有無を判定"""
+    lines = text.splitlines()
+    if truncated and lines:
+        lines = lines[:-1]  # 途中で切れた最終行は除外
+    lines = [line for line in lines[:20] if line.strip()]
+    if len(lines) < 2:
+        return None
+
+    sample = '\n'.join(lines)
+    sniffer = csv.Sniffer()
+    try:
+        dialect = sniffer.sniff(sample, delimiters=',\t;|')
+    except csv.Error:
+        return None
+
+    # 全行で列数が一致し、2列以上ある場合のみ表形式とみなす
+    rows = list(csv.reader(lines, dialect))
+    column_counts = {len(row) for row in rows}
+    if len(column_counts) != 1 or column_counts.pop() < 2:
+        return None
+
+    try:
+        has_header = sniffer.has_header(sample)
+    except csv.Error:
+        has_header = False
+
+    return {
+        'delimiter': dialect.delimiter,
+        'quotechar': dialect.quotechar,
+        'hasHeader': has_header
+    }
+
+
+# テスト用のサンプル関数
+def test_content_sniffer():
+    """
+    内容判定のテスト
+    """
+    samples = {
+        'report.pdf': b'%PDF-1.7\n1 0 obj << /Type /Font /Subtype /Type1 >> endobj\n%%EOF',
+        'photo.pdf': b'\x89PNG\r\n\x1a\n' + b'\x00' * 32,
+        'data.csv': 'id\tname\n1\t山田\n2\t佐藤\n'.encode('cp932'),
+        'broken.docx': bytes(range(256)) * 4,
+    }
+    for file_name, content in samples.items():
+        declared = file_name.rsplit('.', 1)[-1]
+        sniff = sniff_content(content)
+        routed, rejection = route_content(sniff, declared)
+        print(f"{file_name}: {sniff.to_dict()} -> {routed} {rejection or ''}")
+
+
+if __name__ == "__main__":
+    test_content_sniffer()
@@ -0,0 +1,307 @@
+"""
+コンテンツアドレス型の変換結果キャッシュ
+(ファイルSHA-256, 形式, 変換器名+バージョン, 変換オプション) をキーとして
+圧縮したマークダウンと変換メタデータをS3に保存し、ウォームコンテナでは/tmpにも保持する。
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+# 変換結果に影響しないため、キャッシュキーから除外する品質設定
+_NON_CONVERSION_QUALITY_KEYS = ('earlyAcceptEnabled', 'earlyAcceptQualityScore')
+
+
+def file_sha256(file_content: bytes) -> str:
+    """ファイル内容のSHA-256"""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def converter_version(file_format: str, method: str, config: Dict[str, Any]) -> str:
+    """
+    変換器のバージョン文字列（プロセッサー実装とライブラリのバージョン）
+
+    Args:
+        file_format: ファイル形式
+        method: 処理方法（markitdown / langchain）
+        config: Markitdown設定
+
+    Returns:
+        str: バージョン文字列
+    """
+    from format_processors import get_format_processor
+
+    processor = get_format_processor(file_format, config)
+    version = f"{type(processor).__name__}/{getattr(processor, 'PROCESSOR_VERSION', 'unknown')}"
+
+    try:
+        from importlib.metadata import version as package_version
+        version += f"+{method}/{package_version(method)}"
+    except Exception:
+        # ライブラリ未導入（モック実装）の場合はプロセッサーのバージョンのみ
+        pass
+    return version
+
+
+def conversion_options(config: Dict[str, Any], file_format: str) -> Dict[str, Any]:
+    """
+    変換結果に影響する設定を抽出
+
+    Args:
+        config: Markitdown設定
+        file_format: ファイル形式
+
+    Returns:
+        Dict: 変換オプション
+    """
+    format_config = config.get('supportedFormats', {}).get(file_format, {})
+    quality = {k: v for k, v in config.get('quality', {}).items() if k not in _NON_CONVERSION_QUALITY_KEYS}
+    return {
+        'ocr': format_config.get('ocr', False),
+        'quality': quality
+    }
+
+
+class ConversionCache:
+    """変換結果キャッシュ（/tmpのローカル層 + S3）"""
+
+    # ローカル層の既定上限（/tmpの既定サイズ512MBの一部）
+    DEFAULT_LOCAL_MAX_MB = 128
+
+    def __init__(self, bucket: Optional[str] = None, prefix: str = 'conversion-cache/',
+                 local_dir: str = '/tmp/conversion-cache', local_max_mb: Optional[int] = None):
+        """
+        初期化
+
+        Args:
+            bucket: 保存先S3バケット（省略時はCONVERSION_CACHE_BUCKET環境変数、未設定時はローカル層のみ）
+            prefix: S3キープレフィックス
+            local_dir: ローカル層のディレクトリ
+            local_max_mb: ローカル層の上限（MB）
+        """
+        self.bucket = bucket or os.environ.get('CONVERSION_CACHE_BUCKET')
+        self.prefix = prefix
+        self.local_dir = local_dir
+        if local_max_mb is None:
+            local_max_mb = int(os.environ.get('CONVERSION_CACHE_LOCAL_MAX_MB', str(self.DEFAULT_LOCAL_MAX_MB)))
+        self.local_max_bytes = local_max_mb * 1024 * 1024
+        self.s3_client = boto3.client('s3') if self.bucket else None
+
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'remote_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(file_hash: str, file_format: str, converter: str, version: str,
+                 options: Dict[str, Any]) -> str:
+        """
+        キャッシュキーを作成（同一ファイルのエントリはファイルハッシュ配下にまとめる）
+
+        Args:
+            file_hash: ファイル内容のSHA-256
+            file_format: ファイル形式
+            converter: 変換器名
+            version: 変換器のバージョン
+            options: 変換オプション
+
+        Returns:
+            str: キャッシュキー
+        """
+        digest = hashlib.sha256(json.dumps(
+            {'format': file_format, 'converter': converter, 'version': version, 'options': options},
+            sort_keys=True, ensure_ascii=False, default=str
+        ).encode('utf-8')).hexdigest()[:24]
+        return f"{file_hash}/{file_format}-{converter}-{digest}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        キャッシュエントリを取得（ローカル層 → S3の順）
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            Optional[Dict]: エントリ（markdown, metadata, fileName 等）
+        """
+        path = self._local_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(gzip.decompress(f.read()))
+            os.utime(path)  # LRU用に最終利用時刻を更新
+            self._count('local_hits')
+            return entry
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"ローカル変換キャッシュの読み込みに失敗: {key} - {e}")
+
+        if self.s3_client:
+            try:
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=self._s3_key(key))
+                body = response['Body'].read()
+                self._write_local(key, body)
+                self._count('remote_hits')
+                return json.loads(gzip.decompress(body))
+            except Exception as e:
+                if getattr(e, 'response', {}).get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                    logger.warning(f"S3変換キャッシュの読み込みに失敗: {key} - {e}")
+
+        self._count('misses')
+        return None
+
+    def put(self, key: str, markdown: str, metadata: Dict[str, Any], file_name: Optional[str] = None) -> None:
+        """
+        キャッシュエントリを保存
+
+        Args:
+            key: キャッシュキー
+            markdown: 変換結果のマークダウン
+            metadata: 変換メタデータ
+            file_name: 元のファイル名（リプレイ時のチャンクIDに使用）
+        """
+        body = gzip.compress(json.dumps({
+            'key': key,
+            'fileName': file_name,
+            'markdown': markdown,
+            'metadata': metadata,
+            'createdAt': datetime.now().isoformat()
+        }, ensure_ascii=False, default=str).encode('utf-8'))
+
+        self._write_local(key, body)
+        if self.s3_client:
+            try:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self._s3_key(key), Body=body,
+                                          ContentType='application/json', ContentEncoding='gzip')
+            except Exception as e:
+                logger.warning(f"S3変換キャッシュの保存に失敗: {key} - {e}")
+        self._count('writes')
+
+    def list_keys(self, file_hash: str) -> List[str]:
+        """
+        ファイルハッシュに対応するキャッシュキーの一覧
+
+        Args:
+            file_hash: ファイル内容のSHA-256
+
+        Returns:
+            List[str]: キャッシュキー
+        """
+        keys = set()
+        local_dir = os.path.join(self.local_dir, file_hash)
+        if os.path.isdir(local_dir):
+            for name in os.listdir(local_dir):
+                if name.endswith('.json.gz'):
+                    keys.add(f"{file_hash}/{name[:-len('.json.gz')]}")
+
+        if self.s3_client:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}{file_hash}/"):
+                for obj in page.get('Contents', []):
+                    key = obj['Key'][len(self.prefix):]
+                    if key.endswith('.json.gz'):
+                        keys.add(key[:-len('.json.gz')])
+        return sorted(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """統計情報を取得"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _s3_key(self, key: str) -> str:
+        return f"{self.prefix}{key}.json.gz"
+
+    def _local_path(self, key: str) -> str:
+        return os.path.join(self.local_dir, f"{key}.json.gz")
+
+    def _write_local(self, key: str, body: bytes) -> None:
+        """ローカル層に書き込み、上限を超えた場合は古いエントリから削除"""
+        path = self._local_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+            self._evict_local()
+        except OSError as e:
+            logger.warning(f"ローカル変換キャッシュの保存に失敗: {key} - {e}")
+
+    def _evict_local(self) -> None:
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.local_dir):
+            for name in files:
+                if not name.endswith('.json.gz'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.local_max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count('evictions')
+            if total <= self.local_max_bytes:
+                break
+
+
+# グローバルインスタンス（ウォーム起動間でローカル層を再利用）
+_conversion_cache: Optional[ConversionCache] = None
+
+
+def get_conversion_cache() -> Optional[ConversionCache]:
+    """
+    変換キャッシュを取得（CONVERSION_CACHE_ENABLED=false の場合はNone）
+
+    Returns:
+        Optional[ConversionCache]: 変換キャッシュ
+    """
+    global _conversion_cache
+    if os.environ.get('CONVERSION_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    if _conversion_cache is None:
+        _conversion_cache = ConversionCache()
+    return _conversion_cache
+
+
+# テスト用のサンプル関数
+def test_conversion_cache():
+    """
+    変換キャッシュのテスト
+    """
+    cache = ConversionCache(bucket=None, local_dir='/tmp/conversion-cache-sample')
+    config = {'supportedFormats': {'pdf': {'ocr': True}}, 'quality': {'ocrAccuracy': 'high'}}
+    content = b'%PDF-1.4 sample'
+    key = ConversionCache.make_key(file_sha256(content), 'pdf', 'markitdown',
+                                   converter_version('pdf', 'markitdown', config),
+                                   conversion_options(config, 'pdf'))
+    print(f"キャッシュキー: {key}")
+    print(f"初回取得: {cache.get(key)}")
+    cache.put(key, '# sample', {'method': 'markitdown', 'qualityScore': 90}, 'sample.pdf')
+    print(f"再取得: {cache.get(key)['markdown']}")
+    print(f"統計: {cache.get_stats()}")
+
+
+if __name__ == "__main__":
+    test_conversion_cache()
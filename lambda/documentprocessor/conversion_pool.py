@@ -0,0 +1,591 @@
+"""
+CPU負荷の高い形式変換のプロセスプール実行
+Office・PDF・画像の変換をプリフォークしたワーカープロセスで実行し、複数vCPUを活用する。
+ワーカーはウォーム起動間で再利用し、大きな入力はパイプ経由のpickleではなく共有メモリで受け渡す。
+メモリ上限・期限を超えたワーカーは強制終了して再生成するため、コンテナ全体は巻き込まれない。
+補助スレッドの起動後の再生成はforkserver（利用できない場合はspawn）で行い、
+他のスレッドが保持していたロックをフォークで引き継がない。
+"""
+
+import logging
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from error_handler import ProcessingError, ErrorType, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# プロセスプールで実行する形式（OfficeDocumentProcessor・PDFProcessor・ImageProcessor）
+PROCESS_POOL_FORMATS = frozenset(['docx', 'xlsx', 'pptx', 'pdf', 'png', 'jpg', 'jpeg', 'gif'])
+
+# この値以上の入力は共有メモリで受け渡す
+DEFAULT_SHARED_MEMORY_THRESHOLD_BYTES = 1024 * 1024
+
+
+@dataclass
+class SharedPayload:
+    """共有メモリ上の入力への参照（ワーカーにはこの参照のみを送る）"""
+    name: str
+    size: int
+    kind: str  # 'shm'（POSIX共有メモリ）または 'mmap'（/tmp上のメモリマップファイル）
+
+
+class SharedBuffer:
+    """
+    ワーカーに受け渡す入力の共有メモリ
+
+    Lambdaには/dev/shmが無いため、POSIX共有メモリを作成できない場合は
+    /tmp上のファイルをワーカー側でメモリマップして読み取る。
+    """
+
+    def __init__(self, data: bytes, fallback_dir: Optional[str] = None):
+        """
+        初期化
+
+        Args:
+            data: 受け渡すデータ
+            fallback_dir: 共有メモリが使えない場合の一時ファイル配置先
+        """
+        self._shm = None
+        self._path: Optional[str] = None
+        size = len(data)
+
+        try:
+            from multiprocessing import shared_memory
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+            self._shm.buf[:size] = data
+            self.payload = SharedPayload(self._shm.name, size, 'shm')
+        except (ImportError, OSError) as e:
+            logger.debug(f"POSIX共有メモリが使用できないためメモリマップファイルを使用: {e}")
+            fd, self._path = tempfile.mkstemp(prefix='conversion-', dir=fallback_dir or tempfile.gettempdir())
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self.payload = SharedPayload(self._path, size, 'mmap')
+
+    def close(self) -> None:
+        """共有メモリを解放"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        elif self._path:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+
+def _load_payload(payload: SharedPayload) -> bytes:
+    """ワーカー側で共有メモリから入力を読み取る"""
+    if payload.kind == 'shm':
+        from multiprocessing import shared_memory, resource_tracker
+        shm = shared_memory.SharedMemory(name=payload.name)
+        try:
+            # 解放は親プロセスが行うため、ワーカーのリソーストラッカーからは外す
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        try:
+            return bytes(shm.buf[:payload.size])
+        finally:
+            shm.close()
+
+    if payload.size == 0:
+        return b''
+    with open(payload.name, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:payload.size]
+
+
+def _apply_memory_limit(memory_limit_bytes: Optional[int]) -> None:
+    """ワーカーのアドレス空間に上限を設定（現在の使用量に上乗せ）"""
+    if not memory_limit_bytes:
+        return
+    try:
+        import resource
+        with open('/proc/self/statm') as f:
+            current_vm = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        limit = current_vm + memory_limit_bytes
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except Exception as e:
+        # 上限を設定できない環境では親プロセス側のRSS監視のみで制御する
+        logger.debug(f"ワーカーのメモリ上限を設定できません: {e}")
+
+
+def _thread_safe_context() -> Any:
+    """スレッドの状態を引き継がずにワーカーを起動するmultiprocessingのコンテキスト"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # フォークサーバーで本モジュールを読み込み、ワーカーの起動ごとのインポートを省く
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _worker_main(conn: Any, memory_limit_bytes: Optional[int]) -> None:
+    """ワーカープロセスのメインループ（タスクを受信して結果を返す）"""
+    if not logging.getLogger().handlers:
+        # forkserver・spawnで起動したワーカーは親プロセスのログ設定を引き継がない
+        logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    _apply_memory_limit(memory_limit_bytes)
+    # 起動完了を通知（親プロセスはこの時点のRSSを基準にメモリ増加量を監視する）
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            break
+        if task is None:
+            break
+
+        func, payload, args = task
+        content = None
+        try:
+            content = _load_payload(payload) if isinstance(payload, SharedPayload) else payload
+            result = ('ok', func(content, *args))
+        except MemoryError:
+            result = ('memory', 'ワーカーのメモリ上限を超過しました')
+        except Exception as e:
+            result = ('error', f"{type(e).__name__}: {e}")
+        finally:
+            del content
+
+        try:
+            conn.send(result)
+        except Exception as e:
+            conn.send(('error', f"結果の送信に失敗: {e}"))
+
+
+def convert_in_worker(file_content: bytes, file_format: str, method: str,
+                      config: Dict[str, Any], file_name: str) -> Tuple[bool, str, Dict]:
+    """
+    ワーカープロセスで実行する形式変換
+
+    Args:
+        file_content: ファイル内容
+        file_format: ファイル形式
+        method: 処理方法（markitdown / langchain）
+        config: Markitdown設定
+        file_name: ファイル名
+
+    Returns:
+        (成功フラグ, 変換結果, メタデータ)
+    """
+    from format_processors import get_format_processor
+
+    processor = get_format_processor(file_format, config)
+    if not processor:
+        return False, "", {
+            'method': method,
+            'success': False,
+            'error': f'サポートされていないファイル形式: {file_format}'
+        }
+
+    if method == 'markitdown':
+        success, content, metadata = processor.process_with_markitdown(file_content, file_name)
+    else:
+        success, content, metadata = processor.process_with_langchain(file_content, file_name)
+    metadata['workerPid'] = os.getpid()
+    return success, content, metadata
+
+
+def convert_pages_in_worker(file_content: bytes, method: str, config: Dict[str, Any], file_name: str,
+                            first_page: int, last_page: int) -> Tuple[bool, str, Dict]:
+    """
+    ワーカープロセスで実行するPDFのページ範囲変換
+
+    Args:
+        file_content: PDF全体の内容（共有メモリ経由で受け渡し）
+        method: 処理方法（markitdown / langchain）
+        config: Markitdown設定
+        file_name: ファイル名
+        first_page: 開始ページ（1始まり）
+        last_page: 終了ページ（1始まり、範囲に含む）
+
+    Returns:
+        (成功フラグ, 変換結果, メタデータ)
+    """
+    from format_processors import PDFProcessor
+
+    success, content, metadata = PDFProcessor(config).process_pages(
+        method, file_content, file_name, first_page, last_page
+    )
+    metadata['workerPid'] = os.getpid()
+    return success, content, metadata
+
+
+class _Worker:
+    """プリフォークしたワーカープロセス"""
+
+    def __init__(self, context: Any, memory_limit_bytes: Optional[int]):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_limit_bytes), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks_completed = 0
+        # 起動直後のRSS（フォーク元から引き継いだコピーオンライトのページを含む）
+        self.baseline_rss: Optional[int] = None
+        # フォークしたワーカーは起動時のページを親プロセスと共有する
+        self.shares_parent_pages = context.get_start_method() == 'fork'
+
+    def wait_ready(self, timeout: Optional[float]) -> bool:
+        """
+        起動完了を待機して基準RSSを記録
+
+        Args:
+            timeout: 最大待機秒数（Noneで無制限）
+
+        Returns:
+            bool: 起動完了したか
+        """
+        if self.baseline_rss is not None:
+            return True
+        try:
+            if not self.conn.poll(timeout):
+                return False
+            self.conn.recv()
+        except (EOFError, OSError):
+            return False
+        self.baseline_rss = self.rss_bytes() or 0
+        return True
+
+    def rss_growth_bytes(self) -> Optional[int]:
+        """起動直後からの常駐メモリの増加量（タスクが確保したメモリ）"""
+        rss = self.rss_bytes()
+        if rss is None:
+            return None
+        return max(0, rss - (self.baseline_rss or 0))
+
+    def memory_bytes(self) -> Optional[int]:
+        """親プロセスのRSSに含まれないワーカーのメモリ量（フォークしたワーカーは起動後の増加量）"""
+        return self.rss_growth_bytes() if self.shares_parent_pages else self.rss_bytes()
+
+    def rss_bytes(self) -> Optional[int]:
+        """ワーカーの常駐メモリ量"""
+        try:
+            with open(f'/proc/{self.process.pid}/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def kill(self) -> None:
+        """ワーカーを強制終了"""
+        try:
+            self.process.kill()
+            self.process.join(1)
+        finally:
+            self.conn.close()
+
+    def stop(self) -> None:
+        """ワーカーを正常終了"""
+        try:
+            self.conn.send(None)
+            self.process.join(1)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class ConversionProcessPool:
+    """形式変換用のプリフォーク済みワーカープール"""
+
+    # 結果待ちの間に期限・キャンセル・メモリ使用量を確認する間隔
+    POLL_INTERVAL_SECONDS = 0.05
+
+    def __init__(self, max_workers: int = 3, memory_limit_mb: Optional[int] = None,
+                 shared_memory_threshold: int = DEFAULT_SHARED_MEMORY_THRESHOLD_BYTES,
+                 start_method: str = 'fork'):
+        """
+        初期化（ワーカーはこの時点でフォークし、以降の呼び出しで再利用する）
+
+        Args:
+            max_workers: ワーカー数
+            memory_limit_mb: ワーカーあたりのメモリ上限（MB、起動後の増加量、Noneで無制限）
+            shared_memory_threshold: 共有メモリで受け渡す入力サイズの閾値（バイト）
+            start_method: multiprocessingの起動方式（forkの場合、補助スレッドの起動後の再生成はforkserver）
+        """
+        self.max_workers = max(1, max_workers)
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self.shared_memory_threshold = shared_memory_threshold
+        self._context = multiprocessing.get_context(start_method)
+        self._respawn_context = _thread_safe_context() if start_method == 'fork' else None
+        self._condition = threading.Condition()
+        # 実行中を含む全ワーカー（メモリ使用量の集計用）
+        self._workers: List[_Worker] = []
+        self._idle: List[_Worker] = [self._spawn() for _ in range(self.max_workers)]
+        self._closed = False
+        self._stats = {
+            'tasks': 0, 'shared_memory_tasks': 0, 'timeouts': 0,
+            'cancelled': 0, 'memory_kills': 0, 'crashes': 0, 'respawns': 0, 'thread_safe_respawns': 0
+        }
+
+        logger.info(f"変換ワーカープールを初期化: {self.max_workers}ワーカー "
+                    f"(メモリ上限: {memory_limit_mb or '無制限'}MB)")
+
+    def _spawn(self, respawn: bool = False) -> _Worker:
+        """
+        ワーカーを起動
+
+        Args:
+            respawn: 異常・中断したワーカーの再生成か（補助スレッドの起動後はフォークせずに起動する）
+        """
+        if respawn and self._respawn_context is not None and threading.active_count() > 1:
+            # ログ出力・ハートビートなどのスレッドが保持中のロックをフォークで引き継ぐとワーカーが停止しうる
+            with self._condition:
+                self._stats['thread_safe_respawns'] += 1
+            worker = _Worker(self._respawn_context, self.memory_limit_bytes)
+        else:
+            worker = _Worker(self._context, self.memory_limit_bytes)
+        with self._condition:
+            self._workers.append(worker)
+        return worker
+
+    def run(self, func: Callable[..., Any], file_content: bytes, *args,
+            timeout: Optional[float] = None, deadline: Optional[Any] = None) -> Any:
+        """
+        ワーカープロセスで関数を実行
+
+        Args:
+            func: 実行する関数（モジュールトップレベルで定義されpickle可能であること）
+            file_content: 関数の第1引数として渡す入力データ
+            *args: 関数の残りの位置引数
+            timeout: 最大実行秒数
+            deadline: 実行期限（Deadline）。キャンセル時はワーカーを強制終了する
+
+        Returns:
+            Any: 関数の戻り値
+
+        Raises:
+            TimeoutError: 期限・タイムアウトを超過した場合
+            ProcessingError: キャンセル・メモリ上限超過・ワーカー異常終了・関数内エラーの場合
+        """
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        if deadline is not None:
+            deadline_at = time.monotonic() + deadline.remaining()
+            expires_at = deadline_at if expires_at is None else min(expires_at, deadline_at)
+
+        worker = self._acquire(expires_at)
+        buffer = None
+        healthy = False
+        try:
+            if not worker.wait_ready(None if expires_at is None else max(0.0, expires_at - time.monotonic())):
+                raise ProcessingError(ErrorType.CONVERSION_FAILED, "変換ワーカーの起動を確認できませんでした")
+            if len(file_content) >= self.shared_memory_threshold:
+                buffer = SharedBuffer(file_content)
+                payload = buffer.payload
+            else:
+                payload = file_content
+
+            with self._condition:
+                self._stats['tasks'] += 1
+                if buffer is not None:
+                    self._stats['shared_memory_tasks'] += 1
+
+            worker.conn.send((func, payload, args))
+            status, value = self._wait_result(worker, expires_at, deadline, timeout)
+            worker.tasks_completed += 1
+
+            if status == 'ok':
+                healthy = True
+                return value
+            if status == 'memory':
+                # メモリ不足後のヒープは断片化しているためワーカーを作り直す
+                with self._condition:
+                    self._stats['memory_kills'] += 1
+                raise ProcessingError(
+                    ErrorType.MEMORY_LIMIT_EXCEEDED, value,
+                    {'limit_mb': self._limit_mb()}
+                )
+            healthy = True
+            raise ProcessingError(ErrorType.CONVERSION_FAILED, f"ワーカーでの変換に失敗: {value}")
+        finally:
+            if buffer is not None:
+                buffer.close()
+            self._release(worker, healthy)
+
+    def _wait_result(self, worker: _Worker, expires_at: Optional[float],
+                     deadline: Optional[Any], timeout: Optional[float]) -> Tuple[str, Any]:
+        """期限・キャンセル・メモリ使用量を監視しながら結果を待機"""
+        while True:
+            try:
+                if worker.conn.poll(self.POLL_INTERVAL_SECONDS):
+                    return worker.conn.recv()
+            except (EOFError, OSError):
+                pass
+
+            if not worker.process.is_alive():
+                with self._condition:
+                    self._stats['crashes'] += 1
+                raise ProcessingError(
+                    ErrorType.CONVERSION_FAILED,
+                    f"変換ワーカーが異常終了しました (exitcode: {worker.process.exitcode})",
+                    {'exitcode': worker.process.exitcode}
+                )
+
+            if deadline is not None and deadline.cancelled():
+                with self._condition:
+                    self._stats['cancelled'] += 1
+                raise ProcessingError(
+                    ErrorType.PROCESSING_INTERRUPTED,
+                    f"変換がキャンセルされました: {deadline.cancel_reason()}"
+                )
+
+            if expires_at is not None and time.monotonic() >= expires_at:
+                with self._condition:
+                    self._stats['timeouts'] += 1
+                raise TimeoutError("変換ワーカーがタイムアウトしました", timeout or 0)
+
+            # フォーク元と共有するページは上限に含めず、起動後に増加した分のみを監視する
+            growth = worker.rss_growth_bytes()
+            if self.memory_limit_bytes and growth is not None and growth > self.memory_limit_bytes:
+                with self._condition:
+                    self._stats['memory_kills'] += 1
+                raise ProcessingError(
+                    ErrorType.MEMORY_LIMIT_EXCEEDED,
+                    f"変換ワーカーのメモリ使用量が上限を超過: +{growth / 1024 / 1024:.1f}MB > {self._limit_mb()}MB",
+                    {'current_memory_mb': growth / 1024 / 1024, 'limit_mb': self._limit_mb(),
+                     'baseline_memory_mb': (worker.baseline_rss or 0) / 1024 / 1024}
+                )
+
+    def _limit_mb(self) -> Optional[float]:
+        return self.memory_limit_bytes / 1024 / 1024 if self.memory_limit_bytes else None
+
+    def _acquire(self, expires_at: Optional[float]) -> _Worker:
+        """空きワーカーを取得"""
+        with self._condition:
+            while not self._idle:
+                if self._closed:
+                    raise ProcessingError(ErrorType.PROCESSING_INTERRUPTED, "変換ワーカープールは終了しています")
+                wait = None if expires_at is None else expires_at - time.monotonic()
+                if wait is not None and wait <= 0:
+                    raise TimeoutError("空き変換ワーカーの待機がタイムアウトしました", 0)
+                self._condition.wait(wait)
+            return self._idle.pop()
+
+    def _release(self, worker: _Worker, healthy: bool) -> None:
+        """ワーカーを返却（異常・中断したワーカーは強制終了して再生成）"""
+        if not healthy:
+            worker.kill()
+            with self._condition:
+                self._workers.remove(worker)
+            try:
+                worker = self._spawn(respawn=True)
+                with self._condition:
+                    self._stats['respawns'] += 1
+            except Exception as e:
+                logger.error(f"変換ワーカーの再生成に失敗: {e}")
+                worker = None
+
+        with self._condition:
+            if worker is not None:
+                if self._closed:
+                    self._workers.remove(worker)
+                    worker.stop()
+                else:
+                    self._idle.append(worker)
+            self._condition.notify()
+
+    def memory_bytes(self) -> int:
+        """
+        ワーカーのメモリ使用量の合計（親プロセスのRSSに含まれない分）
+
+        コンテナのメモリ上限はワーカーを含めたプロセス全体に適用されるため、メモリモニターの計測に加算する。
+
+        Returns:
+            int: 合計（バイト、取得できないワーカーは0）
+        """
+        with self._condition:
+            workers = list(self._workers)
+        return sum(worker.memory_bytes() or 0 for worker in workers)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """統計情報を取得"""
+        with self._condition:
+            return dict(self._stats, workers=self.max_workers, idle=len(self._idle))
+
+    def shutdown(self) -> None:
+        """全ワーカーを終了"""
+        with self._condition:
+            self._closed = True
+            workers, self._idle = self._idle, []
+            self._workers = [worker for worker in self._workers if worker not in workers]
+            self._condition.notify_all()
+        for worker in workers:
+            worker.stop()
+
+
+# グローバルインスタンス（ウォーム起動間で再利用）
+_conversion_pool: Optional[ConversionProcessPool] = None
+_conversion_pool_lock = threading.Lock()
+
+
+def get_conversion_pool(config: Dict[str, Any]) -> Optional[ConversionProcessPool]:
+    """
+    設定に応じた変換ワーカープールを取得
+
+    performance.parallelProcessing が無効な場合はNone（ハンドラースレッドで変換）。
+
+    Args:
+        config: Markitdown設定
+
+    Returns:
+        Optional[ConversionProcessPool]: ワーカープール
+    """
+    global _conversion_pool
+    performance = config.get('performance', {})
+    if not performance.get('parallelProcessing', False):
+        return None
+
+    with _conversion_pool_lock:
+        if _conversion_pool is None:
+            max_workers = int(performance.get('maxConcurrentProcesses', 1))
+            memory_limit_mb = os.environ.get('CONVERSION_WORKER_MEMORY_MB')
+            if memory_limit_mb:
+                memory_limit_mb = int(memory_limit_mb)
+            elif performance.get('memoryLimitMB'):
+                # 設定のメモリ上限をワーカー間で分割
+                memory_limit_mb = max(64, int(performance['memoryLimitMB']) // max(1, max_workers))
+            else:
+                memory_limit_mb = None
+
+            _conversion_pool = ConversionProcessPool(
+                max_workers=max_workers,
+                memory_limit_mb=memory_limit_mb,
+                shared_memory_threshold=int(os.environ.get(
+                    'CONVERSION_SHM_THRESHOLD_BYTES', str(DEFAULT_SHARED_MEMORY_THRESHOLD_BYTES)
+                ))
+            )
+        return _conversion_pool
+
+
+# テスト用のサンプル関数
+def test_conversion_pool():
+    """
+    変換ワーカープールのテスト
+    """
+    pool = ConversionProcessPool(max_workers=2, memory_limit_mb=512, shared_memory_threshold=1024)
+    try:
+        config = {'performance': {'maxFileSizeBytes': 10485760}}
+        success, content, metadata = pool.run(convert_in_worker, b'%PDF-1.4 sample' * 200,
+                                              'pdf', 'markitdown', config, 'sample.pdf', timeout=30)
+        print(f"変換結果: {success}, {len(content)}文字 (ワーカー: {metadata.get('workerPid')})")
+        print(f"統計: {pool.get_stats()}")
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    test_conversion_pool()
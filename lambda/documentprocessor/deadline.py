@@ -0,0 +1,337 @@
+"""
+Lambda実行期限の伝搬と協調キャンセル
+context.get_remaining_time_in_millis() から導出した期限を変換・チャンク化・
+埋め込み・インデックスの各段階に渡し、残り時間に応じて処理量を調整する。
+完了できない処理はチェックポイントとして保存し、後続の呼び出しで再開する。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from error_handler import TimeoutError, ProcessingError, ErrorType
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """実行期限（スレッドセーフな協調キャンセル付き）"""
+
+    # Lambdaの最大実行時間
+    DEFAULT_BUDGET_MS = 15 * 60 * 1000
+    # チェックポイント保存・メタデータ書き込み用に確保する時間
+    DEFAULT_SAFETY_MARGIN_MS = 10000
+
+    def __init__(self, budget_ms: float, safety_margin_ms: float = 0, parent: Optional['Deadline'] = None):
+        """
+        初期化
+
+        Args:
+            budget_ms: 現在からの利用可能時間（ミリ秒）
+            safety_margin_ms: 期限から差し引く安全マージン（ミリ秒）
+            parent: 親期限（親のキャンセル・期限は子に伝搬する）
+        """
+        self.expires_at = time.monotonic() + max(0.0, budget_ms - safety_margin_ms) / 1000.0
+        self.parent = parent
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        self._cancel_event = threading.Event()
+        self._reason: Optional[str] = None
+
+    @classmethod
+    def from_context(cls, context: Any, safety_margin_ms: Optional[float] = None) -> 'Deadline':
+        """
+        Lambdaコンテキストから期限を作成
+
+        Args:
+            context: Lambdaコンテキスト（get_remaining_time_in_millisを持たない場合は既定値）
+            safety_margin_ms: 安全マージン（省略時はDEADLINE_SAFETY_MARGIN_MS環境変数）
+
+        Returns:
+            Deadline: 期限
+        """
+        if safety_margin_ms is None:
+            safety_margin_ms = float(os.environ.get('DEADLINE_SAFETY_MARGIN_MS', str(cls.DEFAULT_SAFETY_MARGIN_MS)))
+
+        remaining_ms = None
+        get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        if callable(get_remaining):
+            try:
+                remaining_ms = float(get_remaining())
+            except Exception as e:
+                logger.warning(f"残り実行時間の取得に失敗: {e}")
+
+        if remaining_ms is None:
+            remaining_ms = float(os.environ.get('DEADLINE_DEFAULT_BUDGET_MS', str(cls.DEFAULT_BUDGET_MS)))
+            # 既定値の場合でもマージンが予算を食い潰さないようにする
+            safety_margin_ms = min(safety_margin_ms, remaining_ms * 0.1)
+
+        return cls(remaining_ms, safety_margin_ms)
+
+    def child(self, max_seconds: Optional[float]) -> 'Deadline':
+        """
+        親期限と段階ごとの上限の早い方を期限とする子期限を作成
+
+        子のキャンセルは親に伝搬しないため、試行単位の打ち切りに使用できる。
+
+        Args:
+            max_seconds: 段階の最大秒数（Noneで親と同じ）
+
+        Returns:
+            Deadline: 子期限
+        """
+        budget_ms = self.remaining_ms() if max_seconds is None else max_seconds * 1000
+        return Deadline(budget_ms, parent=self)
+
+    def extend(self, seconds: float) -> None:
+        """
+        期限を延長（親の期限は超えない）
+
+        空きワーカーの待ち時間など、段階の処理時間に含めない時間を差し戻すために使用する。
+
+        Args:
+            seconds: 延長する秒数
+        """
+        expires_at = self.expires_at + max(0.0, seconds)
+        if self.parent is not None:
+            expires_at = min(expires_at, self.parent.expires_at)
+        self.expires_at = max(self.expires_at, expires_at)
+
+    def remaining(self) -> float:
+        """残り秒数（0未満にはならない）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def remaining_ms(self) -> float:
+        """残りミリ秒"""
+        return self.remaining() * 1000
+
+    def expired(self) -> bool:
+        """期限切れまたはキャンセル済みか"""
+        return self.cancelled() or time.monotonic() >= self.expires_at
+
+    def can_afford(self, estimated_seconds: float) -> bool:
+        """
+        推定所要時間の処理を期限内に完了できるか
+
+        Args:
+            estimated_seconds: 推定所要秒数
+
+        Returns:
+            bool: 完了見込みがある場合True
+        """
+        return not self.cancelled() and self.remaining() >= estimated_seconds
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        """
+        協調キャンセルを要求（この期限から作成した全ての子期限に伝搬）
+
+        Args:
+            reason: キャンセル理由
+        """
+        if not self._cancel_event.is_set():
+            self._reason = reason
+            self._cancel_event.set()
+
+    def cancelled(self) -> bool:
+        """自身または祖先がキャンセル要求済みか"""
+        return self._cancel_event.is_set() or (self.parent is not None and self.parent.cancelled())
+
+    def cancel_reason(self) -> Optional[str]:
+        """キャンセル理由（祖先のキャンセルを含む）"""
+        if self._cancel_event.is_set():
+            return self._reason
+        return self.parent.cancel_reason() if self.parent is not None else None
+
+    def check(self, stage: str) -> None:
+        """
+        協調キャンセルのチェックポイント（期限切れ・キャンセル時は例外）
+
+        Args:
+            stage: 処理段階名
+
+        Raises:
+            ProcessingError: キャンセル済みの場合
+            TimeoutError: 期限切れの場合
+        """
+        if self.cancelled():
+            raise ProcessingError(
+                ErrorType.PROCESSING_INTERRUPTED,
+                f"処理がキャンセルされました ({stage}): {self.cancel_reason()}",
+                {'stage': stage}
+            )
+        if time.monotonic() >= self.expires_at:
+            raise TimeoutError(f"実行期限を超過しました ({stage})", 0)
+
+    def wait(self, seconds: float) -> bool:
+        """
+        キャンセル可能な待機（期限を超えて待たない）
+
+        Args:
+            seconds: 待機秒数
+
+        Returns:
+            bool: 待機を完了した場合True、キャンセル・期限切れで中断した場合False
+        """
+        allowed = min(seconds, self.remaining())
+        end = time.monotonic() + allowed
+        while True:
+            if self.cancelled():
+                return False
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            # 祖先のキャンセルも検知できるよう短い間隔で待機
+            self._cancel_event.wait(min(remaining, 0.05))
+        return allowed >= seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ログ・メタデータ用の辞書表現"""
+        return {
+            'remainingMs': round(self.remaining_ms(), 1),
+            'cancelled': self.cancelled(),
+            'cancelReason': self.cancel_reason()
+        }
+
+
+class CheckpointStore:
+    """処理途中状態のチェックポイント保存（S3、保存先が未設定の場合は無効）"""
+
+    def __init__(self, bucket: Optional[str] = None, prefix: str = 'checkpoints/',
+                 local_dir: Optional[str] = None):
+        """
+        初期化
+
+        /tmpは実行環境ごとに独立しており再開する呼び出しから読めないため、
+        ローカル保存は明示的に指定した場合（ローカル開発・テスト）のみ使用する。
+
+        Args:
+            bucket: 保存先S3バケット（省略時はCHECKPOINT_BUCKET環境変数）
+            prefix: S3キープレフィックス
+            local_dir: S3未設定時の保存先ディレクトリ（省略時はCHECKPOINT_LOCAL_DIR環境変数）
+        """
+        self.bucket = bucket or os.environ.get('CHECKPOINT_BUCKET')
+        self.prefix = prefix
+        self.local_dir = local_dir or os.environ.get('CHECKPOINT_LOCAL_DIR')
+        self.s3_client = boto3.client('s3') if self.bucket else None
+
+    @property
+    def enabled(self) -> bool:
+        """チェックポイントの保存先が設定されているか"""
+        return bool(self.s3_client or self.local_dir)
+
+    def save(self, checkpoint_id: str, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        チェックポイントを保存
+
+        Args:
+            checkpoint_id: チェックポイントID
+            state: 保存する状態（JSONシリアライズ可能であること）
+
+        Returns:
+            Optional[Dict]: 保存先情報（保存先が未設定の場合はNone）
+        """
+        if not self.enabled:
+            logger.warning(f"チェックポイントの保存先が未設定のため保存しません: {checkpoint_id}")
+            return None
+        body = json.dumps(state, ensure_ascii=False, default=str)
+        if self.s3_client:
+            key = f"{self.prefix}{checkpoint_id}.json"
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=body.encode('utf-8'),
+                                      ContentType='application/json')
+            location = {'checkpointId': checkpoint_id, 'bucket': self.bucket, 'key': key}
+        else:
+            os.makedirs(self.local_dir, exist_ok=True)
+            path = os.path.join(self.local_dir, f"{checkpoint_id}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(body)
+            location = {'checkpointId': checkpoint_id, 'path': path}
+
+        logger.info(f"チェックポイントを保存しました: {checkpoint_id} (段階: {state.get('stage')})")
+        return location
+
+    def load(self, checkpoint_id: str) -> Optional[Dict[str, Any]]:
+        """
+        チェックポイントを読み込み
+
+        Args:
+            checkpoint_id: チェックポイントID
+
+        Returns:
+            Optional[Dict]: 保存された状態（存在しない場合はNone）
+        """
+        if not self.enabled:
+            return None
+        try:
+            if self.s3_client:
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{checkpoint_id}.json")
+                return json.loads(response['Body'].read())
+            path = os.path.join(self.local_dir, f"{checkpoint_id}.json")
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            logger.error(f"チェックポイントの読み込みに失敗: {checkpoint_id} - {e}")
+            return None
+        except Exception as e:
+            logger.error(f"チェックポイントの読み込みに失敗: {checkpoint_id} - {e}")
+            return None
+
+
+def object_checkpoint_id(bucket: str, key: str, version_id: Optional[str] = None,
+                         etag: Optional[str] = None) -> str:
+    """
+    S3オブジェクトバージョン単位のチェックポイントIDを作成
+
+    同じオブジェクトバージョンのイベントは同じチェックポイントから再開する。
+
+    Args:
+        bucket: S3バケット名
+        key: S3キー（フルパス）
+        version_id: バージョンID（バージョニング有効時）
+        etag: ETag（バージョンIDがない場合に内容の識別に使用）
+
+    Returns:
+        str: チェックポイントID
+    """
+    version = f"v:{version_id}" if version_id else f"e:{(etag or '').strip(chr(34))}"
+    return hashlib.sha256(f"{bucket}/{key}#{version}".encode('utf-8')).hexdigest()[:32]
+
+
+# テスト用のサンプル関数
+def test_deadline():
+    """
+    期限伝搬とチェックポイントのテスト
+    """
+    class SampleContext:
+        def get_remaining_time_in_millis(self):
+            return 3000
+
+    deadline = Deadline.from_context(SampleContext(), safety_margin_ms=500)
+    stage = deadline.child(1.0)
+    print(f"残り時間: {deadline.remaining():.2f}秒, 段階期限: {stage.remaining():.2f}秒")
+    print(f"5秒の処理は可能か: {deadline.can_afford(5)}")
+
+    deadline.cancel('sample')
+    try:
+        stage.check('embedding')
+    except ProcessingError as e:
+        print(f"キャンセル検出: {e.message}")
+
+    store = CheckpointStore(local_dir='/tmp/markitdown-checkpoints')
+    location = store.save(object_checkpoint_id('sample-bucket', 'docs/sample.pdf', etag='"abc123"'),
+                          {'stage': 'embedding', 'completed': 3})
+    print(f"チェックポイント: {location} -> {store.load(location['checkpointId'])}")
+
+
+if __name__ == "__main__":
+    test_deadline()
@@ -3,12 +3,18 @@ Document Processor Lambda Function with Markitdown Integration
 Markitdown統合対応ドキュメント処理Lambda関数
 """
 
+import io
 import json
 import os
+import hashlib
 import logging
+import threading
+import time
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Optional, Tuple, List, Callable
 import boto3
 from botocore.exceptions import ClientError
 
@@ -25,10 +31,10 @@ from error_handler import (
 )
 
 # LangChain統合
-from langchain_integration import LangChainIntegration, create_langchain_integration
+from langchain_integration import LangChainIntegration, ProcessingResult, create_langchain_integration
 
 # ベクトル埋め込み処理（Bedrock KB互換）
-from vector_embedding_bedrock_kb import BedrockKBVectorProcessor, create_bedrock_kb_vector_processor
+from vector_embedding_bedrock_kb import BedrockKBVectorProcessor, EmbeddingResult, create_bedrock_kb_vector_processor
 
 # メタデータ管理
 from metadata_manager import MetadataManager, create_metadata_manager
@@ -37,7 +43,51 @@ from metadata_manager import MetadataManager, create_metadata_manager
 from cloudwatch_metrics import CloudWatchMetricsCollector, create_cloudwatch_metrics_collector
 
 # 構造化ログ出力
-from structured_logging import MarkitdownLogger, create_markitdown_logger
+from structured_logging import (
+    ASYNC_LOGGING_ENABLED, LazyJson, MarkitdownLogger, create_markitdown_logger, flush_logs_after, install_queue_logging
+)
+
+# 実行期限の伝搬とチェックポイント
+from deadline import Deadline, CheckpointStore, object_checkpoint_id
+
+# CPU負荷の高い変換のプロセスプール実行
+from conversion_pool import PROCESS_POOL_FORMATS, convert_in_worker, convert_pages_in_worker, get_conversion_pool
+
+# PDFのページ範囲処理
+from format_processors import PDFProcessor, split_pages
+
+# 変換結果キャッシュ
+from conversion_cache import (
+    ConversionCache, get_conversion_cache, file_sha256, converter_version, conversion_options
+)
+
+# マジックバイトによる内容判定
+from content_sniffer import CONTENT_SNIFFING_ENABLED, sniff_content, route_content, preferred_method
+
+# 表形式ファイルの行ストリーミング
+from tabular_stream import TABULAR_STREAMING_ENABLED, TABULAR_FORMATS, TableChunkStream
+
+# HTML/XMLのストリーミング抽出
+from markup_stream import MARKUP_STREAMING_ENABLED, MARKUP_FORMATS, MarkupChunkStream
+
+# 画像OCRの前処理（類似画像の再利用・縮小・空白スキップ）
+from image_preprocess import IMAGE_PREPROCESS_ENABLED, IMAGE_FORMATS, preprocess_image, get_ocr_result_cache
+
+# ZIPアーカイブのメンバー単位の処理
+from archive_stream import (
+    ARCHIVE_INGEST_ENABLED, ARCHIVE_FORMATS, ArchiveLimits, ArchiveReader, ArchiveManifestStore, archive_source_uri
+)
+
+# S3オブジェクト単位の冪等性リース
+from idempotency import (
+    IDEMPOTENCY_ENABLED, LEASE_GRACE_SECONDS, IdempotencyStore, Lease, LeaseStatus, object_lease_key
+)
+
+# 段階別トレーシング
+from tracing import export_trace, get_tracer, span, traced
+
+# メモリ計測とバックプレッシャー
+from memory_monitor import MEMORY_MONITOR_ENABLED, SpillList, effective_limit_mb, get_memory_monitor
 
 # ログ設定
 logger = logging.getLogger()
@@ -52,11 +102,77 @@ MARKITDOWN_ENABLED = os.environ.get('MARKITDOWN_ENABLED', 'true').lower() == 'tr
 MARKITDOWN_ENVIRONMENT = os.environ.get('MARKITDOWN_ENVIRONMENT', 'prod')
 TRACKING_TABLE_NAME = os.environ.get('MARKITDOWN_TRACKING_TABLE', 'EmbeddingProcessingTracking')
 LOG_LEVEL = os.environ.get('MARKITDOWN_LOG_LEVEL', 'info').upper()
+# S3イベントの処理がチェックポイントで中断した場合に自身を非同期で再呼び出しして再開する
+CHECKPOINT_REENQUEUE_ENABLED = os.environ.get('CHECKPOINT_REENQUEUE_ENABLED', 'true').lower() == 'true'
+# 再投入の上限回数（期限内に進捗しない処理の無限再呼び出しを防止）
+CHECKPOINT_MAX_RESUMES = int(os.environ.get('CHECKPOINT_MAX_RESUMES', '10'))
 
 # ログレベル設定
 if LOG_LEVEL in ['DEBUG', 'INFO', 'WARNING', 'ERROR']:
     logger.setLevel(getattr(logging, LOG_LEVEL))
 
+# Lambda実行環境ではログの書き出しをキュー経由で別スレッドに移す（呼び出し終了時に書き出しを待つ）
+if ASYNC_LOGGING_ENABLED:
+    install_queue_logging(logger)
+
+# 品質比較モードで変換を並行実行するワーカー（ウォーム起動間で再利用）
+_compare_executor: Optional[ThreadPoolExecutor] = None
+_compare_executor_lock = threading.Lock()
+
+
+def _get_compare_executor() -> ThreadPoolExecutor:
+    """品質比較用のワーカープールを取得"""
+    global _compare_executor
+    with _compare_executor_lock:
+        if _compare_executor is None:
+            _compare_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='compare')
+        return _compare_executor
+
+# PDFのページバッチ変換と、完了したバッチの埋め込み生成を実行するワーカー
+_page_executor: Optional[ThreadPoolExecutor] = None
+_embedding_executor: Optional[ThreadPoolExecutor] = None
+
+# ページバッチあたりの既定ページ数（supportedFormats.pdf.pageBatchSize）
+DEFAULT_PAGE_BATCH_SIZE = 10
+
+# ストリーミング処理（表形式・HTML/XML）の埋め込みバッチあたりのチャンク数と、同時に埋め込み待ちにできるバッチ数
+CHUNK_STREAM_BATCH_SIZE = 25
+CHUNK_STREAM_MAX_IN_FLIGHT = 2
+
+# メモリ逼迫時に埋め込み生成・格納を分割して行う際の1回あたりのチャンク数
+MEMORY_INDEX_SLICE_SIZE = 100
+
+
+def _get_page_executors() -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    """ページバッチ変換用・埋め込み用のワーカープールを取得"""
+    global _page_executor, _embedding_executor
+    with _compare_executor_lock:
+        if _page_executor is None:
+            _page_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='page')
+            _embedding_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='page-embedding')
+        return _page_executor, _embedding_executor
+
+# アーカイブのメンバーを並行処理するワーカー（メンバーの処理内でページ・埋め込み用のワーカーを使うため別プール）
+_archive_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_archive_executor() -> ThreadPoolExecutor:
+    """アーカイブメンバー処理用のワーカープールを取得"""
+    global _archive_executor
+    with _compare_executor_lock:
+        if _archive_executor is None:
+            _archive_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='archive')
+        return _archive_executor
+
+
+def tag_chunk_owner(chunks: List[Dict[str, Any]], user_id: Optional[str], project_id: Optional[str]) -> None:
+    """チャンクのメタデータ（OpenSearchドキュメントに展開される）にユーザーID・プロジェクトIDを設定"""
+    for chunk in chunks:
+        if user_id is not None:
+            chunk['metadata']['user_id'] = user_id
+        if project_id is not None:
+            chunk['metadata']['project_id'] = project_id
+
 class DocumentProcessor:
     """ドキュメント処理クラス"""
     
@@ -64,16 +180,24 @@ class DocumentProcessor:
         """初期化"""
         self.config = None
         self.tracking_table = None
+        self.idempotency_store = None
         self.fallback_handler = None
         self.resource_monitor = None
+        self.memory_monitor = None
         self.langchain_integration = None
         self.vector_processor = None
         self.metadata_manager = None
         self.metrics_collector = None
         self.structured_logger = None
+        self.checkpoint_store = CheckpointStore()
+        self.archive_manifest_store = ArchiveManifestStore()
+        self.conversion_pool = None
+        self.conversion_cache = None
         self._initialize_config()
         self._initialize_tracking()
         self._initialize_handlers()
+        self._initialize_conversion_pool()
+        self._initialize_conversion_cache()
         self._initialize_langchain()
         self._initialize_vector_processor()
         self._initialize_metadata_manager()
@@ -98,6 +222,8 @@ class DocumentProcessor:
         """追跡テーブルの初期化"""
         try:
             self.tracking_table = dynamodb.Table(TRACKING_TABLE_NAME)
+            if IDEMPOTENCY_ENABLED:
+                self.idempotency_store = IdempotencyStore(self.tracking_table)
             logger.info(f"追跡テーブルを初期化しました: {TRACKING_TABLE_NAME}")
         except Exception as e:
             logger.warning(f"追跡テーブルの初期化に失敗: {e}")
@@ -108,12 +234,37 @@ class DocumentProcessor:
         try:
             self.fallback_handler = FallbackHandler(self.config)
             self.resource_monitor = ResourceMonitor(self.config)
+            if MEMORY_MONITOR_ENABLED:
+                self.memory_monitor = get_memory_monitor()
+                self.memory_monitor.set_limit(effective_limit_mb(
+                    self.config.get('performance', {}).get('memoryLimitMB')
+                ))
             logger.info("エラーハンドリングとリソース監視を初期化しました")
         except Exception as e:
             logger.error(f"ハンドラーの初期化に失敗: {e}")
             # フォールバック用の基本ハンドラーを作成
             self.fallback_handler = None
             self.resource_monitor = None
+            self.memory_monitor = None
+    
+    def _initialize_conversion_pool(self):
+        """変換ワーカープールの初期化（コールドスタート時にワーカーをフォーク）"""
+        try:
+            self.conversion_pool = get_conversion_pool(self.config)
+            if self.conversion_pool and self.memory_monitor:
+                # ワーカーのメモリもLambdaのメモリ上限に含まれるため逼迫度の判定に加える
+                self.memory_monitor.add_source('conversionWorkers', self.conversion_pool.memory_bytes)
+        except Exception as e:
+            logger.warning(f"変換ワーカープールの初期化に失敗、ハンドラースレッドで変換します: {e}")
+            self.conversion_pool = None
+    
+    def _initialize_conversion_cache(self):
+        """変換結果キャッシュの初期化"""
+        try:
+            self.conversion_cache = get_conversion_cache()
+        except Exception as e:
+            logger.warning(f"変換キャッシュの初期化に失敗: {e}")
+            self.conversion_cache = None
     
     def _initialize_langchain(self):
         """LangChain統合の初期化"""
@@ -206,7 +357,8 @@ class DocumentProcessor:
             'htm': 'html',
             'xml': 'xml',
             'csv': 'csv',
-            'tsv': 'tsv'
+            'tsv': 'tsv',
+            'zip': 'zip'
         }
         
         return format_mapping.get(extension)
@@ -219,33 +371,333 @@ class DocumentProcessor:
         return (file_format in self.config.get('supportedFormats', {}) and 
                 self.config['supportedFormats'][file_format].get('enabled', False))
     
-    def process_with_markitdown(self, file_content: bytes, file_format: str, file_name: str) -> Tuple[bool, str, Dict]:
-        """Markitdownを使用した文書変換"""
+    def _lookup_conversion_cache(self, method: str, file_content: bytes,
+                                 file_format: str) -> Tuple[Optional[str], Optional[Tuple[bool, str, Dict]]]:
+        """変換キャッシュを参照（戻り値: キャッシュキー, キャッシュ済みの変換結果）"""
+        if not self.conversion_cache:
+            return None, None
+        try:
+            cache_key = ConversionCache.make_key(
+                file_sha256(file_content), file_format, method,
+                converter_version(file_format, method, self.config),
+                conversion_options(self.config, file_format)
+            )
+            entry = self.conversion_cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"変換キャッシュの参照に失敗: {e}")
+            return None, None
+        
+        if not entry:
+            return cache_key, None
+        
+        logger.info(f"変換キャッシュを使用: {method} ({cache_key})")
+        metadata = dict(entry.get('metadata', {}), cacheHit=True, cacheKey=cache_key)
+        return cache_key, (True, entry['markdown'], metadata)
+    
+    def _store_conversion_cache(self, cache_key: Optional[str], result: Tuple[bool, str, Dict],
+                                file_name: str) -> Tuple[bool, str, Dict]:
+        """成功した変換結果を変換キャッシュに保存"""
+        success, content, metadata = result
+        if cache_key and success and content:
+            try:
+                self.conversion_cache.put(cache_key, content, metadata, file_name)
+                metadata = dict(metadata, cacheHit=False, cacheKey=cache_key)
+            except Exception as e:
+                logger.warning(f"変換キャッシュの保存に失敗: {e}")
+        return success, content, metadata
+    
+    def _uses_conversion_pool(self, file_format: str) -> bool:
+        """ワーカープロセスで変換する形式か（キャンセル時に実行中の変換を中断できる）"""
+        return bool(self.conversion_pool) and file_format in PROCESS_POOL_FORMATS
+    
+    def _convert_in_pool(self, method: str, file_content: bytes, file_format: str, file_name: str,
+                         deadline: Optional[Deadline]) -> Optional[Tuple[bool, str, Dict]]:
+        """CPU負荷の高い形式をワーカープロセスで変換（対象外の場合はNone）"""
+        if not self._uses_conversion_pool(file_format):
+            return None
+        
+        timeout_seconds = self.config.get('supportedFormats', {}).get(file_format, {}).get('timeout', 60)
+        return self.conversion_pool.run(
+            convert_in_worker, file_content, file_format, method, self.config, file_name,
+            timeout=timeout_seconds, deadline=deadline
+        )
+    
+    @traced('conversion.markitdown')
+    def process_with_markitdown(self, file_content: bytes, file_format: str, file_name: str,
+                                deadline: Optional[Deadline] = None) -> Tuple[bool, str, Dict]:
+        """Markitdownを使用した文書変換（変換キャッシュ対応）"""
         from format_processors import get_format_processor
         
-        processor = get_format_processor(file_format, self.config)
-        if not processor:
-            return False, "", {
+        cache_key, cached = self._lookup_conversion_cache('markitdown', file_content, file_format)
+        if cached is not None:
+            return cached
+        
+        if IMAGE_PREPROCESS_ENABLED and file_format in IMAGE_FORMATS:
+            return self._store_conversion_cache(
+                cache_key, self._process_image_with_markitdown(file_content, file_format, file_name, deadline), file_name
+            )
+        
+        result = self._convert_in_pool('markitdown', file_content, file_format, file_name, deadline)
+        if result is None:
+            processor = get_format_processor(file_format, self.config)
+            if not processor:
+                return False, "", {
+                    'method': 'markitdown',
+                    'success': False,
+                    'error': f'サポートされていないファイル形式: {file_format}'
+                }
+            result = processor.process_with_markitdown(file_content, file_name)
+        
+        return self._store_conversion_cache(cache_key, result, file_name)
+    
+    def _process_image_with_markitdown(self, file_content: bytes, file_format: str, file_name: str,
+                                       deadline: Optional[Deadline] = None) -> Tuple[bool, str, Dict]:
+        """
+        画像の前処理を行ってOCR
+        
+        ほぼ空白の画像はOCRを省略し、同一・類似画像（知覚ハッシュの近傍）は
+        OCR結果を再利用する。それ以外はOCRに必要な解像度へ縮小してから変換する。
+        """
+        from format_processors import ImageProcessor
+        
+        start_time = datetime.now()
+        prepared = preprocess_image(file_content, file_format)
+        ocr_cache = get_ocr_result_cache()
+        processor = ImageProcessor(self.config)
+        
+        reused = None
+        if prepared.blank:
+            saved_seconds = ocr_cache.record_blank()
+            ocr_section = f"{ImageProcessor.OCR_SECTION_HEADING}\n\n空白の画像のためOCRを省略しました\n"
+            reused = {'ocrSkipped': 'blank', 'ocrSecondsSaved': saved_seconds}
+        else:
+            entry = ocr_cache.lookup(prepared)
+            if entry:
+                ocr_section = entry['ocrSection']
+                reused = {'ocrReusedFrom': entry['imageHash'], 'hashDistance': entry['distance'],
+                          'ocrSecondsSaved': entry['ocrSeconds']}
+        
+        if reused is not None:
+            markdown_content = processor.render_markdown(file_name, len(file_content), start_time, ocr_section)
+            processing_time = (datetime.now() - start_time).total_seconds() * 1000
+            logger.info(f"画像のOCRを省略: {file_name} ({reused})")
+            return True, markdown_content, dict(reused, **{
                 'method': 'markitdown',
-                'success': False,
-                'error': f'サポートされていないファイル形式: {file_format}'
-            }
+                'processor': 'ImageProcessor',
+                'startTime': start_time.isoformat(),
+                'endTime': datetime.now().isoformat(),
+                'processingTime': processing_time,
+                'success': True,
+                'ocrUsed': False,
+                'outputLength': len(markdown_content),
+                'qualityScore': 85,
+                'imagePreprocess': prepared.to_dict()
+            })
         
-        return processor.process_with_markitdown(file_content, file_name)
+        ocr_started = time.monotonic()
+        result = self._convert_in_pool('markitdown', prepared.content, file_format, file_name, deadline)
+        if result is None:
+            result = processor.process_with_markitdown(prepared.content, file_name)
+        success, markdown_content, metadata = result
+        ocr_seconds = time.monotonic() - ocr_started
+        
+        ocr_section = ImageProcessor.extract_ocr_section(markdown_content) if success else None
+        if ocr_section:
+            ocr_cache.put(prepared, ocr_section, ocr_seconds)
+            if prepared.downscaled:
+                # ファイル情報は縮小前の画像で記載
+                markdown_content = processor.render_markdown(file_name, len(file_content), start_time, ocr_section)
+        return success, markdown_content, dict(metadata, ocrSeconds=round(ocr_seconds, 3),
+                                               imagePreprocess=prepared.to_dict())
     
-    def process_with_langchain(self, file_content: bytes, file_format: str, file_name: str) -> Tuple[bool, str, Dict]:
-        """LangChainを使用した文書変換"""
+    @traced('conversion.langchain')
+    def process_with_langchain(self, file_content: bytes, file_format: str, file_name: str,
+                               deadline: Optional[Deadline] = None) -> Tuple[bool, str, Dict]:
+        """LangChainを使用した文書変換（変換キャッシュ対応）"""
         from format_processors import get_format_processor
         
-        processor = get_format_processor(file_format, self.config)
-        if not processor:
-            return False, "", {
-                'method': 'langchain',
-                'success': False,
-                'error': f'サポートされていないファイル形式: {file_format}'
+        cache_key, cached = self._lookup_conversion_cache('langchain', file_content, file_format)
+        if cached is not None:
+            return cached
+        
+        result = self._convert_in_pool('langchain', file_content, file_format, file_name, deadline)
+        if result is None:
+            processor = get_format_processor(file_format, self.config)
+            if not processor:
+                return False, "", {
+                    'method': 'langchain',
+                    'success': False,
+                    'error': f'サポートされていないファイル形式: {file_format}'
+                }
+            result = processor.process_with_langchain(file_content, file_name)
+        
+        return self._store_conversion_cache(cache_key, result, file_name)
+    
+    def _bind_converter(self, method: str, file_format: str,
+                        deadline: Optional[Deadline] = None) -> Callable[[bytes, str], Tuple[bool, str, Dict]]:
+        """FallbackHandler用に形式・期限を束縛した変換関数を作成（関数名は処理方法名）"""
+        func = self.process_with_markitdown if method == 'markitdown' else self.process_with_langchain
+        
+        def convert(file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
+            return func(file_content, file_format, file_name, deadline=deadline)
+        
+        convert.__name__ = method
+        return convert
+    
+    def _bind_compare_converter(self, method: str, file_format: str,
+                                deadline: Deadline) -> Callable[[bytes, str], Tuple[bool, str, Dict]]:
+        """
+        品質比較用に開始前・完了後のキャンセル確認を加えた変換関数を作成
+        
+        キャンセルで実行中の変換を中断できるのはワーカープロセスで変換する形式のみ
+        （ワーカーを停止する）。スレッドで変換する形式はライブラリの呼び出しを中断できず、
+        実行中の変換は完了まで比較用ワーカーとCPUを使い続ける。そのため開始前にキャンセル
+        されていれば変換を行わず、完了後にキャンセルされていれば結果を破棄する。
+        """
+        convert = self._bind_converter(method, file_format, deadline)
+        
+        def cancelled_result() -> Tuple[bool, str, Dict]:
+            return False, "", {'method': method, 'success': False, 'cancelled': True,
+                               'error': f"キャンセルされました: {deadline.cancel_reason()}"}
+        
+        def compare_convert(file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
+            if deadline.cancelled():
+                return cancelled_result()
+            result = convert(file_content, file_name)
+            if deadline.cancelled():
+                logger.info(f"キャンセル後に完了した変換結果を破棄: {method} ({file_name})")
+                return cancelled_result()
+            return result
+        
+        compare_convert.__name__ = method
+        return compare_convert
+    
+    def replay_from_cache(self, cache_keys: List[str],
+                          chunk_size: Optional[int] = None,
+                          chunk_overlap: Optional[int] = None,
+                          generate_embeddings: bool = False,
+                          store_embeddings: bool = False,
+                          deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        変換キャッシュのマークダウンからチャンキング・埋め込みを再実行
+        
+        ソースファイルと変換処理には触れないため、チャンク設定のオフライン検証に使用する。
+        
+        Args:
+            cache_keys: 変換キャッシュキー
+            chunk_size: チャンクサイズ（省略時は現在の設定）
+            chunk_overlap: チャンクオーバーラップ（省略時は現在の設定）
+            generate_embeddings: 埋め込みを生成するか
+            store_embeddings: 生成した埋め込みをOpenSearchに格納するか
+            deadline: 実行期限
+        
+        Returns:
+            Dict: キーごとのチャンキング・埋め込み結果
+        """
+        if not self.conversion_cache:
+            raise ValueError("変換キャッシュが無効化されています")
+        if not self.langchain_integration:
+            raise ValueError("LangChain統合が初期化されていません")
+        if deadline is None:
+            deadline = Deadline.from_context(None)
+        
+        chunker = self.langchain_integration
+        if chunk_size is not None or chunk_overlap is not None:
+            chunker = LangChainIntegration(
+                region=chunker.region,
+                embedding_model=chunker.embedding_model,
+                chunk_size=chunk_size if chunk_size is not None else chunker.chunk_size,
+                chunk_overlap=chunk_overlap if chunk_overlap is not None else chunker.chunk_overlap
+            )
+        
+        results = []
+        for cache_key in cache_keys:
+            if deadline.expired():
+                results.append({'cacheKey': cache_key, 'success': False, 'error': '実行期限のため未処理'})
+                continue
+            
+            entry = self.conversion_cache.get(cache_key)
+            if not entry:
+                results.append({'cacheKey': cache_key, 'success': False, 'error': 'キャッシュエントリが見つかりません'})
+                continue
+            
+            source_file = entry.get('fileName') or cache_key
+            markdown = entry.get('markdown', '')
+            chunk_start = time.monotonic()
+            chunk_result = self._chunk_markdown(
+                markdown, source_file, entry.get('metadata', {}).get('method', 'unknown'), chunker
+            )
+            chunk_sizes = [len(chunk['content']) for chunk in chunk_result.chunks]
+            item = {
+                'cacheKey': cache_key,
+                'fileName': source_file,
+                'success': chunk_result.success,
+                'chunkCount': len(chunk_sizes),
+                'averageChunkSize': sum(chunk_sizes) / len(chunk_sizes) if chunk_sizes else 0,
+                'maxChunkSize': max(chunk_sizes) if chunk_sizes else 0,
+                'chunkingMs': round((time.monotonic() - chunk_start) * 1000, 2)
             }
+            if not chunk_result.success:
+                item['error'] = chunk_result.error
+            
+            if generate_embeddings and chunk_result.success and chunk_result.chunks and self.vector_processor:
+                vector_result = self.vector_processor.generate_embeddings(
+                    [chunk['content'] for chunk in chunk_result.chunks], deadline=deadline
+                )
+                item['embeddings'] = {
+                    'success': vector_result.success,
+                    'count': len(vector_result.embeddings),
+                    'deadlineExhausted': vector_result.metadata.get('deadline_exhausted', False),
+                    'processingTime': vector_result.metadata.get('total_processing_time', 0),
+                    'error': vector_result.error
+                }
+                
+                if (store_embeddings and vector_result.success and
+                        not vector_result.metadata.get('deadline_exhausted')):
+                    documents = self.vector_processor.create_bedrock_kb_documents(
+                        chunks=chunk_result.chunks,
+                        embeddings=vector_result.embeddings,
+                        source_file=source_file,
+                        source_uri=f"\\\\file\\{source_file}",
+                        author="replay",
+                        file_size=len(markdown.encode('utf-8')),
+                        parent_chunks=None
+                    )
+                    item['opensearchStorage'] = self.vector_processor.store_embeddings_to_opensearch(documents)
+            
+            results.append(item)
         
-        return processor.process_with_langchain(file_content, file_name)
+        logger.info(f"変換キャッシュのリプレイ完了: {len(results)}件 (chunk_size={chunker.chunk_size}, "
+                    f"chunk_overlap={chunker.chunk_overlap})")
+        return {
+            'success': all(item['success'] for item in results),
+            'chunkSize': chunker.chunk_size,
+            'chunkOverlap': chunker.chunk_overlap,
+            'results': results,
+            'cacheStats': self.conversion_cache.get_stats()
+        }
+    
+    def save_checkpoint(self, file_hash: str, stage: str, state: Dict[str, Any],
+                        checkpoint_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        期限内に完了できなかった処理のチェックポイントを保存
+        
+        Args:
+            file_hash: ファイル識別ハッシュ
+            stage: 未完了の処理段階（chunking / embedding / indexing）
+            state: 再開に必要な状態
+            checkpoint_id: チェックポイントID（S3オブジェクトはバージョン単位のID、省略時はfile_hashから作成）
+        
+        Returns:
+            Optional[Dict]: 保存先情報（保存先が未設定・保存失敗時はNone）
+        """
+        checkpoint_id = checkpoint_id or hashlib.sha256(file_hash.encode()).hexdigest()[:32]
+        try:
+            return self.checkpoint_store.save(checkpoint_id, dict(state, stage=stage,
+                                                                  createdAt=datetime.now().isoformat()))
+        except Exception as e:
+            logger.error(f"チェックポイントの保存に失敗: {e}")
+            return None
     
     def compare_quality(self, markitdown_result: Dict, langchain_result: Dict) -> str:
         """品質比較を行い、最適な結果を選択"""
@@ -260,6 +712,626 @@ class DocumentProcessor:
             logger.info(f"品質比較結果: LangChain選択 (スコア: {langchain_score} vs {markitdown_score})")
             return 'langchain'
     
+    def convert_both_compare(self, file_content: bytes, file_format: str, file_name: str,
+                             processing_order: List[str], timeout_seconds: float,
+                             deadline: Deadline) -> Tuple[str, str, List[Dict], Dict[str, Any]]:
+        """
+        品質比較モード: 各変換方法を並行実行して最良の結果を選択
+        
+        quality.earlyAcceptEnabled が有効な場合、先に完了した結果の品質スコアが
+        quality.earlyAcceptQualityScore 以上であれば残りの変換をキャンセルして採用する。
+        実行中の変換を中断できるのはワーカープロセスで変換する形式のみで、スレッドで変換する
+        形式は結果を破棄するだけとなる（_bind_compare_converter を参照、cancelled の interrupted で判別）。
+        
+        Args:
+            file_content: ファイル内容
+            file_format: ファイル形式
+            file_name: ファイル名
+            processing_order: 実行する処理方法
+            timeout_seconds: 1処理方法あたりのタイムアウト時間
+            deadline: 実行期限
+        
+        Returns:
+            (採用した処理方法, 変換結果, 試行メタデータ, 比較メタデータ)
+        """
+        quality_config = self.config.get('quality', {})
+        early_accept_score = None
+        if quality_config.get('earlyAcceptEnabled', False):
+            early_accept_score = quality_config.get('earlyAcceptQualityScore', 90)
+        
+        methods = [m for m in processing_order if m in ('markitdown', 'langchain')]
+        stages = {method: deadline.child(timeout_seconds) for method in methods}
+        started = {}
+        futures = {}
+        executor = _get_compare_executor()
+        compare_start = time.monotonic()
+        for method in methods:
+            started[method] = time.monotonic()
+            converter = self._bind_compare_converter(method, file_format, stages[method])
+            futures[executor.submit(converter, file_content, file_name)] = method
+        
+        results: Dict[str, Tuple[bool, str, Dict]] = {}
+        accepted = None
+        pending = set(futures)
+        while pending and accepted is None:
+            timeout = max(stage.remaining() for stage in stages.values())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            
+            for future in done:
+                method = futures[future]
+                wall_clock_ms = (time.monotonic() - started[method]) * 1000
+                try:
+                    success, content, metadata = future.result()
+                except Exception as e:
+                    success, content, metadata = False, "", {'method': method, 'success': False, 'error': str(e)}
+                metadata = dict(metadata, wallClockMs=round(wall_clock_ms, 2))
+                results[method] = (success, content, metadata)
+                
+                if (accepted is None and success and early_accept_score is not None and
+                        metadata.get('qualityScore', 0) >= early_accept_score):
+                    accepted = method
+                    logger.info(f"品質比較を早期確定: {method} (スコア: {metadata.get('qualityScore')} >= {early_accept_score})")
+        
+        # 未完了の変換をキャンセル（早期確定または期限切れ）
+        cancelled = []
+        reason = 'early-accept' if accepted else 'timeout'
+        for future in pending:
+            method = futures[future]
+            not_started = future.cancel()
+            stages[method].cancel(reason)
+            cancelled.append({
+                'method': method,
+                'reason': reason,
+                'cancelledWorkMs': round((time.monotonic() - started[method]) * 1000, 2),
+                # Falseの場合、実行中の変換はバックグラウンドで完了まで継続する
+                'interrupted': not_started or self._uses_conversion_pool(file_format)
+            })
+        
+        attempted_methods = [results[m][2] for m in methods if m in results]
+        for entry in cancelled:
+            attempted_methods.append({'method': entry['method'], 'success': False, 'cancelled': True,
+                                      'error': f"キャンセルされました: {entry['reason']}",
+                                      'wallClockMs': entry['cancelledWorkMs']})
+        
+        # 構造化ログ: 変換試行
+        if self.structured_logger:
+            for metadata in attempted_methods:
+                try:
+                    self.structured_logger.log_conversion_attempt(
+                        method=metadata.get('method'),
+                        duration_ms=metadata.get('wallClockMs', 0),
+                        success=metadata.get('success', False),
+                        file_format=file_format,
+                        output_size=metadata.get('outputLength', 0),
+                        quality_score=metadata.get('qualityScore')
+                    )
+                except Exception as e:
+                    logger.warning(f"変換試行ログに失敗: {e}")
+        
+        succeeded = {m: r for m, r in results.items() if r[0]}
+        if accepted:
+            final_method = accepted
+        elif 'markitdown' in succeeded and 'langchain' in succeeded:
+            final_method = self.compare_quality(succeeded['markitdown'][2], succeeded['langchain'][2])
+        elif succeeded:
+            final_method = next(iter(succeeded))
+        else:
+            raise ProcessingError(
+                ErrorType.CONVERSION_FAILED,
+                "両方の処理方法が失敗しました",
+                {'cancelled': cancelled}
+            )
+        
+        comparison = {
+            'mode': 'concurrent',
+            'earlyAcceptScore': early_accept_score,
+            'earlyAccepted': accepted is not None,
+            'selectedMethod': final_method,
+            'wallClockMs': round((time.monotonic() - compare_start) * 1000, 2),
+            'methodWallClockMs': {m: results[m][2]['wallClockMs'] for m in results},
+            'cancelled': cancelled,
+            'cancelledWorkMs': round(sum(c['cancelledWorkMs'] for c in cancelled), 2)
+        }
+        logger.info(f"品質比較完了: {final_method} ({comparison['wallClockMs']:.2f}ms, "
+                    f"キャンセル: {len(cancelled)}件)")
+        return final_method, succeeded[final_method][1], attempted_methods, comparison
+    
+    def plan_page_batches(self, file_content: bytes, file_format: Optional[str]) -> Optional[List[Tuple[int, int]]]:
+        """
+        PDFをページバッチに分割する計画（ページ並列処理の対象外はNone）
+        
+        Args:
+            file_content: ファイル内容
+            file_format: ファイル形式
+        
+        Returns:
+            Optional[List[Tuple[int, int]]]: (開始ページ, 終了ページ) のリスト
+        """
+        if file_format != 'pdf':
+            return None
+        batch_size = int(self.config.get('supportedFormats', {}).get('pdf', {}).get(
+            'pageBatchSize', DEFAULT_PAGE_BATCH_SIZE))
+        if batch_size <= 0:
+            return None
+        
+        page_count = PDFProcessor(self.config).count_pages(file_content)
+        if page_count <= batch_size:
+            return None
+        return [(first, min(first + batch_size - 1, page_count))
+                for first in range(1, page_count + 1, batch_size)]
+    
+    def convert_pdf_pages(self, file_content: bytes, file_name: str, processing_order: List[str],
+                          page_batches: List[Tuple[int, int]], compare: bool, timeout_seconds: float,
+                          deadline: Deadline) -> Tuple[str, str, List[Dict], Dict[str, Any]]:
+        """
+        PDFをページバッチごとに並行変換し、完了したバッチから順にチャンキング・埋め込みを実行
+        
+        Args:
+            file_content: ファイル内容
+            file_name: ファイル名
+            processing_order: 処理方法の優先順
+            page_batches: (開始ページ, 終了ページ) のリスト
+            compare: 各バッチで全処理方法を実行して品質の高い結果を採用するか
+            timeout_seconds: 1バッチあたりのタイムアウト時間
+            deadline: 実行期限
+        
+        Returns:
+            (採用した処理方法, 変換結果, 試行メタデータ, ページ処理メタデータ)
+        """
+        # 変換済みの結果があればページ単位の変換は不要
+        for method in processing_order:
+            _, cached = self._lookup_conversion_cache(method, file_content, 'pdf')
+            if cached is not None and self.langchain_integration and split_pages(cached[1])[0][0] is not None:
+                chunk_result = self._chunk_markdown(cached[1], file_name, method)
+                return method, cached[1], [cached[2]], {
+                    'pageCount': page_batches[-1][1],
+                    'batches': len(page_batches),
+                    'chunkResult': chunk_result,
+                    'embeddings': []
+                }
+        
+        page_executor, embedding_executor = _get_page_executors()
+        batch_deadline = deadline.child(None)
+        pipeline_start = time.monotonic()
+        futures = {
+            page_executor.submit(self._convert_page_batch, file_content, file_name, processing_order,
+                                 compare, first, last, timeout_seconds, batch_deadline): (first, last)
+            for first, last in page_batches
+        }
+        
+        batches: Dict[int, Dict[str, Any]] = {}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=batch_deadline.remaining(), return_when=FIRST_COMPLETED)
+                if not done:
+                    batch_deadline.check(f"conversion:pages ({len(pending)}バッチ未完了)")
+                    continue
+                
+                for future in done:
+                    first, last = futures[future]
+                    method, content, metadata = future.result()
+                    if method is None:
+                        raise ProcessingError(
+                            ErrorType.CONVERSION_FAILED,
+                            f"ページ{first}-{last}の変換に失敗しました",
+                            {'firstPage': first, 'lastPage': last, 'errors': metadata.get('errors', [])}
+                        )
+                    
+                    # 変換済みのバッチは他のバッチの完了を待たずにチャンキング・埋め込みへ
+                    if self.langchain_integration:
+                        chunk_result = self._chunk_markdown(content, file_name, method)
+                    else:
+                        chunk_result = ProcessingResult(success=False, chunks=[], embeddings=[], metadata={},
+                                                        error="LangChain統合が初期化されていません")
+                    embedding_future = None
+                    if self.memory_monitor and chunk_result.chunks and self.memory_monitor.should_flush():
+                        # メモリ逼迫時はバッチごとの先行埋め込みを行わず、後続の埋め込み段階で分割して処理
+                        self.memory_monitor.record('deferredEmbeddings')
+                    elif self.vector_processor and chunk_result.success and chunk_result.chunks:
+                        embedding_future = embedding_executor.submit(
+                            self.vector_processor.generate_embeddings,
+                            [chunk['content'] for chunk in chunk_result.chunks], deadline=deadline
+                        )
+                    batches[first] = {
+                        'method': method,
+                        'content': content,
+                        'metadata': metadata,
+                        'chunkResult': chunk_result,
+                        'embeddingFuture': embedding_future,
+                        'readyMs': round((time.monotonic() - pipeline_start) * 1000, 2)
+                    }
+        except Exception:
+            batch_deadline.cancel('page-batch-failed')
+            for future in pending:
+                future.cancel()
+            raise
+        
+        ordered = [batches[first] for first, _ in page_batches]
+        final_content = "\n\n".join(batch['content'] for batch in ordered)
+        
+        # チャンクはページ順に連番を振り直す（チャンクIDはページ番号を含むため不変）
+        chunks = [chunk for batch in ordered for chunk in batch['chunkResult'].chunks]
+        for index, chunk in enumerate(chunks):
+            chunk['metadata']['chunk_index'] = index
+        chunk_result = ProcessingResult(
+            success=all(batch['chunkResult'].success for batch in ordered),
+            chunks=chunks,
+            embeddings=[e for batch in ordered for e in batch['chunkResult'].embeddings],
+            metadata=dict(ordered[-1]['chunkResult'].metadata, total_chunks=len(chunks),
+                          total_characters=len(final_content), pages=page_batches[-1][1])
+        )
+        
+        # 先頭から連続して完了したバッチの埋め込みのみ採用（残りは通常の埋め込み段階で生成）
+        embeddings = []
+        for batch in ordered:
+            future = batch['embeddingFuture']
+            if future is None:
+                break
+            try:
+                vector_result = future.result(timeout=deadline.remaining())
+            except Exception as e:
+                logger.warning(f"ページバッチの埋め込み生成に失敗: {e}")
+                break
+            if not vector_result.success or vector_result.metadata.get('deadline_exhausted'):
+                break
+            embeddings.extend(vector_result.embeddings)
+        
+        # 処理方法ごとに試行メタデータを集約
+        attempted_methods = []
+        pages_by_method: Dict[str, int] = {}
+        for method in processing_order:
+            method_batches = [b for b in ordered if b['method'] == method]
+            if not method_batches:
+                continue
+            pages = sum(b['metadata'].get('pages', 0) for b in method_batches)
+            pages_by_method[method] = pages
+            scores = [(b['metadata']['qualityScore'], b['metadata'].get('pages', 1))
+                      for b in method_batches if 'qualityScore' in b['metadata']]
+            entry = {
+                'method': method,
+                'success': True,
+                'pages': pages,
+                'pageBatches': len(method_batches),
+                'processingTime': sum(b['metadata'].get('processingTime', 0) for b in method_batches),
+                'outputLength': sum(len(b['content']) for b in method_batches)
+            }
+            if scores:
+                entry['qualityScore'] = sum(score * weight for score, weight in scores) / sum(w for _, w in scores)
+            attempted_methods.append(entry)
+        final_method = max(pages_by_method, key=pages_by_method.get)
+        
+        # 全バッチが同じ処理方法の場合は変換キャッシュに保存
+        if len(pages_by_method) == 1:
+            cache_key, _ = self._lookup_conversion_cache(final_method, file_content, 'pdf')
+            self._store_conversion_cache(cache_key, (True, final_content, dict(attempted_methods[0])), file_name)
+        
+        page_pipeline = {
+            'pageCount': page_batches[-1][1],
+            'batches': len(page_batches),
+            'batchSize': page_batches[0][1] - page_batches[0][0] + 1,
+            'wallClockMs': round((time.monotonic() - pipeline_start) * 1000, 2),
+            'batchReadyMs': [batch['readyMs'] for batch in ordered],
+            'embeddedChunks': len(embeddings),
+            'chunkResult': chunk_result,
+            'embeddings': embeddings
+        }
+        logger.info(f"ページ並列処理完了: {file_name} ({page_pipeline['pageCount']}ページ, "
+                    f"{len(page_batches)}バッチ, {page_pipeline['wallClockMs']:.2f}ms)")
+        return final_method, final_content, attempted_methods, page_pipeline
+    
+    @traced('conversion.pages')
+    def _convert_page_batch(self, file_content: bytes, file_name: str, processing_order: List[str],
+                            compare: bool, first_page: int, last_page: int, timeout_seconds: float,
+                            deadline: Deadline) -> Tuple[Optional[str], str, Dict]:
+        """ページバッチを変換（失敗時は次の処理方法、品質比較時は全処理方法を実行）"""
+        succeeded = {}
+        errors = []
+        for method in processing_order:
+            deadline.check(f"conversion:{method}:p{first_page}-{last_page}")
+            try:
+                if self.conversion_pool:
+                    success, content, metadata = self.conversion_pool.run(
+                        convert_pages_in_worker, file_content, method, self.config, file_name, first_page, last_page,
+                        timeout=timeout_seconds, deadline=deadline
+                    )
+                else:
+                    success, content, metadata = PDFProcessor(self.config).process_pages(
+                        method, file_content, file_name, first_page, last_page
+                    )
+            except ProcessingError as e:
+                if deadline.cancelled():
+                    raise
+                success, content, metadata = False, "", {'method': method, 'success': False, 'error': e.message}
+            
+            if success:
+                succeeded[method] = (content, metadata)
+                if not compare:
+                    break
+            else:
+                errors.append({'method': method, 'error': metadata.get('error')})
+        
+        if not succeeded:
+            return None, "", {'errors': errors}
+        if 'markitdown' in succeeded and 'langchain' in succeeded:
+            method = self.compare_quality(succeeded['markitdown'][1], succeeded['langchain'][1])
+        else:
+            method = next(iter(succeeded))
+        return method, succeeded[method][0], succeeded[method][1]
+    
+    @traced('chunking')
+    def _chunk_markdown(self, markdown_content: str, source_file: str, processing_method: str,
+                        chunker: Optional[LangChainIntegration] = None, user_id: Optional[str] = None,
+                        project_id: Optional[str] = None) -> ProcessingResult:
+        """マークダウンをチャンキング（ページ境界マーカーがある場合はページ単位で実際のページ番号を付与）"""
+        chunker = chunker or self.langchain_integration
+        pages = split_pages(markdown_content)
+        if len(pages) == 1 and pages[0][0] is None:
+            result = chunker.process_markdown_content(
+                markdown_content=markdown_content,
+                source_file=source_file,
+                processing_method=processing_method,
+                user_id=user_id,
+                project_id=project_id
+            )
+            tag_chunk_owner(result.chunks, user_id, project_id)
+            return result
+        
+        chunks = []
+        embeddings = []
+        metadata = {}
+        for page_number, page_content in pages:
+            page_result = chunker.process_markdown_content(
+                markdown_content=page_content,
+                source_file=source_file,
+                processing_method=processing_method,
+                page_number=page_number,
+                user_id=user_id,
+                project_id=project_id
+            )
+            if not page_result.success:
+                return page_result
+            chunks.extend(page_result.chunks)
+            embeddings.extend(page_result.embeddings)
+            metadata = page_result.metadata
+        
+        for index, chunk in enumerate(chunks):
+            chunk['metadata']['chunk_index'] = index
+        tag_chunk_owner(chunks, user_id, project_id)
+        metadata = dict(metadata, total_chunks=len(chunks), total_characters=len(markdown_content),
+                        page_number=None, pages=len(pages))
+        return ProcessingResult(success=True, chunks=chunks, embeddings=embeddings, metadata=metadata)
+    
+    def create_chunk_stream(self, file_content: bytes, file_format: Optional[str], file_name: str,
+                            start: int = 0) -> Optional[Any]:
+        """
+        ストリーミングでチャンクを生成する形式のチャンクストリームを作成
+        
+        Args:
+            file_content: ファイル内容
+            file_format: ファイル形式
+            file_name: ファイル名
+            start: 処理を開始する行・レコード（チェックポイントからの再開用）
+        
+        Returns:
+            Optional: TableChunkStream / MarkupChunkStream（対象外の形式はNone）
+        """
+        chunk_size = self.langchain_integration.chunk_size
+        if TABULAR_STREAMING_ENABLED and file_format in TABULAR_FORMATS:
+            return TableChunkStream(file_content, file_format, file_name, chunk_size=chunk_size, start_row=start)
+        if MARKUP_STREAMING_ENABLED and file_format in MARKUP_FORMATS:
+            boundary_elements = self.config.get('supportedFormats', {}).get(file_format, {}).get('chunkBoundaryElements')
+            return MarkupChunkStream(file_content, file_format, file_name, chunk_size=chunk_size,
+                                     start_record=start, boundary_elements=boundary_elements)
+        return None
+    
+    def ingest_chunk_stream(self, stream: Any, file_name: str, file_size: int,
+                            author: Optional[str], deadline: Deadline,
+                            source_uri: Optional[str] = None, project_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        チャンクストリームのバッチごとに埋め込み生成・格納
+        
+        全体のマークダウンやチャンクを保持せず、埋め込み待ちのバッチ数を
+        CHUNK_STREAM_MAX_IN_FLIGHT に制限して解析側を待たせる（メモリ使用量は入力の行数・レコード数に依存しない）。
+        メモリ逼迫時は埋め込み待ちのバッチを格納し終えてから次のバッチを送る。
+        
+        Args:
+            stream: チャンクストリーム（create_chunk_stream で作成）
+            file_name: ファイル名
+            file_size: ファイルサイズ
+            author: 作成者
+            deadline: 実行期限
+            source_uri: ソースURI（省略時はファイル名から作成）
+            project_id: プロジェクトID（作成者とともに各チャンクのメタデータに設定）
+        
+        Returns:
+            Dict: 処理統計（nextOffsetが設定されている場合は期限による中断）
+        """
+        position_start = f"{stream.POSITION_KEY}_start"
+        position_end = f"{stream.POSITION_KEY}_end"
+        _, embedding_executor = _get_page_executors()
+        totals = {'chunks': 0, 'embeddings': 0, 'stored': 0, 'failedBatches': 0, 'embeddingDimension': 0}
+        in_flight = deque()
+        next_offset = None
+        
+        def embed_and_store(batch: List[Dict[str, Any]], chunk_offset: int) -> Tuple[int, int, bool, bool]:
+            vector_result = self.vector_processor.generate_embeddings(
+                [chunk['content'] for chunk in batch], deadline=deadline
+            )
+            if not vector_result.success:
+                return 0, 0, False, False
+            exhausted = bool(vector_result.metadata.get('deadline_exhausted'))
+            embedded = batch[:len(vector_result.embeddings)]
+            tag_chunk_owner(embedded, author, project_id)
+            if vector_result.embeddings:
+                totals['embeddingDimension'] = len(vector_result.embeddings[0])
+            opensearch_docs = self.vector_processor.create_bedrock_kb_documents(
+                chunks=embedded,
+                embeddings=vector_result.embeddings,
+                source_file=file_name,
+                source_uri=source_uri or f"\\\\file\\{file_name}",
+                author=author or "system",
+                file_size=file_size,
+                chunk_index_offset=chunk_offset
+            )
+            storage = self.vector_processor.store_embeddings_to_opensearch(opensearch_docs)
+            return len(embedded), storage.get('stored_count', 0), True, exhausted
+        
+        def settle_oldest() -> None:
+            nonlocal next_offset
+            batch, future = in_flight.popleft()
+            try:
+                embedded, stored, success, exhausted = future.result()
+            except Exception as e:
+                logger.warning(f"ストリーミングチャンクのベクトル処理に失敗: {file_name} - {e}")
+                embedded, stored, success, exhausted = 0, 0, False, False
+            totals['embeddings'] += embedded
+            totals['stored'] += stored
+            if not success:
+                totals['failedBatches'] += 1
+            elif exhausted and next_offset is None:
+                # 埋め込みが完了したチャンクの次から再開
+                next_offset = (batch[embedded]['metadata'][position_start] if embedded < len(batch)
+                               else batch[-1]['metadata'][position_end] + 1)
+        
+        def submit(batch: List[Dict[str, Any]]) -> None:
+            max_in_flight = CHUNK_STREAM_MAX_IN_FLIGHT
+            if in_flight and self.memory_monitor and self.memory_monitor.should_flush():
+                # メモリ逼迫時は埋め込み待ちのバッチをすべて格納してから次のバッチを送る
+                self.memory_monitor.record('earlyFlushes')
+                max_in_flight = 1
+            while len(in_flight) >= max_in_flight:
+                settle_oldest()
+            if next_offset is not None:
+                # 先行バッチが期限で中断した場合、以降は再開時に処理
+                return
+            offset = totals['chunks'] - len(batch)
+            in_flight.append((batch, embedding_executor.submit(embed_and_store, batch, offset)))
+        
+        batch: List[Dict[str, Any]] = []
+        stop_offset = None
+        for chunk in stream:
+            if next_offset is not None or deadline.expired():
+                stop_offset = chunk['metadata'][position_start]
+                break
+            batch.append(chunk)
+            totals['chunks'] += 1
+            if len(batch) >= CHUNK_STREAM_BATCH_SIZE:
+                submit(batch)
+                batch = []
+        
+        if batch:
+            if stop_offset is None:
+                submit(batch)
+            else:
+                # 期限切れで未送信のまま残ったバッチは再開時に処理
+                stop_offset = batch[0]['metadata'][position_start]
+                totals['chunks'] -= len(batch)
+        while in_flight:
+            settle_oldest()
+        if next_offset is None:
+            next_offset = stop_offset
+        
+        stats = stream.get_stats()
+        stats.update(totals)
+        stats['nextOffset'] = next_offset
+        logger.info(f"ストリーミング処理完了: {file_name} ({stats['chunks']}チャンク, {stats['elapsedSeconds']}秒)")
+        return stats
+    
+    def embed_and_index_slices(self, chunks: List[Dict[str, Any]], completed_embeddings: List[List[float]],
+                               file_name: str, source_uri: Optional[str], author: Optional[str], file_size: int,
+                               deadline: Deadline) -> Tuple[EmbeddingResult, Dict[str, Any], Optional[str]]:
+        """
+        チャンクを MEMORY_INDEX_SLICE_SIZE 件ずつ埋め込み生成・格納（メモリ逼迫時の埋め込み・インデックス段階）
+        
+        全チャンクのベクトル・ドキュメント・バルク本文を同時に保持せず、格納済みの埋め込みは
+        SpillList に移す（逼迫時は一時ファイルに退避）。ドキュメントIDはチャンク位置と内容から決まるため、
+        期限で中断した場合は生成済みの埋め込みをチェックポイントに保存し、再開時に先頭から格納し直す。
+        
+        Args:
+            chunks: チャンクリスト
+            completed_embeddings: 生成済みの埋め込み（チェックポイント・ページバッチから再利用）
+            file_name: ファイル名
+            source_uri: ソースURI
+            author: 作成者
+            file_size: ファイルサイズ
+            deadline: 実行期限
+        
+        Returns:
+            (埋め込み結果, 格納結果, 未完了の段階)
+        """
+        monitor = self.memory_monitor
+        monitor.record('slicedIndexing')
+        embeddings = SpillList(monitor)
+        totals = {'stored': 0, 'failed': 0, 'slices': 0}
+        pending_stage = None
+        vector_result = None
+        index = 0
+        while index < len(chunks):
+            if deadline.expired():
+                pending_stage = 'embedding'
+                break
+            slice_chunks = chunks[index:index + monitor.fit_batch_size(MEMORY_INDEX_SLICE_SIZE)]
+            slice_embeddings = completed_embeddings[index:index + len(slice_chunks)]
+            exhausted = False
+            if len(slice_embeddings) < len(slice_chunks):
+                vector_result = self.vector_processor.generate_embeddings(
+                    [chunk['content'] for chunk in slice_chunks[len(slice_embeddings):]], deadline=deadline
+                )
+                if not vector_result.success:
+                    break
+                slice_embeddings = slice_embeddings + vector_result.embeddings
+                exhausted = bool(vector_result.metadata.get('deadline_exhausted'))
+            if slice_embeddings:
+                documents = self.vector_processor.create_bedrock_kb_documents(
+                    chunks=slice_chunks[:len(slice_embeddings)],
+                    embeddings=slice_embeddings,
+                    source_file=file_name,
+                    source_uri=source_uri,
+                    author=author or "system",
+                    file_size=file_size,
+                    chunk_index_offset=index
+                )
+                storage = self.vector_processor.store_embeddings_to_opensearch(documents)
+                totals['stored'] += storage.get('stored_count', 0)
+                totals['failed'] += len(documents) - storage.get('stored_count', 0)
+                totals['slices'] += 1
+                embeddings.extend(slice_embeddings)
+                index += len(slice_embeddings)
+            if exhausted or not slice_embeddings:
+                pending_stage = 'embedding'
+                break
+        
+        opensearch_result = {
+            'success': totals['failed'] == 0,
+            'index': self.vector_processor.opensearch_index,
+            'stored_count': totals['stored'],
+            'failed_count': totals['failed'],
+            'slices': totals['slices'],
+            'format': 'bedrock-knowledge-base-compatible'
+        }
+        if vector_result is not None and not vector_result.success:
+            return vector_result, opensearch_result, None
+        logger.info(f"分割格納完了: {file_name} ({len(embeddings)}/{len(chunks)}チャンク, {totals['slices']}回, "
+                    f"退避 {embeddings.spilled_count}件)")
+        return EmbeddingResult(
+            success=True,
+            embeddings=embeddings,
+            metadata={
+                'total_texts': len(chunks),
+                'total_embeddings': len(embeddings),
+                'embedding_model': self.vector_processor.embedding_model,
+                'embedding_dimension': len(embeddings[0]) if len(embeddings) else 0,
+                'batch_size': MEMORY_INDEX_SLICE_SIZE,
+                'sliced': True,
+                'slices': totals['slices'],
+                'spilled_embeddings': embeddings.spilled_count,
+                'deadline_exhausted': pending_stage is not None
+            }
+        ), opensearch_result, pending_stage
+    
     def save_tracking_info(self, file_hash: str, file_name: str, file_format: str, 
                           processing_strategy: str, final_method: str, 
                           attempted_methods: List[Dict], total_time: float,
@@ -299,21 +1371,227 @@ class DocumentProcessor:
             if final_method_data and 'qualityScore' in final_method_data:
                 item['qualityScore'] = final_method_data['qualityScore']
             
-            self.tracking_table.put_item(Item=item)
+            if self.metadata_manager:
+                # 処理中はメタデータと同じバッファに追加
+                self.metadata_manager.put_item(TRACKING_TABLE_NAME, self.tracking_table, item)
+            else:
+                self.tracking_table.put_item(Item=item)
             logger.info(f"追跡情報を保存しました: {file_name}")
             
         except Exception as e:
             logger.error(f"追跡情報の保存に失敗: {e}")
     
+    def process_archive(self, file_content: bytes, file_name: str,
+                        processing_strategy: Optional[str] = None,
+                        user_id: Optional[str] = None,
+                        project_id: Optional[str] = None,
+                        deadline: Optional[Deadline] = None,
+                        archive_uri: Optional[str] = None) -> Dict[str, Any]:
+        """
+        ZIPアーカイブをメンバーごとに処理
+        
+        展開前にセントラルディレクトリでZIP爆弾（メンバー数・展開後サイズ・圧縮率）を検証し、
+        メンバーを1件ずつ展開して通常の形式別パイプライン（process_document）で並行処理する。
+        同時に展開・処理するメンバー数は performance.maxConcurrentProcesses に制限する。
+        前回取り込み時とSHA-256が同じメンバー、およびアーカイブ内で内容が重複するメンバーは処理しない。
+        チェックポイントで中断・期限で未展開のメンバーが残った場合は未完了（success=False, incomplete=True）とし、
+        次回の取り込みでマニフェストにないメンバーのみ処理する。
+        
+        Args:
+            file_content: ZIPファイル内容
+            file_name: アーカイブのファイル名
+            processing_strategy: 処理戦略（各メンバーに適用）
+            user_id: ユーザーID
+            project_id: プロジェクトID
+            deadline: 実行期限
+            archive_uri: アーカイブのURI（マニフェストのキー、省略時はファイル名から作成。
+                S3オブジェクトはバケット・フルキーで指定し、同名の別アーカイブと区別する）
+        
+        Returns:
+            Dict: 処理結果（metadata.archive にメンバーごとの結果）
+        """
+        start_time = datetime.now()
+        if deadline is None:
+            deadline = Deadline.from_context(None)
+        if archive_uri is None:
+            archive_uri = f"\\\\file\\{file_name}"
+        file_hash = f"{file_name}-{len(file_content)}-{start_time.timestamp()}"
+        max_in_flight = max(1, self.config.get('performance', {}).get('maxConcurrentProcesses', 3))
+        members: List[Dict[str, Any]] = []
+        result = {
+            'success': False,
+            'fileName': file_name,
+            'fileFormat': 'zip',
+            'processingStrategy': processing_strategy or 'auto',
+            'finalMethod': None,
+            'markdownContent': '',
+            'metadata': {'startTime': start_time.isoformat(), 'attemptedMethods': [], 'totalProcessingTime': 0},
+            'error': None
+        }
+        
+        def is_supported(path: str) -> bool:
+            member_format = self.get_file_format(path)
+            return bool(member_format) and member_format not in ARCHIVE_FORMATS and self.is_format_supported(member_format)
+        
+        def settle(entry: Dict[str, Any], future: Any) -> None:
+            try:
+                member_result = future.result()
+            except Exception as e:
+                member_result = {'success': False, 'error': {'message': str(e), 'type': type(e).__name__}}
+            entry['status'] = 'processed' if member_result['success'] else 'failed'
+            entry['fileFormat'] = member_result.get('fileFormat')
+            entry['finalMethod'] = member_result.get('finalMethod')
+            if member_result.get('error'):
+                entry['error'] = member_result['error'].get('message')
+            if member_result.get('checkpoint'):
+                entry['status'] = 'partial'
+                entry['checkpoint'] = member_result['checkpoint']
+        
+        try:
+            reader = ArchiveReader(io.BytesIO(file_content), file_name, ArchiveLimits.from_config(self.config),
+                                   is_supported)
+            previous_manifest = self.archive_manifest_store.load(archive_uri)
+            first_by_hash: Dict[str, Dict[str, Any]] = {}
+            in_flight = deque()
+            executor = _get_archive_executor()
+            
+            for member in reader.iter_members():
+                entry = {
+                    'path': member.path,
+                    'sourceUri': archive_source_uri(archive_uri, member.path),
+                    'sha256': member.sha256,
+                    'size': member.file_size
+                }
+                members.append(entry)
+                if previous_manifest.get(member.path) == member.sha256:
+                    entry['status'] = 'unchanged'
+                elif member.sha256 in first_by_hash:
+                    entry['status'] = 'duplicate'
+                    entry['duplicateOf'] = first_by_hash[member.sha256]['path']
+                else:
+                    first_by_hash[member.sha256] = entry
+                    while len(in_flight) >= max_in_flight:
+                        settle(*in_flight.popleft())
+                    in_flight.append((entry, executor.submit(
+                        self.process_document, member.content, member.path, processing_strategy,
+                        user_id, project_id, deadline, None, entry['sourceUri']
+                    )))
+                if deadline.expired():
+                    # 未展開のメンバーは次回の取り込みで処理（マニフェストに含めない）
+                    break
+            while in_flight:
+                settle(*in_flight.popleft())
+            reader.close()
+            
+            # 取り込みが完了したメンバーのみマニフェストに記録（失敗・中断したメンバーは次回再処理）
+            manifest = {entry['path']: entry['sha256'] for entry in members
+                        if entry['status'] in ('processed', 'unchanged')
+                        or (entry['status'] == 'duplicate' and first_by_hash[entry['sha256']]['status'] == 'processed')}
+            if manifest != previous_manifest:
+                self.archive_manifest_store.save(archive_uri, manifest)
+            
+            counts = {status: sum(1 for entry in members if entry['status'] == status)
+                      for status in ('processed', 'partial', 'failed', 'unchanged', 'duplicate')}
+            stats = reader.get_stats()
+            stats.update(counts)
+            stats['deferred'] = stats['plannedMembers'] - len(members)
+            # 中断・未展開のメンバーが残る場合は取り込み完了として報告しない
+            incomplete = bool(counts['partial'] or stats['deferred'])
+            result.update({
+                'success': counts['failed'] == 0 and not incomplete,
+                'incomplete': incomplete,
+                'finalMethod': 'archive'
+            })
+            result['metadata']['archive'] = dict(stats, members=members, skipped=reader.skipped, archiveUri=archive_uri)
+            if counts['failed']:
+                result['error'] = {'message': f"{counts['failed']}件のメンバーの処理に失敗しました",
+                                   'type': 'ArchiveMemberError', 'timestamp': datetime.now().isoformat()}
+            elif incomplete:
+                result['error'] = {'message': f"{counts['partial']}件のメンバーが中断、{stats['deferred']}件が未展開です"
+                                              "（次回の取り込みで処理）",
+                                   'type': 'ArchiveIncomplete', 'timestamp': datetime.now().isoformat()}
+            logger.info(f"アーカイブ処理完了: {file_name} ({stats})")
+        
+        except Exception as e:
+            result['error'] = {'message': str(e), 'type': type(e).__name__, 'timestamp': datetime.now().isoformat()}
+            if isinstance(e, ProcessingError):
+                result['error']['details'] = e.details
+            logger.error(f"アーカイブ処理失敗: {file_name} - {e}")
+        
+        end_time = datetime.now()
+        total_time = (end_time - start_time).total_seconds() * 1000
+        result['metadata'].update({'endTime': end_time.isoformat(), 'totalProcessingTime': total_time})
+        self.save_tracking_info(
+            file_hash, file_name, 'zip', result['processingStrategy'], result['finalMethod'] or 'none',
+            [], total_time, 0, has_error=not result['success'],
+            error_message=result['error']['message'] if result['error'] else None
+        )
+        return result
+    
     def process_document(self, file_content: bytes, file_name: str, 
                         processing_strategy: Optional[str] = None,
                         user_id: Optional[str] = None,
-                        project_id: Optional[str] = None) -> Dict[str, Any]:
-        """メインの文書処理関数（エラーハンドリング・フォールバック対応）"""
+                        project_id: Optional[str] = None,
+                        deadline: Optional[Deadline] = None,
+                        checkpoint: Optional[Dict[str, Any]] = None,
+                        source_uri: Optional[str] = None,
+                        checkpoint_id: Optional[str] = None,
+                        object_uri: Optional[str] = None) -> Dict[str, Any]:
+        """
+        メインの文書処理関数（エラーハンドリング・フォールバック対応）
+        
+        各段階は実行期限の残り時間に応じて処理量を調整し、期限内に完了できない
+        段階はチェックポイントとして保存する。checkpointを指定した場合は
+        保存済みの変換結果・埋め込みから処理を再開する。checkpoint_idを指定した場合は
+        そのIDでチェックポイントを保存する（S3オブジェクトのバージョン単位で再開するため）。
+        ZIPアーカイブはメンバーごとに process_archive で処理する（object_uri はS3オブジェクトの
+        バケット・フルキーのURIで、アーカイブのマニフェストとメンバーのソースURIに使用する）。
+        処理中のメタデータ・追跡情報の書き込みはバッファし、終了時にBatchWriteItemでまとめて書き込む。
+        """
+        if not self.metadata_manager:
+            return self._process_document(file_content, file_name, processing_strategy, user_id,
+                                          project_id, deadline, checkpoint, source_uri, checkpoint_id,
+                                          object_uri)
+        
+        with self.metadata_manager.write_behind() as metadata_buffer:
+            result = self._process_document(file_content, file_name, processing_strategy, user_id,
+                                            project_id, deadline, checkpoint, source_uri, checkpoint_id,
+                                            object_uri)
+        if metadata_buffer is not None:
+            result['metadata']['metadataWrites'] = metadata_buffer.get_stats()
+        return result
+    
+    def _process_document(self, file_content: bytes, file_name: str,
+                          processing_strategy: Optional[str],
+                          user_id: Optional[str],
+                          project_id: Optional[str],
+                          deadline: Optional[Deadline],
+                          checkpoint: Optional[Dict[str, Any]],
+                          source_uri: Optional[str],
+                          checkpoint_id: Optional[str] = None,
+                          object_uri: Optional[str] = None) -> Dict[str, Any]:
+        """文書処理の本体（process_document を参照）"""
         start_time = datetime.now()
+        if deadline is None:
+            deadline = Deadline.from_context(None)
         file_format = self.get_file_format(file_name)
         file_hash = f"{file_name}-{len(file_content)}-{start_time.timestamp()}"
         
+        # 拡張子ではなく内容から形式を判定（判別できない内容は変換前に拒否）
+        content_sniff = None
+        sniff_rejection = None
+        if CONTENT_SNIFFING_ENABLED:
+            with span('sniff') as sniff_span:
+                content_sniff = sniff_content(file_content)
+                file_format, sniff_rejection = route_content(content_sniff, file_format)
+                sniff_span.set_attributes(fileFormat=file_format, rejected=bool(sniff_rejection))
+        
+        if file_format in ARCHIVE_FORMATS and ARCHIVE_INGEST_ENABLED and not sniff_rejection:
+            return self.process_archive(file_content, file_name, processing_strategy, user_id, project_id, deadline,
+                                        archive_uri=object_uri or source_uri)
+        if source_uri is None:
+            source_uri = f"\\\\file\\{file_name}"
+        
         # 構造化ログ開始
         processing_log_id = None
         if self.structured_logger:
@@ -344,11 +1622,16 @@ class DocumentProcessor:
                 
                 processing_metadata = self.metadata_manager.create_processing_metadata(
                     file_id=file_metadata.file_id,
-                    processing_strategy=processing_strategy or 'auto'
+                    processing_strategy=processing_strategy or 'auto',
+                    user_id=user_id,
+                    project_id=project_id,
+                    file_format=file_format or 'unknown'
                 )
             except Exception as e:
                 logger.warning(f"メタデータ作成に失敗: {e}")
         
+        comparison = None
+        page_pipeline = None
         result = {
             'success': False,
             'fileName': file_name,
@@ -363,8 +1646,17 @@ class DocumentProcessor:
             },
             'error': None
         }
+        if content_sniff:
+            result['metadata']['contentSniff'] = content_sniff.to_dict()
         
         try:
+            if sniff_rejection:
+                raise ProcessingError(
+                    ErrorType.INVALID_FILE_CONTENT,
+                    f"{sniff_rejection}: {file_name}",
+                    content_sniff.to_dict()
+                )
+            
             # リソース監視による事前検証
             if self.resource_monitor:
                 self.resource_monitor.validate_file_size(file_content, file_name)
@@ -384,141 +1676,162 @@ class DocumentProcessor:
                     f"無効化されているファイル形式: {file_format}"
                 )
             
-            # 処理戦略の決定
-            if not processing_strategy:
-                processing_order = get_processing_order(self.config, file_format)
+            if checkpoint:
+                # チェックポイントからの再開（変換済みの結果を使用）
+                final_content = checkpoint.get('markdownContent', '')
+                final_method = checkpoint.get('finalMethod')
+                attempted_methods = checkpoint.get('attemptedMethods', [])
+                result['processingStrategy'] = checkpoint.get('processingStrategy') or processing_strategy or 'auto'
+                logger.info(f"チェックポイントから再開: {file_name} (段階: {checkpoint.get('stage')})")
             else:
-                # カスタム戦略の処理
-                if processing_strategy == 'markitdown-only':
-                    processing_order = ['markitdown'] if should_use_markitdown(self.config, file_format) else []
-                elif processing_strategy == 'langchain-only':
-                    processing_order = ['langchain'] if should_use_langchain(self.config, file_format) else []
-                elif processing_strategy == 'markitdown-first':
-                    processing_order = ['markitdown', 'langchain']
-                elif processing_strategy == 'langchain-first':
-                    processing_order = ['langchain', 'markitdown']
-                elif processing_strategy == 'both-compare':
-                    processing_order = ['markitdown', 'langchain']
-                else:
+                # 処理戦略の決定
+                if not processing_strategy:
                     processing_order = get_processing_order(self.config, file_format)
+                    # テキスト層のあるPDFはOCRなしの変換、スキャンPDFはOCR対応の変換を先に試行
+                    preferred = preferred_method(content_sniff)
+                    if preferred in processing_order[1:]:
+                        processing_order = [preferred] + [m for m in processing_order if m != preferred]
+                else:
+                    # カスタム戦略の処理
+                    if processing_strategy == 'markitdown-only':
+                        processing_order = ['markitdown'] if should_use_markitdown(self.config, file_format) else []
+                    elif processing_strategy == 'langchain-only':
+                        processing_order = ['langchain'] if should_use_langchain(self.config, file_format) else []
+                    elif processing_strategy == 'markitdown-first':
+                        processing_order = ['markitdown', 'langchain']
+                    elif processing_strategy == 'langchain-first':
+                        processing_order = ['langchain', 'markitdown']
+                    elif processing_strategy == 'both-compare':
+                        processing_order = ['markitdown', 'langchain']
+                    else:
+                        processing_order = get_processing_order(self.config, file_format)
             
-            if not processing_order:
-                raise ProcessingError(
-                    ErrorType.UNSUPPORTED_FORMAT,
-                    f"利用可能な処理方法がありません: {file_format}"
-                )
+                if not processing_order:
+                    raise ProcessingError(
+                        ErrorType.UNSUPPORTED_FORMAT,
+                        f"利用可能な処理方法がありません: {file_format}"
+                    )
             
-            result['processingStrategy'] = processing_strategy or 'auto'
+                result['processingStrategy'] = processing_strategy or 'auto'
             
-            # フォールバック機構を使用した処理実行
-            if self.fallback_handler and len(processing_order) >= 2:
-                # フォールバック機能を使用
-                primary_method = processing_order[0]
-                fallback_method = processing_order[1] if len(processing_order) > 1 else None
-                
-                primary_func = self.process_with_markitdown if primary_method == 'markitdown' else self.process_with_langchain
-                fallback_func = self.process_with_langchain if fallback_method == 'langchain' else self.process_with_markitdown if fallback_method == 'markitdown' else None
-                
                 # タイムアウト設定を取得
                 format_config = self.config.get('supportedFormats', {}).get(file_format, {})
                 timeout_seconds = format_config.get('timeout', 60)
+                effective_strategy = processing_strategy or format_config.get('processingStrategy')
                 
-                success, final_content, final_metadata = self.fallback_handler.execute_with_fallback(
-                    primary_func, fallback_func, file_content, file_format, file_name, timeout_seconds
-                )
-                
-                if success:
-                    final_method = final_metadata.get('finalMethod', primary_method)
-                    attempted_methods = final_metadata.get('attemptedMethods', [])
-                else:
-                    raise ProcessingError(
-                        ErrorType.CONVERSION_FAILED,
-                        "フォールバック処理も含めてすべての処理が失敗しました"
-                    )
-            
-            else:
-                # 従来の順次実行モード
                 attempted_methods = []
                 final_content = ""
                 final_method = None
+                page_batches = self.plan_page_batches(file_content, file_format)
             
-            # 品質比較モードの場合は両方実行
-            if processing_strategy == 'both-compare' and len(processing_order) >= 2:
-                markitdown_result = None
-                langchain_result = None
+                # 複数バッチに分割できるPDFはページ範囲ごとに並行変換
+                if page_batches:
+                    final_method, final_content, attempted_methods, page_pipeline = self.convert_pdf_pages(
+                        file_content, file_name, processing_order, page_batches,
+                        effective_strategy == 'both-compare', timeout_seconds, deadline
+                    )
                 
-                # Markitdown実行
-                if 'markitdown' in processing_order:
-                    success, content, metadata = self.process_with_markitdown(file_content, file_format, file_name)
-                    attempted_methods.append(metadata)
-                    if success:
-                        markitdown_result = {'content': content, 'metadata': metadata}
+                # 品質比較モードの場合は両方を並行実行
+                elif effective_strategy == 'both-compare' and len(processing_order) >= 2:
+                    final_method, final_content, attempted_methods, comparison = self.convert_both_compare(
+                        file_content, file_format, file_name, processing_order, timeout_seconds, deadline
+                    )
                 
-                # LangChain実行
-                if 'langchain' in processing_order:
-                    success, content, metadata = self.process_with_langchain(file_content, file_format, file_name)
-                    attempted_methods.append(metadata)
-                    if success:
-                        langchain_result = {'content': content, 'metadata': metadata}
+                # フォールバック機構を使用した処理実行
+                elif self.fallback_handler and len(processing_order) >= 2:
+                    # フォールバック機能を使用
+                    primary_method = processing_order[0]
+                    fallback_method = processing_order[1] if len(processing_order) > 1 else None
                 
-                # 品質比較
-                if markitdown_result and langchain_result:
-                    final_method = self.compare_quality(markitdown_result['metadata'], langchain_result['metadata'])
-                    final_content = markitdown_result['content'] if final_method == 'markitdown' else langchain_result['content']
-                elif markitdown_result:
-                    final_method = 'markitdown'
-                    final_content = markitdown_result['content']
-                elif langchain_result:
-                    final_method = 'langchain'
-                    final_content = langchain_result['content']
-                else:
-                    raise Exception("両方の処理方法が失敗しました")
-            
-            else:
-                # 順次実行モード
-                for method in processing_order:
-                    if method == 'markitdown':
-                        success, content, metadata = self.process_with_markitdown(file_content, file_format, file_name)
-                    elif method == 'langchain':
-                        success, content, metadata = self.process_with_langchain(file_content, file_format, file_name)
+                    primary_func = self._bind_converter(primary_method, file_format, deadline)
+                    fallback_func = self._bind_converter(fallback_method, file_format, deadline) if fallback_method else None
+                
+                    success, final_content, final_metadata = self.fallback_handler.execute_with_fallback(
+                        primary_func, fallback_func, file_content, file_format, file_name, timeout_seconds,
+                        deadline=deadline
+                    )
+                
+                    if success:
+                        final_method = final_metadata.get('finalMethod', primary_method)
+                        attempted_methods = final_metadata.get('attemptedMethods', [])
                     else:
-                        continue
+                        raise ProcessingError(
+                            ErrorType.CONVERSION_FAILED,
+                            "フォールバック処理も含めてすべての処理が失敗しました"
+                        )
+            
+                else:
+                    # 順次実行モード
+                    for method in processing_order:
+                        deadline.check(f"conversion:{method}")
+                        if method == 'markitdown':
+                            success, content, metadata = self.process_with_markitdown(file_content, file_format, file_name, deadline)
+                        elif method == 'langchain':
+                            success, content, metadata = self.process_with_langchain(file_content, file_format, file_name, deadline)
+                        else:
+                            continue
                     
-                    attempted_methods.append(metadata)
+                        attempted_methods.append(metadata)
                     
-                    # 構造化ログ: 変換試行
-                    if self.structured_logger:
-                        try:
-                            self.structured_logger.log_conversion_attempt(
-                                method=method,
-                                duration_ms=metadata.get('processingTime', 0),
-                                success=success,
-                                file_format=file_format,
-                                output_size=metadata.get('outputLength', 0),
-                                quality_score=metadata.get('qualityScore')
-                            )
-                        except Exception as e:
-                            logger.warning(f"変換試行ログに失敗: {e}")
+                        # 構造化ログ: 変換試行
+                        if self.structured_logger:
+                            try:
+                                self.structured_logger.log_conversion_attempt(
+                                    method=method,
+                                    duration_ms=metadata.get('processingTime', 0),
+                                    success=success,
+                                    file_format=file_format,
+                                    output_size=metadata.get('outputLength', 0),
+                                    quality_score=metadata.get('qualityScore')
+                                )
+                            except Exception as e:
+                                logger.warning(f"変換試行ログに失敗: {e}")
                     
-                    if success:
-                        final_content = content
-                        final_method = method
-                        break
+                        if success:
+                            final_content = content
+                            final_method = method
+                            break
                 
-                if not final_method:
-                    raise Exception("すべての処理方法が失敗しました")
+                    if not final_method:
+                        raise Exception("すべての処理方法が失敗しました")
             
             # LangChain統合処理（チャンキングと埋め込み生成）
             langchain_result = None
-            if self.langchain_integration and final_content:
+            stream_pipeline = None
+            stream_error = None
+            stream_cleanup = None
+            pending_stage = None
+            chunk_stream = None
+            if self.langchain_integration and self.vector_processor and not page_pipeline:
+                chunk_stream = self.create_chunk_stream(file_content, file_format, file_name,
+                                                        start=(checkpoint or {}).get('streamOffset', 0))
+            if page_pipeline:
+                # ページ並列処理でバッチごとにチャンキング済み
+                langchain_result = page_pipeline['chunkResult']
+            elif self.langchain_integration and final_content and deadline.expired():
+                pending_stage = 'chunking'
+            elif chunk_stream is not None:
+                # 表形式・HTML/XMLは行・レコード単位のストリーミングでチャンキング・埋め込み・格納を逐次実行
+                stream_source_uri = source_uri or f"\\\\file\\{file_name}"
                 try:
-                    langchain_result = self.langchain_integration.process_markdown_content(
-                        markdown_content=final_content,
-                        source_file=file_name,
-                        processing_method=final_method,
-                        user_id=None,  # TODO: 実際のユーザーIDを取得
-                        project_id=None  # TODO: 実際のプロジェクトIDを取得
+                    stream_pipeline = self.ingest_chunk_stream(
+                        chunk_stream, file_name, len(file_content), user_id, deadline, stream_source_uri, project_id
                     )
+                    stream_pipeline['format'] = file_format
+                    if stream_pipeline['nextOffset'] is not None:
+                        pending_stage = 'chunking'
+                except Exception as e:
+                    # 変換結果全体のチャンキングで処理し直す（チャンク境界が異なりドキュメントIDが重複しないため、
+                    # 格納済みのバッチを削除してから格納し直す）
+                    logger.warning(f"ストリーミング処理に失敗したため変換結果全体をチャンキング: {e}")
+                    stream_pipeline = None
+                    stream_error = f"{type(e).__name__}: {e}"
+                    stream_cleanup = self.vector_processor.delete_documents_by_source_uri(stream_source_uri)
+            if (self.langchain_integration and final_content and not page_pipeline and pending_stage is None
+                    and (chunk_stream is None or stream_error)):
+                try:
+                    langchain_result = self._chunk_markdown(final_content, file_name, final_method,
+                                                            user_id=user_id, project_id=project_id)
                     logger.info(f"LangChain処理完了: {len(langchain_result.chunks)}チャンク, {len(langchain_result.embeddings)}埋め込み")
                     
                     # 構造化ログ: LangChain処理
@@ -553,17 +1866,172 @@ class DocumentProcessor:
                     'totalProcessingTime': total_time
                 }
             })
+            if comparison:
+                result['metadata']['comparison'] = comparison
+            if page_pipeline:
+                result['metadata']['pagePipeline'] = {
+                    k: v for k, v in page_pipeline.items() if k not in ('chunkResult', 'embeddings')
+                }
+            if stream_pipeline:
+                result['metadata']['streamingIngest'] = stream_pipeline
+            elif stream_error:
+                result['metadata']['streamingIngest'] = {'error': stream_error, 'fallback': 'markdown',
+                                                         'cleanup': stream_cleanup}
+                if not (langchain_result and langchain_result.success):
+                    # ストリーミング・代替のチャンキングとも失敗した場合は格納されていないため失敗とする
+                    result['success'] = False
+                    result['error'] = {
+                        'message': f"ストリーミング処理と代替のチャンキングに失敗しました: {stream_error}",
+                        'type': 'ChunkingFailed',
+                        'timestamp': datetime.now().isoformat()
+                    }
+            image_metadata = next((m for m in attempted_methods
+                                   if m.get('method') == final_method and m.get('imagePreprocess')), None)
+            if image_metadata:
+                result['metadata']['imagePreprocess'] = dict(
+                    image_metadata['imagePreprocess'],
+                    ocrSkipped=image_metadata.get('ocrSkipped'),
+                    ocrReusedFrom=image_metadata.get('ocrReusedFrom'),
+                    ocrSecondsSaved=image_metadata.get('ocrSecondsSaved', 0.0),
+                    totals=get_ocr_result_cache().get_stats()
+                )
+            if content_sniff:
+                result['metadata']['contentSniff'] = content_sniff.to_dict()
+            conversion_cache_key = next((m.get('cacheKey') for m in attempted_methods
+                                         if m.get('method') == final_method and m.get('cacheKey')), None)
+            if conversion_cache_key:
+                result['metadata']['conversionCacheKey'] = conversion_cache_key
             
             # ベクトル埋め込み生成とOpenSearch格納
             vector_result = None
             opensearch_result = None
             
             if self.vector_processor and langchain_result and langchain_result.success:
-                try:\n                    # 埋め込み生成\n                    texts = [chunk['content'] for chunk in langchain_result.chunks]\n                    vector_result = self.vector_processor.generate_embeddings(texts)\n                    \n                    if vector_result.success:\n                        # Bedrock KB互換OpenSearchドキュメント作成\n                        opensearch_docs = self.vector_processor.create_bedrock_kb_documents(\n                            chunks=langchain_result.chunks,\n                            embeddings=vector_result.embeddings,\n                            source_file=file_name,
-                            source_uri=f"\\\\file\\{file_name}",  # ファイルパス形式
+                # ページバッチ単位のチャンキング結果にも格納前にユーザーID・プロジェクトIDを設定
+                tag_chunk_owner(langchain_result.chunks, user_id, project_id)
+                try:
+                    # 埋め込み生成（チェックポイントに保存済みの埋め込みは再利用）
+                    texts = [chunk['content'] for chunk in langchain_result.chunks]
+                    completed_embeddings = []
+                    if checkpoint and checkpoint.get('stage') in ('embedding', 'indexing'):
+                        completed_embeddings = checkpoint.get('embeddings', [])[:len(texts)]
+                    elif page_pipeline:
+                        # ページバッチの完了時に生成済みの埋め込みを再利用
+                        completed_embeddings = page_pipeline['embeddings'][:len(texts)]
+                    
+                    # メモリ逼迫時・全チャンクの一括処理が残りメモリに収まらない場合は分割して格納
+                    sliced = bool(self.memory_monitor and self.memory_monitor.should_slice(len(texts)))
+                    
+                    if deadline.expired():
+                        pending_stage = 'embedding'
+                    elif sliced:
+                        vector_result, opensearch_result, pending_stage = self.embed_and_index_slices(
+                            langchain_result.chunks, completed_embeddings, file_name, source_uri,
+                            user_id, len(file_content), deadline
+                        )
+                    elif len(completed_embeddings) < len(texts):
+                        vector_result = self.vector_processor.generate_embeddings(
+                            texts[len(completed_embeddings):], deadline=deadline
+                        )
+                        if vector_result.success:
+                            vector_result.embeddings = completed_embeddings + vector_result.embeddings
+                        if vector_result.metadata.get('deadline_exhausted'):
+                            pending_stage = 'embedding'
+                    else:
+                        vector_result = EmbeddingResult(
+                            success=True,
+                            embeddings=completed_embeddings,
+                            metadata={'total_embeddings': len(completed_embeddings), 'resumed': True}
+                        )
+                    
+                    if vector_result and vector_result.success and not pending_stage and not sliced and deadline.expired():
+                        pending_stage = 'indexing'
+                    
+                    if vector_result and vector_result.success and not pending_stage and not sliced:
+                        # Bedrock KB互換OpenSearchドキュメント作成
+                        opensearch_docs = self.vector_processor.create_bedrock_kb_documents(
+                            chunks=langchain_result.chunks,
+                            embeddings=vector_result.embeddings,
+                            source_file=file_name,
+                            source_uri=source_uri,  # ファイルパス形式（アーカイブメンバーはアーカイブ内のパス）
                             author=user_id or "system",
                             file_size=len(file_content),
-                            parent_chunks=None  # 必要に応じて親チャンクを設定\n                        )\n                        \n                        # OpenSearchに格納\n                        opensearch_result = self.vector_processor.store_embeddings_to_opensearch(opensearch_docs)\n                        \n                        logger.info(f\"ベクトル処理完了: {len(vector_result.embeddings)}埋め込み, OpenSearch格納: {opensearch_result.get('stored_count', 0)}\")\n                    \n                except Exception as e:\n                    logger.warning(f\"ベクトル処理に失敗: {e}\")\n                    vector_result = None\n                    opensearch_result = None\n            \n            # LangChain結果を追加\n            if langchain_result and langchain_result.success:\n                result['langchainProcessing'] = {\n                    'success': True,\n                    'chunks': langchain_result.chunks,\n                    'embeddings': langchain_result.embeddings,\n                    'metadata': langchain_result.metadata\n                }\n            elif langchain_result:\n                result['langchainProcessing'] = {\n                    'success': False,\n                    'error': langchain_result.error\n                }\n            \n            # ベクトル処理結果を追加\n            if vector_result and vector_result.success:\n                result['vectorProcessing'] = {\n                    'success': True,\n                    'embeddings_count': len(vector_result.embeddings),\n                    'embedding_dimension': len(vector_result.embeddings[0]) if vector_result.embeddings else 0,\n                    'metadata': vector_result.metadata\n                }\n            elif vector_result:\n                result['vectorProcessing'] = {\n                    'success': False,\n                    'error': vector_result.error\n                }\n            \n            # OpenSearch格納結果を追加\n            if opensearch_result:\n                result['opensearchStorage'] = opensearch_result
+                            parent_chunks=None  # 必要に応じて親チャンクを設定
+                        )
+                        
+                        # OpenSearchに格納
+                        opensearch_result = self.vector_processor.store_embeddings_to_opensearch(opensearch_docs)
+                        
+                        logger.info(f"ベクトル処理完了: {len(vector_result.embeddings)}埋め込み, OpenSearch格納: {opensearch_result.get('stored_count', 0)}")
+                    
+                except Exception as e:
+                    logger.warning(f"ベクトル処理に失敗: {e}")
+                    vector_result = None
+                    opensearch_result = None
+            
+            # 期限内に完了できなかった段階はチェックポイントとして保存
+            if pending_stage:
+                logger.warning(f"実行期限のため{pending_stage}段階以降を中断: {file_name} "
+                               f"(残り {deadline.remaining():.2f}秒)")
+                result['checkpoint'] = self.save_checkpoint(file_hash, pending_stage, {
+                    'fileName': file_name,
+                    'fileFormat': file_format,
+                    'processingStrategy': result['processingStrategy'],
+                    'finalMethod': final_method,
+                    'attemptedMethods': attempted_methods,
+                    'markdownContent': final_content,
+                    'embeddings': list(vector_result.embeddings) if vector_result and vector_result.success else [],
+                    'streamOffset': stream_pipeline['nextOffset'] if stream_pipeline else 0
+                }, checkpoint_id=checkpoint_id)
+                if not result['checkpoint']:
+                    # 再開できないため未完了の段階を成功として報告しない
+                    result['success'] = False
+                    result['error'] = {
+                        'message': f"実行期限内に{pending_stage}段階を完了できず、チェックポイントも保存できませんでした",
+                        'type': 'CheckpointUnavailable',
+                        'timestamp': datetime.now().isoformat()
+                    }
+            result['metadata']['deadline'] = deadline.to_dict()
+            
+            # LangChain結果を追加
+            if langchain_result and langchain_result.success:
+                result['langchainProcessing'] = {
+                    'success': True,
+                    'chunks': langchain_result.chunks,
+                    'embeddings': langchain_result.embeddings,
+                    'metadata': langchain_result.metadata
+                }
+            elif langchain_result:
+                result['langchainProcessing'] = {
+                    'success': False,
+                    'error': langchain_result.error
+                }
+            
+            # ベクトル処理結果を追加
+            if vector_result and vector_result.success:
+                result['vectorProcessing'] = {
+                    'success': True,
+                    'embeddings_count': len(vector_result.embeddings),
+                    'embedding_dimension': len(vector_result.embeddings[0]) if vector_result.embeddings else 0,
+                    'metadata': vector_result.metadata
+                }
+            elif vector_result:
+                result['vectorProcessing'] = {
+                    'success': False,
+                    'error': vector_result.error
+                }
+            elif stream_pipeline:
+                result['vectorProcessing'] = {
+                    'success': stream_pipeline['failedBatches'] == 0,
+                    'embeddings_count': stream_pipeline['embeddings'],
+                    'embedding_dimension': stream_pipeline['embeddingDimension'],
+                    'metadata': {'streaming': True, 'failed_batches': stream_pipeline['failedBatches']}
+                }
+                opensearch_result = {'stored_count': stream_pipeline['stored'], 'streaming': True}
+            
+            # OpenSearch格納結果を追加
+            if opensearch_result:
+                result['opensearchStorage'] = opensearch_result
             
             # メタデータ更新
             if self.metadata_manager and processing_metadata:
@@ -615,13 +2083,15 @@ class DocumentProcessor:
                             index_name=opensearch_result.get('index')
                         )
                     
-                    # 処理メタデータ更新
-                    self.metadata_manager.update_processing_metadata(
-                        processing_metadata=processing_metadata,
-                        attempted_methods=attempted_methods,
-                        final_method=final_method,
-                        success=True
-                    )
+                    # 処理メタデータ更新（チェックポイントから再開する実行は再開後の完了時に記録するため除外）
+                    if not result.get('checkpoint'):
+                        self.metadata_manager.update_processing_metadata(
+                            processing_metadata=processing_metadata,
+                            attempted_methods=attempted_methods,
+                            final_method=final_method,
+                            success=result['success'],
+                            error_message=None if result['success'] else result['error']['message']
+                        )
                 except Exception as e:
                     logger.warning(f"メタデータ更新に失敗: {e}")
             
@@ -716,6 +2186,8 @@ class DocumentProcessor:
                     'totalProcessingTime': total_time
                 }
             })
+            if content_sniff:
+                result['metadata']['contentSniff'] = content_sniff.to_dict()
             
             # エラー時のCloudWatchメトリクス送信
             if self.metrics_collector:
@@ -781,9 +2253,183 @@ class DocumentProcessor:
 # グローバルインスタンス
 processor = DocumentProcessor()
 
+def replay_handler(event, context):
+    """
+    変換キャッシュのリプレイ用エントリーポイント
+    
+    イベント例: {"cacheKeys": [...]} または {"fileSha256": "..."} に
+    chunkSize / chunkOverlap / generateEmbeddings / storeEmbeddings を指定する。
+    """
+    try:
+        cache_keys = list(event.get('cacheKeys', []))
+        if event.get('fileSha256') and processor.conversion_cache:
+            cache_keys.extend(processor.conversion_cache.list_keys(event['fileSha256']))
+        if not cache_keys:
+            raise ValueError("cacheKeys または fileSha256 が指定されていません")
+        
+        result = processor.replay_from_cache(
+            cache_keys=cache_keys,
+            chunk_size=event.get('chunkSize'),
+            chunk_overlap=event.get('chunkOverlap'),
+            generate_embeddings=event.get('generateEmbeddings', False),
+            store_embeddings=event.get('storeEmbeddings', False),
+            deadline=Deadline.from_context(context)
+        )
+        status_code = 200 if result['success'] else 207
+        body = result
+    except Exception as e:
+        logger.error(f"変換キャッシュのリプレイに失敗: {e}")
+        status_code = 500
+        body = {
+            'success': False,
+            'error': {
+                'message': str(e),
+                'type': type(e).__name__,
+                'timestamp': datetime.now().isoformat()
+            }
+        }
+    
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body, default=str, ensure_ascii=False)
+    }
+
+class RetryableInvocationError(Exception):
+    """Lambdaの非同期呼び出しの再試行で処理させるため、ハンドラーから送出するエラー"""
+
+
+def acquire_object_lease(record: Dict[str, Any], deadline: Deadline,
+                         resumed_lease: Optional[Dict[str, Any]] = None) -> Optional[Lease]:
+    """
+    S3イベントのオブジェクトバージョンのリースを取得
+    
+    Args:
+        record: S3イベントレコード
+        deadline: 実行期限（リース期間は残り時間 + 猶予）
+        resumed_lease: チェックポイントから再開する場合、再投入した呼び出しのリース
+    
+    Returns:
+        Optional[Lease]: リース（冪等性リースが無効、または取得に失敗した場合None）
+    """
+    if not processor.idempotency_store:
+        return None
+    bucket = record['s3']['bucket']['name']
+    s3_object = record['s3']['object']
+    lease_seconds = deadline.remaining() + LEASE_GRACE_SECONDS
+    try:
+        if resumed_lease:
+            # 所有者が一致する場合のみ延長できる（期限切れ後に他の呼び出しが取得していれば通常の取得へ）
+            lease = Lease(**resumed_lease)
+            if processor.idempotency_store.extend(lease, lease_seconds):
+                return lease
+        return processor.idempotency_store.acquire(
+            object_lease_key(bucket, s3_object['key'], s3_object.get('versionId'), s3_object.get('eTag')),
+            lease_seconds=lease_seconds,
+            details={'bucket': bucket, 'objectKey': s3_object['key'], 'fileName': s3_object['key'].split('/')[-1]}
+        )
+    except Exception as e:
+        # リースを使用できない場合も処理は継続（重複処理の抑止のみが失われる）
+        logger.warning(f"リースの取得に失敗したためリースなしで処理します: {e}")
+        return None
+
+def object_record_checkpoint_id(record: Dict[str, Any]) -> str:
+    """S3イベントレコードのオブジェクトバージョン単位のチェックポイントID"""
+    s3_object = record['s3']['object']
+    return object_checkpoint_id(record['s3']['bucket']['name'], s3_object['key'],
+                                s3_object.get('versionId'), s3_object.get('eTag'))
+
+def reenqueue_object_event(record: Dict[str, Any], lease: Optional[Lease], context: Any,
+                           resume_count: int) -> bool:
+    """
+    チェックポイントで中断したS3イベントを自身への非同期呼び出しで再投入
+    
+    再開する呼び出しは同じオブジェクトバージョンのチェックポイントを読み込み、リースを引き継ぐ。
+    
+    Args:
+        record: S3イベントレコード
+        lease: 取得したリース
+        context: Lambdaコンテキスト（呼び出し先の関数ARN）
+        resume_count: これまでの再投入回数
+    
+    Returns:
+        bool: 再投入できたか
+    """
+    function_arn = getattr(context, 'invoked_function_arn', None)
+    if not CHECKPOINT_REENQUEUE_ENABLED or not function_arn:
+        return False
+    if resume_count >= CHECKPOINT_MAX_RESUMES:
+        logger.error(f"再投入の上限（{CHECKPOINT_MAX_RESUMES}回）に達しました: {record['s3']['object']['key']}")
+        return False
+    payload = {'Records': [record], 'resumeCount': resume_count + 1}
+    if lease is not None:
+        payload['lease'] = lease.to_dict()
+    try:
+        boto3.client('lambda').invoke(FunctionName=function_arn, InvocationType='Event',
+                                      Payload=json.dumps(payload, default=str).encode('utf-8'))
+        logger.info(f"チェックポイントから再開するため再投入しました: {record['s3']['object']['key']} "
+                    f"({resume_count + 1}回目)")
+        return True
+    except Exception as e:
+        logger.error(f"チェックポイントからの再開の再投入に失敗: {e}")
+        return False
+
+def settle_object_lease(lease: Optional[Lease], result: Optional[Dict[str, Any]],
+                        resumable: bool = False) -> None:
+    """
+    処理結果に応じてリースを完了・延長・解放
+    
+    成功時は完了を記録し、失敗時は再処理できるよう解放する。
+    チェックポイント保存時は、再開する呼び出しがリースを引き継ぐ場合のみ延長する
+    （再開されないリースを延長すると期限切れまで同じオブジェクトを処理できないため解放する）。
+    
+    Args:
+        lease: 取得したリース
+        result: 処理結果（例外の場合None）
+        resumable: チェックポイントから再開する呼び出しがリースを引き継ぐか（再投入済み、または呼び出し元に返す場合）
+    """
+    if lease is None or not processor.idempotency_store:
+        return
+    try:
+        if result and result.get('success') and result.get('checkpoint') and resumable:
+            processor.idempotency_store.extend(lease)
+        elif result and result.get('success'):
+            processor.idempotency_store.complete(lease, {
+                'fileName': result.get('fileName') or '',
+                'finalMethod': result.get('finalMethod') or 'none'
+            })
+        else:
+            processor.idempotency_store.release(lease)
+    except Exception as e:
+        logger.warning(f"リースの更新に失敗（期限切れ後に再取得可能）: {e}")
+
+@flush_logs_after
 def lambda_handler(event, context):
     """Lambda関数のエントリーポイント"""
-    logger.info(f"Document Processor Lambda開始 - Event: {json.dumps(event, default=str)}")
+    # ファイル内容は長さのみ、長いフィールドは切り詰めて出力（INFOが無効な場合は作成しない）
+    logger.info("Document Processor Lambda開始 - Event: %s", LazyJson(event))
+    
+    if event.get('action') == 'replay':
+        return replay_handler(event, context)
+    
+    # 段階別のスパンを記録（explain指定時はスパンの木をレスポンスに含める）
+    explain = bool(event.get('explain'))
+    trace = get_tracer().start_trace('document-processor')
+    # RSSを継続的に採取し、段階（スパン）ごとのピークを記録（逼迫時は各段階が処理量を調整）
+    memory_monitor = processor.memory_monitor
+    if memory_monitor:
+        memory_monitor.start(get_tracer())
+    
+    # 呼び出しの残り時間から実行期限を作成し、全段階に伝搬する
+    deadline = Deadline.from_context(context)
+    processing_strategy = None
+    checkpoint_id = None
+    s3_record = None
+    object_uri = None
+    lease = None
     
     try:
         # イベントからファイル情報を取得
@@ -794,10 +2440,48 @@ def lambda_handler(event, context):
             bucket = record['s3']['bucket']['name']
             key = record['s3']['object']['key']
             
+            # 同じオブジェクトバージョンを処理済み・処理中の場合はダウンロードせずに終了
+            lease = acquire_object_lease(record, deadline, event.get('lease'))
+            if lease is not None and not lease.acquired:
+                if lease.status != LeaseStatus.DONE:
+                    # 処理中の呼び出しが失敗した場合に備え、非同期呼び出しの再試行で再確認する
+                    # （他の呼び出しのリースのため解放しない）
+                    holder = lease
+                    lease = None
+                    raise RetryableInvocationError(
+                        f"同じオブジェクトバージョンを処理中です: {bucket}/{key} ({holder.status})"
+                    )
+                logger.info(f"重複イベントのため処理をスキップ: {bucket}/{key} ({lease.status})")
+                if memory_monitor:
+                    memory_monitor.stop()
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'success': True,
+                        'duplicate': True,
+                        'status': 'already_done',
+                        'lease': lease.to_dict()
+                    }, default=str, ensure_ascii=False)
+                }
+            
             # S3からファイルを取得
-            response = s3_client.get_object(Bucket=bucket, Key=key)
-            file_content = response['Body'].read()
+            with span('s3.download', bucket=bucket, key=key) as download_span:
+                response = s3_client.get_object(Bucket=bucket, Key=key)
+                file_content = response['Body'].read()
+                download_span.set_attributes(bytes=len(file_content))
             file_name = key.split('/')[-1]
+            # アップロード時のオブジェクトメタデータ（x-amz-meta-user-id / x-amz-meta-project-id）から取得
+            object_metadata = response.get('Metadata') or {}
+            user_id = object_metadata.get('user-id')
+            project_id = object_metadata.get('project-id')
+            # 同じオブジェクトバージョンの中断済み処理があれば再開する
+            s3_record = record
+            checkpoint_id = object_record_checkpoint_id(record)
+            object_uri = f"s3://{bucket}/{key}"
             
         elif 'body' in event:
             # API Gatewayイベントの場合
@@ -805,26 +2489,80 @@ def lambda_handler(event, context):
             file_name = body.get('fileName')
             file_content = body.get('fileContent', '').encode() if isinstance(body.get('fileContent'), str) else body.get('fileContent', b'')
             processing_strategy = body.get('processingStrategy')
+            user_id = body.get('userId')
+            project_id = body.get('projectId')
+            checkpoint_id = body.get('checkpointId')
+            lease = Lease(**body['lease']) if body.get('lease') else None
+            explain = explain or bool(body.get('explain'))
             
         else:
             # 直接呼び出しの場合
             file_name = event.get('fileName')
             file_content = event.get('fileContent', '').encode() if isinstance(event.get('fileContent'), str) else event.get('fileContent', b'')
             processing_strategy = event.get('processingStrategy')
+            user_id = event.get('userId')
+            project_id = event.get('projectId')
+            checkpoint_id = event.get('checkpointId')
+            # チェックポイントからの再開時は元の呼び出しのリースを引き継ぐ
+            lease = Lease(**event['lease']) if event.get('lease') else None
         
         if not file_name or not file_content:
             raise ValueError("ファイル名またはファイル内容が指定されていません")
         
+        # チェックポイントからの再開
+        checkpoint = None
+        if checkpoint_id:
+            checkpoint = processor.checkpoint_store.load(checkpoint_id)
+            if not checkpoint and s3_record is None:
+                logger.warning(f"チェックポイントが見つからないため最初から処理します: {checkpoint_id}")
+        
         # 文書処理実行
         result = processor.process_document(
             file_content=file_content,
             file_name=file_name,
-            processing_strategy=processing_strategy
+            processing_strategy=processing_strategy,
+            user_id=user_id,
+            project_id=project_id,
+            deadline=deadline,
+            checkpoint=checkpoint,
+            checkpoint_id=checkpoint_id if s3_record is not None else None,
+            object_uri=object_uri
         )
+        # チェックポイントからの再開: S3イベントは自身を再投入し、それ以外は呼び出し元がリースを引き継ぐ
+        resumable = bool(result['success'] and result.get('checkpoint'))
+        if s3_record is not None and resumable:
+            # S3イベントには再開を依頼する呼び出し元がないため自身で再投入する
+            if not reenqueue_object_event(s3_record, lease, context, int(event.get('resumeCount', 0))):
+                # リースを解放し、非同期呼び出しの再試行で同じチェックポイントから再開させる
+                settle_object_lease(lease, None)
+                lease = None
+                raise RetryableInvocationError(
+                    f"チェックポイントからの再開を再投入できませんでした: {result['checkpoint'].get('checkpointId')}"
+                )
+        if s3_record is not None and result.get('incomplete'):
+            # 未完了のアーカイブは非同期呼び出しの再試行でマニフェストにない残りのメンバーを処理させる
+            settle_object_lease(lease, None)
+            lease = None
+            raise RetryableInvocationError(f"アーカイブの取り込みが未完了です: {object_uri}")
+        settle_object_lease(lease, result, resumable)
+        if lease is not None and resumable:
+            result['lease'] = lease.to_dict()
         
-        # レスポンス作成
+        if memory_monitor:
+            memory_report = result.setdefault('metadata', {})['memory'] = memory_monitor.stop()
+            logger.info("🧠 段階別メモリ | %s", LazyJson({'event_type': 'memory_summary', **memory_report}))
+        trace.set_attributes(fileName=file_name, success=result['success'])
+        trace_summary = export_trace(get_tracer().end_trace(trace))
+        if explain:
+            result['trace'] = dict(trace_summary, spans=trace.to_dict())
+        
+        # レスポンス作成（チェックポイント保存時は未完了として202を返す）
+        if result['success']:
+            status_code = 202 if result.get('checkpoint') else 200
+        else:
+            status_code = 400
         response = {
-            'statusCode': 200 if result['success'] else 400,
+            'statusCode': status_code,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
@@ -839,6 +2577,14 @@ def lambda_handler(event, context):
         error_msg = str(e)
         logger.error(f"Document Processor Lambda エラー: {error_msg}")
         logger.error(f"Traceback: {traceback.format_exc()}")
+        settle_object_lease(lease, None)
+        if memory_monitor:
+            logger.info("🧠 段階別メモリ | %s", LazyJson({'event_type': 'memory_summary', **memory_monitor.stop()}))
+        trace.error = f"{type(e).__name__}: {error_msg}"
+        export_trace(get_tracer().end_trace(trace))
+        if isinstance(e, RetryableInvocationError):
+            # 呼び出しを失敗させてLambdaの再試行に委ねる
+            raise
         
         return {
             'statusCode': 500,
@@ -3,14 +3,52 @@
 Markitdown統合でのエラー処理とフォールバック戦略
 """
 
+import concurrent.futures
 import logging
+import threading
 import time
 from typing import Dict, Any, Tuple, Optional, Callable
 from datetime import datetime
 from enum import Enum
 
+from memory_monitor import read_rss_bytes
+
 logger = logging.getLogger(__name__)
 
+# 期限付き実行用のワーカースレッド（ウォーム起動間で再利用）
+_timeout_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_timeout_executor_lock = threading.Lock()
+
+
+def _get_timeout_executor(max_workers: int) -> concurrent.futures.ThreadPoolExecutor:
+    """
+    期限付き実行用のスレッドプールを取得
+
+    Args:
+        max_workers: ワーカースレッド数（作成時のみ使用）
+    """
+    global _timeout_executor
+    with _timeout_executor_lock:
+        if _timeout_executor is None:
+            _timeout_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix='conversion'
+            )
+        return _timeout_executor
+
+
+def _retire_timeout_executor(executor: concurrent.futures.ThreadPoolExecutor) -> None:
+    """
+    停止できないスレッドを抱えたスレッドプールを以降の実行に使用しない
+
+    実行中のスレッドは中断できないため、期限切れの処理が終わるまでワーカーを占有し続ける。
+    新しいプールに切り替え、後続の段階が空きワーカーを待たないようにする（古いプールは処理の終了後に破棄）。
+    """
+    global _timeout_executor
+    with _timeout_executor_lock:
+        if _timeout_executor is executor:
+            _timeout_executor = None
+    executor.shutdown(wait=False)
+
 class ErrorType(Enum):
     """エラータイプの定義"""
     CONVERSION_FAILED = "CONVERSION_FAILED"
@@ -68,6 +106,8 @@ class FallbackHandler:
         self.retry_attempts = self.fallback_config.get('retryAttempts', 2)
         self.retry_delay_ms = self.fallback_config.get('retryDelayMs', 1000)
         self.use_langchain_on_failure = self.fallback_config.get('useLangChainOnFailure', True)
+        # 並行処理する文書数 × 比較モードで同時に実行する処理方法数（markitdown / langchain）
+        self.max_workers = 2 * max(1, int(config.get('performance', {}).get('maxConcurrentProcesses', 2)))
     
     def execute_with_fallback(self, 
                             primary_func: Callable,
@@ -75,7 +115,8 @@ class FallbackHandler:
                             file_content: bytes,
                             file_format: str,
                             file_name: str,
-                            timeout_seconds: Optional[int] = None) -> Tuple[bool, str, Dict]:
+                            timeout_seconds: Optional[int] = None,
+                            deadline: Optional[Any] = None) -> Tuple[bool, str, Dict]:
         """
         フォールバック機能付きで処理を実行
         
@@ -85,7 +126,8 @@ class FallbackHandler:
             file_content: ファイル内容
             file_format: ファイル形式
             file_name: ファイル名
-            timeout_seconds: タイムアウト時間
+            timeout_seconds: 1処理方法あたりのタイムアウト時間
+            deadline: 呼び出し全体の実行期限（Deadline）
         
         Returns:
             (成功フラグ, 変換結果, メタデータ)
@@ -95,7 +137,7 @@ class FallbackHandler:
         
         # 主要処理の実行
         success, content, metadata = self._execute_with_retry(
-            primary_func, file_content, file_name, timeout_seconds
+            primary_func, file_content, file_name, timeout_seconds, deadline
         )
         attempts.append(metadata)
         
@@ -105,16 +147,19 @@ class FallbackHandler:
         
         # フォールバック処理の実行
         if fallback_func and self.use_langchain_on_failure:
-            logger.info(f"フォールバック処理を開始: {file_name}")
-            
-            success, content, fallback_metadata = self._execute_with_retry(
-                fallback_func, file_content, file_name, timeout_seconds
-            )
-            attempts.append(fallback_metadata)
-            
-            if success:
-                logger.info(f"フォールバック処理が成功: {file_name}")
-                return True, content, self._create_final_metadata(attempts, fallback_metadata['method'], start_time)
+            if deadline is not None and deadline.expired():
+                logger.warning(f"実行期限切れのためフォールバック処理をスキップ: {file_name}")
+            else:
+                logger.info(f"フォールバック処理を開始: {file_name}")
+                
+                success, content, fallback_metadata = self._execute_with_retry(
+                    fallback_func, file_content, file_name, timeout_seconds, deadline
+                )
+                attempts.append(fallback_metadata)
+                
+                if success:
+                    logger.info(f"フォールバック処理が成功: {file_name}")
+                    return True, content, self._create_final_metadata(attempts, fallback_metadata['method'], start_time)
         
         # すべての処理が失敗
         logger.error(f"すべての処理が失敗: {file_name}")
@@ -124,24 +169,45 @@ class FallbackHandler:
                           func: Callable,
                           file_content: bytes,
                           file_name: str,
-                          timeout_seconds: Optional[int] = None) -> Tuple[bool, str, Dict]:
-        """リトライ機能付きで処理を実行"""
+                          timeout_seconds: Optional[int] = None,
+                          deadline: Optional[Any] = None) -> Tuple[bool, str, Dict]:
+        """リトライ機能付きで処理を実行（残り時間で完了できない試行は行わない）"""
+        
+        stage_deadline = self._stage_deadline(timeout_seconds, deadline)
+        last_duration = 0.0
         
         for attempt in range(self.retry_attempts + 1):
+            # 2回目以降は前回の所要時間と待機時間が残り時間に収まる場合のみ試行
+            if attempt > 0 and stage_deadline is not None:
+                required = last_duration + self.retry_delay_ms / 1000.0
+                if not stage_deadline.can_afford(required):
+                    logger.warning(f"残り時間不足のためリトライを中止: {file_name} "
+                                   f"(必要: {required:.2f}秒, 残り: {stage_deadline.remaining():.2f}秒)")
+                    return False, "", {
+                        'method': getattr(func, '__name__', 'unknown'),
+                        'success': False,
+                        'error': '実行期限内にリトライを完了できません',
+                        'error_type': ErrorType.TIMEOUT_ERROR.value,
+                        'attempts': attempt
+                    }
+            
+            attempt_start = time.monotonic()
             try:
-                if timeout_seconds:
-                    # タイムアウト付き実行
-                    return self._execute_with_timeout(func, file_content, file_name, timeout_seconds)
+                if stage_deadline is not None:
+                    # 期限付き実行
+                    return self._execute_with_timeout(func, file_content, file_name, stage_deadline)
                 else:
                     # 通常実行
                     return func(file_content, file_name)
                     
             except ProcessingError as e:
+                last_duration = time.monotonic() - attempt_start
                 logger.warning(f"処理エラー (試行 {attempt + 1}/{self.retry_attempts + 1}): {e.message}")
                 
                 # リトライ不可能なエラーの場合は即座に失敗
                 if e.error_type in [ErrorType.FILE_TOO_LARGE, ErrorType.UNSUPPORTED_FORMAT, 
-                                  ErrorType.SECURITY_VIOLATION, ErrorType.INVALID_FILE_CONTENT]:
+                                  ErrorType.SECURITY_VIOLATION, ErrorType.INVALID_FILE_CONTENT,
+                                  ErrorType.PROCESSING_INTERRUPTED]:
                     return False, "", {
                         'method': getattr(func, '__name__', 'unknown'),
                         'success': False,
@@ -151,8 +217,7 @@ class FallbackHandler:
                     }
                 
                 # 最後の試行でない場合はリトライ
-                if attempt < self.retry_attempts:
-                    time.sleep(self.retry_delay_ms / 1000.0)
+                if attempt < self.retry_attempts and self._wait_before_retry(stage_deadline):
                     continue
                 else:
                     return False, "", {
@@ -164,11 +229,11 @@ class FallbackHandler:
                     }
                     
             except Exception as e:
+                last_duration = time.monotonic() - attempt_start
                 logger.error(f"予期しないエラー (試行 {attempt + 1}/{self.retry_attempts + 1}): {e}")
                 
                 # 最後の試行でない場合はリトライ
-                if attempt < self.retry_attempts:
-                    time.sleep(self.retry_delay_ms / 1000.0)
+                if attempt < self.retry_attempts and self._wait_before_retry(stage_deadline):
                     continue
                 else:
                     return False, "", {
@@ -187,27 +252,68 @@ class FallbackHandler:
             'error_type': 'RETRY_EXCEEDED'
         }
     
+    def _stage_deadline(self, timeout_seconds: Optional[int], deadline: Optional[Any]) -> Optional[Any]:
+        """処理方法ごとの期限を作成（呼び出し全体の期限とタイムアウトの早い方）"""
+        if deadline is not None:
+            return deadline.child(timeout_seconds)
+        if timeout_seconds:
+            from deadline import Deadline
+            return Deadline(timeout_seconds * 1000)
+        return None
+    
+    def _wait_before_retry(self, stage_deadline: Optional[Any]) -> bool:
+        """リトライ前の待機（期限・キャンセルで中断した場合はFalse）"""
+        delay = self.retry_delay_ms / 1000.0
+        if stage_deadline is None:
+            time.sleep(delay)
+            return True
+        return stage_deadline.wait(delay)
+    
     def _execute_with_timeout(self, 
                             func: Callable,
                             file_content: bytes,
                             file_name: str,
-                            timeout_seconds: int) -> Tuple[bool, str, Dict]:
-        """タイムアウト付きで処理を実行"""
-        import signal
+                            stage_deadline: Any) -> Tuple[bool, str, Dict]:
+        """
+        期限付きで処理を実行
         
-        def timeout_handler(signum, frame):
-            raise TimeoutError(f"処理がタイムアウトしました: {timeout_seconds}秒", timeout_seconds)
+        SIGALRMはメインスレッドでしか使えず並列処理と併用できないため、
+        ワーカースレッドで実行して期限まで待機する。空きワーカーの待ち時間は段階の処理時間に含めず、
+        処理の開始時点から期限を計る（待機は呼び出し全体の期限まで）。期限を超えた場合は
+        期限オブジェクトをキャンセルし、協調キャンセルに対応した処理を停止させる。
+        停止しないスレッドはワーカーを占有し続けるため、そのスレッドプールは以降の実行に使用しない。
+        """
+        stage_deadline.check(getattr(func, '__name__', 'conversion'))
+        
+        started = threading.Event()
         
-        # タイムアウトハンドラーを設定
-        old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(timeout_seconds)
+        def run():
+            started.set()
+            return func(file_content, file_name)
         
+        queued_at = time.monotonic()
+        executor = _get_timeout_executor(self.max_workers)
+        future = executor.submit(run)
+        queue_limit = (stage_deadline.parent or stage_deadline).remaining()
+        if not started.wait(queue_limit) and future.cancel():
+            stage_deadline.cancel('timeout')
+            raise TimeoutError(
+                f"空き変換スレッドの待機がタイムアウトしました: {queue_limit:.1f}秒 ({file_name})",
+                round(queue_limit, 3)
+            )
+        stage_deadline.extend(time.monotonic() - queued_at)
+        
+        budget_seconds = stage_deadline.remaining()
         try:
-            result = func(file_content, file_name)
-            signal.alarm(0)  # タイマーをクリア
-            return result
-        finally:
-            signal.signal(signal.SIGALRM, old_handler)  # 元のハンドラーを復元
+            return future.result(timeout=budget_seconds)
+        except concurrent.futures.TimeoutError:
+            stage_deadline.cancel('timeout')
+            if not future.done():
+                _retire_timeout_executor(executor)
+            raise TimeoutError(
+                f"処理がタイムアウトしました: {budget_seconds:.1f}秒 ({file_name})",
+                round(budget_seconds, 3)
+            )
     
     def _create_final_metadata(self, 
                              attempts: list,
@@ -253,25 +359,21 @@ class ResourceMonitor:
         logger.debug(f"ファイルサイズ検証OK: {file_name} ({file_size} bytes)")
     
     def validate_memory_usage(self) -> None:
-        """メモリ使用量の検証"""
-        try:
-            import psutil
-            process = psutil.Process()
-            memory_mb = process.memory_info().rss / 1024 / 1024
-            
-            if memory_mb > self.max_memory_mb:
-                raise ProcessingError(
-                    ErrorType.MEMORY_LIMIT_EXCEEDED,
-                    f"メモリ使用量が制限を超過: {memory_mb:.1f}MB > {self.max_memory_mb}MB",
-                    {'current_memory_mb': memory_mb, 'limit_mb': self.max_memory_mb}
-                )
-            
-            logger.debug(f"メモリ使用量OK: {memory_mb:.1f}MB / {self.max_memory_mb}MB")
-            
-        except ImportError:
-            logger.warning("psutilが利用できないため、メモリ監視をスキップします")
-        except Exception as e:
-            logger.warning(f"メモリ監視エラー: {e}")
+        """メモリ使用量の検証（処理中の継続的な計測は memory_monitor.MemoryMonitor を参照）"""
+        memory_bytes = read_rss_bytes()
+        if memory_bytes is None:
+            logger.warning("RSSを取得できないため、メモリ監視をスキップします")
+            return
+        memory_mb = memory_bytes / 1024 / 1024
+        
+        if memory_mb > self.max_memory_mb:
+            raise ProcessingError(
+                ErrorType.MEMORY_LIMIT_EXCEEDED,
+                f"メモリ使用量が制限を超過: {memory_mb:.1f}MB > {self.max_memory_mb}MB",
+                {'current_memory_mb': memory_mb, 'limit_mb': self.max_memory_mb}
+            )
+        
+        logger.debug(f"メモリ使用量OK: {memory_mb:.1f}MB / {self.max_memory_mb}MB")
     
     def validate_file_content(self, file_content: bytes, file_name: str, file_format: str) -> None:
         """ファイル内容の基本検証"""
@@ -0,0 +1,712 @@
+"""
+Bedrock Runtimeの決定的なフェイク実装
+開発環境・オフライン検証用に、埋め込み（Titan v1/v2・Cohere）と生成（Nova・Claude・Titan Text）に応答する。
+同じテキスト・シードには同じベクトルを返し、語彙を共有するテキストほどコサイン類似度が高くなる。
+遅延・スロットリング・エラーコードはモデルごとに注入でき、リトライ・レート制限・スループットの検証に使用できる。
+
+利用方法:
+    - FakeBedrockRuntime: boto3の bedrock-runtime クライアント互換（invoke_model / invoke_model_with_response_stream）
+    - FakeBedrockRuntime.register(session): botocoreセッションに登録し、以降に作成したクライアントの呼び出しに応答
+    - FakeBedrockServer: ローカルHTTPサーバー（endpoint_url に指定して実際のboto3クライアントから呼び出し）
+"""
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import math
+import re
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass, asdict, field
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
+from urllib.parse import unquote
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from bedrock_rate_limiter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 埋め込みモデルごとの既定の次元数
+EMBEDDING_DIMENSIONS = {
+    'amazon.titan-embed-text-v1': 1536,
+    'amazon.titan-embed-text-v2:0': 1024,
+    'cohere.embed-english-v3': 1024,
+    'cohere.embed-multilingual-v3': 1024
+}
+DEFAULT_EMBEDDING_DIMENSION = 1536
+# Titan Text Embeddings V2 で指定できる次元数
+TITAN_V2_DIMENSIONS = (256, 512, 1024)
+# Cohere Embed の1リクエストあたりのテキスト数上限
+COHERE_MAX_TEXTS = 96
+# 埋め込みの入力文字数上限（Titanの8,192トークン相当）
+MAX_EMBEDDING_INPUT_CHARS = 50000
+
+# 生成モデルの既定の応答（プロンプトの先頭の参考文書を引用する）
+CANNED_ANSWER = 'ローカル応答: 参考文書に基づく回答です。'
+
+# エラーコード → HTTPステータス
+ERROR_STATUS_CODES = {
+    'ThrottlingException': 429,
+    'ModelNotReadyException': 429,
+    'ServiceQuotaExceededException': 429,
+    'ModelTimeoutException': 408,
+    'ServiceUnavailableException': 503,
+    'InternalServerException': 500,
+    'ModelErrorException': 424,
+    'ValidationException': 400,
+    'AccessDeniedException': 403,
+    'ResourceNotFoundException': 404
+}
+
+# 1つの特徴量を割り当てる次元数（衝突の影響を分散）
+FEATURE_SPREAD = 4
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+')
+_STOPWORDS = frozenset((
+    'a', 'an', 'the', 'is', 'are', 'was', 'be', 'of', 'to', 'in', 'on', 'for', 'and', 'or', 'what', 'how',
+    'with', 'this', 'that', 'it', 'as', 'by', 'at', 'from'
+))
+
+
+@dataclass
+class FaultProfile:
+    """モデルの応答特性"""
+    latency_ms: float = 0.0  # 遅延（生成は最初のトークンまで）の中央値（ミリ秒）
+    sigma: float = 0.25  # 遅延の対数正規分布の広がり
+    throttle_rate: float = 0.0  # ThrottlingException の発生率（0〜1）
+    error_rate: float = 0.0  # error_codes のエラーの発生率（0〜1）
+    error_codes: Tuple[str, ...] = ('ServiceUnavailableException',)
+    tokens_per_second: float = 0.0  # ストリーミングの出力速度（0で待機なし）
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書形式に変換"""
+        return asdict(self)
+
+
+@dataclass
+class ModelStats:
+    """モデルごとの呼び出し統計"""
+    calls: int = 0
+    throttled: int = 0
+    errors: Dict[str, int] = field(default_factory=dict)
+    input_tokens: int = 0
+    output_tokens: int = 0
+    injected_latency_ms: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書形式に変換"""
+        return dict(asdict(self), injected_latency_ms=round(self.injected_latency_ms, 3))
+
+
+class FakeBedrockError(Exception):
+    """フェイクが返すBedrockのエラー（コードとHTTPステータス）"""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+        self.status_code = ERROR_STATUS_CODES.get(code, 400)
+
+    def to_client_error(self, operation_name: str) -> ClientError:
+        """botocoreの ClientError に変換"""
+        return ClientError({
+            'Error': {'Code': self.code, 'Message': self.message},
+            'ResponseMetadata': {'HTTPStatusCode': self.status_code,
+                                 'HTTPHeaders': {'x-amzn-errortype': self.code}, 'RetryAttempts': 0}
+        }, operation_name)
+
+
+def is_embedding_model(model_id: str) -> bool:
+    """埋め込みモデルか判定"""
+    return 'embed' in model_id
+
+
+def embedding_dimension(model_id: str) -> int:
+    """埋め込みモデルの既定の次元数"""
+    return EMBEDDING_DIMENSIONS.get(model_id, DEFAULT_EMBEDDING_DIMENSION)
+
+
+def text_features(text: str) -> Dict[str, float]:
+    """
+    テキストの特徴量（英数字は単語、日本語は文字バイグラム）と重み（1 + log 出現回数）
+
+    Args:
+        text: 入力テキスト
+
+    Returns:
+        Dict[str, float]: 特徴量 → 重み
+    """
+    counts: Dict[str, int] = {}
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token.isascii():
+            if token in _STOPWORDS:
+                continue
+            # 簡易的な語幹処理（複数形）
+            features = [token[:-1] if len(token) > 3 and token.endswith('s') else token]
+        else:
+            features = [token[i:i + 2] for i in range(len(token) - 1)] or [token]
+        for feature in features:
+            counts[feature] = counts.get(feature, 0) + 1
+    return {feature: 1.0 + math.log(count) for feature, count in counts.items()}
+
+
+@lru_cache(maxsize=4096)
+def _embedding(text: str, dimension: int, seed: int) -> Tuple[float, ...]:
+    weights: Dict[int, float] = {}
+    # 特徴量がないテキスト（記号のみ等）はテキスト全体を1つの特徴量とする
+    features = text_features(text) or {f"\0{text}": 1.0}
+    for feature, weight in features.items():
+        digest = hashlib.blake2b(f"{seed}:{feature}".encode('utf-8'), digest_size=4 * FEATURE_SPREAD).digest()
+        for (value,) in struct.iter_unpack('>I', digest):
+            index = value % dimension
+            weights[index] = weights.get(index, 0.0) + (weight if value >> 31 else -weight)
+    norm = math.sqrt(sum(value * value for value in weights.values())) or 1.0
+    vector = [0.0] * dimension
+    for index, value in weights.items():
+        vector[index] = value / norm
+    return tuple(vector)
+
+
+def semantic_embedding(text: str, dimension: int = DEFAULT_EMBEDDING_DIMENSION, seed: int = 0) -> List[float]:
+    """
+    特徴量ハッシュによる決定的な単位ベクトル（語彙を共有するテキストほど類似度が高い）
+
+    Args:
+        text: 入力テキスト
+        dimension: 次元数
+        seed: シード（異なるシードは異なる埋め込み空間）
+
+    Returns:
+        List[float]: 埋め込みベクトル
+    """
+    return list(_embedding(text, dimension, seed))
+
+
+def canned_answer(prompt: str) -> str:
+    """生成モデルの決定的な応答"""
+    for line in prompt.splitlines():
+        line = line.strip()
+        if line.startswith('内容:'):
+            return f"{CANNED_ANSWER} {line[len('内容:'):].strip()[:80]}"
+    return CANNED_ANSWER
+
+
+class _EventStream:
+    """invoke_model_with_response_stream の body（イベントの反復とclose）"""
+
+    def __init__(self, events: Iterator[Dict[str, Any]]):
+        self._events = events
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self._events
+
+    def close(self) -> None:
+        self._events = iter(())
+
+
+class FakeBedrockRuntime:
+    """Bedrock Runtimeのフェイク（boto3の bedrock-runtime クライアント互換）"""
+
+    def __init__(self, profiles: Optional[Dict[str, FaultProfile]] = None, seed: int = 0,
+                 region_name: str = 'us-east-1', responses: Optional[Dict[str, str]] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        初期化
+
+        Args:
+            profiles: モデルID（前方一致、'*' は全モデル）→ 応答特性
+            seed: 埋め込み・遅延・エラー注入のシード
+            region_name: リージョン（meta.region_name）
+            responses: プロンプトに含まれるキーワード → 生成の応答
+            sleep: 遅延の待機関数（テストでは記録用の関数に置き換え可能）
+        """
+        self.profiles = dict(profiles or {})
+        self.seed = seed
+        self.responses = dict(responses or {})
+        self.sleep = sleep
+        self.meta = SimpleNamespace(region_name=region_name, service_model=SimpleNamespace(service_name='bedrock-runtime'))
+        self.stats: Dict[str, ModelStats] = {}
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def profile(self, model_id: str) -> FaultProfile:
+        """モデルの応答特性（完全一致 → 最長の前方一致 → '*'）"""
+        if model_id in self.profiles:
+            return self.profiles[model_id]
+        prefixes = [key for key in self.profiles if key != '*' and model_id.startswith(key)]
+        if prefixes:
+            return self.profiles[max(prefixes, key=len)]
+        return self.profiles.get('*') or FaultProfile()
+
+    def _draw(self, model_id: str, body: bytes) -> Tuple[float, float, float, float]:
+        """リクエストごとの一様乱数（同じリクエストの再試行は試行回数ごとに異なる値）"""
+        base = hashlib.sha256(f"{self.seed}:{model_id}:".encode('utf-8') + body).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(base, 0)
+            self._attempts[base] = attempt + 1
+        digest = hashlib.sha256(f"{base}:{attempt}".encode('utf-8')).digest()
+        return tuple((int.from_bytes(digest[i * 8:(i + 1) * 8], 'big') + 1) / (2 ** 64 + 2) for i in range(4))
+
+    def _model_stats(self, model_id: str) -> ModelStats:
+        return self.stats.setdefault(model_id, ModelStats())
+
+    def inject(self, model_id: str, body: bytes) -> None:
+        """
+        遅延を注入し、スロットリング・エラーを発生させる
+
+        Raises:
+            FakeBedrockError: スロットリングまたは注入したエラー
+        """
+        profile = self.profile(model_id)
+        fault_draw, u1, u2, code_draw = self._draw(model_id, body)
+        error = None
+        if fault_draw < profile.throttle_rate:
+            error = FakeBedrockError('ThrottlingException', 'Too many requests, please wait before trying again.')
+        elif fault_draw < profile.throttle_rate + profile.error_rate and profile.error_codes:
+            code = profile.error_codes[int(code_draw * len(profile.error_codes)) % len(profile.error_codes)]
+            error = FakeBedrockError(code, 'Injected error')
+        delay_ms = 0.0
+        if profile.latency_ms > 0:
+            # Box-Muller変換による対数正規分布（エラー応答は遅延の1/4）
+            z = math.sqrt(-2 * math.log(u1)) * math.cos(2 * math.pi * u2)
+            delay_ms = profile.latency_ms * math.exp(profile.sigma * z) * (0.25 if error else 1.0)
+        with self._lock:
+            stats = self._model_stats(model_id)
+            stats.calls += 1
+            stats.injected_latency_ms += delay_ms
+            if error and error.code == 'ThrottlingException':
+                stats.throttled += 1
+            elif error:
+                stats.errors[error.code] = stats.errors.get(error.code, 0) + 1
+        if delay_ms > 0:
+            self.sleep(delay_ms / 1000)
+        if error:
+            raise error
+
+    def respond(self, model_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        モデルのリクエスト形式に応じた応答本文を作成（遅延・エラー注入なし）
+
+        Args:
+            model_id: モデルID
+            request: リクエスト本文
+
+        Returns:
+            Dict: 応答本文
+
+        Raises:
+            FakeBedrockError: リクエストが無効な場合（ValidationException）
+        """
+        if model_id.startswith('amazon.titan-embed'):
+            response = self._titan_embedding(model_id, request)
+            tokens = (response['inputTextTokenCount'], 0)
+        elif model_id.startswith('cohere.embed'):
+            response = self._cohere_embedding(model_id, request)
+            tokens = (sum(estimate_tokens(text) for text in request['texts']), 0)
+        else:
+            response, tokens = self._generate(model_id, request)
+        with self._lock:
+            stats = self._model_stats(model_id)
+            stats.input_tokens += tokens[0]
+            stats.output_tokens += tokens[1]
+        return response
+
+    def _titan_embedding(self, model_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Titan Text Embeddings（v1 / v2）の応答"""
+        text = request.get('inputText')
+        if not isinstance(text, str) or not text:
+            raise FakeBedrockError('ValidationException', 'Malformed input request: inputText is required')
+        if len(text) > MAX_EMBEDDING_INPUT_CHARS:
+            raise FakeBedrockError('ValidationException', 'Too many input tokens.')
+        dimension = embedding_dimension(model_id)
+        if model_id.startswith('amazon.titan-embed-text-v2'):
+            dimension = request.get('dimensions', dimension)
+            if dimension not in TITAN_V2_DIMENSIONS:
+                raise FakeBedrockError('ValidationException', f"dimensions must be one of {TITAN_V2_DIMENSIONS}")
+        embedding = semantic_embedding(text, dimension, self.seed)
+        if request.get('normalize') is False:
+            # 正規化しない場合は長さに応じた大きさのベクトル
+            scale = math.sqrt(len(text))
+            embedding = [value * scale for value in embedding]
+        response = {'embedding': embedding, 'inputTextTokenCount': estimate_tokens(text)}
+        if model_id.startswith('amazon.titan-embed-text-v2'):
+            response['embeddingsByType'] = {'float': embedding}
+        return response
+
+    def _cohere_embedding(self, model_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Cohere Embed の応答"""
+        texts = request.get('texts')
+        if not isinstance(texts, list) or not texts:
+            raise FakeBedrockError('ValidationException', 'Malformed input request: texts is required')
+        if len(texts) > COHERE_MAX_TEXTS:
+            raise FakeBedrockError('ValidationException', f"texts must contain at most {COHERE_MAX_TEXTS} items")
+        if not request.get('input_type'):
+            raise FakeBedrockError('ValidationException', 'Malformed input request: input_type is required')
+        embeddings = [semantic_embedding(text, embedding_dimension(model_id), self.seed) for text in texts]
+        response_id = hashlib.sha256(json.dumps(texts, ensure_ascii=False).encode('utf-8')).hexdigest()[:32]
+        if request.get('embedding_types'):
+            return {'id': response_id, 'texts': texts, 'embeddings': {'float': embeddings},
+                    'response_type': 'embeddings_by_type'}
+        return {'id': response_id, 'texts': texts, 'embeddings': embeddings, 'response_type': 'embeddings_floats'}
+
+    def _answer(self, prompt: str, max_tokens: int) -> Tuple[str, str]:
+        """生成の応答テキストと停止理由"""
+        answer = next((text for keyword, text in self.responses.items() if keyword in prompt), None)
+        answer = answer or canned_answer(prompt)
+        if estimate_tokens(answer) > max_tokens:
+            while answer and estimate_tokens(answer) > max_tokens:
+                answer = answer[:-1]
+            return answer, 'max_tokens'
+        return answer, 'end_turn'
+
+    def _generate(self, model_id: str, request: Dict[str, Any]) -> Tuple[Dict[str, Any], Tuple[int, int]]:
+        """生成モデル（Nova / Claude / Titan Text）の応答と入出力トークン数"""
+        if model_id.startswith('amazon.nova') or model_id.startswith('anthropic.claude'):
+            messages = request.get('messages')
+            if not isinstance(messages, list) or not messages:
+                raise FakeBedrockError('ValidationException', 'Malformed input request: messages is required')
+            content = messages[-1].get('content', '')
+            prompt = content if isinstance(content, str) else ' '.join(part.get('text', '') for part in content)
+        elif model_id.startswith('amazon.titan-text'):
+            prompt = request.get('inputText', '')
+            if not prompt:
+                raise FakeBedrockError('ValidationException', 'Malformed input request: inputText is required')
+        else:
+            raise FakeBedrockError('ValidationException', 'The provided model identifier is invalid.')
+
+        input_tokens = estimate_tokens(prompt)
+        if model_id.startswith('amazon.nova'):
+            answer, stop = self._answer(prompt, request.get('inferenceConfig', {}).get('max_new_tokens', 5000))
+            output_tokens = estimate_tokens(answer)
+            return {'output': {'message': {'role': 'assistant', 'content': [{'text': answer}]}},
+                    'stopReason': stop,
+                    'usage': {'inputTokens': input_tokens, 'outputTokens': output_tokens,
+                              'totalTokens': input_tokens + output_tokens}}, (input_tokens, output_tokens)
+        if model_id.startswith('anthropic.claude'):
+            if not request.get('max_tokens'):
+                raise FakeBedrockError('ValidationException', 'Malformed input request: max_tokens is required')
+            answer, stop = self._answer(prompt, request['max_tokens'])
+            output_tokens = estimate_tokens(answer)
+            return {'id': f"msg_{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:24]}", 'type': 'message',
+                    'role': 'assistant', 'model': model_id, 'content': [{'type': 'text', 'text': answer}],
+                    'stop_reason': stop, 'stop_sequence': None,
+                    'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens}}, (input_tokens, output_tokens)
+        answer, stop = self._answer(prompt, request.get('textGenerationConfig', {}).get('maxTokenCount', 512))
+        output_tokens = estimate_tokens(answer)
+        return {'outputText': answer, 'inputTextTokenCount': input_tokens,
+                'results': [{'outputText': answer, 'tokenCount': output_tokens,
+                             'completionReason': 'LENGTH' if stop == 'max_tokens' else 'FINISH'}]}, \
+            (input_tokens, output_tokens)
+
+    @staticmethod
+    def _parse_body(body: Any) -> Tuple[bytes, Dict[str, Any]]:
+        """リクエスト本文（bytes / str / ファイル）を解析"""
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        try:
+            return body or b'', json.loads(body or b'{}')
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise FakeBedrockError('ValidationException', 'Malformed input request, please reformat your input and try again.')
+
+    def invoke(self, model_id: str, body: Any) -> Dict[str, Any]:
+        """
+        遅延・エラーを注入して応答本文を作成（HTTPサーバー・botocoreイベントから共通で使用）
+
+        Raises:
+            FakeBedrockError: スロットリング・注入したエラー・無効なリクエスト
+        """
+        raw, request = self._parse_body(body)
+        self.inject(model_id, raw)
+        return self.respond(model_id, request)
+
+    def invoke_model(self, modelId: str = None, body: Any = None, contentType: str = 'application/json',
+                     accept: str = 'application/json', **kwargs) -> Dict[str, Any]:
+        """boto3の invoke_model 互換"""
+        if not modelId or body is None:
+            raise FakeBedrockError('ValidationException', 'modelId and body are required').to_client_error('InvokeModel')
+        start = time.time()
+        try:
+            response = self.invoke(modelId, body)
+        except FakeBedrockError as e:
+            raise e.to_client_error('InvokeModel')
+        payload = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        return {
+            'body': StreamingBody(io.BytesIO(payload), len(payload)),
+            'contentType': 'application/json',
+            'ResponseMetadata': {
+                'RequestId': hashlib.sha256(payload).hexdigest()[:36],
+                'HTTPStatusCode': 200,
+                'HTTPHeaders': {'x-amzn-bedrock-invocation-latency': str(int((time.time() - start) * 1000))},
+                'RetryAttempts': 0
+            }
+        }
+
+    def stream_events(self, model_id: str, body: Any) -> Iterator[Dict[str, Any]]:
+        """
+        ストリーミング生成のイベント（モデル別の形式、tokens_per_second に応じて間隔を空ける）
+
+        Raises:
+            FakeBedrockError: スロットリング・注入したエラー・無効なリクエスト
+        """
+        if is_embedding_model(model_id):
+            raise FakeBedrockError('ValidationException', 'The model does not support streaming.')
+        response = self.invoke(model_id, body)
+        return self._stream(model_id, response, self.profile(model_id).tokens_per_second)
+
+    def _stream(self, model_id: str, response: Dict[str, Any], tokens_per_second: float) -> Iterator[Dict[str, Any]]:
+        if model_id.startswith('amazon.nova'):
+            answer = response['output']['message']['content'][0]['text']
+            usage = response['usage']
+        elif model_id.startswith('anthropic.claude'):
+            answer = response['content'][0]['text']
+            usage = response['usage']
+        else:
+            answer = response['outputText']
+            usage = {}
+        pieces = re.findall(r'\S+\s*|\s+', answer) if answer.isascii() else [answer[i:i + 4] for i in range(0, len(answer), 4)]
+
+        def paced(piece: str) -> str:
+            if tokens_per_second > 0:
+                self.sleep(estimate_tokens(piece) / tokens_per_second)
+            return piece
+
+        if model_id.startswith('amazon.nova'):
+            yield {'messageStart': {'role': 'assistant'}}
+            for piece in pieces:
+                yield {'contentBlockDelta': {'delta': {'text': paced(piece)}, 'contentBlockIndex': 0}}
+            yield {'contentBlockStop': {'contentBlockIndex': 0}}
+            yield {'messageStop': {'stopReason': response['stopReason']}}
+            yield {'metadata': {'usage': usage}}
+        elif model_id.startswith('anthropic.claude'):
+            yield {'type': 'message_start', 'message': dict(response, content=[], stop_reason=None,
+                                                            usage={'input_tokens': usage['input_tokens'], 'output_tokens': 0})}
+            yield {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}
+            for piece in pieces:
+                yield {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': paced(piece)}}
+            yield {'type': 'content_block_stop', 'index': 0}
+            yield {'type': 'message_delta', 'delta': {'stop_reason': response['stop_reason'], 'stop_sequence': None},
+                   'usage': {'output_tokens': usage['output_tokens']}}
+            yield {'type': 'message_stop'}
+        else:
+            for i, piece in enumerate(pieces):
+                yield {'outputText': paced(piece), 'index': 0,
+                       'completionReason': 'FINISH' if i == len(pieces) - 1 else None}
+
+    def invoke_model_with_response_stream(self, modelId: str = None, body: Any = None, **kwargs) -> Dict[str, Any]:
+        """boto3の invoke_model_with_response_stream 互換（body はチャンクのイベントストリーム）"""
+        try:
+            events = self.stream_events(modelId or '', body)
+        except FakeBedrockError as e:
+            raise e.to_client_error('InvokeModelWithResponseStream')
+        chunks = ({'chunk': {'bytes': json.dumps(event, ensure_ascii=False).encode('utf-8')}} for event in events)
+        return {
+            'body': _EventStream(chunks),
+            'contentType': 'application/json',
+            'ResponseMetadata': {'HTTPStatusCode': 200, 'RetryAttempts': 0}
+        }
+
+    def register(self, session: Any) -> Callable[..., Any]:
+        """
+        botocoreセッションの before-call イベントに登録し、以降に作成したクライアントの invoke_model に応答
+
+        Args:
+            session: botocore.session.Session（boto3.DEFAULT_SESSION._session 等）
+
+        Returns:
+            Callable: 登録したハンドラー（unregister に使用）
+        """
+        def before_call(event_name: str, params: Dict[str, Any], **kwargs):
+            url_path = params.get('url_path', '')
+            if not event_name.endswith('.InvokeModel') or not url_path.startswith('/model/'):
+                return None
+            return self.short_circuit(unquote(url_path.split('/')[2]), params.get('body'))
+
+        session.register('before-call.bedrock-runtime.InvokeModel', before_call)
+        return before_call
+
+    def short_circuit(self, model_id: str, body: Any) -> Tuple[Any, Dict[str, Any]]:
+        """before-call で返す応答（HTTP応答と解析済みの結果）"""
+        try:
+            response = self.invoke(model_id, body)
+        except FakeBedrockError as e:
+            return SimpleNamespace(status_code=e.status_code, headers={}, content=b''), {
+                'Error': {'Code': e.code, 'Message': e.message},
+                'ResponseMetadata': {'HTTPStatusCode': e.status_code}
+            }
+        payload = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        return SimpleNamespace(status_code=200, headers={}, content=b''), {
+            'body': StreamingBody(io.BytesIO(payload), len(payload)),
+            'contentType': 'application/json',
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {}
+            self._attempts = {}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """モデルごとの呼び出し統計"""
+        with self._lock:
+            return {model_id: stats.to_dict() for model_id, stats in sorted(self.stats.items())}
+
+
+def encode_event_message(headers: Dict[str, str], payload: bytes) -> bytes:
+    """
+    AWSイベントストリーム形式のメッセージを作成（文字列ヘッダーのみ）
+
+    Args:
+        headers: ヘッダー（:event-type 等）
+        payload: ペイロード
+
+    Returns:
+        bytes: プレリュード・ヘッダー・ペイロード・CRCを含むメッセージ
+    """
+    encoded_headers = b''
+    for name, value in headers.items():
+        name_bytes, value_bytes = name.encode('utf-8'), value.encode('utf-8')
+        encoded_headers += struct.pack('>B', len(name_bytes)) + name_bytes + struct.pack('>BH', 7, len(value_bytes)) + value_bytes
+    total_length = 12 + len(encoded_headers) + len(payload) + 4
+    prelude = struct.pack('>II', total_length, len(encoded_headers))
+    message = prelude + struct.pack('>I', zlib.crc32(prelude)) + encoded_headers + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+class FakeBedrockServer:
+    """FakeBedrockRuntimeをHTTPで提供するローカルサーバー（boto3の endpoint_url に指定）"""
+
+    def __init__(self, runtime: Optional[FakeBedrockRuntime] = None, host: str = '127.0.0.1', port: int = 0):
+        """
+        初期化
+
+        Args:
+            runtime: 応答するフェイク（省略時は既定の設定）
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0で空きポート）
+        """
+        self.runtime = runtime or FakeBedrockRuntime()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        runtime = self.runtime
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                parts = self.path.split('?')[0].strip('/').split('/')
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if len(parts) != 3 or parts[0] != 'model' or parts[2] not in ('invoke', 'invoke-with-response-stream'):
+                    self._error(FakeBedrockError('ResourceNotFoundException', f"Unknown path: {self.path}"))
+                    return
+                model_id = unquote(parts[1])
+                try:
+                    if parts[2] == 'invoke':
+                        payload = json.dumps(runtime.invoke(model_id, body), ensure_ascii=False).encode('utf-8')
+                        self.send_response(200)
+                        self.send_header('Content-Type', 'application/json')
+                        self.send_header('Content-Length', str(len(payload)))
+                        self.end_headers()
+                        self.wfile.write(payload)
+                        return
+                    events = runtime.stream_events(model_id, body)
+                except FakeBedrockError as e:
+                    self._error(e)
+                    return
+                # ストリーミングは接続終了までイベントを順次送信
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+                self.end_headers()
+                for event in events:
+                    payload = json.dumps({'bytes': base64.b64encode(
+                        json.dumps(event, ensure_ascii=False).encode('utf-8')).decode('ascii')}).encode('utf-8')
+                    self.wfile.write(encode_event_message(
+                        {':event-type': 'chunk', ':content-type': 'application/json', ':message-type': 'event'},
+                        payload))
+                    self.wfile.flush()
+
+            def _error(self, error: FakeBedrockError) -> None:
+                payload = json.dumps({'message': error.message}).encode('utf-8')
+                self.send_response(error.status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('x-amzn-ErrorType', error.code)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def start(self) -> 'FakeBedrockServer':
+        """サーバーをバックグラウンドで開始"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"フェイクBedrockサーバーを開始: {self.url}")
+        return self
+
+    def stop(self) -> None:
+        """サーバーを停止"""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'FakeBedrockServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+# テスト用のサンプル関数
+def test_fake_bedrock():
+    """
+    フェイクBedrock Runtimeのテスト
+    """
+    runtime = FakeBedrockRuntime({'amazon.titan-embed': FaultProfile(latency_ms=20, throttle_rate=0.2)}, seed=1)
+    texts = ['FSx for NetApp ONTAPの設定方法', 'FSx ONTAPの設定手順', '機械学習の基礎']
+    vectors = []
+    for text in texts:
+        try:
+            response = runtime.invoke_model(modelId='amazon.titan-embed-text-v1', body=json.dumps({'inputText': text}))
+            vectors.append(json.loads(response['body'].read())['embedding'])
+        except ClientError as e:
+            print(f"{text}: {e.response['Error']['Code']}")
+    for i in range(1, len(vectors)):
+        print(f"類似度 0-{i}: {sum(a * b for a, b in zip(vectors[0], vectors[i])):.3f}")
+
+    with FakeBedrockServer(runtime) as server:
+        import boto3
+        client = boto3.client('bedrock-runtime', endpoint_url=server.url, region_name='us-east-1',
+                              aws_access_key_id='testing', aws_secret_access_key='testing')
+        response = client.invoke_model_with_response_stream(
+            modelId='anthropic.claude-3-haiku-20240307-v1:0',
+            body=json.dumps({'anthropic_version': 'bedrock-2023-05-31', 'max_tokens': 100,
+                             'messages': [{'role': 'user', 'content': '内容: ストリーミングのテスト'}]})
+        )
+        text = ''.join(json.loads(event['chunk']['bytes']).get('delta', {}).get('text', '')
+                       for event in response['body'])
+        print(f"ストリーミング応答: {text}")
+    print(f"統計: {runtime.get_stats()}")
+
+
+if __name__ == "__main__":
+    test_fake_bedrock()
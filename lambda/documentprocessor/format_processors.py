@@ -4,16 +4,24 @@
 """
 
 import logging
-from typing import Dict, Any, Tuple, Optional
+import re
+from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime
 import base64
 import io
 
 logger = logging.getLogger(__name__)
 
+# ページ単位変換の出力に挿入するページ境界マーカー（チャンクのページ番号に使用）
+PAGE_MARKER = '<!-- page: {page} -->'
+PAGE_MARKER_PATTERN = re.compile(r'^<!-- page: (\d+) -->$', re.MULTILINE)
+
 class BaseFormatProcessor:
     """ファイル形式プロセッサーの基底クラス"""
     
+    # 変換結果に影響する変更を行った場合に更新（変換キャッシュのキーに含まれる）
+    PROCESSOR_VERSION = '1.0.0'
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
     
@@ -40,6 +48,8 @@ class BaseFormatProcessor:
 class OfficeDocumentProcessor(BaseFormatProcessor):
     """Office文書（docx, xlsx, pptx）プロセッサー"""
     
+    PROCESSOR_VERSION = '1.2.0'
+    
     def process_with_markitdown(self, file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
         """MarkitdownでOffice文書を変換"""
         start_time = datetime.now()
@@ -74,7 +84,7 @@ class OfficeDocumentProcessor(BaseFormatProcessor):
 ## 変換内容
 
 ### Office文書の構造化データ
-{self._generate_office_mock_content(file_extension, file_content)}
+{self._extract_office_content(file_extension, file_content, metadata)}
 
 ---
 *このファイルはMicrosoft Markitdownで変換されました*
@@ -108,7 +118,7 @@ class OfficeDocumentProcessor(BaseFormatProcessor):
             logger.error(f"Markitdown Office文書変換失敗: {file_name} - {e}")
             return False, "", metadata    
  
-   def process_with_langchain(self, file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
+    def process_with_langchain(self, file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
         """LangChainでOffice文書を変換"""
         start_time = datetime.now()
         metadata = {
@@ -142,7 +152,7 @@ class OfficeDocumentProcessor(BaseFormatProcessor):
 ## 変換内容
 
 ### LangChainによる構造化抽出
-{self._generate_office_mock_content(file_extension, file_content)}
+{self._extract_office_content(file_extension, file_content, metadata)}
 
 ---
 *このファイルはLangChainで変換されました*
@@ -176,6 +186,41 @@ class OfficeDocumentProcessor(BaseFormatProcessor):
             logger.error(f"LangChain Office文書変換失敗: {file_name} - {e}")
             return False, "", metadata
     
+    def _extract_office_content(self, file_extension: str, file_content: bytes, metadata: Dict[str, Any]) -> str:
+        """
+        OOXMLパッケージから本文を含むパートのみを遅延展開して抽出（ZIPとして読めない場合はモック）
+        
+        Args:
+            file_extension: ファイル形式
+            file_content: ファイル内容
+            metadata: 抽出統計（ooxml）を追加するメタデータ
+        
+        Returns:
+            str: 抽出したマークダウン
+        """
+        from ooxml_reader import OOXML_FORMATS, is_ooxml_package, extract_ooxml
+        from tabular_stream import TABULAR_STREAMING_ENABLED, summarize_table
+        
+        if file_extension not in OOXML_FORMATS or not is_ooxml_package(file_content):
+            return self._generate_office_mock_content(file_extension, file_content)
+        
+        ocr = self.config.get('supportedFormats', {}).get(file_extension, {}).get('ocr', False)
+        if file_extension == 'xlsx' and TABULAR_STREAMING_ENABLED and not ocr:
+            # 行チャンクは tabular_stream で別途生成するため、ブック全体のマークダウンは作らず行単位で集計した概要のみ返す
+            summary = summarize_table(file_content, file_extension)
+            metadata.update(rowCount=summary['rowCount'], columnTypes=summary['columnTypes'])
+            return DataFileProcessor.generate_data_summary(file_extension, summary)
+        
+        extraction = extract_ooxml(file_content, file_extension, ocr=ocr, ocr_image=self._ocr_embedded_image)
+        metadata['ooxml'] = extraction.to_dict()
+        return extraction.markdown
+    
+    def _ocr_embedded_image(self, image_content: bytes, member_name: str) -> str:
+        """埋め込み画像1件をOCR"""
+        processor = ImageProcessor(self.config)
+        success, content, _ = processor.process_with_markitdown(image_content, member_name.rsplit('/', 1)[-1])
+        return (ImageProcessor.extract_ocr_section(content) or '') if success else ''
+    
     def _generate_office_mock_content(self, file_extension: str, file_content: bytes) -> str:
         """Office文書のモックコンテンツ生成"""
         content_size = len(file_content)
@@ -228,6 +273,135 @@ class OfficeDocumentProcessor(BaseFormatProcessor):
 class PDFProcessor(BaseFormatProcessor):
     """PDF文書プロセッサー"""
     
+    # ページオブジェクト（/Pagesツリーノードを除く）
+    PAGE_OBJECT_PATTERN = re.compile(rb'/Type\s*/Page(?!s)\b')
+    
+    def count_pages(self, file_content: bytes) -> int:
+        """
+        PDFのページ数を取得
+        
+        Args:
+            file_content: ファイル内容
+        
+        Returns:
+            int: ページ数
+        """
+        try:
+            from pypdf import PdfReader
+            return len(PdfReader(io.BytesIO(file_content)).pages)
+        except ImportError:
+            pass
+        except Exception as e:
+            logger.warning(f"PDFページ数の取得に失敗: {e}")
+        
+        # pypdf未導入時はページオブジェクトを数える（圧縮オブジェクトストリームの場合は推定値）
+        page_objects = len(self.PAGE_OBJECT_PATTERN.findall(file_content))
+        return page_objects or max(1, len(file_content) // 50000)
+    
+    def open_reader(self, file_content: bytes) -> Optional[Any]:
+        """
+        ページ分割用にPDFを解析（バッチごとに1回）
+        
+        Args:
+            file_content: ファイル内容
+        
+        Returns:
+            Optional[PdfReader]: リーダー（pypdf未導入・解析失敗時はNone）
+        """
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            return None
+        try:
+            return PdfReader(io.BytesIO(file_content))
+        except Exception as e:
+            logger.warning(f"PDFをページに分割できません: {e}")
+            return None
+    
+    @staticmethod
+    def write_page(reader: Any, index: int) -> bytes:
+        """
+        解析済みのPDFから1ページのみを含むPDFを作成
+        
+        Args:
+            reader: open_reader で作成したリーダー
+            index: ページ番号（0始まり）
+        
+        Returns:
+            bytes: 1ページのPDF
+        """
+        from pypdf import PdfWriter
+        
+        writer = PdfWriter()
+        writer.add_page(reader.pages[index])
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+    
+    def process_pages(self, method: str, file_content: bytes, file_name: str,
+                      first_page: int, last_page: int) -> Tuple[bool, str, Dict]:
+        """
+        ページ範囲を1ページずつ変換し、ページ境界マーカー付きのマークダウンを作成
+        
+        PDFの解析はバッチごとに1回とし、各ページは解析済みのリーダーから書き出す。
+        pypdf未導入・解析失敗時はページに分割できないため、バッチ全体を1回で変換する。
+        
+        Args:
+            method: 処理方法（markitdown / langchain）
+            file_content: PDF全体の内容
+            file_name: ファイル名
+            first_page: 開始ページ（1始まり）
+            last_page: 終了ページ（1始まり、範囲に含む）
+        
+        Returns:
+            (成功フラグ, 変換結果, メタデータ)
+        """
+        start_time = datetime.now()
+        convert = self.process_with_markitdown if method == 'markitdown' else self.process_with_langchain
+        metadata = {
+            'method': method,
+            'processor': 'PDFProcessor',
+            'startTime': start_time.isoformat(),
+            'firstPage': first_page,
+            'lastPage': last_page,
+            'success': False
+        }
+        
+        reader = self.open_reader(file_content)
+        if reader is None:
+            # ページに分割できない場合はバッチ全体を1回で変換（ページ番号はバッチの先頭ページ）
+            units = [(first_page, f"{file_name} (p.{first_page}-{last_page})", file_content)]
+        else:
+            units = ((page, f"{file_name} (p.{page})", self.write_page(reader, page - 1))
+                     for page in range(first_page, min(last_page, len(reader.pages)) + 1))
+        
+        sections = []
+        quality_scores = []
+        for page, label, page_content in units:
+            success, content, page_metadata = convert(page_content, label)
+            if not success:
+                metadata.update({
+                    'processingTime': (datetime.now() - start_time).total_seconds() * 1000,
+                    'error': f"ページ{page}の変換に失敗: {page_metadata.get('error')}"
+                })
+                return False, "", metadata
+            sections.append(f"{PAGE_MARKER.format(page=page)}\n{content}")
+            if 'qualityScore' in page_metadata:
+                quality_scores.append(page_metadata['qualityScore'])
+        
+        markdown_content = "\n\n".join(sections)
+        metadata.update({
+            'success': True,
+            'endTime': datetime.now().isoformat(),
+            'processingTime': (datetime.now() - start_time).total_seconds() * 1000,
+            'outputLength': len(markdown_content),
+            'pages': last_page - first_page + 1,
+            'pagesSplit': reader is not None
+        })
+        if quality_scores:
+            metadata['qualityScore'] = sum(quality_scores) / len(quality_scores)
+        return True, markdown_content, metadata
+    
     def process_with_markitdown(self, file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
         """MarkitdownでPDF文書を変換（OCR対応）"""
         start_time = datetime.now()
@@ -392,6 +566,8 @@ class PDFProcessor(BaseFormatProcessor):
 class ImageProcessor(BaseFormatProcessor):
     """画像ファイル（png, jpg, jpeg, gif）プロセッサー"""
     
+    OCR_SECTION_HEADING = '## OCR抽出結果'
+    
     def process_with_markitdown(self, file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
         """Markitdownで画像を変換（OCR対応）"""
         start_time = datetime.now()
@@ -414,30 +590,8 @@ class ImageProcessor(BaseFormatProcessor):
             # markdown_content = result.text_content
             
             # モック実装
-            file_extension = file_name.split('.')[-1].lower()
-            markdown_content = f"""# {file_name}
-
-## 画像情報
-- **ファイル名**: {file_name}
-- **ファイル形式**: {file_extension.upper()}
-- **ファイルサイズ**: {len(file_content):,} bytes
-- **処理方法**: Microsoft Markitdown OCR
-- **処理日時**: {start_time.isoformat()}
-
-## OCR抽出結果
-
-### 検出されたテキスト
-{self._generate_image_mock_content(file_content)}
-
-### 画像解析結果
-- OCR信頼度: 92%
-- 検出言語: 日本語・英語
-- テキスト領域: 検出済み
-- 画像品質: 高品質
-
----
-*この画像はMicrosoft MarkitdownのOCR機能で解析されました*
-"""
+            markdown_content = self.render_markdown(file_name, len(file_content), start_time,
+                                                    self._generate_ocr_section(file_content))
             
             end_time = datetime.now()
             processing_time = (end_time - start_time).total_seconds() * 1000
@@ -491,6 +645,57 @@ class ImageProcessor(BaseFormatProcessor):
         logger.warning(f"LangChain 画像処理はサポートされていません: {file_name}")
         return False, "", metadata
     
+    def render_markdown(self, file_name: str, file_size: int, processed_at: datetime, ocr_section: str) -> str:
+        """
+        画像情報とOCR結果からマークダウンを作成
+        
+        Args:
+            file_name: ファイル名
+            file_size: 元のファイルサイズ
+            processed_at: 処理日時
+            ocr_section: OCR結果のセクション（OCR_SECTION_HEADINGで始まる）
+        
+        Returns:
+            str: マークダウン
+        """
+        file_extension = file_name.split('.')[-1].lower()
+        return f"""# {file_name}
+
+## 画像情報
+- **ファイル名**: {file_name}
+- **ファイル形式**: {file_extension.upper()}
+- **ファイルサイズ**: {file_size:,} bytes
+- **処理方法**: Microsoft Markitdown OCR
+- **処理日時**: {processed_at.isoformat()}
+
+{ocr_section}
+---
+*この画像はMicrosoft MarkitdownのOCR機能で解析されました*
+"""
+    
+    @classmethod
+    def extract_ocr_section(cls, markdown_content: str) -> Optional[str]:
+        """変換結果のマークダウンからOCR結果のセクションを取り出す（類似画像での再利用用）"""
+        start = markdown_content.find(cls.OCR_SECTION_HEADING)
+        if start < 0:
+            return None
+        end = markdown_content.rfind('\n---\n')
+        return markdown_content[start:end + 1] if end > start else markdown_content[start:]
+    
+    def _generate_ocr_section(self, file_content: bytes) -> str:
+        """OCR結果のセクション（モック）"""
+        return f"""{self.OCR_SECTION_HEADING}
+
+### 検出されたテキスト
+{self._generate_image_mock_content(file_content)}
+
+### 画像解析結果
+- OCR信頼度: 92%
+- 検出言語: 日本語・英語
+- テキスト領域: 検出済み
+- 画像品質: 高品質
+"""
+    
     def _generate_image_mock_content(self, file_content: bytes) -> str:
         """画像のモックコンテンツ生成"""
         content_size = len(file_content)
@@ -510,6 +715,8 @@ class ImageProcessor(BaseFormatProcessor):
 class WebDocumentProcessor(BaseFormatProcessor):
     """Web文書（html, xml）プロセッサー"""
     
+    PROCESSOR_VERSION = '1.1.0'
+    
     def process_with_markitdown(self, file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
         """MarkitdownでWeb文書を変換"""
         start_time = datetime.now()
@@ -530,12 +737,10 @@ class WebDocumentProcessor(BaseFormatProcessor):
             # result = markitdown.convert(file_content.decode('utf-8'))
             # markdown_content = result.text_content
             
-            # モック実装
+            # モック実装（全体をデコード・DOM構築せず、定型要素を除いた先頭レコードのみ逐次抽出）
             file_extension = file_name.split('.')[-1].lower()
-            try:
-                text_content = file_content.decode('utf-8')[:1000]  # 最初の1000文字をサンプル
-            except UnicodeDecodeError:
-                text_content = "[バイナリコンテンツ]"
+            summary = self._summarize_markup(file_content, file_extension)
+            text_content = '\n\n'.join(summary['sampleRecords'])
             
             markdown_content = f"""# {file_name}
 
@@ -563,6 +768,8 @@ class WebDocumentProcessor(BaseFormatProcessor):
                 'endTime': end_time.isoformat(),
                 'processingTime': processing_time,
                 'outputLength': len(markdown_content),
+                'recordCount': summary['recordCount'],
+                'droppedElements': summary['droppedElements'],
                 'qualityScore': 80  # Web文書の変換品質
             })
             
@@ -603,12 +810,10 @@ class WebDocumentProcessor(BaseFormatProcessor):
             # documents = loader.load()
             # markdown_content = "\n\n".join([doc.page_content for doc in documents])
             
-            # モック実装
+            # モック実装（全体をデコード・DOM構築せず、定型要素を除いた先頭レコードのみ逐次抽出）
             file_extension = file_name.split('.')[-1].lower()
-            try:
-                text_content = file_content.decode('utf-8')[:1000]
-            except UnicodeDecodeError:
-                text_content = "[バイナリコンテンツ]"
+            summary = self._summarize_markup(file_content, file_extension)
+            text_content = '\n\n'.join(summary['sampleRecords'])
             
             markdown_content = f"""# {file_name}
 
@@ -636,6 +841,8 @@ class WebDocumentProcessor(BaseFormatProcessor):
                 'endTime': end_time.isoformat(),
                 'processingTime': processing_time,
                 'outputLength': len(markdown_content),
+                'recordCount': summary['recordCount'],
+                'droppedElements': summary['droppedElements'],
                 'qualityScore': 85  # LangChainはWeb文書が得意
             })
             
@@ -656,8 +863,19 @@ class WebDocumentProcessor(BaseFormatProcessor):
             logger.error(f"LangChain Web文書変換失敗: {file_name} - {e}")
             return False, "", metadata
     
+    def _summarize_markup(self, file_content: bytes, file_extension: str) -> Dict[str, Any]:
+        """ストリーミング解析でレコード数・先頭レコードを取得"""
+        from markup_stream import summarize_markup
+        
+        boundary_elements = self.config.get('supportedFormats', {}).get(file_extension, {}).get('chunkBoundaryElements')
+        return summarize_markup(file_content, file_extension, boundary_elements)
+    
+    # 変換結果に含めない実行可能コンテンツ（要素ごと除去）
+    ACTIVE_CONTENT_PATTERN = re.compile(r'(?is)<(script|style)\b[^>]*>.*?(</\1\s*>|$)')
+    
     def _generate_web_mock_content(self, file_extension: str, text_content: str) -> str:
         """Web文書のモックコンテンツ生成"""
+        text_content = self.ACTIVE_CONTENT_PATTERN.sub('', text_content)
         if file_extension == 'html':
             return f"""
 #### HTML構造解析
@@ -692,6 +910,8 @@ class WebDocumentProcessor(BaseFormatProcessor):
 class DataFileProcessor(BaseFormatProcessor):
     """データファイル（csv, tsv）プロセッサー"""
     
+    PROCESSOR_VERSION = '1.1.0'
+    
     def process_with_markitdown(self, file_content: bytes, file_name: str) -> Tuple[bool, str, Dict]:
         """Markitdownでデータファイルを変換（通常は使用しない）"""
         # データファイルはLangChainが専門のため、Markitdownでは基本的に処理しない
@@ -729,18 +949,11 @@ class DataFileProcessor(BaseFormatProcessor):
             if not self.validate_file(file_content, file_name):
                 raise ValueError("ファイル検証に失敗しました")
             
-            # TODO: 実際のLangChain + pandas実装
-            # import pandas as pd
-            # df = pd.read_csv(io.BytesIO(file_content))
-            # markdown_content = df.to_markdown()
+            # ファイル全体をデコードせず行単位で集計（行チャンクは tabular_stream で別途生成）
+            from tabular_stream import summarize_table
             
-            # モック実装
             file_extension = file_name.split('.')[-1].lower()
-            try:
-                text_content = file_content.decode('utf-8')
-                lines = text_content.split('\n')[:10]  # 最初の10行をサンプル
-            except UnicodeDecodeError:
-                lines = ["[バイナリコンテンツ]"]
+            summary = summarize_table(file_content, file_extension)
             
             markdown_content = f"""# {file_name}
 
@@ -748,19 +961,13 @@ class DataFileProcessor(BaseFormatProcessor):
 - **ファイル名**: {file_name}
 - **ファイル形式**: {file_extension.upper()}
 - **ファイルサイズ**: {len(file_content):,} bytes
-- **処理方法**: LangChain + Pandas
+- **処理方法**: LangChain（行ストリーミング）
 - **処理日時**: {start_time.isoformat()}
 
 ## データ構造
 
 ### 統計情報
-{self._generate_data_mock_content(file_extension, lines)}
-
-### データサンプル
-```
-{chr(10).join(lines[:5])}
-```
-
+{self.generate_data_summary(file_extension, summary)}
 ---
 *このデータファイルはLangChainで変換されました*
 """
@@ -773,6 +980,8 @@ class DataFileProcessor(BaseFormatProcessor):
                 'endTime': end_time.isoformat(),
                 'processingTime': processing_time,
                 'outputLength': len(markdown_content),
+                'rowCount': summary['rowCount'],
+                'columnTypes': summary['columnTypes'],
                 'qualityScore': 90  # LangChainはデータファイルが得意
             })
             
@@ -793,32 +1002,55 @@ class DataFileProcessor(BaseFormatProcessor):
             logger.error(f"LangChain データファイル変換失敗: {file_name} - {e}")
             return False, "", metadata
     
-    def _generate_data_mock_content(self, file_extension: str, lines: list) -> str:
-        """データファイルのモックコンテンツ生成"""
-        separator = ',' if file_extension == 'csv' else '\t'
+    @staticmethod
+    def generate_data_summary(file_extension: str, summary: Dict[str, Any]) -> str:
+        """データファイルの概要（列・型・先頭行）を生成"""
+        columns = summary['columns']
         
-        if lines and len(lines) > 0:
-            header_cols = len(lines[0].split(separator)) if lines[0] else 0
-            data_rows = len(lines) - 1
-        else:
-            header_cols = 0
-            data_rows = 0
+        def table_row(cells: list) -> str:
+            return '| ' + ' | '.join(str(cell).replace('|', '\\|') for cell in cells) + ' |'
+        
+        column_rows = '\n'.join(table_row([name, column_type])
+                                for name, column_type in zip(columns, summary['columnTypes']))
+        sample_rows = '\n'.join(table_row((row + [''] * len(columns))[:len(columns)])
+                                for row in summary['sampleRows'])
         
         return f"""
-- **区切り文字**: {separator}
-- **推定列数**: {header_cols}
-- **推定行数**: {data_rows}
-- **データ型**: 混合型
-- **エンコーディング**: UTF-8
+- **列数**: {len(columns)}
+- **行数**: {summary['rowCount']:,}
+- **ファイル形式**: {file_extension.upper()}
 
-#### データ概要
-| 項目 | 値 |
+#### 列の型
+| 列 | 型 |
 |------|-----|
-| 列数 | {header_cols} |
-| 行数 | {data_rows} |
-| ファイル形式 | {file_extension.upper()} |
+{column_rows}
+
+### データサンプル
+{table_row(columns)}
+{table_row(['---'] * len(columns))}
+{sample_rows}
 """
 
+def split_pages(markdown_content: str) -> List[Tuple[Optional[int], str]]:
+    """
+    ページ境界マーカーでマークダウンを分割
+    
+    Args:
+        markdown_content: マークダウン（マーカーがない場合は全体を1要素として返す）
+    
+    Returns:
+        List[Tuple[Optional[int], str]]: (ページ番号, ページ内容) のリスト
+    """
+    markers = list(PAGE_MARKER_PATTERN.finditer(markdown_content))
+    if not markers:
+        return [(None, markdown_content)]
+    
+    pages = []
+    for index, marker in enumerate(markers):
+        end = markers[index + 1].start() if index + 1 < len(markers) else len(markdown_content)
+        pages.append((int(marker.group(1)), markdown_content[marker.end():end].strip()))
+    return pages
+
 # ファイル形式別プロセッサーのファクトリー
 def get_format_processor(file_format: str, config: Dict[str, Any]) -> Optional[BaseFormatProcessor]:
     """ファイル形式に応じたプロセッサーを取得"""
@@ -0,0 +1,247 @@
+"""
+S3オブジェクト単位の冪等性リース
+S3イベントは少なくとも1回配信され、保存1回で複数のイベントが発生することもあるため、
+追跡テーブルへの条件付き書き込みで (バケット, キー, バージョン/ETag) ごとのリースを取得し、
+同じオブジェクトバージョンを処理する呼び出しを1つに限定する。
+リースには有効期限があり、保持したまま異常終了した呼び出しのリースは期限後に他の呼び出しが取得できる。
+"""
+
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_ENABLED = os.environ.get('MARKITDOWN_IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+
+# リースアイテムのソートキー（追跡テーブルのキーは fileHash / processedAt）
+LEASE_SORT_KEY = 'LEASE'
+# Lambdaの残り時間に加えるリースの猶予（秒）
+LEASE_GRACE_SECONDS = 60
+# 残り時間が不明な場合のリース期間（Lambdaの最大実行時間 + 猶予）
+DEFAULT_LEASE_SECONDS = 15 * 60 + LEASE_GRACE_SECONDS
+# 処理完了の記録を保持する期間（秒、TTLで自動削除）
+DONE_RETENTION_SECONDS = 90 * 24 * 60 * 60
+
+
+class LeaseStatus:
+    """リースの状態"""
+    ACQUIRED = 'acquired'
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+
+
+@dataclass
+class Lease:
+    """リース取得結果"""
+    lease_key: str
+    acquired: bool
+    status: str
+    owner: Optional[str] = None  # 取得した場合のみ（完了・延長・解放の条件に使用）
+    expires_at: Optional[int] = None
+    completed_at: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書形式に変換"""
+        return asdict(self)
+
+
+def object_lease_key(bucket: str, key: str, version_id: Optional[str] = None,
+                     etag: Optional[str] = None) -> str:
+    """
+    オブジェクトバージョンのリースキーを作成
+
+    Args:
+        bucket: S3バケット名
+        key: S3キー
+        version_id: バージョンID（バージョニング有効時）
+        etag: ETag（バージョンIDがない場合に内容の識別に使用）
+
+    Returns:
+        str: リースキー（OBJECT#<バケット>/<キー>#<バージョン>）
+    """
+    version = f"v:{version_id}" if version_id else f"e:{(etag or '').strip(chr(34))}"
+    return f"OBJECT#{bucket}/{key}#{version}"
+
+
+class IdempotencyStore:
+    """追跡テーブルの条件付き書き込みによる冪等性リース"""
+
+    def __init__(self, table: Any, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+        """
+        初期化
+
+        Args:
+            table: 追跡テーブル（DynamoDB）
+            lease_seconds: 既定のリース期間（秒）
+        """
+        self.table = table
+        self.lease_seconds = lease_seconds
+
+    @staticmethod
+    def _key(lease_key: str) -> Dict[str, str]:
+        return {'fileHash': lease_key, 'processedAt': LEASE_SORT_KEY}
+
+    def acquire(self, lease_key: str, lease_seconds: Optional[float] = None,
+                details: Optional[Dict[str, Any]] = None) -> Lease:
+        """
+        リースを取得
+
+        未登録、または処理中のまま期限切れのリースのみ取得できる。取得できない場合は既存のリースの状態を返す。
+
+        Args:
+            lease_key: リースキー
+            lease_seconds: リース期間（秒、省略時は既定値）
+            details: リースアイテムに記録する属性（バケット・キー等）
+
+        Returns:
+            Lease: 取得結果（acquired が False の場合は処理済みまたは他の呼び出しが処理中）
+        """
+        now = int(time.time())
+        owner = str(uuid.uuid4())
+        expires_at = now + int(lease_seconds or self.lease_seconds)
+        item = dict(details or {})
+        item.update(self._key(lease_key))
+        item.update({
+            'leaseStatus': LeaseStatus.IN_PROGRESS,
+            'leaseOwner': owner,
+            'leaseExpiresAt': expires_at,
+            'createdAt': datetime.now().isoformat(),
+            # TTLの削除は遅延するため、期限の判定には leaseExpiresAt を使用
+            'ttl': expires_at + DONE_RETENTION_SECONDS
+        })
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(fileHash) OR '
+                                    '(leaseStatus = :in_progress AND leaseExpiresAt < :now)',
+                ExpressionAttributeValues={':in_progress': LeaseStatus.IN_PROGRESS, ':now': now}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            existing = self.table.get_item(Key=self._key(lease_key), ConsistentRead=True).get('Item') or {}
+            lease = Lease(
+                lease_key=lease_key,
+                acquired=False,
+                status=existing.get('leaseStatus', LeaseStatus.IN_PROGRESS),
+                expires_at=int(existing['leaseExpiresAt']) if existing.get('leaseExpiresAt') else None,
+                completed_at=existing.get('completedAt')
+            )
+            logger.info(f"リースを取得できませんでした（{lease.status}）: {lease_key}")
+            return lease
+
+        logger.info(f"リースを取得しました: {lease_key} (期限: {expires_at})")
+        return Lease(lease_key=lease_key, acquired=True, status=LeaseStatus.ACQUIRED,
+                     owner=owner, expires_at=expires_at)
+
+    def _update_owned(self, lease: Lease, update_expression: str, names: Dict[str, str],
+                      values: Dict[str, Any]) -> bool:
+        """リースを保持している場合のみ更新（期限切れ後に他の呼び出しが取得したリースは変更しない）"""
+        try:
+            self.table.update_item(
+                Key=self._key(lease.lease_key),
+                UpdateExpression=update_expression,
+                ConditionExpression='leaseOwner = :owner',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=dict(values, **{':owner': lease.owner})
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            logger.warning(f"リースは他の呼び出しに取得されています: {lease.lease_key}")
+            return False
+
+    def extend(self, lease: Lease, lease_seconds: Optional[float] = None) -> bool:
+        """
+        リースを延長（チェックポイントから処理を継続する場合）
+
+        Args:
+            lease: 取得したリース
+            lease_seconds: 延長後の残り期間（秒）
+
+        Returns:
+            bool: 延長できたか
+        """
+        expires_at = int(time.time()) + int(lease_seconds or self.lease_seconds)
+        if self._update_owned(lease, 'SET leaseExpiresAt = :expires, #ttl = :ttl', {'#ttl': 'ttl'},
+                              {':expires': expires_at, ':ttl': expires_at + DONE_RETENTION_SECONDS}):
+            lease.expires_at = expires_at
+            return True
+        return False
+
+    def complete(self, lease: Lease, summary: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        処理完了を記録（以降の同じオブジェクトバージョンのイベントは処理しない）
+
+        Args:
+            lease: 取得したリース
+            summary: 記録する処理結果の要約
+
+        Returns:
+            bool: 記録できたか
+        """
+        completed_at = datetime.now().isoformat()
+        if self._update_owned(lease, 'SET leaseStatus = :done, completedAt = :completed, '
+                                     '#summary = :summary, #ttl = :ttl',
+                              {'#summary': 'summary', '#ttl': 'ttl'},
+                              {':done': LeaseStatus.DONE, ':completed': completed_at,
+                               ':summary': summary or {},
+                               ':ttl': int(time.time()) + DONE_RETENTION_SECONDS}):
+            lease.status = LeaseStatus.DONE
+            lease.completed_at = completed_at
+            return True
+        return False
+
+    def release(self, lease: Lease) -> bool:
+        """
+        リースを解放（処理失敗時、後続のイベントや再試行で再処理できるようにする）
+
+        Args:
+            lease: 取得したリース
+
+        Returns:
+            bool: 解放できたか
+        """
+        try:
+            self.table.delete_item(
+                Key=self._key(lease.lease_key),
+                ConditionExpression='leaseOwner = :owner',
+                ExpressionAttributeValues={':owner': lease.owner}
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            logger.warning(f"リースは他の呼び出しに取得されています: {lease.lease_key}")
+            return False
+
+
+# テスト用のサンプル関数
+def test_idempotency():
+    """
+    冪等性リースのテスト
+    """
+    import boto3
+
+    table = boto3.resource('dynamodb').Table(os.environ.get('MARKITDOWN_TRACKING_TABLE', 'EmbeddingProcessingTracking'))
+    store = IdempotencyStore(table, lease_seconds=60)
+    lease_key = object_lease_key('sample-bucket', 'docs/sample.pdf', etag='"abc123"')
+
+    first = store.acquire(lease_key)
+    second = store.acquire(lease_key)
+    print(f"1回目: {first.to_dict()}")
+    print(f"2回目: {second.to_dict()}")
+    store.complete(first, {'chunks': 3})
+    print(f"完了後: {store.acquire(lease_key).to_dict()}")
+
+
+if __name__ == "__main__":
+    test_idempotency()
@@ -0,0 +1,306 @@
+"""
+画像OCRの前処理
+知覚ハッシュ（dHash）による類似画像のOCR結果再利用、OCRに必要な解像度への縮小、
+ほぼ空白の画像のスキップを行う。Pillowが利用できない環境では内容ハッシュによる
+完全一致の再利用のみを行う。
+"""
+
+import hashlib
+import io
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PREPROCESS_ENABLED = os.environ.get('IMAGE_PREPROCESS_ENABLED', 'true').lower() == 'true'
+IMAGE_FORMATS = frozenset(['png', 'jpg', 'jpeg', 'gif'])
+
+# OCRに必要な解像度の上限（長辺ピクセル数、A4・300dpi相当）
+OCR_MAX_LONG_EDGE = int(os.environ.get('OCR_MAX_LONG_EDGE', '2480'))
+# 類似画像とみなすdHashのハミング距離（64ビット中）
+PHASH_MAX_DISTANCE = 4
+# 空白画像とみなす輝度の標準偏差
+BLANK_STDDEV_THRESHOLD = 3.0
+# 空白判定に使用する縮小画像の辺の長さ
+BLANK_SAMPLE_SIZE = 64
+
+
+@dataclass
+class ImagePreprocessResult:
+    """画像前処理の結果"""
+    image_hash: str
+    hash_method: str  # dhash / sha256
+    width: Optional[int] = None
+    height: Optional[int] = None
+    scaled_width: Optional[int] = None
+    scaled_height: Optional[int] = None
+    blank: bool = False
+    preprocess_ms: float = 0.0
+    content: bytes = field(default=b'', repr=False)
+
+    @property
+    def downscaled(self) -> bool:
+        return self.scaled_width is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'imageHash': self.image_hash,
+            'hashMethod': self.hash_method,
+            'width': self.width,
+            'height': self.height,
+            'scaledWidth': self.scaled_width,
+            'scaledHeight': self.scaled_height,
+            'blank': self.blank,
+            'preprocessMs': round(self.preprocess_ms, 2)
+        }
+
+
+def read_image_size(file_content: bytes) -> Optional[Tuple[int, int]]:
+    """
+    画像ヘッダーから幅・高さを取得（デコードしない）
+
+    Args:
+        file_content: 画像ファイル内容
+
+    Returns:
+        Optional[Tuple[int, int]]: (幅, 高さ)
+    """
+    if file_content.startswith(b'\x89PNG\r\n\x1a\n') and len(file_content) >= 24:
+        return struct.unpack('>II', file_content[16:24])
+    if file_content[:6] in (b'GIF87a', b'GIF89a') and len(file_content) >= 10:
+        return struct.unpack('<HH', file_content[6:10])
+    if file_content.startswith(b'\xff\xd8'):
+        offset = 2
+        while offset + 9 <= len(file_content):
+            if file_content[offset] != 0xFF:
+                offset += 1
+                continue
+            marker = file_content[offset + 1]
+            # SOFnマーカー（DHT・JPG・DACを除く）に画像サイズが含まれる
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', file_content[offset + 5:offset + 9])
+                return width, height
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                offset += 2
+                continue
+            offset += 2 + struct.unpack('>H', file_content[offset + 2:offset + 4])[0]
+    return None
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """16進表記のハッシュ間のハミング距離"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def _difference_hash(gray: Any) -> str:
+    """dHash: 9x8に縮小した輝度の横方向の差分を64ビットにまとめる"""
+    from PIL import Image
+
+    pixels = gray.resize((9, 8), Image.LANCZOS).tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def preprocess_image(file_content: bytes, file_format: str,
+                     max_long_edge: int = OCR_MAX_LONG_EDGE) -> ImagePreprocessResult:
+    """
+    OCR前の画像前処理（ハッシュ計算・空白判定・縮小）
+
+    Args:
+        file_content: 画像ファイル内容
+        file_format: ファイル形式（png / jpg / jpeg / gif）
+        max_long_edge: OCRに渡す画像の長辺の上限
+
+    Returns:
+        ImagePreprocessResult: 前処理の結果（contentはOCRに渡す画像）
+    """
+    start = time.monotonic()
+    size = read_image_size(file_content)
+    result = ImagePreprocessResult(
+        image_hash=hashlib.sha256(file_content).hexdigest(),
+        hash_method='sha256',
+        width=size[0] if size else None,
+        height=size[1] if size else None,
+        content=file_content
+    )
+
+    try:
+        from PIL import Image, ImageStat
+    except ImportError:
+        # Pillow未導入の場合は完全一致の再利用のみ
+        result.preprocess_ms = (time.monotonic() - start) * 1000
+        return result
+
+    try:
+        with Image.open(io.BytesIO(file_content)) as image:
+            image.seek(0)  # アニメーションGIFは先頭フレームのみ
+            result.width, result.height = image.size
+            gray = image.convert('L')
+            result.image_hash = _difference_hash(gray)
+            result.hash_method = 'dhash'
+
+            sample = gray.copy()
+            sample.thumbnail((BLANK_SAMPLE_SIZE, BLANK_SAMPLE_SIZE))
+            result.blank = ImageStat.Stat(sample).stddev[0] < BLANK_STDDEV_THRESHOLD
+
+            if not result.blank and max(image.size) > max_long_edge:
+                scaled = image.convert('RGB') if file_format in ('jpg', 'jpeg') else image.copy()
+                scaled.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+                buffer = io.BytesIO()
+                if file_format in ('jpg', 'jpeg'):
+                    scaled.save(buffer, format='JPEG', quality=90)
+                else:
+                    scaled.save(buffer, format='PNG', optimize=False)
+                result.content = buffer.getvalue()
+                result.scaled_width, result.scaled_height = scaled.size
+    except Exception as e:
+        logger.warning(f"画像の前処理に失敗したため元の画像でOCRします: {e}")
+
+    result.preprocess_ms = (time.monotonic() - start) * 1000
+    return result
+
+
+class OcrResultCache:
+    """画像ハッシュをキーとするOCR結果のLRUキャッシュ（dHashは近傍一致で検索）"""
+
+    DEFAULT_MAX_ENTRIES = 4096
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_distance: int = PHASH_MAX_DISTANCE):
+        """
+        初期化
+
+        Args:
+            max_entries: 保持するエントリ数の上限
+            max_distance: 類似とみなすハミング距離の上限
+        """
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries: 'OrderedDict[Tuple[str, str], Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'images': 0, 'exactHits': 0, 'nearHits': 0, 'misses': 0,
+            'blankSkipped': 0, 'downscaled': 0, 'ocrRuns': 0, 'ocrSeconds': 0.0, 'ocrSecondsSaved': 0.0
+        }
+
+    def lookup(self, prepared: ImagePreprocessResult) -> Optional[Dict[str, Any]]:
+        """
+        同一・類似画像のOCR結果を検索
+
+        Args:
+            prepared: 画像前処理の結果
+
+        Returns:
+            Optional[Dict]: エントリ（ocrSection, ocrSeconds, imageHash, distance）
+        """
+        with self._lock:
+            self._stats['images'] += 1
+            if prepared.downscaled:
+                self._stats['downscaled'] += 1
+
+            key = (prepared.hash_method, prepared.image_hash)
+            entry = self._entries.get(key)
+            distance = 0
+            if entry is None and prepared.hash_method == 'dhash':
+                best = None
+                for (method, image_hash), candidate in self._entries.items():
+                    if method != 'dhash':
+                        continue
+                    candidate_distance = hamming_distance(image_hash, prepared.image_hash)
+                    if candidate_distance <= self.max_distance and (best is None or candidate_distance < best[0]):
+                        best = (candidate_distance, (method, image_hash), candidate)
+                if best:
+                    distance, key, entry = best
+
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['exactHits' if distance == 0 else 'nearHits'] += 1
+            self._stats['ocrSecondsSaved'] += entry['ocrSeconds']
+            return dict(entry, distance=distance)
+
+    def put(self, prepared: ImagePreprocessResult, ocr_section: str, ocr_seconds: float) -> None:
+        """
+        OCR結果を保存
+
+        Args:
+            prepared: 画像前処理の結果
+            ocr_section: OCR結果のマークダウン
+            ocr_seconds: OCRの所要秒数
+        """
+        with self._lock:
+            self._entries[(prepared.hash_method, prepared.image_hash)] = {
+                'imageHash': prepared.image_hash,
+                'ocrSection': ocr_section,
+                'ocrSeconds': ocr_seconds
+            }
+            self._entries.move_to_end((prepared.hash_method, prepared.image_hash))
+            self._stats['ocrRuns'] += 1
+            self._stats['ocrSeconds'] += ocr_seconds
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_blank(self) -> float:
+        """
+        空白画像のスキップを記録
+
+        Returns:
+            float: 節約したOCR秒数（これまでのOCRの平均所要時間から推定）
+        """
+        with self._lock:
+            ocr_runs = self._stats['ocrRuns']
+            saved = self._stats['ocrSeconds'] / ocr_runs if ocr_runs > 0 else 0.0
+            self._stats['images'] += 1
+            self._stats['blankSkipped'] += 1
+            self._stats['ocrSecondsSaved'] += saved
+            return saved
+
+    def get_stats(self) -> Dict[str, Any]:
+        """統計情報を取得"""
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        stats['ocrSeconds'] = round(stats['ocrSeconds'], 3)
+        stats['ocrSecondsSaved'] = round(stats['ocrSecondsSaved'], 3)
+        return stats
+
+
+# グローバルインスタンス（ウォーム起動間で再利用）
+_ocr_result_cache: Optional[OcrResultCache] = None
+
+
+def get_ocr_result_cache() -> OcrResultCache:
+    """OCR結果キャッシュを取得"""
+    global _ocr_result_cache
+    if _ocr_result_cache is None:
+        _ocr_result_cache = OcrResultCache()
+    return _ocr_result_cache
+
+
+# テスト用のサンプル関数
+def test_image_preprocess():
+    """
+    画像前処理のテスト
+    """
+    png_header = b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\rIHDR' + struct.pack('>II', 4000, 3000) + b'\x08\x02\x00\x00\x00'
+    prepared = preprocess_image(png_header, 'png')
+    print(f"前処理結果: {prepared.to_dict()}")
+
+    cache = OcrResultCache()
+    print(f"初回検索: {cache.lookup(prepared)}")
+    cache.put(prepared, '## OCR抽出結果\nサンプル', 1.5)
+    print(f"再検索: {cache.lookup(prepared)}")
+    print(f"統計: {cache.get_stats()}")
+
+
+if __name__ == "__main__":
+    test_image_preprocess()
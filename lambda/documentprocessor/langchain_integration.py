@@ -11,6 +11,8 @@ import hashlib
 import re
 from datetime import datetime
 
+from fake_bedrock import embedding_dimension, semantic_embedding
+
 # LangChain imports (実際の実装では必要)
 # from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 # from langchain.schema import Document
@@ -30,6 +32,7 @@ class ChunkMetadata:
     header_level: Optional[int] = None
     parent_header: Optional[str] = None
     processing_method: str = 'markitdown'
+    page_number: Optional[int] = None
     created_at: str = None
     
     def __post_init__(self):
@@ -81,7 +84,8 @@ class LangChainIntegration:
                                source_file: str,
                                processing_method: str = 'markitdown',
                                user_id: Optional[str] = None,
-                               project_id: Optional[str] = None) -> ProcessingResult:
+                               project_id: Optional[str] = None,
+                               page_number: Optional[int] = None) -> ProcessingResult:
         """
         マークダウンコンテンツを処理してチャンクと埋め込みを生成
         
@@ -91,6 +95,7 @@ class LangChainIntegration:
             processing_method: 処理方法
             user_id: ユーザーID
             project_id: プロジェクトID
+            page_number: ページ番号（ページ単位で処理する場合）
             
         Returns:
             ProcessingResult: 処理結果
@@ -99,7 +104,7 @@ class LangChainIntegration:
             logger.info(f"📄 マークダウンコンテンツ処理開始: {source_file}")
             
             # 1. マークダウンをチャンクに分割
-            chunks = self._split_markdown_content(markdown_content, source_file, processing_method)
+            chunks = self._split_markdown_content(markdown_content, source_file, processing_method, page_number)
             
             # 2. 各チャンクの埋め込みを生成
             embeddings = self._generate_embeddings([chunk['content'] for chunk in chunks])
@@ -115,5 +120,372 @@ class LangChainIntegration:
                 'chunk_overlap': self.chunk_overlap,
                 'processed_at': datetime.utcnow().isoformat(),
                 'user_id': user_id,
-                'project_id': project_id
-            }\n            \n            logger.info(f\"✅ マークダウンコンテンツ処理完了: {len(chunks)}チャンク生成\")\n            \n            return ProcessingResult(\n                success=True,\n                chunks=chunks,\n                embeddings=embeddings,\n                metadata=metadata\n            )\n            \n        except Exception as e:\n            logger.error(f\"❌ マークダウンコンテンツ処理エラー: {e}\")\n            return ProcessingResult(\n                success=False,\n                chunks=[],\n                embeddings=[],\n                metadata={},\n                error=str(e)\n            )\n    \n    def _split_markdown_content(self, \n                              markdown_content: str, \n                              source_file: str,\n                              processing_method: str) -> List[Dict[str, Any]]:\n        \"\"\"\n        マークダウンコンテンツをチャンクに分割\n        \n        Args:\n            markdown_content: マークダウンテキスト\n            source_file: ソースファイル名\n            processing_method: 処理方法\n            \n        Returns:\n            List[Dict]: チャンクリスト\n        \"\"\"\n        chunks = []\n        \n        # ヘッダーベースの分割を実行\n        header_chunks = self._split_by_headers(markdown_content)\n        \n        for i, (content, header_info) in enumerate(header_chunks):\n            # 長いチャンクをさらに分割\n            if len(content) > self.chunk_size:\n                sub_chunks = self._split_long_chunk(content)\n                for j, sub_content in enumerate(sub_chunks):\n                    chunk_id = self._generate_chunk_id(source_file, i, j)\n                    chunk_metadata = ChunkMetadata(\n                        chunk_id=chunk_id,\n                        source_file=source_file,\n                        chunk_index=len(chunks),\n                        chunk_size=len(sub_content),\n                        chunk_type=self._detect_chunk_type(sub_content),\n                        header_level=header_info.get('level'),\n                        parent_header=header_info.get('title'),\n                        processing_method=processing_method\n                    )\n                    \n                    chunks.append({\n                        'content': sub_content.strip(),\n                        'metadata': chunk_metadata.__dict__\n                    })\n            else:\n                chunk_id = self._generate_chunk_id(source_file, i)\n                chunk_metadata = ChunkMetadata(\n                    chunk_id=chunk_id,\n                    source_file=source_file,\n                    chunk_index=len(chunks),\n                    chunk_size=len(content),\n                    chunk_type=self._detect_chunk_type(content),\n                    header_level=header_info.get('level'),\n                    parent_header=header_info.get('title'),\n                    processing_method=processing_method\n                )\n                \n                chunks.append({\n                    'content': content.strip(),\n                    'metadata': chunk_metadata.__dict__\n                })\n        \n        return chunks\n    \n    def _split_by_headers(self, markdown_content: str) -> List[Tuple[str, Dict[str, Any]]]:\n        \"\"\"\n        ヘッダーに基づいてマークダウンを分割\n        \n        Args:\n            markdown_content: マークダウンテキスト\n            \n        Returns:\n            List[Tuple]: (コンテンツ, ヘッダー情報) のタプルリスト\n        \"\"\"\n        # ヘッダーパターン\n        header_pattern = r'^(#{1,6})\\s+(.+)$'\n        lines = markdown_content.split('\\n')\n        \n        chunks = []\n        current_chunk = []\n        current_header = {'level': None, 'title': None}\n        \n        for line in lines:\n            header_match = re.match(header_pattern, line)\n            \n            if header_match:\n                # 前のチャンクを保存\n                if current_chunk:\n                    chunks.append(('\\n'.join(current_chunk), current_header.copy()))\n                    current_chunk = []\n                \n                # 新しいヘッダー情報を設定\n                level = len(header_match.group(1))\n                title = header_match.group(2).strip()\n                current_header = {'level': level, 'title': title}\n                current_chunk.append(line)\n            else:\n                current_chunk.append(line)\n        \n        # 最後のチャンクを保存\n        if current_chunk:\n            chunks.append(('\\n'.join(current_chunk), current_header))\n        \n        return chunks\n    \n    def _split_long_chunk(self, content: str) -> List[str]:\n        \"\"\"\n        長いチャンクを分割\n        \n        Args:\n            content: 分割するコンテンツ\n            \n        Returns:\n            List[str]: 分割されたチャンクリスト\n        \"\"\"\n        # 実際の実装では RecursiveCharacterTextSplitter を使用\n        # splitter = RecursiveCharacterTextSplitter(\n        #     chunk_size=self.chunk_size,\n        #     chunk_overlap=self.chunk_overlap,\n        #     separators=[\"\\n\\n\", \"\\n\", \". \", \" \", \"\"]\n        # )\n        # return splitter.split_text(content)\n        \n        # モックアップ実装\n        chunks = []\n        words = content.split()\n        current_chunk = []\n        current_size = 0\n        \n        for word in words:\n            word_size = len(word) + 1  # スペース込み\n            \n            if current_size + word_size > self.chunk_size and current_chunk:\n                chunks.append(' '.join(current_chunk))\n                # オーバーラップ処理\n                overlap_words = current_chunk[-self.chunk_overlap//10:] if len(current_chunk) > self.chunk_overlap//10 else current_chunk\n                current_chunk = overlap_words + [word]\n                current_size = sum(len(w) + 1 for w in current_chunk)\n            else:\n                current_chunk.append(word)\n                current_size += word_size\n        \n        if current_chunk:\n            chunks.append(' '.join(current_chunk))\n        \n        return chunks\n    \n    def _detect_chunk_type(self, content: str) -> str:\n        \"\"\"\n        チャンクタイプを検出\n        \n        Args:\n            content: チャンクコンテンツ\n            \n        Returns:\n            str: チャンクタイプ\n        \"\"\"\n        content_lower = content.lower().strip()\n        \n        # ヘッダー\n        if re.match(r'^#{1,6}\\s+', content):\n            return 'header'\n        \n        # コードブロック\n        if '```' in content or content.startswith('    '):\n            return 'code'\n        \n        # リスト\n        if re.match(r'^[\\*\\-\\+]\\s+', content, re.MULTILINE) or re.match(r'^\\d+\\.\\s+', content, re.MULTILINE):\n            return 'list'\n        \n        # テーブル\n        if '|' in content and re.search(r'\\|.*\\|', content):\n            return 'table'\n        \n        # デフォルトは段落\n        return 'paragraph'\n    \n    def _generate_chunk_id(self, source_file: str, chunk_index: int, sub_index: Optional[int] = None) -> str:\n        \"\"\"\n        チャンクIDを生成\n        \n        Args:\n            source_file: ソースファイル名\n            chunk_index: チャンクインデックス\n            sub_index: サブインデックス\n            \n        Returns:\n            str: チャンクID\n        \"\"\"\n        base_string = f\"{source_file}_{chunk_index}\"\n        if sub_index is not None:\n            base_string += f\"_{sub_index}\"\n        \n        return hashlib.md5(base_string.encode()).hexdigest()[:16]\n    \n    def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:\n        \"\"\"\n        テキストリストの埋め込みを生成\n        \n        Args:\n            texts: テキストリスト\n            \n        Returns:\n            List[List[float]]: 埋め込みリスト\n        \"\"\"\n        try:\n            logger.info(f\"🔢 埋め込み生成開始: {len(texts)}テキスト\")\n            \n            # 実際の実装では Bedrock Embeddings を使用\n            # embeddings = self.embeddings.embed_documents(texts)\n            \n            # モックアップ実装（実際の埋め込み次元は1536）\n            embeddings = []\n            for text in texts:\n                # ダミー埋め込み（実際の実装では削除）\n                mock_embedding = [0.1] * 1536  # Titan Embeddings の次元数\n                # テキストの特徴を反映したダミー値\n                text_hash = hash(text) % 1000\n                for i in range(min(10, len(mock_embedding))):\n                    mock_embedding[i] = (text_hash + i) / 1000.0\n                embeddings.append(mock_embedding)\n            \n            logger.info(f\"✅ 埋め込み生成完了: {len(embeddings)}埋め込み\")\n            return embeddings\n            \n        except Exception as e:\n            logger.error(f\"❌ 埋め込み生成エラー: {e}\")\n            raise\n    \n    def create_langchain_documents(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:\n        \"\"\"\n        LangChain Document オブジェクトを作成\n        \n        Args:\n            chunks: チャンクリスト\n            \n        Returns:\n            List[Dict]: LangChain Document 互換オブジェクト\n        \"\"\"\n        documents = []\n        \n        for chunk in chunks:\n            # 実際の実装では langchain.schema.Document を使用\n            # doc = Document(\n            #     page_content=chunk['content'],\n            #     metadata=chunk['metadata']\n            # )\n            \n            # モックアップ実装\n            doc = {\n                'page_content': chunk['content'],\n                'metadata': chunk['metadata'],\n                'type': 'Document'\n            }\n            documents.append(doc)\n        \n        return documents\n    \n    def get_processing_stats(self) -> Dict[str, Any]:\n        \"\"\"\n        処理統計を取得\n        \n        Returns:\n            Dict: 処理統計\n        \"\"\"\n        return {\n            'embedding_model': self.embedding_model,\n            'chunk_size': self.chunk_size,\n            'chunk_overlap': self.chunk_overlap,\n            'region': self.region,\n            'supported_chunk_types': ['header', 'paragraph', 'list', 'code', 'table']\n        }\n\n\ndef create_langchain_integration(config: Dict[str, Any]) -> LangChainIntegration:\n    \"\"\"\n    LangChain統合インスタンスを作成\n    \n    Args:\n        config: 設定辞書\n        \n    Returns:\n        LangChainIntegration: 統合インスタンス\n    \"\"\"\n    return LangChainIntegration(\n        region=config.get('region', 'us-east-1'),\n        embedding_model=config.get('embedding_model', 'amazon.titan-embed-text-v1'),\n        chunk_size=config.get('chunk_size', 1000),\n        chunk_overlap=config.get('chunk_overlap', 200)\n    )\n\n\n# テスト用のサンプル関数\ndef test_langchain_integration():\n    \"\"\"\n    LangChain統合のテスト\n    \"\"\"\n    # サンプルマークダウンコンテンツ\n    sample_markdown = \"\"\"\n# ドキュメントタイトル\n\nこれはサンプルドキュメントです。\n\n## セクション1\n\nセクション1の内容です。\n\n### サブセクション1.1\n\nサブセクションの内容です。\n\n- リスト項目1\n- リスト項目2\n- リスト項目3\n\n## セクション2\n\n```python\ndef hello_world():\n    print(\"Hello, World!\")\n```\n\n| 列1 | 列2 | 列3 |\n|-----|-----|-----|\n| A   | B   | C   |\n| D   | E   | F   |\n\"\"\"\n    \n    # LangChain統合をテスト\n    integration = LangChainIntegration()\n    result = integration.process_markdown_content(\n        markdown_content=sample_markdown,\n        source_file=\"test_document.md\",\n        processing_method=\"markitdown\"\n    )\n    \n    print(f\"処理結果: {result.success}\")\n    print(f\"チャンク数: {len(result.chunks)}\")\n    print(f\"埋め込み数: {len(result.embeddings)}\")\n    \n    for i, chunk in enumerate(result.chunks[:3]):  # 最初の3チャンクを表示\n        print(f\"\\nチャンク {i+1}:\")\n        print(f\"タイプ: {chunk['metadata']['chunk_type']}\")\n        print(f\"サイズ: {chunk['metadata']['chunk_size']}\")\n        print(f\"コンテンツ: {chunk['content'][:100]}...\")\n\n\nif __name__ == \"__main__\":\n    test_langchain_integration()\n"
\ No newline at end of file
+                'project_id': project_id,
+                'page_number': page_number
+            }
+            
+            logger.info(f"✅ マークダウンコンテンツ処理完了: {len(chunks)}チャンク生成")
+            
+            return ProcessingResult(
+                success=True,
+                chunks=chunks,
+                embeddings=embeddings,
+                metadata=metadata
+            )
+            
+        except Exception as e:
+            logger.error(f"❌ マークダウンコンテンツ処理エラー: {e}")
+            return ProcessingResult(
+                success=False,
+                chunks=[],
+                embeddings=[],
+                metadata={},
+                error=str(e)
+            )
+    
+    def _split_markdown_content(self, 
+                              markdown_content: str, 
+                              source_file: str,
+                              processing_method: str,
+                              page_number: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        マークダウンコンテンツをチャンクに分割
+        
+        Args:
+            markdown_content: マークダウンテキスト
+            source_file: ソースファイル名
+            processing_method: 処理方法
+            page_number: ページ番号（チャンクIDとメタデータに含める）
+            
+        Returns:
+            List[Dict]: チャンクリスト
+        """
+        chunks = []
+        # ページごとに処理した場合もチャンクIDが重複しないようにページ番号を含める
+        id_source = f"{source_file}#page={page_number}" if page_number is not None else source_file
+        
+        # ヘッダーベースの分割を実行
+        header_chunks = self._split_by_headers(markdown_content)
+        
+        for i, (content, header_info) in enumerate(header_chunks):
+            # 長いチャンクをさらに分割
+            if len(content) > self.chunk_size:
+                sub_chunks = self._split_long_chunk(content)
+                for j, sub_content in enumerate(sub_chunks):
+                    chunk_id = self._generate_chunk_id(id_source, i, j)
+                    chunk_metadata = ChunkMetadata(
+                        chunk_id=chunk_id,
+                        source_file=source_file,
+                        chunk_index=len(chunks),
+                        chunk_size=len(sub_content),
+                        chunk_type=self._detect_chunk_type(sub_content),
+                        header_level=header_info.get('level'),
+                        parent_header=header_info.get('title'),
+                        processing_method=processing_method,
+                        page_number=page_number
+                    )
+                    
+                    chunks.append({
+                        'content': sub_content.strip(),
+                        'metadata': chunk_metadata.__dict__
+                    })
+            else:
+                chunk_id = self._generate_chunk_id(id_source, i)
+                chunk_metadata = ChunkMetadata(
+                    chunk_id=chunk_id,
+                    source_file=source_file,
+                    chunk_index=len(chunks),
+                    chunk_size=len(content),
+                    chunk_type=self._detect_chunk_type(content),
+                    header_level=header_info.get('level'),
+                    parent_header=header_info.get('title'),
+                    processing_method=processing_method,
+                    page_number=page_number
+                )
+                
+                chunks.append({
+                    'content': content.strip(),
+                    'metadata': chunk_metadata.__dict__
+                })
+        
+        return chunks
+    
+    def _split_by_headers(self, markdown_content: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        ヘッダーに基づいてマークダウンを分割
+        
+        Args:
+            markdown_content: マークダウンテキスト
+            
+        Returns:
+            List[Tuple]: (コンテンツ, ヘッダー情報) のタプルリスト
+        """
+        # ヘッダーパターン
+        header_pattern = r'^(#{1,6})\s+(.+)$'
+        lines = markdown_content.split('\n')
+        
+        chunks = []
+        current_chunk = []
+        current_header = {'level': None, 'title': None}
+        
+        for line in lines:
+            header_match = re.match(header_pattern, line)
+            
+            if header_match:
+                # 前のチャンクを保存
+                if current_chunk:
+                    chunks.append(('\n'.join(current_chunk), current_header.copy()))
+                    current_chunk = []
+                
+                # 新しいヘッダー情報を設定
+                level = len(header_match.group(1))
+                title = header_match.group(2).strip()
+                current_header = {'level': level, 'title': title}
+                current_chunk.append(line)
+            else:
+                current_chunk.append(line)
+        
+        # 最後のチャンクを保存
+        if current_chunk:
+            chunks.append(('\n'.join(current_chunk), current_header))
+        
+        return chunks
+    
+    def _split_long_chunk(self, content: str) -> List[str]:
+        """
+        長いチャンクを分割
+        
+        Args:
+            content: 分割するコンテンツ
+            
+        Returns:
+            List[str]: 分割されたチャンクリスト
+        """
+        # 実際の実装では RecursiveCharacterTextSplitter を使用
+        # splitter = RecursiveCharacterTextSplitter(
+        #     chunk_size=self.chunk_size,
+        #     chunk_overlap=self.chunk_overlap,
+        #     separators=["\n\n", "\n", ". ", " ", ""]
+        # )
+        # return splitter.split_text(content)
+        
+        # モックアップ実装
+        chunks = []
+        words = content.split()
+        current_chunk = []
+        current_size = 0
+        
+        for word in words:
+            word_size = len(word) + 1  # スペース込み
+            
+            if current_size + word_size > self.chunk_size and current_chunk:
+                chunks.append(' '.join(current_chunk))
+                # オーバーラップ処理
+                overlap_words = current_chunk[-self.chunk_overlap//10:] if len(current_chunk) > self.chunk_overlap//10 else current_chunk
+                current_chunk = overlap_words + [word]
+                current_size = sum(len(w) + 1 for w in current_chunk)
+            else:
+                current_chunk.append(word)
+                current_size += word_size
+        
+        if current_chunk:
+            chunks.append(' '.join(current_chunk))
+        
+        return chunks
+    
+    def _detect_chunk_type(self, content: str) -> str:
+        """
+        チャンクタイプを検出
+        
+        Args:
+            content: チャンクコンテンツ
+            
+        Returns:
+            str: チャンクタイプ
+        """
+        content_lower = content.lower().strip()
+        
+        # ヘッダー
+        if re.match(r'^#{1,6}\s+', content):
+            return 'header'
+        
+        # コードブロック
+        if '```' in content or content.startswith('    '):
+            return 'code'
+        
+        # リスト
+        if re.match(r'^[\*\-\+]\s+', content, re.MULTILINE) or re.match(r'^\d+\.\s+', content, re.MULTILINE):
+            return 'list'
+        
+        # テーブル
+        if '|' in content and re.search(r'\|.*\|', content):
+            return 'table'
+        
+        # デフォルトは段落
+        return 'paragraph'
+    
+    def _generate_chunk_id(self, source_file: str, chunk_index: int, sub_index: Optional[int] = None) -> str:
+        """
+        チャンクIDを生成
+        
+        Args:
+            source_file: ソースファイル名
+            chunk_index: チャンクインデックス
+            sub_index: サブインデックス
+            
+        Returns:
+            str: チャンクID
+        """
+        base_string = f"{source_file}_{chunk_index}"
+        if sub_index is not None:
+            base_string += f"_{sub_index}"
+        
+        return hashlib.md5(base_string.encode()).hexdigest()[:16]
+    
+    def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        テキストリストの埋め込みを生成
+        
+        Args:
+            texts: テキストリスト
+            
+        Returns:
+            List[List[float]]: 埋め込みリスト
+        """
+        try:
+            logger.info(f"🔢 埋め込み生成開始: {len(texts)}テキスト")
+            
+            # 実際の実装では Bedrock Embeddings を使用
+            # embeddings = self.embeddings.embed_documents(texts)
+            
+            # モックアップ実装（fake_bedrock と同じ決定的な埋め込み、次元数はモデルの既定値）
+            dimension = embedding_dimension(self.embedding_model)
+            embeddings = [semantic_embedding(text, dimension) for text in texts]
+            
+            logger.info(f"✅ 埋め込み生成完了: {len(embeddings)}埋め込み")
+            return embeddings
+            
+        except Exception as e:
+            logger.error(f"❌ 埋め込み生成エラー: {e}")
+            raise
+    
+    def create_langchain_documents(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        LangChain Document オブジェクトを作成
+        
+        Args:
+            chunks: チャンクリスト
+            
+        Returns:
+            List[Dict]: LangChain Document 互換オブジェクト
+        """
+        documents = []
+        
+        for chunk in chunks:
+            # 実際の実装では langchain.schema.Document を使用
+            # doc = Document(
+            #     page_content=chunk['content'],
+            #     metadata=chunk['metadata']
+            # )
+            
+            # モックアップ実装
+            doc = {
+                'page_content': chunk['content'],
+                'metadata': chunk['metadata'],
+                'type': 'Document'
+            }
+            documents.append(doc)
+        
+        return documents
+    
+    def get_processing_stats(self) -> Dict[str, Any]:
+        """
+        処理統計を取得
+        
+        Returns:
+            Dict: 処理統計
+        """
+        return {
+            'embedding_model': self.embedding_model,
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+            'region': self.region,
+            'supported_chunk_types': ['header', 'paragraph', 'list', 'code', 'table']
+        }
+
+
+def create_langchain_integration(config: Dict[str, Any]) -> LangChainIntegration:
+    """
+    LangChain統合インスタンスを作成
+    
+    Args:
+        config: 設定辞書
+        
+    Returns:
+        LangChainIntegration: 統合インスタンス
+    """
+    return LangChainIntegration(
+        region=config.get('region', 'us-east-1'),
+        embedding_model=config.get('embedding_model', 'amazon.titan-embed-text-v1'),
+        chunk_size=config.get('chunk_size', 1000),
+        chunk_overlap=config.get('chunk_overlap', 200)
+    )
+
+
+# テスト用のサンプル関数
+def test_langchain_integration():
+    """
+    LangChain統合のテスト
+    """
+    # サンプルマークダウンコンテンツ
+    sample_markdown = """
+# ドキュメントタイトル
+
+これはサンプルドキュメントです。
+
+## セクション1
+
+セクション1の内容です。
+
+### サブセクション1.1
+
+サブセクションの内容です。
+
+- リスト項目1
+- リスト項目2
+- リスト項目3
+
+## セクション2
+
+```python
+def hello_world():
+    print("Hello, World!")
+```
+
+| 列1 | 列2 | 列3 |
+|-----|-----|-----|
+| A   | B   | C   |
+| D   | E   | F   |
+"""
+    
+    # LangChain統合をテスト
+    integration = LangChainIntegration()
+    result = integration.process_markdown_content(
+        markdown_content=sample_markdown,
+        source_file="test_document.md",
+        processing_method="markitdown"
+    )
+    
+    print(f"処理結果: {result.success}")
+    print(f"チャンク数: {len(result.chunks)}")
+    print(f"埋め込み数: {len(result.embeddings)}")
+    
+    for i, chunk in enumerate(result.chunks[:3]):  # 最初の3チャンクを表示
+        print(f"\nチャンク {i+1}:")
+        print(f"タイプ: {chunk['metadata']['chunk_type']}")
+        print(f"サイズ: {chunk['metadata']['chunk_size']}")
+        print(f"コンテンツ: {chunk['content'][:100]}...")
+
+
+if __name__ == "__main__":
+    test_langchain_integration()
@@ -0,0 +1,446 @@
+"""
+HTML/XMLのストリーミング抽出
+DOMを構築せずに逐次解析し、ナビゲーション・スクリプト等の定型要素を読み飛ばしながら
+指定した要素の境界でレコードに区切り、チャンクを逐次生成する。
+"""
+
+import codecs
+import hashlib
+import io
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from content_sniffer import sniff_content
+from langchain_integration import ChunkMetadata
+
+logger = logging.getLogger(__name__)
+
+MARKUP_STREAMING_ENABLED = os.environ.get('MARKUP_STREAMING_ENABLED', 'true').lower() == 'true'
+MARKUP_FORMATS = frozenset(['html', 'xml'])
+
+# 逐次デコード・解析する単位
+READ_BLOCK_SIZE = 64 * 1024
+
+# 変換結果に含めない定型要素（内容ごと読み飛ばす）
+HTML_BOILERPLATE_TAGS = frozenset([
+    'script', 'style', 'noscript', 'template', 'nav', 'header', 'footer', 'aside', 'svg', 'iframe', 'form'
+])
+# テキストブロックの区切りとなる要素
+HTML_BLOCK_TAGS = frozenset([
+    'p', 'div', 'li', 'dt', 'dd', 'tr', 'td', 'th', 'pre', 'blockquote', 'br', 'hr', 'table', 'ul', 'ol',
+    'section', 'article', 'main', 'title', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'figcaption', 'caption'
+])
+HTML_HEADING_TAGS = {f'h{level}': level for level in range(1, 7)}
+# 終了タグを持たない要素
+HTML_VOID_TAGS = frozenset(['br', 'hr', 'img', 'input', 'meta', 'link', 'area', 'base', 'col', 'embed', 'source', 'wbr'])
+
+# チャンクの区切りとする要素の既定値（XMLで空の場合はルート直下の要素）
+DEFAULT_BOUNDARY_ELEMENTS = {
+    'html': ['article', 'section', 'h1', 'h2'],
+    'xml': []
+}
+
+
+def _local_name(tag: str) -> str:
+    """名前空間を除いた要素名"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_xml_records(file_content: bytes, record_elements: Optional[List[str]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    XMLをレコード単位で逐次解析（処理済みの要素は破棄）
+
+    Args:
+        file_content: ファイル内容
+        record_elements: レコードとする要素名（空の場合はルート直下の要素）
+
+    Yields:
+        Tuple[str, str]: (レコードの見出し, レコードのテキスト)
+    """
+    record_names = frozenset(record_elements or [])
+    stack: List[ET.Element] = []
+    record_depth = None
+
+    for event, elem in ET.iterparse(io.BytesIO(file_content), events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if record_depth is None:
+                name = _local_name(elem.tag)
+                if (name in record_names) if record_names else len(stack) == 2:
+                    record_depth = len(stack)
+            continue
+
+        depth = len(stack)
+        stack.pop()
+        if record_depth is not None and depth > record_depth:
+            # レコード内の要素はレコード終了時にまとめて処理
+            continue
+
+        if depth == record_depth:
+            record_depth = None
+            yield _render_xml_record(elem)
+        elif elem.text and elem.text.strip() and len(elem) == 0 and depth > 1:
+            # レコード外のテキスト要素（ヘッダー情報等）は単独のレコードとする
+            yield _local_name(elem.tag), f"- **{_local_name(elem.tag)}**: {elem.text.strip()}"
+
+        elem.clear()
+        if stack:
+            # 親から切り離して木が成長しないようにする
+            try:
+                stack[-1].remove(elem)
+            except ValueError:
+                pass
+
+
+def _render_xml_record(record: ET.Element) -> Tuple[str, str]:
+    """レコード要素を見出しと「パス: 値」形式のテキストに変換"""
+    name = _local_name(record.tag)
+    identifier = next((record.get(key) for key in ('id', 'name', 'key', 'code') if record.get(key)), None)
+    label = f"{name} {identifier}" if identifier else name
+
+    lines = [f"### {label}"]
+    for key, value in record.attrib.items():
+        lines.append(f"- **@{_local_name(key)}**: {value}")
+
+    def walk(elem: ET.Element, path: str) -> None:
+        for child in elem:
+            child_path = f"{path}/{_local_name(child.tag)}" if path else _local_name(child.tag)
+            text = ' '.join((child.text or '').split())
+            if text:
+                lines.append(f"- **{child_path}**: {text}")
+            for key, value in child.attrib.items():
+                lines.append(f"- **{child_path}@{_local_name(key)}**: {value}")
+            walk(child, child_path)
+
+    if record.text and record.text.strip():
+        lines.append(' '.join(record.text.split()))
+    walk(record, '')
+    return label, '\n'.join(lines)
+
+
+class _HtmlBlockParser(HTMLParser):
+    """定型要素を読み飛ばしながらテキストブロックを逐次抽出するHTMLパーサー"""
+
+    def __init__(self, boundary_elements: List[str]):
+        super().__init__(convert_charrefs=True)
+        self.boundary_elements = frozenset(boundary_elements)
+        self.records: List[Tuple[str, str]] = []
+        self.dropped_elements = 0
+        self._skip_depth = 0
+        self._text: List[str] = []
+        self._blocks: List[str] = []
+        self._label = ''
+        self._prefix = ''
+        self._preformatted = 0
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skip_depth:
+            if tag in HTML_BOILERPLATE_TAGS:
+                self._skip_depth += 1
+            return
+        if tag in HTML_BOILERPLATE_TAGS:
+            self._flush_block()
+            self._skip_depth = 1
+            self.dropped_elements += 1
+            return
+        if tag in self.boundary_elements:
+            self._flush_record()
+        if tag in HTML_BLOCK_TAGS:
+            self._flush_block()
+            if tag in HTML_HEADING_TAGS:
+                self._prefix = '#' * HTML_HEADING_TAGS[tag] + ' '
+            elif tag == 'title':
+                self._prefix = '# '
+            elif tag == 'li':
+                self._prefix = '- '
+        if tag == 'pre':
+            self._preformatted += 1
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if not self._skip_depth and tag in HTML_BLOCK_TAGS:
+            self._flush_block()
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_depth:
+            if tag in HTML_BOILERPLATE_TAGS:
+                self._skip_depth -= 1
+            return
+        if tag in HTML_BLOCK_TAGS and tag not in HTML_VOID_TAGS:
+            is_heading = tag in HTML_HEADING_TAGS
+            text = self._flush_block()
+            if is_heading and text:
+                self._label = text.lstrip('# ')
+        if tag == 'pre' and self._preformatted:
+            self._preformatted -= 1
+
+    def handle_data(self, data: str) -> None:
+        if not self._skip_depth:
+            self._text.append(data)
+
+    def close(self) -> None:
+        super().close()
+        self._flush_record()
+
+    def _flush_block(self) -> str:
+        raw = ''.join(self._text)
+        text = raw.strip('\n') if self._preformatted else ' '.join(raw.split())
+        self._text = []
+        prefix, self._prefix = self._prefix, ''
+        if not text:
+            return ''
+        block = prefix + text
+        self._blocks.append(block)
+        return block
+
+    def _flush_record(self) -> None:
+        self._flush_block()
+        if self._blocks:
+            self.records.append((self._label, '\n\n'.join(self._blocks)))
+            self._blocks = []
+
+
+def iter_html_records(file_content: bytes, boundary_elements: Optional[List[str]] = None,
+                      stats: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    HTMLを区切り要素ごとのレコードとして逐次抽出
+
+    Args:
+        file_content: ファイル内容
+        boundary_elements: レコードの区切りとする要素名
+        stats: 読み飛ばした定型要素数を記録する辞書（droppedElements）
+
+    Yields:
+        Tuple[str, str]: (直前の見出し, レコードのテキスト)
+    """
+    sniff = sniff_content(file_content[:8192])
+    decoder = codecs.getincrementaldecoder(sniff.encoding or 'utf-8')(errors='replace')
+    parser = _HtmlBlockParser(DEFAULT_BOUNDARY_ELEMENTS['html'] if boundary_elements is None else boundary_elements)
+
+    view = memoryview(file_content)
+    for offset in range(0, len(view), READ_BLOCK_SIZE):
+        parser.feed(decoder.decode(view[offset:offset + READ_BLOCK_SIZE]))
+        yield from parser.records
+        parser.records = []
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.records
+    if stats is not None:
+        stats['droppedElements'] = parser.dropped_elements
+
+
+class MarkupChunkStream:
+    """HTML/XMLからレコード境界に沿ったチャンクを逐次生成"""
+
+    # チャンクメタデータの位置キー（record_start / record_end、チェックポイントの再開位置）
+    POSITION_KEY = 'record'
+
+    def __init__(self, file_content: bytes, file_format: str, source_file: str,
+                 chunk_size: int = 1000, start_record: int = 0,
+                 boundary_elements: Optional[List[str]] = None):
+        """
+        初期化
+
+        Args:
+            file_content: ファイル内容
+            file_format: ファイル形式（html / xml）
+            source_file: ソースファイル名
+            chunk_size: チャンクの目安文字数
+            start_record: 処理を開始するレコード（0始まり、チェックポイントからの再開用）
+            boundary_elements: チャンクの区切りとする要素名（Noneで形式ごとの既定値）
+        """
+        if file_format not in MARKUP_FORMATS:
+            raise ValueError(f"HTML/XMLではないファイル形式: {file_format}")
+        self.file_content = file_content
+        self.file_format = file_format
+        self.source_file = source_file
+        self.chunk_size = chunk_size
+        self.start_record = start_record
+        self.boundary_elements = (DEFAULT_BOUNDARY_ELEMENTS[file_format] if boundary_elements is None
+                                  else boundary_elements)
+
+        self.records = 0
+        self.chunks = 0
+        self._parser_stats: Dict[str, Any] = {}
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    def _iter_records(self) -> Iterator[Tuple[str, str]]:
+        if self.file_format == 'xml':
+            return iter_xml_records(self.file_content, self.boundary_elements)
+        return iter_html_records(self.file_content, self.boundary_elements, self._parser_stats)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        self._started_at = time.monotonic()
+        try:
+            yield from self._iter_chunks()
+        finally:
+            self._finished_at = time.monotonic()
+
+    def _iter_chunks(self) -> Iterator[Dict[str, Any]]:
+        parts: List[str] = []
+        length = 0
+        record_start = last_record = None
+        label = None
+
+        for record_label, text in self._iter_records():
+            record_index = self.records
+            self.records += 1
+            if record_index < self.start_record:
+                continue
+
+            # チャンクサイズを超えるレコードは行単位で分割
+            for piece in self._split_record(text):
+                if parts and length + len(piece) + 2 > self.chunk_size:
+                    yield self._make_chunk(parts, record_start, last_record, label)
+                    parts, length = [], 0
+                if not parts:
+                    record_start = record_index
+                    label = record_label
+                parts.append(piece)
+                length += len(piece) + 2
+                last_record = record_index
+
+        if parts:
+            yield self._make_chunk(parts, record_start, last_record, label)
+
+    def _split_record(self, text: str) -> List[str]:
+        if len(text) <= self.chunk_size:
+            return [text]
+        pieces = []
+        current: List[str] = []
+        length = 0
+        for line in text.split('\n'):
+            while len(line) > self.chunk_size:
+                pieces.extend(['\n'.join(current)] if current else [])
+                current, length = [], 0
+                pieces.append(line[:self.chunk_size])
+                line = line[self.chunk_size:]
+            if current and length + len(line) + 1 > self.chunk_size:
+                pieces.append('\n'.join(current))
+                current, length = [], 0
+            current.append(line)
+            length += len(line) + 1
+        if current:
+            pieces.append('\n'.join(current))
+        return [piece for piece in pieces if piece.strip()]
+
+    def _make_chunk(self, parts: List[str], record_start: int, record_end: int,
+                    label: Optional[str]) -> Dict[str, Any]:
+        content = '\n\n'.join(parts)
+        chunk_id = hashlib.md5(
+            f"{self.source_file}#records={record_start}-{record_end}:{self.chunks}".encode()
+        ).hexdigest()[:16]
+        metadata = ChunkMetadata(
+            chunk_id=chunk_id,
+            source_file=self.source_file,
+            chunk_index=self.chunks,
+            chunk_size=len(content),
+            chunk_type='record' if self.file_format == 'xml' else 'section',
+            parent_header=label or None,
+            processing_method='streaming'
+        ).__dict__
+        metadata.update({'record_start': record_start, 'record_end': record_end})
+        self.chunks += 1
+        return {'content': content, 'metadata': metadata}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """処理統計（レコード数・チャンク数・スループット）"""
+        elapsed = 0.0
+        if self._started_at is not None:
+            elapsed = (self._finished_at or time.monotonic()) - self._started_at
+        return {
+            'records': self.records,
+            'startRecord': self.start_record,
+            'chunks': self.chunks,
+            'boundaryElements': self.boundary_elements,
+            'droppedElements': self._parser_stats.get('droppedElements', 0),
+            'elapsedSeconds': round(elapsed, 3),
+            'recordsPerSecond': round(self.records / elapsed, 1) if elapsed > 0 else None,
+            'mbPerSecond': round(len(self.file_content) / 1024 / 1024 / elapsed, 2) if elapsed > 0 else None
+        }
+
+
+def summarize_markup(file_content: bytes, file_format: str, boundary_elements: Optional[List[str]] = None,
+                     sample_records: int = 3, sample_chars: int = 2000) -> Dict[str, Any]:
+    """
+    HTML/XMLの概要（レコード数・先頭レコード）をストリーミングで集計
+
+    Args:
+        file_content: ファイル内容
+        file_format: ファイル形式
+        boundary_elements: レコードの区切りとする要素名
+        sample_records: 概要に含める先頭レコード数
+        sample_chars: 先頭レコードの最大文字数
+
+    Returns:
+        Dict: 概要
+    """
+    stream = MarkupChunkStream(file_content, file_format, '', boundary_elements=boundary_elements)
+    samples = []
+    labels = []
+    record_count = 0
+    for label, text in stream._iter_records():
+        if len(samples) < sample_records:
+            samples.append(text[:sample_chars])
+        if label and len(labels) < 20 and label not in labels:
+            labels.append(label)
+        record_count += 1
+    return {
+        'recordCount': record_count,
+        'labels': labels,
+        'sampleRecords': samples,
+        'droppedElements': stream._parser_stats.get('droppedElements', 0)
+    }
+
+
+def _benchmark_parse(approach: str, records: int) -> Tuple[int, float, float, float]:
+    """ベンチマーク用: 独立プロセスで解析し (件数, 秒, tracemallocピークMB, RSS増加MB) を返す"""
+    import resource
+    import tracemalloc
+    from xml.dom import minidom
+
+    content = ('<?xml version="1.0" encoding="UTF-8"?>\n<export>' + ''.join(
+        f'<item id="{i}"><name>商品{i}</name><price currency="JPY">{i * 10}</price>'
+        f'<description>説明文 {i} です。</description></item>'
+        for i in range(records)
+    ) + '</export>').encode('utf-8')
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    started = time.monotonic()
+    if approach == 'stream':
+        count = sum(1 for _ in MarkupChunkStream(content, 'xml', 'export.xml', chunk_size=2000))
+    elif approach == 'etree':
+        count = len(ET.fromstring(content))
+    else:
+        count = len(minidom.parseString(content).getElementsByTagName('item'))
+    elapsed = time.monotonic() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+    return count, elapsed, peak / 1024 / 1024, rss_growth / 1024
+
+
+# テスト用のサンプル関数
+def test_markup_stream():
+    """
+    ストリーミング解析とDOM構築のスループット・ピークメモリ比較（各方式を独立プロセスで計測）
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    records = 50000
+    context = multiprocessing.get_context('spawn')
+    for label, approach in (('ストリーミング', 'stream'), ('ElementTree(DOM)', 'etree'), ('minidom(DOM)', 'minidom')):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            count, elapsed, peak_mb, rss_mb = executor.submit(_benchmark_parse, approach, records).result()
+        print(f"{label}: {count}件, {records / elapsed:,.0f}レコード/秒, "
+              f"ピーク {peak_mb:.1f}MB (tracemalloc), RSS増加 {rss_mb:.1f}MB")
+
+
+if __name__ == "__main__":
+    test_markup_stream()
@@ -0,0 +1,515 @@
+"""
+取り込みパイプラインの継続的なメモリ計測とバックプレッシャー
+バックグラウンドスレッドでRSSを定期的に採取し、トレーサーのスパン（段階）ごとのピークを記録する
+（任意でtracemallocのスナップショットから段階ごとの割り当て箇所の上位を記録）。
+RSSが performance.memoryLimitMB に近づくと、埋め込みバッチの縮小・インデックス格納の早期フラッシュ・
+中間データの一時ファイルへの退避を呼び出し側に指示し、大きなファイルでもOOMで強制終了せずに処理を続ける。
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+MEMORY_MONITOR_ENABLED = os.environ.get('MARKITDOWN_MEMORY_MONITOR', 'true').lower() == 'true'
+# RSSの採取間隔（0でスパンの開始・終了時のみ採取）
+MEMORY_SAMPLE_INTERVAL_MS = float(os.environ.get('MEMORY_SAMPLE_INTERVAL_MS', '50'))
+# 段階ごとにtracemallocのスナップショットを取得（割り当てのたびにオーバーヘッドがあるため既定は無効）
+MEMORY_TRACEMALLOC_ENABLED = os.environ.get('MEMORY_TRACEMALLOC', 'false').lower() == 'true'
+# 上限に対する比率: これを超えるとバッチ縮小・早期フラッシュ
+MEMORY_SOFT_LIMIT_RATIO = float(os.environ.get('MEMORY_SOFT_LIMIT_RATIO', '0.7'))
+# 上限に対する比率: これを超えると最小バッチ・一時ファイルへの退避
+MEMORY_HARD_LIMIT_RATIO = float(os.environ.get('MEMORY_HARD_LIMIT_RATIO', '0.85'))
+# 退避ファイルの作成先（Lambdaでは /tmp のエフェメラルストレージ）
+MEMORY_SPILL_DIR = os.environ.get('MEMORY_SPILL_DIR') or tempfile.gettempdir()
+
+# 段階ごとに記録する割り当て箇所の件数
+TRACEMALLOC_TOP_ALLOCATIONS = 5
+# 埋め込みベクトル1件あたりの概算メモリ（1536次元のfloatのリスト）
+EMBEDDING_BYTES_ESTIMATE = 1536 * 32
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_MB = 1024 * 1024
+
+
+class MemoryPressure:
+    """メモリ逼迫度"""
+    NORMAL = 'normal'
+    ELEVATED = 'elevated'
+    CRITICAL = 'critical'
+
+
+def read_rss_bytes() -> Optional[int]:
+    """
+    現在のプロセスのRSS（psutilを使わずに取得）
+
+    Returns:
+        Optional[int]: RSS（バイト、/proc が無い環境ではresourceによる最大RSS、取得できない場合はNone）
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOSはバイト、Linuxはキロバイト単位
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def effective_limit_mb(configured_mb: Optional[float]) -> float:
+    """
+    実効的なメモリ上限
+
+    Args:
+        configured_mb: 設定値（performance.memoryLimitMB）
+
+    Returns:
+        float: 設定値とLambdaの割り当てメモリ（AWS_LAMBDA_FUNCTION_MEMORY_SIZE）の小さい方
+    """
+    limits = [float(configured_mb)] if configured_mb and float(configured_mb) > 0 else []
+    lambda_memory = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if lambda_memory and lambda_memory.isdigit():
+        limits.append(float(lambda_memory))
+    return min(limits) if limits else 1024.0
+
+
+def _to_mb(value: Optional[float]) -> Optional[float]:
+    return round(value / _MB, 2) if value is not None else None
+
+
+class MemoryMonitor:
+    """RSSの継続的な採取・段階ごとのピーク記録・逼迫度に応じた処理量の調整"""
+
+    def __init__(self, limit_mb: float = 1024,
+                 interval_ms: float = MEMORY_SAMPLE_INTERVAL_MS,
+                 soft_ratio: float = MEMORY_SOFT_LIMIT_RATIO,
+                 hard_ratio: float = MEMORY_HARD_LIMIT_RATIO,
+                 tracemalloc_enabled: bool = MEMORY_TRACEMALLOC_ENABLED,
+                 sampler: Callable[[], Optional[int]] = read_rss_bytes):
+        """
+        初期化
+
+        Args:
+            limit_mb: メモリ上限（MB）
+            interval_ms: バックグラウンドでの採取間隔（ミリ秒、0で無効）
+            soft_ratio: バッチ縮小・早期フラッシュを始める上限比率
+            hard_ratio: 最小バッチ・一時ファイルへの退避を始める上限比率
+            tracemalloc_enabled: 段階ごとにtracemallocのスナップショットを取得するか
+            sampler: RSS（バイト）の取得関数
+        """
+        self.limit_bytes = limit_mb * _MB
+        self.interval_ms = interval_ms
+        self.soft_ratio = soft_ratio
+        self.hard_ratio = hard_ratio
+        self.tracemalloc_enabled = tracemalloc_enabled
+        self.sampler = sampler
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._tracer: Optional[Any] = None
+        self._started_tracemalloc = False
+        # 自プロセス外のメモリ使用量（変換ワーカーなど）の取得関数
+        self._sources: Dict[str, Callable[[], Optional[int]]] = {}
+        self._reset()
+
+    def _reset(self) -> None:
+        self._current: Optional[int] = None
+        self._source_bytes: Dict[str, int] = {}
+        self._baseline: Optional[int] = None
+        self._peak = 0
+        self._samples = 0
+        self._open: Dict[int, Dict[str, Any]] = {}
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        self._adaptations = {'batchShrinks': 0, 'earlyFlushes': 0, 'slicedIndexing': 0,
+                             'deferredEmbeddings': 0, 'spills': 0, 'spilledItems': 0}
+
+    def set_limit(self, limit_mb: float) -> None:
+        """メモリ上限（MB）を変更"""
+        self.limit_bytes = limit_mb * _MB
+
+    def add_source(self, name: str, sampler: Callable[[], Optional[int]]) -> None:
+        """
+        自プロセスのRSSに加算するメモリ使用量の取得関数を登録（同じ名前は置き換え）
+
+        子プロセスのメモリもコンテナのメモリ上限に含まれるため、逼迫度の判定に加える。
+
+        Args:
+            name: 名前（レポートの sourcesMB のキー）
+            sampler: メモリ使用量（バイト）の取得関数
+        """
+        with self._lock:
+            self._sources[name] = sampler
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, tracer: Optional[Any] = None) -> 'MemoryMonitor':
+        """
+        呼び出し1回分の計測を開始（統計をリセットし、採取スレッドを起動）
+
+        Args:
+            tracer: スパンの開始・終了を通知するトレーサー（段階ごとのピークの記録先）
+
+        Returns:
+            MemoryMonitor: 自身
+        """
+        self.stop()
+        with self._lock:
+            self._reset()
+        if tracer is not None:
+            tracer.add_listener(self.on_span)
+            self._tracer = tracer
+        if self.tracemalloc_enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._baseline = self.sample()
+        if self.interval_ms > 0:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> Dict[str, Any]:
+        """
+        計測を終了（採取スレッドを停止）
+
+        Returns:
+            Dict: 計測結果（report を参照）
+        """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self._tracer is not None:
+            self._tracer.remove_listener(self.on_span)
+            self._tracer = None
+        self.sample()
+        report = self.report()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return report
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval_ms / 1000):
+            self.sample()
+
+    def sample(self) -> Optional[int]:
+        """
+        RSSを採取し、全体と実行中の段階のピークを更新
+
+        Returns:
+            Optional[int]: RSS（バイト、登録した取得関数の使用量を含む）
+        """
+        rss = self.sampler()
+        if rss is None:
+            return None
+        with self._lock:
+            sources = list(self._sources.items())
+        source_bytes = {}
+        for name, sampler in sources:
+            try:
+                source_bytes[name] = sampler() or 0
+            except Exception as e:
+                logger.debug(f"メモリ使用量を取得できません: {name} - {e}")
+        rss += sum(source_bytes.values())
+        with self._lock:
+            self._current = rss
+            self._source_bytes = source_bytes
+            self._samples += 1
+            self._peak = max(self._peak, rss)
+            for entry in self._open.values():
+                if rss > entry['peak']:
+                    entry['peak'] = rss
+        return rss
+
+    def on_span(self, event: str, span: Any) -> None:
+        """
+        スパンの開始・終了の通知（Tracer.add_listener に登録）
+
+        Args:
+            event: 'start' または 'end'
+            span: スパン（終了時に memoryPeakMB 属性を追加）
+        """
+        rss = self.sample()
+        if event == 'start':
+            with self._lock:
+                self._open[id(span)] = {'start': rss or 0, 'peak': rss or 0}
+            return
+        with self._lock:
+            entry = self._open.pop(id(span), None)
+            if entry is None:
+                return
+            stage = self._stages.setdefault(span.name, {'count': 0, 'peakBytes': 0, 'maxGrowthBytes': 0})
+            stage['count'] += 1
+            stage['peakBytes'] = max(stage['peakBytes'], entry['peak'])
+            stage['maxGrowthBytes'] = max(stage['maxGrowthBytes'], entry['peak'] - entry['start'])
+        span.set_attributes(memoryPeakMB=_to_mb(entry['peak']))
+        if self.tracemalloc_enabled and tracemalloc.is_tracing():
+            self._record_allocations(span.name)
+
+    def _record_allocations(self, name: str) -> None:
+        """段階の終了時点のtracemallocの割り当て上位（段階内で最も多い時点のみ保持）"""
+        traced_current, _ = tracemalloc.get_traced_memory()
+        with self._lock:
+            stage = self._stages[name]
+            if traced_current <= stage.get('tracedBytes', -1):
+                return
+            stage['tracedBytes'] = traced_current
+        statistics = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP_ALLOCATIONS]
+        allocations = [{
+            'location': f"{item.traceback[0].filename}:{item.traceback[0].lineno}",
+            'sizeKB': round(item.size / 1024, 1),
+            'count': item.count
+        } for item in statistics]
+        with self._lock:
+            stage['topAllocations'] = allocations
+
+    def current_bytes(self) -> Optional[int]:
+        """直近のRSS（採取スレッドが動いていない場合はその場で採取）"""
+        if not self.running:
+            return self.sample()
+        with self._lock:
+            return self._current
+
+    def usage_ratio(self) -> float:
+        """直近のRSSの上限に対する比率"""
+        current = self.current_bytes()
+        if current is None or self.limit_bytes <= 0:
+            return 0.0
+        return current / self.limit_bytes
+
+    def pressure(self) -> str:
+        """現在の逼迫度（MemoryPressure）"""
+        ratio = self.usage_ratio()
+        if ratio >= self.hard_ratio:
+            return MemoryPressure.CRITICAL
+        if ratio >= self.soft_ratio:
+            return MemoryPressure.ELEVATED
+        return MemoryPressure.NORMAL
+
+    def headroom_bytes(self) -> float:
+        """バッチ縮小を始める水準までの残りメモリ（バイト）"""
+        return self.limit_bytes * self.soft_ratio - (self.current_bytes() or 0)
+
+    def record(self, adaptation: str, count: int = 1) -> None:
+        """逼迫による処理量の調整を記録"""
+        with self._lock:
+            self._adaptations[adaptation] = self._adaptations.get(adaptation, 0) + count
+
+    def fit_batch_size(self, batch_size: int, minimum: int = 1) -> int:
+        """
+        逼迫度に応じてバッチサイズを縮小
+
+        Args:
+            batch_size: 希望するバッチサイズ
+            minimum: 最小バッチサイズ
+
+        Returns:
+            int: 通常時はそのまま、ELEVATEDで半分、CRITICALで最小値
+        """
+        pressure = self.pressure()
+        if pressure == MemoryPressure.NORMAL:
+            return batch_size
+        fitted = minimum if pressure == MemoryPressure.CRITICAL else max(minimum, batch_size // 2)
+        if fitted < batch_size:
+            self.record('batchShrinks')
+            logger.info(f"メモリ逼迫のためバッチサイズを縮小: {batch_size} -> {fitted} "
+                        f"({self.usage_ratio():.0%} / {_to_mb(self.limit_bytes)}MB)")
+        return min(fitted, batch_size)
+
+    def should_flush(self) -> bool:
+        """バッファ中のデータを早期に書き出すべきか（ELEVATED以上）"""
+        return self.pressure() != MemoryPressure.NORMAL
+
+    def should_spill(self) -> bool:
+        """保持中の中間データを一時ファイルに退避すべきか（CRITICAL）"""
+        return self.pressure() == MemoryPressure.CRITICAL
+
+    def should_slice(self, items: int, bytes_per_item: int = EMBEDDING_BYTES_ESTIMATE) -> bool:
+        """
+        一括処理せず分割して格納すべきか
+
+        Args:
+            items: 処理件数
+            bytes_per_item: 1件あたりの概算メモリ
+
+        Returns:
+            bool: 逼迫している、または一括処理の概算が残りメモリを超える場合True
+        """
+        return self.should_flush() or items * bytes_per_item > self.headroom_bytes()
+
+    def report(self) -> Dict[str, Any]:
+        """
+        計測結果
+
+        Returns:
+            Dict: limitMB, baselineMB, peakMB, currentMB（登録した取得関数の使用量を含む）,
+                  sourcesMB（取得関数ごとの直近の使用量）, samples, pressure,
+                  stages（段階名 → count, peakMB, maxGrowthMB, 任意でtracemallocの割り当て上位）, adaptations
+        """
+        with self._lock:
+            stages = {}
+            for name, stage in sorted(self._stages.items()):
+                stages[name] = {
+                    'count': stage['count'],
+                    'peakMB': _to_mb(stage['peakBytes']),
+                    'maxGrowthMB': _to_mb(stage['maxGrowthBytes'])
+                }
+                if 'tracedBytes' in stage:
+                    stages[name]['tracedMB'] = _to_mb(stage['tracedBytes'])
+                    stages[name]['topAllocations'] = stage.get('topAllocations', [])
+            summary = {
+                'limitMB': _to_mb(self.limit_bytes),
+                'baselineMB': _to_mb(self._baseline),
+                'peakMB': _to_mb(self._peak),
+                'currentMB': _to_mb(self._current),
+                'sourcesMB': {name: _to_mb(value) for name, value in self._source_bytes.items()},
+                'samples': self._samples,
+                'stages': stages,
+                'adaptations': dict(self._adaptations)
+            }
+        summary['pressure'] = self.pressure()
+        return summary
+
+
+class SpillList:
+    """
+    追加専用のリスト（メモリ逼迫時は保持中の要素をJSON Lines形式の一時ファイルへ退避）
+
+    len・反復・整数インデックスに対応し、退避済みの要素は読み出し時にファイルから復元する。
+    """
+
+    def __init__(self, monitor: Optional[MemoryMonitor] = None, spill_dir: str = MEMORY_SPILL_DIR):
+        """
+        初期化
+
+        Args:
+            monitor: 逼迫度の判定に使うモニター（Noneの場合は退避しない）
+            spill_dir: 一時ファイルの作成先
+        """
+        self.monitor = monitor
+        self.spill_dir = spill_dir
+        self._items: List[Any] = []
+        self._file: Optional[Any] = None
+        self._spilled = 0
+
+    @property
+    def spilled_count(self) -> int:
+        return self._spilled
+
+    def append(self, item: Any) -> None:
+        self._items.append(item)
+
+    def extend(self, items: Iterable[Any]) -> None:
+        """要素を追加し、逼迫している場合は保持中の要素を退避"""
+        self._items.extend(items)
+        if self.monitor is not None and self._items and self.monitor.should_spill():
+            self.spill()
+
+    def spill(self) -> int:
+        """
+        保持中の要素を一時ファイルに書き出してメモリから解放
+
+        Returns:
+            int: 退避した要素数
+        """
+        if not self._items:
+            return 0
+        if self._file is None:
+            self._file = tempfile.NamedTemporaryFile('w+', dir=self.spill_dir, prefix='spill-', suffix='.jsonl')
+        for item in self._items:
+            self._file.write(json.dumps(item, separators=(',', ':')))
+            self._file.write('\n')
+        self._file.flush()
+        count = len(self._items)
+        self._spilled += count
+        self._items = []
+        if self.monitor is not None:
+            self.monitor.record('spills')
+            self.monitor.record('spilledItems', count)
+        logger.info(f"メモリ逼迫のため中間データを一時ファイルに退避: {count}件 (累計 {self._spilled}件)")
+        return count
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._items)
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._file is not None:
+            with open(self._file.name) as spilled:
+                for line in spilled:
+                    yield json.loads(line)
+        yield from list(self._items)
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('SpillList index out of range')
+        if index >= self._spilled:
+            return self._items[index - self._spilled]
+        for position, item in enumerate(self):
+            if position == index:
+                return item
+
+    def close(self) -> None:
+        """一時ファイルを削除"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# 共有モニター（呼び出しごとに start/stop で計測区間をリセット）
+_memory_monitor: Optional[MemoryMonitor] = None
+_memory_monitor_lock = threading.Lock()
+
+
+def get_memory_monitor() -> MemoryMonitor:
+    """共有メモリモニターを取得（上限は set_limit で設定値に合わせる）"""
+    global _memory_monitor
+    with _memory_monitor_lock:
+        if _memory_monitor is None:
+            _memory_monitor = MemoryMonitor(limit_mb=effective_limit_mb(os.environ.get('MEMORY_LIMIT_MB')))
+        return _memory_monitor
+
+
+# テスト用のサンプル関数
+def test_memory_monitor():
+    """
+    メモリ計測とバックプレッシャーのテスト
+    """
+    from tracing import Tracer
+
+    tracer = Tracer()
+    monitor = MemoryMonitor(limit_mb=effective_limit_mb(None), interval_ms=5, tracemalloc_enabled=True)
+    root = tracer.start_trace('document')
+    monitor.start(tracer)
+    with tracer.span('chunking'):
+        chunks = ['x' * 1024 for _ in range(5000)]
+        time.sleep(0.02)
+    with tracer.span('embedding'):
+        vectors = SpillList(monitor)
+        vectors.extend([[0.1] * 1536 for _ in range(200)])
+        print(f"バッチサイズ: {monitor.fit_batch_size(25)} (逼迫度: {monitor.pressure()})")
+        vectors.spill()
+        print(f"退避: {vectors.spilled_count}件, 先頭の次元数: {len(vectors[0])}")
+        vectors.close()
+    tracer.end_trace(root)
+    del chunks
+    print(json.dumps(monitor.stop(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    test_memory_monitor()
@@ -1,2 +1,1303 @@
 """
-メタデータ管理機能\n元ファイル情報、変換情報、処理履歴、パフォーマンス情報の包括的管理\n\"\"\"\n\nimport json\nimport logging\nimport os\nfrom typing import Dict, List, Any, Optional, Tuple\nfrom dataclasses import dataclass, asdict\nimport boto3\nfrom botocore.exceptions import ClientError\nimport hashlib\nfrom datetime import datetime, timedelta\nimport uuid\n\nlogger = logging.getLogger(__name__)\n\n@dataclass\nclass FileMetadata:\n    \"\"\"ファイルメタデータ\"\"\"\n    file_id: str\n    original_name: str\n    file_size: int\n    file_format: str\n    mime_type: Optional[str]\n    upload_timestamp: str\n    file_hash: str\n    s3_bucket: Optional[str] = None\n    s3_key: Optional[str] = None\n    user_id: Optional[str] = None\n    project_id: Optional[str] = None\n    \n@dataclass\nclass ProcessingMetadata:\n    \"\"\"処理メタデータ\"\"\"\n    processing_id: str\n    file_id: str\n    processing_strategy: str\n    attempted_methods: List[Dict[str, Any]]\n    final_method: str\n    processing_start_time: str\n    processing_end_time: str\n    total_processing_time: float\n    success: bool\n    error_message: Optional[str] = None\n    \n@dataclass\nclass ConversionMetadata:\n    \"\"\"変換メタデータ\"\"\"\n    conversion_id: str\n    processing_id: str\n    method: str  # 'markitdown' or 'langchain'\n    input_size: int\n    output_size: int\n    conversion_time: float\n    quality_score: Optional[float]\n    success: bool\n    error_details: Optional[Dict[str, Any]] = None\n    \n@dataclass\nclass ChunkingMetadata:\n    \"\"\"チャンキングメタデータ\"\"\"\n    chunking_id: str\n    processing_id: str\n    total_chunks: int\n    chunk_size: int\n    chunk_overlap: int\n    chunking_strategy: str\n    chunking_time: float\n    average_chunk_size: float\n    \n@dataclass\nclass EmbeddingMetadata:\n    \"\"\"埋め込みメタデータ\"\"\"\n    embedding_id: str\n    processing_id: str\n    embedding_model: str\n    embedding_dimension: int\n    total_embeddings: int\n    embedding_time: float\n    batch_size: int\n    average_embedding_time: float\n    \n@dataclass\nclass StorageMetadata:\n    \"\"\"格納メタデータ\"\"\"\n    storage_id: str\n    processing_id: str\n    storage_type: str  # 'opensearch', 'dynamodb', 's3'\n    stored_documents: int\n    storage_time: float\n    index_name: Optional[str] = None\n    table_name: Optional[str] = None\n    bucket_name: Optional[str] = None\n    \nclass MetadataManager:\n    \"\"\"メタデータ管理クラス\"\"\"\n    \n    def __init__(self, \n                 region: str = 'us-east-1',\n                 metadata_table: str = 'DocumentProcessingMetadata',\n                 tracking_table: str = 'EmbeddingProcessingTracking'):\n        \"\"\"\n        初期化\n        \n        Args:\n            region: AWSリージョン\n            metadata_table: メタデータテーブル名\n            tracking_table: 追跡テーブル名\n        \"\"\"\n        self.region = region\n        self.metadata_table_name = metadata_table\n        self.tracking_table_name = tracking_table\n        \n        # DynamoDB初期化\n        self.dynamodb = boto3.resource('dynamodb', region_name=region)\n        \n        try:\n            self.metadata_table = self.dynamodb.Table(metadata_table)\n            self.tracking_table = self.dynamodb.Table(tracking_table)\n            logger.info(f\"メタデータ管理を初期化: {metadata_table}, {tracking_table}\")\n        except Exception as e:\n            logger.error(f\"DynamoDBテーブル初期化エラー: {e}\")\n            self.metadata_table = None\n            self.tracking_table = None\n    \n    def create_file_metadata(self, \n                           file_name: str,\n                           file_content: bytes,\n                           file_format: str,\n                           mime_type: Optional[str] = None,\n                           user_id: Optional[str] = None,\n                           project_id: Optional[str] = None,\n                           s3_bucket: Optional[str] = None,\n                           s3_key: Optional[str] = None) -> FileMetadata:\n        \"\"\"\n        ファイルメタデータを作成\n        \n        Args:\n            file_name: ファイル名\n            file_content: ファイル内容\n            file_format: ファイル形式\n            mime_type: MIMEタイプ\n            user_id: ユーザーID\n            project_id: プロジェクトID\n            s3_bucket: S3バケット名\n            s3_key: S3キー\n            \n        Returns:\n            FileMetadata: ファイルメタデータ\n        \"\"\"\n        file_id = str(uuid.uuid4())\n        file_hash = hashlib.sha256(file_content).hexdigest()\n        \n        metadata = FileMetadata(\n            file_id=file_id,\n            original_name=file_name,\n            file_size=len(file_content),\n            file_format=file_format,\n            mime_type=mime_type,\n            upload_timestamp=datetime.utcnow().isoformat(),\n            file_hash=file_hash,\n            s3_bucket=s3_bucket,\n            s3_key=s3_key,\n            user_id=user_id,\n            project_id=project_id\n        )\n        \n        # DynamoDBに保存\n        self._save_file_metadata(metadata)\n        \n        logger.info(f\"ファイルメタデータ作成: {file_id} ({file_name})\")\n        return metadata\n    \n    def create_processing_metadata(self,\n                                 file_id: str,\n                                 processing_strategy: str) -> ProcessingMetadata:\n        \"\"\"\n        処理メタデータを作成\n        \n        Args:\n            file_id: ファイルID\n            processing_strategy: 処理戦略\n            \n        Returns:\n            ProcessingMetadata: 処理メタデータ\n        \"\"\"\n        processing_id = str(uuid.uuid4())\n        \n        metadata = ProcessingMetadata(\n            processing_id=processing_id,\n            file_id=file_id,\n            processing_strategy=processing_strategy,\n            attempted_methods=[],\n            final_method='',\n            processing_start_time=datetime.utcnow().isoformat(),\n            processing_end_time='',\n            total_processing_time=0.0,\n            success=False\n        )\n        \n        logger.info(f\"処理メタデータ作成: {processing_id} (ファイル: {file_id})\")\n        return metadata\n    \n    def update_processing_metadata(self,\n                                 processing_metadata: ProcessingMetadata,\n                                 attempted_methods: List[Dict[str, Any]],\n                                 final_method: str,\n                                 success: bool,\n                                 error_message: Optional[str] = None) -> ProcessingMetadata:\n        \"\"\"\n        処理メタデータを更新\n        \n        Args:\n            processing_metadata: 処理メタデータ\n            attempted_methods: 試行された方法リスト\n            final_method: 最終的な方法\n            success: 成功フラグ\n            error_message: エラーメッセージ\n            \n        Returns:\n            ProcessingMetadata: 更新された処理メタデータ\n        \"\"\"\n        end_time = datetime.utcnow().isoformat()\n        start_time = datetime.fromisoformat(processing_metadata.processing_start_time.replace('Z', '+00:00'))\n        end_time_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))\n        total_time = (end_time_dt - start_time).total_seconds() * 1000  # ミリ秒\n        \n        processing_metadata.attempted_methods = attempted_methods\n        processing_metadata.final_method = final_method\n        processing_metadata.processing_end_time = end_time\n        processing_metadata.total_processing_time = total_time\n        processing_metadata.success = success\n        processing_metadata.error_message = error_message\n        \n        # DynamoDBに保存\n        self._save_processing_metadata(processing_metadata)\n        \n        logger.info(f\"処理メタデータ更新: {processing_metadata.processing_id} (成功: {success})\")\n        return processing_metadata\n    \n    def create_conversion_metadata(self,\n                                 processing_id: str,\n                                 method: str,\n                                 input_size: int,\n                                 output_size: int,\n                                 conversion_time: float,\n                                 quality_score: Optional[float] = None,\n                                 success: bool = True,\n                                 error_details: Optional[Dict[str, Any]] = None) -> ConversionMetadata:\n        \"\"\"\n        変換メタデータを作成\n        \n        Args:\n            processing_id: 処理ID\n            method: 変換方法\n            input_size: 入力サイズ\n            output_size: 出力サイズ\n            conversion_time: 変換時間\n            quality_score: 品質スコア\n            success: 成功フラグ\n            error_details: エラー詳細\n            \n        Returns:\n            ConversionMetadata: 変換メタデータ\n        \"\"\"\n        conversion_id = str(uuid.uuid4())\n        \n        metadata = ConversionMetadata(\n            conversion_id=conversion_id,\n            processing_id=processing_id,\n            method=method,\n            input_size=input_size,\n            output_size=output_size,\n            conversion_time=conversion_time,\n            quality_score=quality_score,\n            success=success,\n            error_details=error_details\n        )\n        \n        # DynamoDBに保存\n        self._save_conversion_metadata(metadata)\n        \n        logger.info(f\"変換メタデータ作成: {conversion_id} ({method})\")\n        return metadata\n    \n    def create_chunking_metadata(self,\n                               processing_id: str,\n                               total_chunks: int,\n                               chunk_size: int,\n                               chunk_overlap: int,\n                               chunking_strategy: str,\n                               chunking_time: float,\n                               average_chunk_size: float) -> ChunkingMetadata:\n        \"\"\"\n        チャンキングメタデータを作成\n        \n        Args:\n            processing_id: 処理ID\n            total_chunks: 総チャンク数\n            chunk_size: チャンクサイズ\n            chunk_overlap: チャンクオーバーラップ\n            chunking_strategy: チャンキング戦略\n            chunking_time: チャンキング時間\n            average_chunk_size: 平均チャンクサイズ\n            \n        Returns:\n            ChunkingMetadata: チャンキングメタデータ\n        \"\"\"\n        chunking_id = str(uuid.uuid4())\n        \n        metadata = ChunkingMetadata(\n            chunking_id=chunking_id,\n            processing_id=processing_id,\n            total_chunks=total_chunks,\n            chunk_size=chunk_size,\n            chunk_overlap=chunk_overlap,\n            chunking_strategy=chunking_strategy,\n            chunking_time=chunking_time,\n            average_chunk_size=average_chunk_size\n        )\n        \n        # DynamoDBに保存\n        self._save_chunking_metadata(metadata)\n        \n        logger.info(f\"チャンキングメタデータ作成: {chunking_id} ({total_chunks}チャンク)\")\n        return metadata\n    \n    def create_embedding_metadata(self,\n                                processing_id: str,\n                                embedding_model: str,\n                                embedding_dimension: int,\n                                total_embeddings: int,\n                                embedding_time: float,\n                                batch_size: int,\n                                average_embedding_time: float) -> EmbeddingMetadata:\n        \"\"\"\n        埋め込みメタデータを作成\n        \n        Args:\n            processing_id: 処理ID\n            embedding_model: 埋め込みモデル\n            embedding_dimension: 埋め込み次元\n            total_embeddings: 総埋め込み数\n            embedding_time: 埋め込み時間\n            batch_size: バッチサイズ\n            average_embedding_time: 平均埋め込み時間\n            \n        Returns:\n            EmbeddingMetadata: 埋め込みメタデータ\n        \"\"\"\n        embedding_id = str(uuid.uuid4())\n        \n        metadata = EmbeddingMetadata(\n            embedding_id=embedding_id,\n            processing_id=processing_id,\n            embedding_model=embedding_model,\n            embedding_dimension=embedding_dimension,\n            total_embeddings=total_embeddings,\n            embedding_time=embedding_time,\n            batch_size=batch_size,\n            average_embedding_time=average_embedding_time\n        )\n        \n        # DynamoDBに保存\n        self._save_embedding_metadata(metadata)\n        \n        logger.info(f\"埋め込みメタデータ作成: {embedding_id} ({total_embeddings}埋め込み)\")\n        return metadata\n    \n    def create_storage_metadata(self,\n                              processing_id: str,\n                              storage_type: str,\n                              stored_documents: int,\n                              storage_time: float,\n                              index_name: Optional[str] = None,\n                              table_name: Optional[str] = None,\n                              bucket_name: Optional[str] = None) -> StorageMetadata:\n        \"\"\"\n        格納メタデータを作成\n        \n        Args:\n            processing_id: 処理ID\n            storage_type: 格納タイプ\n            stored_documents: 格納ドキュメント数\n            storage_time: 格納時間\n            index_name: インデックス名\n            table_name: テーブル名\n            bucket_name: バケット名\n            \n        Returns:\n            StorageMetadata: 格納メタデータ\n        \"\"\"\n        storage_id = str(uuid.uuid4())\n        \n        metadata = StorageMetadata(\n            storage_id=storage_id,\n            processing_id=processing_id,\n            storage_type=storage_type,\n            stored_documents=stored_documents,\n            storage_time=storage_time,\n            index_name=index_name,\n            table_name=table_name,\n            bucket_name=bucket_name\n        )\n        \n        # DynamoDBに保存\n        self._save_storage_metadata(metadata)\n        \n        logger.info(f\"格納メタデータ作成: {storage_id} ({storage_type}, {stored_documents}ドキュメント)\")\n        return metadata\n    \n    def get_processing_history(self, \n                             file_id: Optional[str] = None,\n                             user_id: Optional[str] = None,\n                             project_id: Optional[str] = None,\n                             limit: int = 100) -> List[Dict[str, Any]]:\n        \"\"\"\n        処理履歴を取得\n        \n        Args:\n            file_id: ファイルID\n            user_id: ユーザーID\n            project_id: プロジェクトID\n            limit: 取得制限数\n            \n        Returns:\n            List[Dict]: 処理履歴リスト\n        \"\"\"\n        try:\n            if not self.metadata_table:\n                logger.warning(\"メタデータテーブルが利用できません\")\n                return []\n            \n            # クエリ条件を構築\n            filter_expression = None\n            expression_attribute_values = {}\n            \n            if file_id:\n                filter_expression = \"file_id = :file_id\"\n                expression_attribute_values[\":file_id\"] = file_id\n            \n            if user_id:\n                if filter_expression:\n                    filter_expression += \" AND user_id = :user_id\"\n                else:\n                    filter_expression = \"user_id = :user_id\"\n                expression_attribute_values[\":user_id\"] = user_id\n            \n            if project_id:\n                if filter_expression:\n                    filter_expression += \" AND project_id = :project_id\"\n                else:\n                    filter_expression = \"project_id = :project_id\"\n                expression_attribute_values[\":project_id\"] = project_id\n            \n            # スキャン実行\n            scan_kwargs = {\n                'Limit': limit\n            }\n            \n            if filter_expression:\n                scan_kwargs['FilterExpression'] = filter_expression\n                scan_kwargs['ExpressionAttributeValues'] = expression_attribute_values\n            \n            response = self.metadata_table.scan(**scan_kwargs)\n            \n            logger.info(f\"処理履歴取得: {len(response['Items'])}件\")\n            return response['Items']\n            \n        except Exception as e:\n            logger.error(f\"処理履歴取得エラー: {e}\")\n            return []\n    \n    def get_performance_statistics(self, \n                                 days: int = 30) -> Dict[str, Any]:\n        \"\"\"\n        パフォーマンス統計を取得\n        \n        Args:\n            days: 統計期間（日数）\n            \n        Returns:\n            Dict: パフォーマンス統計\n        \"\"\"\n        try:\n            if not self.metadata_table:\n                logger.warning(\"メタデータテーブルが利用できません\")\n                return {}\n            \n            # 期間フィルター\n            start_date = (datetime.utcnow() - timedelta(days=days)).isoformat()\n            \n            response = self.metadata_table.scan(\n                FilterExpression=\"processing_start_time >= :start_date\",\n                ExpressionAttributeValues={\n                    \":start_date\": start_date\n                }\n            )\n            \n            items = response['Items']\n            \n            # 統計計算\n            total_processed = len(items)\n            successful = len([item for item in items if item.get('success', False)])\n            failed = total_processed - successful\n            \n            processing_times = [float(item.get('total_processing_time', 0)) for item in items if item.get('total_processing_time')]\n            avg_processing_time = sum(processing_times) / len(processing_times) if processing_times else 0\n            \n            # 方法別統計\n            method_stats = {}\n            for item in items:\n                method = item.get('final_method', 'unknown')\n                if method not in method_stats:\n                    method_stats[method] = {'count': 0, 'success': 0}\n                method_stats[method]['count'] += 1\n                if item.get('success', False):\n                    method_stats[method]['success'] += 1\n            \n            statistics = {\n                'period_days': days,\n                'total_processed': total_processed,\n                'successful': successful,\n                'failed': failed,\n                'success_rate': (successful / total_processed * 100) if total_processed > 0 else 0,\n                'average_processing_time_ms': avg_processing_time,\n                'method_statistics': method_stats,\n                'generated_at': datetime.utcnow().isoformat()\n            }\n            \n            logger.info(f\"パフォーマンス統計生成: {total_processed}件処理, 成功率{statistics['success_rate']:.1f}%\")\n            return statistics\n            \n        except Exception as e:\n            logger.error(f\"パフォーマンス統計取得エラー: {e}\")\n            return {}\n    \n    def _save_file_metadata(self, metadata: FileMetadata):\n        \"\"\"ファイルメタデータをDynamoDBに保存\"\"\"\n        if not self.metadata_table:\n            return\n        \n        try:\n            item = asdict(metadata)\n            item['record_type'] = 'file_metadata'\n            item['ttl'] = int((datetime.utcnow() + timedelta(days=365)).timestamp())\n            \n            self.metadata_table.put_item(Item=item)\n        except Exception as e:\n            logger.error(f\"ファイルメタデータ保存エラー: {e}\")\n    \n    def _save_processing_metadata(self, metadata: ProcessingMetadata):\n        \"\"\"処理メタデータをDynamoDBに保存\"\"\"\n        if not self.metadata_table:\n            return\n        \n        try:\n            item = asdict(metadata)\n            item['record_type'] = 'processing_metadata'\n            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())\n            \n            self.metadata_table.put_item(Item=item)\n        except Exception as e:\n            logger.error(f\"処理メタデータ保存エラー: {e}\")\n    \n    def _save_conversion_metadata(self, metadata: ConversionMetadata):\n        \"\"\"変換メタデータをDynamoDBに保存\"\"\"\n        if not self.metadata_table:\n            return\n        \n        try:\n            item = asdict(metadata)\n            item['record_type'] = 'conversion_metadata'\n            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())\n            \n            self.metadata_table.put_item(Item=item)\n        except Exception as e:\n            logger.error(f\"変換メタデータ保存エラー: {e}\")\n    \n    def _save_chunking_metadata(self, metadata: ChunkingMetadata):\n        \"\"\"チャンキングメタデータをDynamoDBに保存\"\"\"\n        if not self.metadata_table:\n            return\n        \n        try:\n            item = asdict(metadata)\n            item['record_type'] = 'chunking_metadata'\n            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())\n            \n            self.metadata_table.put_item(Item=item)\n        except Exception as e:\n            logger.error(f\"チャンキングメタデータ保存エラー: {e}\")\n    \n    def _save_embedding_metadata(self, metadata: EmbeddingMetadata):\n        \"\"\"埋め込みメタデータをDynamoDBに保存\"\"\"\n        if not self.metadata_table:\n            return\n        \n        try:\n            item = asdict(metadata)\n            item['record_type'] = 'embedding_metadata'\n            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())\n            \n            self.metadata_table.put_item(Item=item)\n        except Exception as e:\n            logger.error(f\"埋め込みメタデータ保存エラー: {e}\")\n    \n    def _save_storage_metadata(self, metadata: StorageMetadata):\n        \"\"\"格納メタデータをDynamoDBに保存\"\"\"\n        if not self.metadata_table:\n            return\n        \n        try:\n            item = asdict(metadata)\n            item['record_type'] = 'storage_metadata'\n            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())\n            \n            self.metadata_table.put_item(Item=item)\n        except Exception as e:\n            logger.error(f\"格納メタデータ保存エラー: {e}\")\n\n\ndef create_metadata_manager(config: Dict[str, Any]) -> MetadataManager:\n    \"\"\"\n    メタデータ管理インスタンスを作成\n    \n    Args:\n        config: 設定辞書\n        \n    Returns:\n        MetadataManager: メタデータ管理インスタンス\n    \"\"\"\n    return MetadataManager(\n        region=config.get('region', 'us-east-1'),\n        metadata_table=config.get('metadata_table', 'DocumentProcessingMetadata'),\n        tracking_table=config.get('tracking_table', 'EmbeddingProcessingTracking')\n    )\n\n\n# テスト用のサンプル関数\ndef test_metadata_manager():\n    \"\"\"\n    メタデータ管理のテスト\n    \"\"\"\n    # メタデータ管理をテスト\n    manager = MetadataManager()\n    \n    # ファイルメタデータ作成\n    file_metadata = manager.create_file_metadata(\n        file_name=\"test_document.pdf\",\n        file_content=b\"test content\",\n        file_format=\"pdf\",\n        mime_type=\"application/pdf\",\n        user_id=\"test_user\",\n        project_id=\"test_project\"\n    )\n    \n    print(f\"ファイルメタデータ: {file_metadata.file_id}\")\n    \n    # 処理メタデータ作成\n    processing_metadata = manager.create_processing_metadata(\n        file_id=file_metadata.file_id,\n        processing_strategy=\"markitdown-first\"\n    )\n    \n    print(f\"処理メタデータ: {processing_metadata.processing_id}\")\n    \n    # 変換メタデータ作成\n    conversion_metadata = manager.create_conversion_metadata(\n        processing_id=processing_metadata.processing_id,\n        method=\"markitdown\",\n        input_size=1000,\n        output_size=1500,\n        conversion_time=250.5,\n        quality_score=85.0\n    )\n    \n    print(f\"変換メタデータ: {conversion_metadata.conversion_id}\")\n    \n    # 処理完了\n    manager.update_processing_metadata(\n        processing_metadata=processing_metadata,\n        attempted_methods=[{\"method\": \"markitdown\", \"success\": True}],\n        final_method=\"markitdown\",\n        success=True\n    )\n    \n    print(\"メタデータ管理テスト完了\")\n\n\nif __name__ == \"__main__\":\n    test_metadata_manager()\n"
\ No newline at end of file
+メタデータ管理機能
+元ファイル情報、変換情報、処理履歴、パフォーマンス情報の包括的管理
+"""
+
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from dataclasses import dataclass, asdict
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+import hashlib
+from datetime import datetime, timedelta
+import uuid
+
+from metadata_rollup import (
+    METADATA_ROLLUPS_ENABLED, ROLLUP_PARTITION_PREFIX, ROLLUP_RECORD_TYPE,
+    build_rollups, merge_deltas, rollup_delta, rollup_key, rollup_update, summarize_rollups
+)
+from tracing import span, traced
+
+logger = logging.getLogger(__name__)
+
+# 処理1回分のメタデータをまとめて書き込む（write-behind）
+METADATA_WRITE_BEHIND_ENABLED = os.environ.get('METADATA_WRITE_BEHIND_ENABLED', 'true').lower() == 'true'
+# 処理1回分のメタデータを1アイテムに集約して保存
+METADATA_COMPACT_MODE = os.environ.get('METADATA_COMPACT_MODE', 'false').lower() == 'true'
+
+# BatchWriteItemの1リクエストあたりの上限アイテム数
+BATCH_WRITE_MAX_ITEMS = 25
+# バッファのアイテム数がこの値に達したら処理途中でも書き込む
+DEFAULT_FLUSH_THRESHOLD = 100
+# 未処理アイテム（UnprocessedItems）の再試行回数と初回待機秒数
+BATCH_WRITE_MAX_RETRIES = 5
+BATCH_WRITE_BASE_DELAY = 0.05
+
+# 集約アイテムでのレコード種別ごとの属性名（リストは複数件を保持）
+COMPACT_RECORD_ATTRIBUTES = {
+    'file_metadata': ('file', False),
+    'conversion_metadata': ('conversions', True),
+    'chunking_metadata': ('chunking', False),
+    'embedding_metadata': ('embedding', False),
+    'storage_metadata': ('storage', True)
+}
+
+# キー設計（単一テーブル）
+# ベーステーブル: pk = FILE#<file_id>（ファイル）/ PROC#<processing_id>（処理と付随レコード）, sk = レコード種別
+# GSI: 処理レコード（processing_metadata / processing_run）のみに属性を付与する疎インデックスで、
+#      ソートキーはいずれも processing_start_time（時間範囲はキー条件で絞り込む）
+FILE_INDEX = 'file-index'        # file_key = FILE#<file_id>
+USER_INDEX = 'user-index'        # user_key = USER#<user_id>
+PROJECT_INDEX = 'project-index'  # project_key = PROJECT#<project_id>
+TIME_INDEX = 'time-index'        # day_key = DAY#<YYYY-MM-DD>（日単位のパーティション）
+INDEX_PARTITION_KEYS = {
+    FILE_INDEX: 'file_key',
+    USER_INDEX: 'user_key',
+    PROJECT_INDEX: 'project_key',
+    TIME_INDEX: 'day_key'
+}
+INDEX_SORT_KEY = 'processing_start_time'
+KEY_ATTRIBUTES = ('pk', 'sk') + tuple(INDEX_PARTITION_KEYS.values())
+PROCESSING_RECORD_TYPES = ('processing_metadata', 'processing_run')
+
+# レコード種別ごとのソートキー（付随レコードは <接頭辞>#<レコードID>）
+RECORD_SORT_KEYS = {
+    'file_metadata': ('FILE', None),
+    'processing_metadata': ('PROC', None),
+    'processing_run': ('PROC', None),
+    'conversion_metadata': ('CONV', 'conversion_id'),
+    'chunking_metadata': ('CHUNK', 'chunking_id'),
+    'embedding_metadata': ('EMBED', 'embedding_id'),
+    'storage_metadata': ('STORE', 'storage_id')
+}
+
+# メタデータテーブルの定義（create_table の引数）
+METADATA_TABLE_SCHEMA = {
+    'KeySchema': [
+        {'AttributeName': 'pk', 'KeyType': 'HASH'},
+        {'AttributeName': 'sk', 'KeyType': 'RANGE'}
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': name, 'AttributeType': 'S'}
+        for name in KEY_ATTRIBUTES + (INDEX_SORT_KEY,)
+    ],
+    'GlobalSecondaryIndexes': [
+        {
+            'IndexName': index_name,
+            'KeySchema': [
+                {'AttributeName': partition_key, 'KeyType': 'HASH'},
+                {'AttributeName': INDEX_SORT_KEY, 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }
+        for index_name, partition_key in INDEX_PARTITION_KEYS.items()
+    ],
+    'BillingMode': 'PAY_PER_REQUEST'
+}
+
+# 時間範囲の指定がない場合の履歴の検索期間（日）
+DEFAULT_HISTORY_DAYS = 30
+# 日単位のパーティションを並行して取得するワーカー数
+PARTITION_FETCH_WORKERS = 8
+# 統計に使用する属性（読み込み量の削減、ロールアップの作成にも使用）
+STATISTICS_ATTRIBUTES = ('processing_id', 'success', 'final_method', 'total_processing_time',
+                         'file_format', INDEX_SORT_KEY)
+# ロールアップのバックフィルの既定の期間（日）
+DEFAULT_BACKFILL_DAYS = 90
+
+
+def metadata_keys(item: Dict[str, Any]) -> Dict[str, str]:
+    """
+    レコードのキー属性を作成
+    
+    Args:
+        item: レコード（record_typeを含む）
+    
+    Returns:
+        Dict[str, str]: pk / sk と、処理レコードの場合はGSIのキー属性
+    """
+    record_type = item['record_type']
+    if record_type == ROLLUP_RECORD_TYPE:
+        return rollup_key(item['day'], item['file_format'], item['final_method'])
+    prefix, id_field = RECORD_SORT_KEYS[record_type]
+    if record_type == 'file_metadata':
+        return {'pk': f"FILE#{item['file_id']}", 'sk': prefix}
+    
+    keys = {'pk': f"PROC#{item['processing_id']}", 'sk': f"{prefix}#{item[id_field]}" if id_field else prefix}
+    if record_type in PROCESSING_RECORD_TYPES:
+        keys['file_key'] = f"FILE#{item['file_id']}"
+        keys['day_key'] = f"DAY#{item[INDEX_SORT_KEY][:10]}"
+        if item.get('user_id'):
+            keys['user_key'] = f"USER#{item['user_id']}"
+        if item.get('project_id'):
+            keys['project_key'] = f"PROJECT#{item['project_id']}"
+    return keys
+
+
+def encode_page_token(position: Dict[str, Any]) -> str:
+    """ページ位置（ExclusiveStartKey等）を不透明なトークンに変換"""
+    return base64.urlsafe_b64encode(json.dumps(position, default=str).encode('utf-8')).decode('ascii')
+
+
+def decode_page_token(token: str) -> Dict[str, Any]:
+    """トークンからページ位置を復元"""
+    return json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+
+@dataclass
+class FileMetadata:
+    """ファイルメタデータ"""
+    file_id: str
+    original_name: str
+    file_size: int
+    file_format: str
+    mime_type: Optional[str]
+    upload_timestamp: str
+    file_hash: str
+    s3_bucket: Optional[str] = None
+    s3_key: Optional[str] = None
+    user_id: Optional[str] = None
+    project_id: Optional[str] = None
+    
+@dataclass
+class ProcessingMetadata:
+    """処理メタデータ"""
+    processing_id: str
+    file_id: str
+    processing_strategy: str
+    attempted_methods: List[Dict[str, Any]]
+    final_method: str
+    processing_start_time: str
+    processing_end_time: str
+    total_processing_time: float
+    success: bool
+    error_message: Optional[str] = None
+    user_id: Optional[str] = None
+    project_id: Optional[str] = None
+    file_format: Optional[str] = None
+    
+@dataclass
+class ConversionMetadata:
+    """変換メタデータ"""
+    conversion_id: str
+    processing_id: str
+    method: str  # 'markitdown' or 'langchain'
+    input_size: int
+    output_size: int
+    conversion_time: float
+    quality_score: Optional[float]
+    success: bool
+    error_details: Optional[Dict[str, Any]] = None
+    
+@dataclass
+class ChunkingMetadata:
+    """チャンキングメタデータ"""
+    chunking_id: str
+    processing_id: str
+    total_chunks: int
+    chunk_size: int
+    chunk_overlap: int
+    chunking_strategy: str
+    chunking_time: float
+    average_chunk_size: float
+    
+@dataclass
+class EmbeddingMetadata:
+    """埋め込みメタデータ"""
+    embedding_id: str
+    processing_id: str
+    embedding_model: str
+    embedding_dimension: int
+    total_embeddings: int
+    embedding_time: float
+    batch_size: int
+    average_embedding_time: float
+    
+@dataclass
+class StorageMetadata:
+    """格納メタデータ"""
+    storage_id: str
+    processing_id: str
+    storage_type: str  # 'opensearch', 'dynamodb', 's3'
+    stored_documents: int
+    storage_time: float
+    index_name: Optional[str] = None
+    table_name: Optional[str] = None
+    bucket_name: Optional[str] = None
+    
+def to_dynamodb_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """DynamoDBに保存できる型に変換（floatはDecimal、Noneの属性は除外）"""
+    converted = json.loads(json.dumps(item, default=str), parse_float=Decimal)
+    return {key: value for key, value in converted.items() if value is not None}
+
+
+class MetadataWriteBuffer:
+    """処理1回分のメタデータ書き込みを保持し、BatchWriteItemでまとめて書き込むバッファ"""
+    
+    def __init__(self, dynamodb: Any, metadata_table_name: str,
+                 flush_threshold: int = DEFAULT_FLUSH_THRESHOLD, compact: bool = False):
+        """
+        初期化
+        
+        Args:
+            dynamodb: DynamoDBリソース
+            metadata_table_name: メタデータテーブル名（集約対象）
+            flush_threshold: 処理途中で書き込むアイテム数
+            compact: 処理1回分のメタデータを1アイテムに集約するか
+        """
+        self.dynamodb = dynamodb
+        self.metadata_table_name = metadata_table_name
+        self.flush_threshold = flush_threshold
+        self.compact = compact
+        self._pending: List[Tuple[str, Dict[str, Any]]] = []
+        self._records: List[Dict[str, Any]] = []
+        self._rollups: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._stats = {'items': 0, 'requests': 0, 'retries': 0, 'failedItems': 0, 'records': 0,
+                       'rollupUpdates': 0}
+    
+    def add(self, table_name: str, item: Dict[str, Any]) -> None:
+        """
+        書き込むアイテムを追加
+        
+        Args:
+            table_name: テーブル名
+            item: アイテム
+        """
+        self._stats['records'] += 1
+        if self.compact and table_name == self.metadata_table_name:
+            # 集約アイテムは処理の最後にまとめて作成
+            self._records.append(item)
+            return
+        self._pending.append((table_name, item))
+        if len(self._pending) >= self.flush_threshold:
+            self._write(self._take_pending())
+    
+    def add_rollup(self, group: Tuple[str, str, str], delta: Dict[str, Any]) -> None:
+        """
+        ロールアップへの加算を追加（同じロールアップへの加算はまとめて1回のUpdateItemにする）
+        
+        Args:
+            group: (日, 形式, 方法)
+            delta: 属性 → 加算値
+        """
+        merge_deltas(self._rollups.setdefault(group, {}), delta)
+    
+    def _take_pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        pending, self._pending = self._pending, []
+        return pending
+    
+    def _compact_item(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """処理メタデータを基に他のレコードを属性として含む集約アイテムを作成"""
+        records, self._records = self._records, []
+        processing = next((r for r in reversed(records) if r['record_type'] == 'processing_metadata'), None)
+        if processing is None:
+            # 処理メタデータがない場合は集約せず個別に保存
+            return [(self.metadata_table_name, record) for record in records]
+        
+        item = dict(processing, record_type='processing_run', sk=RECORD_SORT_KEYS['processing_run'][0])
+        for record in records:
+            attribute = COMPACT_RECORD_ATTRIBUTES.get(record['record_type'])
+            if not attribute:
+                continue
+            name, multiple = attribute
+            value = {k: v for k, v in record.items() if k not in ('record_type', 'ttl') + KEY_ATTRIBUTES}
+            if multiple:
+                item.setdefault(name, []).append(value)
+            else:
+                item[name] = value
+        return [(self.metadata_table_name, item)]
+    
+    @traced('metadata.flush')
+    def flush(self) -> Dict[str, Any]:
+        """
+        保持しているアイテムを書き込み
+        
+        Returns:
+            Dict: 書き込み統計（items, requests, retries, failedItems, records）
+        """
+        pending = self._take_pending()
+        if self._records:
+            pending.extend(self._compact_item())
+        self._write(pending)
+        
+        # ロールアップはBatchWriteItemで更新できないため個別のUpdateItem（ADD）で加算
+        rollups, self._rollups = self._rollups, {}
+        if rollups:
+            table = self.dynamodb.Table(self.metadata_table_name)
+            for group, delta in rollups.items():
+                try:
+                    table.update_item(**rollup_update(group, delta))
+                    self._stats['rollupUpdates'] += 1
+                except ClientError as e:
+                    logger.warning(f"統計ロールアップの更新に失敗: {e}")
+        return self.get_stats()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """統計情報を取得"""
+        return dict(self._stats, compact=self.compact)
+    
+    def _write(self, pending: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """25件ずつBatchWriteItemで書き込み（未処理アイテムは指数バックオフで再試行）"""
+        for start in range(0, len(pending), BATCH_WRITE_MAX_ITEMS):
+            request_items: Dict[str, List[Dict[str, Any]]] = {}
+            for table_name, item in pending[start:start + BATCH_WRITE_MAX_ITEMS]:
+                request_items.setdefault(table_name, []).append({'PutRequest': {'Item': to_dynamodb_item(item)}})
+            page_size = sum(len(requests) for requests in request_items.values())
+            self._stats['items'] += page_size
+            
+            attempt = 0
+            while request_items:
+                try:
+                    self._stats['requests'] += 1
+                    response = self.dynamodb.batch_write_item(RequestItems=request_items)
+                    request_items = {table: requests for table, requests
+                                     in (response.get('UnprocessedItems') or {}).items() if requests}
+                except ClientError as e:
+                    logger.warning(f"メタデータの一括書き込みに失敗: {e}")
+                if not request_items:
+                    break
+                attempt += 1
+                if attempt > BATCH_WRITE_MAX_RETRIES:
+                    failed = sum(len(requests) for requests in request_items.values())
+                    self._stats['failedItems'] += failed
+                    logger.error(f"メタデータの一括書き込みで{failed}件が未処理のまま再試行上限に達しました")
+                    break
+                self._stats['retries'] += 1
+                # フルジッター付きの指数バックオフ
+                time.sleep(random.uniform(0, BATCH_WRITE_BASE_DELAY * (2 ** attempt)))
+
+
+class MetadataManager:
+    """メタデータ管理クラス"""
+    
+    def __init__(self, 
+                 region: str = 'us-east-1',
+                 metadata_table: str = 'DocumentProcessingMetadata',
+                 tracking_table: str = 'EmbeddingProcessingTracking',
+                 compact_mode: bool = METADATA_COMPACT_MODE,
+                 flush_threshold: int = DEFAULT_FLUSH_THRESHOLD):
+        """
+        初期化
+        
+        Args:
+            region: AWSリージョン
+            metadata_table: メタデータテーブル名
+            tracking_table: 追跡テーブル名
+            compact_mode: write-behind時に処理1回分のメタデータを1アイテムに集約するか
+            flush_threshold: write-behind時に処理途中で書き込むアイテム数
+        """
+        self.region = region
+        self.metadata_table_name = metadata_table
+        self.tracking_table_name = tracking_table
+        self.compact_mode = compact_mode
+        self.flush_threshold = flush_threshold
+        # write-behindのバッファはスレッドごと（アーカイブのメンバーを並行処理するため）
+        self._local = threading.local()
+        
+        # DynamoDB初期化
+        self.dynamodb = boto3.resource('dynamodb', region_name=region)
+        
+        try:
+            self.metadata_table = self.dynamodb.Table(metadata_table)
+            self.tracking_table = self.dynamodb.Table(tracking_table)
+            logger.info(f"メタデータ管理を初期化: {metadata_table}, {tracking_table}")
+        except Exception as e:
+            logger.error(f"DynamoDBテーブル初期化エラー: {e}")
+            self.metadata_table = None
+            self.tracking_table = None
+    
+    @contextmanager
+    def write_behind(self) -> Iterator[Optional[MetadataWriteBuffer]]:
+        """
+        処理1回分のメタデータ書き込みをバッファし、終了時にBatchWriteItemでまとめて書き込む
+        
+        Yields:
+            Optional[MetadataWriteBuffer]: このスレッドで使用するバッファ（無効時はNone、統計は終了後に取得）
+        """
+        outer = getattr(self._local, 'buffer', None)
+        if outer is not None or not METADATA_WRITE_BEHIND_ENABLED:
+            # 入れ子の場合は外側のバッファに追加
+            yield outer
+            return
+        buffer = MetadataWriteBuffer(self.dynamodb, self.metadata_table_name,
+                                     self.flush_threshold, self.compact_mode)
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+            try:
+                buffer.flush()
+            except Exception as e:
+                logger.error(f"メタデータの一括書き込みに失敗: {e}")
+    
+    def put_item(self, table_name: str, table: Any, item: Dict[str, Any]) -> None:
+        """
+        アイテムを保存（write-behind中はバッファに追加）
+        
+        Args:
+            table_name: テーブル名
+            table: DynamoDBテーブル（即時書き込み時に使用）
+            item: アイテム
+        """
+        if table_name == self.metadata_table_name:
+            item = dict(item, **metadata_keys(item))
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.add(table_name, item)
+        else:
+            with span('metadata.write', table=table_name):
+                table.put_item(Item=to_dynamodb_item(item))
+    
+    def record_rollup(self, item: Dict[str, Any]) -> None:
+        """
+        処理レコードを (日, 形式, 方法) ごとの統計ロールアップにADDで加算（write-behind中はバッファに追加）
+        
+        Args:
+            item: 処理メタデータ
+        """
+        group, delta = rollup_delta(item)
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.add_rollup(group, delta)
+        else:
+            self.metadata_table.update_item(**rollup_update(group, delta))
+    
+    def create_file_metadata(self, 
+                           file_name: str,
+                           file_content: bytes,
+                           file_format: str,
+                           mime_type: Optional[str] = None,
+                           user_id: Optional[str] = None,
+                           project_id: Optional[str] = None,
+                           s3_bucket: Optional[str] = None,
+                           s3_key: Optional[str] = None) -> FileMetadata:
+        """
+        ファイルメタデータを作成
+        
+        Args:
+            file_name: ファイル名
+            file_content: ファイル内容
+            file_format: ファイル形式
+            mime_type: MIMEタイプ
+            user_id: ユーザーID
+            project_id: プロジェクトID
+            s3_bucket: S3バケット名
+            s3_key: S3キー
+            
+        Returns:
+            FileMetadata: ファイルメタデータ
+        """
+        file_id = str(uuid.uuid4())
+        file_hash = hashlib.sha256(file_content).hexdigest()
+        
+        metadata = FileMetadata(
+            file_id=file_id,
+            original_name=file_name,
+            file_size=len(file_content),
+            file_format=file_format,
+            mime_type=mime_type,
+            upload_timestamp=datetime.utcnow().isoformat(),
+            file_hash=file_hash,
+            s3_bucket=s3_bucket,
+            s3_key=s3_key,
+            user_id=user_id,
+            project_id=project_id
+        )
+        
+        # DynamoDBに保存
+        self._save_file_metadata(metadata)
+        
+        logger.info(f"ファイルメタデータ作成: {file_id} ({file_name})")
+        return metadata
+    
+    def create_processing_metadata(self,
+                                 file_id: str,
+                                 processing_strategy: str,
+                                 user_id: Optional[str] = None,
+                                 project_id: Optional[str] = None,
+                                 file_format: Optional[str] = None) -> ProcessingMetadata:
+        """
+        処理メタデータを作成
+        
+        Args:
+            file_id: ファイルID
+            processing_strategy: 処理戦略
+            user_id: ユーザーID
+            project_id: プロジェクトID
+            file_format: ファイル形式（統計ロールアップの集計単位）
+            
+        Returns:
+            ProcessingMetadata: 処理メタデータ
+        """
+        processing_id = str(uuid.uuid4())
+        
+        metadata = ProcessingMetadata(
+            processing_id=processing_id,
+            file_id=file_id,
+            processing_strategy=processing_strategy,
+            attempted_methods=[],
+            final_method='',
+            processing_start_time=datetime.utcnow().isoformat(),
+            processing_end_time='',
+            total_processing_time=0.0,
+            success=False,
+            user_id=user_id,
+            project_id=project_id,
+            file_format=file_format
+        )
+        
+        logger.info(f"処理メタデータ作成: {processing_id} (ファイル: {file_id})")
+        return metadata
+    
+    def update_processing_metadata(self,
+                                 processing_metadata: ProcessingMetadata,
+                                 attempted_methods: List[Dict[str, Any]],
+                                 final_method: str,
+                                 success: bool,
+                                 error_message: Optional[str] = None) -> ProcessingMetadata:
+        """
+        処理メタデータを更新
+        
+        Args:
+            processing_metadata: 処理メタデータ
+            attempted_methods: 試行された方法リスト
+            final_method: 最終的な方法
+            success: 成功フラグ
+            error_message: エラーメッセージ
+            
+        Returns:
+            ProcessingMetadata: 更新された処理メタデータ
+        """
+        end_time = datetime.utcnow().isoformat()
+        start_time = datetime.fromisoformat(processing_metadata.processing_start_time.replace('Z', '+00:00'))
+        end_time_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
+        total_time = (end_time_dt - start_time).total_seconds() * 1000  # ミリ秒
+        
+        processing_metadata.attempted_methods = attempted_methods
+        processing_metadata.final_method = final_method
+        processing_metadata.processing_end_time = end_time
+        processing_metadata.total_processing_time = total_time
+        processing_metadata.success = success
+        processing_metadata.error_message = error_message
+        
+        # DynamoDBに保存
+        self._save_processing_metadata(processing_metadata)
+        
+        logger.info(f"処理メタデータ更新: {processing_metadata.processing_id} (成功: {success})")
+        return processing_metadata
+    
+    def create_conversion_metadata(self,
+                                 processing_id: str,
+                                 method: str,
+                                 input_size: int,
+                                 output_size: int,
+                                 conversion_time: float,
+                                 quality_score: Optional[float] = None,
+                                 success: bool = True,
+                                 error_details: Optional[Dict[str, Any]] = None) -> ConversionMetadata:
+        """
+        変換メタデータを作成
+        
+        Args:
+            processing_id: 処理ID
+            method: 変換方法
+            input_size: 入力サイズ
+            output_size: 出力サイズ
+            conversion_time: 変換時間
+            quality_score: 品質スコア
+            success: 成功フラグ
+            error_details: エラー詳細
+            
+        Returns:
+            ConversionMetadata: 変換メタデータ
+        """
+        conversion_id = str(uuid.uuid4())
+        
+        metadata = ConversionMetadata(
+            conversion_id=conversion_id,
+            processing_id=processing_id,
+            method=method,
+            input_size=input_size,
+            output_size=output_size,
+            conversion_time=conversion_time,
+            quality_score=quality_score,
+            success=success,
+            error_details=error_details
+        )
+        
+        # DynamoDBに保存
+        self._save_conversion_metadata(metadata)
+        
+        logger.info(f"変換メタデータ作成: {conversion_id} ({method})")
+        return metadata
+    
+    def create_chunking_metadata(self,
+                               processing_id: str,
+                               total_chunks: int,
+                               chunk_size: int,
+                               chunk_overlap: int,
+                               chunking_strategy: str,
+                               chunking_time: float,
+                               average_chunk_size: float) -> ChunkingMetadata:
+        """
+        チャンキングメタデータを作成
+        
+        Args:
+            processing_id: 処理ID
+            total_chunks: 総チャンク数
+            chunk_size: チャンクサイズ
+            chunk_overlap: チャンクオーバーラップ
+            chunking_strategy: チャンキング戦略
+            chunking_time: チャンキング時間
+            average_chunk_size: 平均チャンクサイズ
+            
+        Returns:
+            ChunkingMetadata: チャンキングメタデータ
+        """
+        chunking_id = str(uuid.uuid4())
+        
+        metadata = ChunkingMetadata(
+            chunking_id=chunking_id,
+            processing_id=processing_id,
+            total_chunks=total_chunks,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            chunking_strategy=chunking_strategy,
+            chunking_time=chunking_time,
+            average_chunk_size=average_chunk_size
+        )
+        
+        # DynamoDBに保存
+        self._save_chunking_metadata(metadata)
+        
+        logger.info(f"チャンキングメタデータ作成: {chunking_id} ({total_chunks}チャンク)")
+        return metadata
+    
+    def create_embedding_metadata(self,
+                                processing_id: str,
+                                embedding_model: str,
+                                embedding_dimension: int,
+                                total_embeddings: int,
+                                embedding_time: float,
+                                batch_size: int,
+                                average_embedding_time: float) -> EmbeddingMetadata:
+        """
+        埋め込みメタデータを作成
+        
+        Args:
+            processing_id: 処理ID
+            embedding_model: 埋め込みモデル
+            embedding_dimension: 埋め込み次元
+            total_embeddings: 総埋め込み数
+            embedding_time: 埋め込み時間
+            batch_size: バッチサイズ
+            average_embedding_time: 平均埋め込み時間
+            
+        Returns:
+            EmbeddingMetadata: 埋め込みメタデータ
+        """
+        embedding_id = str(uuid.uuid4())
+        
+        metadata = EmbeddingMetadata(
+            embedding_id=embedding_id,
+            processing_id=processing_id,
+            embedding_model=embedding_model,
+            embedding_dimension=embedding_dimension,
+            total_embeddings=total_embeddings,
+            embedding_time=embedding_time,
+            batch_size=batch_size,
+            average_embedding_time=average_embedding_time
+        )
+        
+        # DynamoDBに保存
+        self._save_embedding_metadata(metadata)
+        
+        logger.info(f"埋め込みメタデータ作成: {embedding_id} ({total_embeddings}埋め込み)")
+        return metadata
+    
+    def create_storage_metadata(self,
+                              processing_id: str,
+                              storage_type: str,
+                              stored_documents: int,
+                              storage_time: float,
+                              index_name: Optional[str] = None,
+                              table_name: Optional[str] = None,
+                              bucket_name: Optional[str] = None) -> StorageMetadata:
+        """
+        格納メタデータを作成
+        
+        Args:
+            processing_id: 処理ID
+            storage_type: 格納タイプ
+            stored_documents: 格納ドキュメント数
+            storage_time: 格納時間
+            index_name: インデックス名
+            table_name: テーブル名
+            bucket_name: バケット名
+            
+        Returns:
+            StorageMetadata: 格納メタデータ
+        """
+        storage_id = str(uuid.uuid4())
+        
+        metadata = StorageMetadata(
+            storage_id=storage_id,
+            processing_id=processing_id,
+            storage_type=storage_type,
+            stored_documents=stored_documents,
+            storage_time=storage_time,
+            index_name=index_name,
+            table_name=table_name,
+            bucket_name=bucket_name
+        )
+        
+        # DynamoDBに保存
+        self._save_storage_metadata(metadata)
+        
+        logger.info(f"格納メタデータ作成: {storage_id} ({storage_type}, {stored_documents}ドキュメント)")
+        return metadata
+    
+    def _query_index(self, index_name: str, key_condition: Any,
+                     filter_condition: Any = None,
+                     limit: Optional[int] = None,
+                     start_key: Optional[Dict[str, Any]] = None,
+                     attributes: Optional[Tuple[str, ...]] = None) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, Any]]:
+        """
+        GSIをページ単位でクエリ（新しい順）
+        
+        フィルター条件はLimitの後に適用されるため、limit件に達するかページが尽きるまで取得を続ける。
+        
+        Args:
+            index_name: インデックス名（Noneの場合はベーステーブル）
+            key_condition: キー条件
+            filter_condition: フィルター条件
+            limit: 取得件数の上限（省略時は全件）
+            start_key: 取得開始位置（ExclusiveStartKey）
+            attributes: 取得する属性（省略時は全属性）
+        
+        Returns:
+            Tuple: (アイテム, 次ページの開始位置, 読み込み統計)
+        """
+        items: List[Dict[str, Any]] = []
+        stats = {'pages': 0, 'scannedCount': 0, 'consumedCapacity': 0.0}
+        kwargs = {
+            'KeyConditionExpression': key_condition,
+            'ScanIndexForward': False,
+            'ReturnConsumedCapacity': 'TOTAL'
+        }
+        if index_name:
+            kwargs['IndexName'] = index_name
+        if filter_condition is not None:
+            kwargs['FilterExpression'] = filter_condition
+        if attributes:
+            kwargs['ProjectionExpression'] = ', '.join(f"#a{i}" for i in range(len(attributes)))
+            kwargs['ExpressionAttributeNames'] = {f"#a{i}": name for i, name in enumerate(attributes)}
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        
+        last_key = None
+        while True:
+            if limit is not None:
+                kwargs['Limit'] = limit - len(items)
+            response = self.metadata_table.query(**kwargs)
+            stats['pages'] += 1
+            stats['scannedCount'] += response.get('ScannedCount', 0)
+            stats['consumedCapacity'] += float(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+            items.extend(response.get('Items', []))
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key or (limit is not None and len(items) >= limit):
+                break
+            kwargs['ExclusiveStartKey'] = last_key
+        return items, last_key, stats
+    
+    def _fetch_day_partitions(self, days: List[str], range_condition: Any, filter_condition: Any = None,
+                              limit: Optional[int] = None,
+                              attributes: Optional[Tuple[str, ...]] = None,
+                              start_keys: Optional[Dict[str, Dict[str, Any]]] = None) -> List[Tuple[str, List[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, Any]]]:
+        """
+        日単位のパーティションを並行してクエリ
+        
+        パーティション内のページは順に取得する必要があるため、複数日にわたる範囲はパーティションごとに並行化する。
+        limit指定時は新しい日からPARTITION_FETCH_WORKERS日ずつ取得し、limit件に達した時点で以降の日は取得しない。
+        
+        Args:
+            days: 日付（YYYY-MM-DD、新しい順）
+            range_condition: processing_start_time の範囲条件
+            filter_condition: フィルター条件
+            limit: 取得件数の上限
+            attributes: 取得する属性
+            start_keys: 日ごとの取得開始位置
+        
+        Returns:
+            List[Tuple]: 日ごとの (日付, アイテム, 次ページの開始位置, 読み込み統計)
+        """
+        def fetch(day: str):
+            key_condition = Key('day_key').eq(f"DAY#{day}")
+            if range_condition is not None:
+                key_condition = key_condition & range_condition
+            return (day,) + self._query_index(TIME_INDEX, key_condition, filter_condition, limit,
+                                              start_key=(start_keys or {}).get(day), attributes=attributes)
+        
+        results = []
+        collected = 0
+        window = PARTITION_FETCH_WORKERS if limit is not None else len(days)
+        with ThreadPoolExecutor(max_workers=PARTITION_FETCH_WORKERS, thread_name_prefix='metadata-query') as executor:
+            for start in range(0, len(days), max(window, 1)):
+                for result in executor.map(fetch, days[start:start + window]):
+                    results.append(result)
+                    collected += len(result[1])
+                if limit is not None and collected >= limit:
+                    break
+        return results
+    
+    def query_processing_history(self,
+                                 file_id: Optional[str] = None,
+                                 user_id: Optional[str] = None,
+                                 project_id: Optional[str] = None,
+                                 start_time: Optional[str] = None,
+                                 end_time: Optional[str] = None,
+                                 limit: int = 100,
+                                 page_token: Optional[str] = None) -> Dict[str, Any]:
+        """
+        処理履歴をGSIのクエリで取得（新しい順、ページ単位）
+        
+        file_id > user_id > project_id の順に最も絞り込めるインデックスを使用し、残りの条件はフィルターで適用する。
+        いずれも指定がない場合は日単位のパーティションを並行してクエリする。
+        
+        Args:
+            file_id: ファイルID
+            user_id: ユーザーID
+            project_id: プロジェクトID
+            start_time: 処理開始日時の下限（ISO形式、IDを指定しない場合の既定は DEFAULT_HISTORY_DAYS 日前）
+            end_time: 処理開始日時の上限（ISO形式）
+            limit: 取得件数
+            page_token: 前回の結果の nextPageToken
+        
+        Returns:
+            Dict: items, nextPageToken（最終ページの場合None）, read（読み込み統計）
+        """
+        position = decode_page_token(page_token) if page_token else {}
+        range_condition = None
+        if start_time and end_time:
+            range_condition = Key(INDEX_SORT_KEY).between(start_time, end_time)
+        elif start_time:
+            range_condition = Key(INDEX_SORT_KEY).gte(start_time)
+        elif end_time:
+            range_condition = Key(INDEX_SORT_KEY).lte(end_time)
+        
+        # インデックスのパーティションキーに使わない条件はフィルターで適用
+        partition = None
+        filters = []
+        for index_name, attribute, value, prefix in ((FILE_INDEX, 'file_id', file_id, 'FILE'),
+                                                     (USER_INDEX, 'user_id', user_id, 'USER'),
+                                                     (PROJECT_INDEX, 'project_id', project_id, 'PROJECT')):
+            if value is None:
+                continue
+            if partition is None:
+                partition = (index_name, Key(INDEX_PARTITION_KEYS[index_name]).eq(f"{prefix}#{value}"))
+            else:
+                filters.append(Attr(attribute).eq(value))
+        filter_condition = None
+        for condition in filters:
+            filter_condition = condition if filter_condition is None else filter_condition & condition
+        
+        if partition is not None:
+            index_name, key_condition = partition
+            if range_condition is not None:
+                key_condition = key_condition & range_condition
+            items, last_key, read = self._query_index(index_name, key_condition, filter_condition, limit,
+                                                      start_key=position.get('key'))
+            next_token = encode_page_token({'key': last_key}) if last_key else None
+            logger.info(f"処理履歴取得: {len(items)}件 ({index_name})")
+            return {'items': items, 'nextPageToken': next_token, 'read': read}
+        
+        # 時間範囲: 日単位のパーティション（新しい順）。前回の続きの日から取得
+        now = datetime.utcnow()
+        start = datetime.fromisoformat(start_time[:19]) if start_time else now - timedelta(days=DEFAULT_HISTORY_DAYS)
+        end = datetime.fromisoformat(end_time[:19]) if end_time else now
+        if range_condition is None:
+            range_condition = Key(INDEX_SORT_KEY).gte(start.isoformat())
+        days = [(end - timedelta(days=offset)).date().isoformat()
+                for offset in range((end.date() - start.date()).days + 1)]
+        if position.get('day'):
+            days = [day for day in days if day <= position['day']]
+        
+        start_keys = {position['day']: position['key']} if position.get('key') else None
+        results = self._fetch_day_partitions(days, range_condition, filter_condition, limit, start_keys=start_keys)
+        
+        items = []
+        read = {'pages': 0, 'scannedCount': 0, 'consumedCapacity': 0.0, 'partitions': len(results)}
+        next_token = None
+        for position_index, (day, day_items, last_key, day_read) in enumerate(results):
+            for name in ('pages', 'scannedCount', 'consumedCapacity'):
+                read[name] += day_read[name]
+            if len(items) >= limit:
+                continue
+            taken = day_items[:limit - len(items)]
+            items.extend(taken)
+            if len(items) >= limit and (len(taken) < len(day_items) or last_key or position_index + 1 < len(days)):
+                # 続きは同じ日の最後に返したアイテムの次から
+                next_token = encode_page_token({'day': day, 'key': {
+                    name: items[-1][name] for name in ('pk', 'sk', 'day_key', INDEX_SORT_KEY)
+                }})
+        logger.info(f"処理履歴取得: {len(items)}件 ({TIME_INDEX}, {read['partitions']}日)")
+        return {'items': items, 'nextPageToken': next_token, 'read': read}
+    
+    def get_processing_history(self, 
+                             file_id: Optional[str] = None,
+                             user_id: Optional[str] = None,
+                             project_id: Optional[str] = None,
+                             limit: int = 100,
+                             start_time: Optional[str] = None,
+                             end_time: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        処理履歴を取得
+        
+        Args:
+            file_id: ファイルID
+            user_id: ユーザーID
+            project_id: プロジェクトID
+            limit: 取得制限数
+            start_time: 処理開始日時の下限（ISO形式）
+            end_time: 処理開始日時の上限（ISO形式）
+            
+        Returns:
+            List[Dict]: 処理履歴リスト（新しい順、続きは query_processing_history のページトークンで取得）
+        """
+        try:
+            if not self.metadata_table:
+                logger.warning("メタデータテーブルが利用できません")
+                return []
+            
+            return self.query_processing_history(file_id, user_id, project_id, start_time, end_time, limit)['items']
+            
+        except Exception as e:
+            logger.error(f"処理履歴取得エラー: {e}")
+            return []
+    
+    def _fetch_rollups(self, days: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        日ごとのロールアップのパーティションを並行してクエリ
+        
+        Args:
+            days: 日付（YYYY-MM-DD）
+        
+        Returns:
+            Tuple: (ロールアップアイテム, 読み込み統計)
+        """
+        def fetch(day: str):
+            items, _, read = self._query_index(None, Key('pk').eq(f"{ROLLUP_PARTITION_PREFIX}{day}"))
+            return items, read
+        
+        items: List[Dict[str, Any]] = []
+        read = {'pages': 0, 'scannedCount': 0, 'consumedCapacity': 0.0, 'partitions': len(days)}
+        with ThreadPoolExecutor(max_workers=PARTITION_FETCH_WORKERS, thread_name_prefix='metadata-query') as executor:
+            for day_items, day_read in executor.map(fetch, days):
+                items.extend(day_items)
+                for name in ('pages', 'scannedCount', 'consumedCapacity'):
+                    read[name] += day_read[name]
+        return items, read
+    
+    def get_performance_statistics(self, 
+                                 days: int = 30) -> Dict[str, Any]:
+        """
+        パフォーマンス統計を取得
+        
+        ロールアップ有効時は期間内の (日, 形式, 方法) ごとのロールアップのみを読み込むため、
+        読み込み量は処理件数に依存しない（期間は日単位で、当日と過去days日分）。
+        無効時は日単位のパーティションの処理レコードを並行してクエリする。
+        
+        Args:
+            days: 統計期間（日数）
+            
+        Returns:
+            Dict: パフォーマンス統計
+        """
+        try:
+            if not self.metadata_table:
+                logger.warning("メタデータテーブルが利用できません")
+                return {}
+            
+            # 期間フィルター
+            now = datetime.utcnow()
+            start = now - timedelta(days=days)
+            partitions = [(now - timedelta(days=offset)).date().isoformat()
+                          for offset in range((now.date() - start.date()).days + 1)]
+            if METADATA_ROLLUPS_ENABLED:
+                rollups, read = self._fetch_rollups(partitions)
+            else:
+                results = self._fetch_day_partitions(partitions, Key(INDEX_SORT_KEY).gte(start.isoformat()),
+                                                     attributes=STATISTICS_ATTRIBUTES)
+                rollups = build_rollups(item for _, day_items, _, _ in results for item in day_items)
+                read = {name: sum(result[3][name] for result in results)
+                        for name in ('pages', 'scannedCount', 'consumedCapacity')}
+                read['partitions'] = len(results)
+            
+            # 統計計算
+            statistics = {'period_days': days}
+            statistics.update(summarize_rollups(rollups))
+            statistics['read'] = read
+            statistics['generated_at'] = datetime.utcnow().isoformat()
+            
+            logger.info(f"パフォーマンス統計生成: {statistics['total_processed']}件処理, 成功率{statistics['success_rate']:.1f}%")
+            return statistics
+            
+        except Exception as e:
+            logger.error(f"パフォーマンス統計取得エラー: {e}")
+            return {}
+    
+    def backfill_index_keys(self, page_size: int = 500) -> Dict[str, Any]:
+        """
+        GSIのキー属性がない処理レコードにキー属性を付与
+        
+        キー設計の変更前に保存された処理レコードは day_key などを持たず、日単位のパーティションから読めないため、
+        ベーステーブルをページ単位でスキャンして不足しているGSIのキー属性を追加する。
+        付与済みのレコードはフィルターで除外されるため、繰り返し実行しても同じレコードを更新しない。
+        
+        Args:
+            page_size: 1回のスキャンで評価するアイテム数
+        
+        Returns:
+            Dict: indexed（更新件数）, skipped（キーを作成できない件数）, read（読み込み統計）
+        """
+        read = {'pages': 0, 'scannedCount': 0, 'consumedCapacity': 0.0}
+        indexed = skipped = 0
+        kwargs = {
+            'FilterExpression': (Attr('record_type').eq('processing_metadata') &
+                                 Attr('day_key').not_exists()),
+            'Limit': page_size,
+            'ReturnConsumedCapacity': 'TOTAL'
+        }
+        while True:
+            response = self.metadata_table.scan(**kwargs)
+            read['pages'] += 1
+            read['scannedCount'] += response.get('ScannedCount', 0)
+            read['consumedCapacity'] += float(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+            for item in response.get('Items', []):
+                try:
+                    keys = metadata_keys(item)
+                except (KeyError, TypeError):
+                    skipped += 1
+                    continue
+                index_keys = {name: value for name, value in keys.items() if name not in ('pk', 'sk')}
+                names = {f"#k{i}": name for i, name in enumerate(index_keys)}
+                self.metadata_table.update_item(
+                    Key={'pk': item['pk'], 'sk': item['sk']},
+                    UpdateExpression='SET ' + ', '.join(f"{name} = :k{i}" for i, name in enumerate(names)),
+                    ConditionExpression=Attr('pk').exists(),
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues={f":k{i}": value for i, value in enumerate(index_keys.values())}
+                )
+                indexed += 1
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            kwargs['ExclusiveStartKey'] = last_key
+        
+        logger.info(f"GSIキー属性のバックフィル: {indexed}件更新, {skipped}件スキップ")
+        return {'indexed': indexed, 'skipped': skipped, 'read': read}
+    
+    def backfill_rollups(self, days: int = DEFAULT_BACKFILL_DAYS, include_today: bool = False,
+                         index_keys: bool = True) -> Dict[str, Any]:
+        """
+        既存の処理レコードから統計ロールアップを作成
+        
+        日ごとに処理レコードから集計し直したロールアップで上書きするため、繰り返し実行しても二重に加算されない。
+        当日は処理中のADD更新と競合するため、既定では前日までを対象とする。
+        GSIのキー属性がない処理レコードは日単位のパーティションに含まれないため、先に backfill_index_keys で付与する。
+        
+        Args:
+            days: 対象期間（日数）
+            include_today: 当日も対象とするか
+            index_keys: 集計前にGSIのキー属性がない処理レコードをスキャンして付与するか
+        
+        Returns:
+            Dict: days, records, rollups, indexed（GSIのキー属性を付与した件数）, read（読み込み統計）
+        """
+        indexed = self.backfill_index_keys() if index_keys else None
+        today = datetime.utcnow().date()
+        first = 0 if include_today else 1
+        partitions = [(today - timedelta(days=offset)).isoformat() for offset in range(first, days + 1)]
+        results = self._fetch_day_partitions(partitions, None, attributes=STATISTICS_ATTRIBUTES)
+        
+        records = [item for _, day_items, _, _ in results for item in day_items]
+        rollups = build_rollups(records)
+        with self.write_behind():
+            for rollup in rollups:
+                self.put_item(self.metadata_table_name, self.metadata_table, rollup)
+        
+        read = {name: sum(result[3][name] for result in results) + (indexed['read'][name] if indexed else 0)
+                for name in ('pages', 'scannedCount', 'consumedCapacity')}
+        logger.info(f"統計ロールアップのバックフィル: {len(partitions)}日, {len(records)}件 → {len(rollups)}件")
+        return {'days': len(partitions), 'records': len(records), 'rollups': len(rollups),
+                'indexed': indexed['indexed'] if indexed else 0, 'read': read}
+    
+    def _save_file_metadata(self, metadata: FileMetadata):
+        """ファイルメタデータをDynamoDBに保存"""
+        if not self.metadata_table:
+            return
+        
+        try:
+            item = asdict(metadata)
+            item['record_type'] = 'file_metadata'
+            item['ttl'] = int((datetime.utcnow() + timedelta(days=365)).timestamp())
+            
+            self.put_item(self.metadata_table_name, self.metadata_table, item)
+        except Exception as e:
+            logger.error(f"ファイルメタデータ保存エラー: {e}")
+    
+    def _save_processing_metadata(self, metadata: ProcessingMetadata):
+        """処理メタデータをDynamoDBに保存"""
+        if not self.metadata_table:
+            return
+        
+        try:
+            item = asdict(metadata)
+            item['record_type'] = 'processing_metadata'
+            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())
+            
+            self.put_item(self.metadata_table_name, self.metadata_table, item)
+            if METADATA_ROLLUPS_ENABLED:
+                self.record_rollup(item)
+        except Exception as e:
+            logger.error(f"処理メタデータ保存エラー: {e}")
+    
+    def _save_conversion_metadata(self, metadata: ConversionMetadata):
+        """変換メタデータをDynamoDBに保存"""
+        if not self.metadata_table:
+            return
+        
+        try:
+            item = asdict(metadata)
+            item['record_type'] = 'conversion_metadata'
+            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())
+            
+            self.put_item(self.metadata_table_name, self.metadata_table, item)
+        except Exception as e:
+            logger.error(f"変換メタデータ保存エラー: {e}")
+    
+    def _save_chunking_metadata(self, metadata: ChunkingMetadata):
+        """チャンキングメタデータをDynamoDBに保存"""
+        if not self.metadata_table:
+            return
+        
+        try:
+            item = asdict(metadata)
+            item['record_type'] = 'chunking_metadata'
+            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())
+            
+            self.put_item(self.metadata_table_name, self.metadata_table, item)
+        except Exception as e:
+            logger.error(f"チャンキングメタデータ保存エラー: {e}")
+    
+    def _save_embedding_metadata(self, metadata: EmbeddingMetadata):
+        """埋め込みメタデータをDynamoDBに保存"""
+        if not self.metadata_table:
+            return
+        
+        try:
+            item = asdict(metadata)
+            item['record_type'] = 'embedding_metadata'
+            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())
+            
+            self.put_item(self.metadata_table_name, self.metadata_table, item)
+        except Exception as e:
+            logger.error(f"埋め込みメタデータ保存エラー: {e}")
+    
+    def _save_storage_metadata(self, metadata: StorageMetadata):
+        """格納メタデータをDynamoDBに保存"""
+        if not self.metadata_table:
+            return
+        
+        try:
+            item = asdict(metadata)
+            item['record_type'] = 'storage_metadata'
+            item['ttl'] = int((datetime.utcnow() + timedelta(days=90)).timestamp())
+            
+            self.put_item(self.metadata_table_name, self.metadata_table, item)
+        except Exception as e:
+            logger.error(f"格納メタデータ保存エラー: {e}")
+
+
+def create_metadata_manager(config: Dict[str, Any]) -> MetadataManager:
+    """
+    メタデータ管理インスタンスを作成
+    
+    Args:
+        config: 設定辞書
+        
+    Returns:
+        MetadataManager: メタデータ管理インスタンス
+    """
+    return MetadataManager(
+        region=config.get('region', 'us-east-1'),
+        metadata_table=config.get('metadata_table', 'DocumentProcessingMetadata'),
+        tracking_table=config.get('tracking_table', 'EmbeddingProcessingTracking'),
+        compact_mode=config.get('compact_mode', METADATA_COMPACT_MODE),
+        flush_threshold=config.get('flush_threshold', DEFAULT_FLUSH_THRESHOLD)
+    )
+
+
+# テスト用のサンプル関数
+def test_metadata_manager():
+    """
+    メタデータ管理のテスト
+    """
+    # メタデータ管理をテスト
+    manager = MetadataManager()
+    
+    # ファイルメタデータ作成
+    file_metadata = manager.create_file_metadata(
+        file_name="test_document.pdf",
+        file_content=b"test content",
+        file_format="pdf",
+        mime_type="application/pdf",
+        user_id="test_user",
+        project_id="test_project"
+    )
+    
+    print(f"ファイルメタデータ: {file_metadata.file_id}")
+    
+    # 処理メタデータ作成
+    processing_metadata = manager.create_processing_metadata(
+        file_id=file_metadata.file_id,
+        processing_strategy="markitdown-first"
+    )
+    
+    print(f"処理メタデータ: {processing_metadata.processing_id}")
+    
+    # 変換メタデータ作成
+    conversion_metadata = manager.create_conversion_metadata(
+        processing_id=processing_metadata.processing_id,
+        method="markitdown",
+        input_size=1000,
+        output_size=1500,
+        conversion_time=250.5,
+        quality_score=85.0
+    )
+    
+    print(f"変換メタデータ: {conversion_metadata.conversion_id}")
+    
+    # 処理完了
+    manager.update_processing_metadata(
+        processing_metadata=processing_metadata,
+        attempted_methods=[{"method": "markitdown", "success": True}],
+        final_method="markitdown",
+        success=True
+    )
+    
+    print("メタデータ管理テスト完了")
+
+
+if __name__ == "__main__":
+    test_metadata_manager()
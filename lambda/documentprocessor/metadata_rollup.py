@@ -0,0 +1,250 @@
+"""
+処理統計のロールアップ
+処理完了時に (日, 形式, 処理方法) ごとの集計アイテムをアトミックなADD更新で加算し、
+処理時間は対数バケットのスケッチ（DDSketch方式）で保持して近似の分位点を求める。
+統計の取得は日数 × 形式 × 方法の小さなアイテムのみを読み込む。
+"""
+
+import logging
+import math
+import os
+from decimal import Decimal
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METADATA_ROLLUPS_ENABLED = os.environ.get('METADATA_ROLLUPS_ENABLED', 'true').lower() == 'true'
+
+ROLLUP_RECORD_TYPE = 'rollup'
+ROLLUP_PARTITION_PREFIX = 'ROLLUP#'
+# 集計カウンター（処理時間の合計はミリ秒）
+ROLLUP_COUNTERS = ('processed', 'successful', 'failed', 'total_processing_time')
+# 処理時間スケッチのバケット属性の接頭辞（lat_<バケット番号>）
+LATENCY_BUCKET_PREFIX = 'lat_'
+# 分位点の相対誤差
+SKETCH_RELATIVE_ACCURACY = 0.02
+# スケッチで区別する最小の処理時間（ミリ秒、これ未満は最小バケットに含める）
+SKETCH_MIN_VALUE_MS = 1.0
+# 統計で返す分位点
+REPORTED_PERCENTILES = (50, 90, 95, 99)
+
+
+class LatencySketch:
+    """対数バケットの処理時間スケッチ（分位点の相対誤差は relative_accuracy 以内）"""
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY,
+                 buckets: Optional[Dict[int, int]] = None):
+        """
+        初期化
+
+        Args:
+            relative_accuracy: 分位点の相対誤差
+            buckets: バケット番号 → 件数
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = dict(buckets or {})
+
+    @property
+    def count(self) -> int:
+        return sum(self.buckets.values())
+
+    def bucket_index(self, value_ms: float) -> int:
+        """処理時間のバケット番号（値は gamma^(i-1) より大きく gamma^i 以下）"""
+        return max(0, math.ceil(math.log(max(value_ms, SKETCH_MIN_VALUE_MS)) / self._log_gamma))
+
+    def add(self, value_ms: float, count: int = 1) -> None:
+        index = self.bucket_index(value_ms)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other: 'LatencySketch') -> None:
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        分位点を取得
+
+        Args:
+            q: 分位（0〜1）
+
+        Returns:
+            Optional[float]: 処理時間（ミリ秒、件数0の場合None）
+        """
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        cumulative = 0
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            if cumulative > rank:
+                # バケット範囲の中で相対誤差が最小となる代表値
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_attributes(self) -> Dict[str, int]:
+        """DynamoDBのトップレベル属性（ADD更新の対象）に変換"""
+        return {f"{LATENCY_BUCKET_PREFIX}{index}": count for index, count in self.buckets.items()}
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any]) -> 'LatencySketch':
+        """ロールアップアイテムのバケット属性から作成"""
+        return cls(buckets={
+            int(name[len(LATENCY_BUCKET_PREFIX):]): int(value)
+            for name, value in item.items() if name.startswith(LATENCY_BUCKET_PREFIX)
+        })
+
+
+def rollup_key(day: str, file_format: Optional[str], method: Optional[str]) -> Dict[str, str]:
+    """ロールアップアイテムのキー（pk = ROLLUP#<日>, sk = <形式>#<方法>）"""
+    return {'pk': f"{ROLLUP_PARTITION_PREFIX}{day}", 'sk': f"{file_format or 'unknown'}#{method or 'none'}"}
+
+
+def rollup_delta(record: Dict[str, Any]) -> Tuple[Tuple[str, str, str], Dict[str, Any]]:
+    """
+    処理レコード1件分の加算値
+
+    Args:
+        record: 処理メタデータ（processing_start_time, file_format, final_method, success, total_processing_time）
+
+    Returns:
+        Tuple: ((日, 形式, 方法), 属性 → 加算値)
+    """
+    success = bool(record.get('success'))
+    processing_time = float(record.get('total_processing_time') or 0)
+    sketch = LatencySketch()
+    sketch.add(processing_time)
+    delta = {
+        'processed': 1,
+        'successful': 1 if success else 0,
+        'failed': 0 if success else 1,
+        'total_processing_time': processing_time
+    }
+    delta.update(sketch.to_attributes())
+    group = (record['processing_start_time'][:10], record.get('file_format') or 'unknown',
+             record.get('final_method') or 'none')
+    return group, delta
+
+
+def merge_deltas(target: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    """加算値をまとめる（同じロールアップへの複数件の加算を1回の更新にする）"""
+    for name, value in delta.items():
+        target[name] = target.get(name, 0) + value
+
+
+def rollup_update(group: Tuple[str, str, str], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ロールアップのADD更新（update_item の引数）
+
+    Args:
+        group: (日, 形式, 方法)
+        delta: 属性 → 加算値
+
+    Returns:
+        Dict: Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues
+    """
+    day, file_format, method = group
+    names = {'#record_type': 'record_type', '#day': 'day', '#file_format': 'file_format', '#method': 'final_method'}
+    values = {':record_type': ROLLUP_RECORD_TYPE, ':day': day, ':file_format': file_format, ':method': method}
+    additions = []
+    for i, (name, value) in enumerate(sorted(delta.items())):
+        names[f"#n{i}"] = name
+        values[f":v{i}"] = Decimal(str(round(value, 3))) if isinstance(value, float) else value
+        additions.append(f"#n{i} :v{i}")
+    return {
+        'Key': rollup_key(day, file_format, method),
+        'UpdateExpression': ('SET #record_type = :record_type, #day = :day, #file_format = :file_format, '
+                             f"#method = :method ADD {', '.join(additions)}"),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values
+    }
+
+
+def build_rollups(records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    処理レコードからロールアップアイテムを作成（バックフィル用）
+
+    Args:
+        records: 処理メタデータ
+
+    Returns:
+        List[Dict]: ロールアップアイテム（record_type, day, file_format, final_method と集計属性）
+    """
+    groups: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for record in records:
+        group, delta = rollup_delta(record)
+        merge_deltas(groups.setdefault(group, {}), delta)
+    return [
+        dict(delta, record_type=ROLLUP_RECORD_TYPE, day=day, file_format=file_format, final_method=method)
+        for (day, file_format, method), delta in sorted(groups.items())
+    ]
+
+
+def summarize_rollups(items: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    ロールアップアイテムから統計を作成
+
+    Args:
+        items: ロールアップアイテム
+
+    Returns:
+        Dict: 件数・成功率・平均処理時間・方法別/形式別の件数・処理時間の分位点
+    """
+    totals = {name: 0 for name in ROLLUP_COUNTERS}
+    method_stats: Dict[str, Dict[str, int]] = {}
+    format_stats: Dict[str, Dict[str, int]] = {}
+    sketch = LatencySketch()
+    for item in items:
+        for name in ROLLUP_COUNTERS:
+            totals[name] += float(item.get(name, 0))
+        for stats, key in ((method_stats, item.get('final_method', 'unknown')),
+                           (format_stats, item.get('file_format', 'unknown'))):
+            entry = stats.setdefault(key, {'count': 0, 'success': 0})
+            entry['count'] += int(item.get('processed', 0))
+            entry['success'] += int(item.get('successful', 0))
+        sketch.merge(LatencySketch.from_item(item))
+
+    processed = int(totals['processed'])
+    return {
+        'total_processed': processed,
+        'successful': int(totals['successful']),
+        'failed': int(totals['failed']),
+        'success_rate': (totals['successful'] / processed * 100) if processed > 0 else 0,
+        'average_processing_time_ms': totals['total_processing_time'] / processed if processed > 0 else 0,
+        'method_statistics': method_stats,
+        'format_statistics': format_stats,
+        'latency_percentiles_ms': {
+            f"p{percentile}": sketch.quantile(percentile / 100) for percentile in REPORTED_PERCENTILES
+        }
+    }
+
+
+def main():
+    """メイン関数（既存の処理メタデータからロールアップを作成）"""
+    import argparse
+
+    from metadata_manager import MetadataManager
+
+    parser = argparse.ArgumentParser(description='処理統計ロールアップのバックフィル')
+    parser.add_argument('command', choices=['backfill'], help='実行するコマンド')
+    parser.add_argument('--days', type=int, default=90, help='対象期間（日数）')
+    parser.add_argument('--include-today', action='store_true',
+                        help='当日も再作成する（処理中の加算と競合するため通常は前日まで）')
+    parser.add_argument('--skip-index', action='store_true',
+                        help='GSIのキー属性がない処理レコードのスキャン・付与を省略する')
+    parser.add_argument('--region', default=os.environ.get('AWS_REGION', 'us-east-1'), help='AWSリージョン')
+    parser.add_argument('--table', default=os.environ.get('METADATA_TABLE', 'DocumentProcessingMetadata'),
+                        help='メタデータテーブル名')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    manager = MetadataManager(region=args.region, metadata_table=args.table)
+    result = manager.backfill_rollups(days=args.days, include_today=args.include_today,
+                                      index_keys=not args.skip_index)
+    print(f"バックフィル完了: {result}")
+
+
+if __name__ == '__main__':
+    main()
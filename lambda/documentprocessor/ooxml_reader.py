@@ -0,0 +1,269 @@
+"""
+Office文書（OOXML）の遅延読み込み
+ZIPのセントラルディレクトリからメンバー一覧のみを取得し、本文を含むXMLパート
+（word/document.xml、スライド、共有文字列・シート）だけを逐次展開・解析する。
+画像・動画等のメディアはOCRが有効な場合を除き展開しない。
+"""
+
+import io
+import logging
+import re
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Any, BinaryIO, Callable, List, Optional, Union
+
+from tabular_stream import load_shared_strings, list_sheets, iter_sheet_rows, markdown_row
+
+logger = logging.getLogger(__name__)
+
+OOXML_FORMATS = frozenset(['docx', 'pptx', 'xlsx'])
+
+# スライド・シートを並行処理するワーカー数
+OOXML_PART_WORKERS = 4
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+PRESENTATION_NS = '{http://schemas.openxmlformats.org/presentationml/2006/main}'
+
+MEDIA_PATTERN = re.compile(r'^(word|ppt|xl)/(media|embeddings)/')
+SLIDE_PATTERN = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+NOTES_PATTERN = re.compile(r'^ppt/notesSlides/notesSlide(\d+)\.xml$')
+HEADING_STYLE_PATTERN = re.compile(r'^(?:Heading|見出し)\s*(\d)$', re.IGNORECASE)
+OCR_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+
+@dataclass
+class OoxmlExtraction:
+    """OOXMLからの抽出結果"""
+    markdown: str
+    parts: List[str] = field(default_factory=list)
+    skipped_media: int = 0
+    skipped_media_bytes: int = 0
+    ocr_media: int = 0
+    elapsed_ms: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'textParts': len(self.parts),
+            'skippedMedia': self.skipped_media,
+            'skippedMediaBytes': self.skipped_media_bytes,
+            'ocrMedia': self.ocr_media,
+            'textChars': len(self.markdown),
+            'elapsedMs': round(self.elapsed_ms, 2)
+        }
+
+
+def is_ooxml_package(source: Union[bytes, str, BinaryIO]) -> bool:
+    """ZIPとして読めるOOXMLパッケージか（セントラルディレクトリの確認のみ）"""
+    try:
+        with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as archive:
+            return '[Content_Types].xml' in archive.namelist()
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+def _iter_paragraph_text(part: BinaryIO, paragraph_tag: str, text_tag: str,
+                         on_paragraph: Callable[[ET.Element, str], None]) -> None:
+    """XMLパートを逐次解析し、段落ごとにテキストを渡す（処理済みの段落は破棄）"""
+    for _, elem in ET.iterparse(part, events=('end',)):
+        if elem.tag == paragraph_tag:
+            on_paragraph(elem, ''.join(t.text or '' for t in elem.iter(text_tag)))
+            elem.clear()
+
+
+def _extract_docx_part(archive: zipfile.ZipFile, name: str) -> str:
+    """Word文書パートから段落・見出し・表を抽出"""
+    lines: List[str] = []
+    row: Optional[List[str]] = None
+    cell: List[str] = []
+
+    with archive.open(name) as part:
+        for event, elem in ET.iterparse(part, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == f'{WORD_NS}tr':
+                    row = []
+                elif elem.tag == f'{WORD_NS}tc':
+                    cell = []
+                continue
+
+            if elem.tag == f'{WORD_NS}p':
+                text = ''.join(t.text or '' for t in elem.iter(f'{WORD_NS}t')).strip()
+                if row is not None:
+                    if text:
+                        cell.append(text)
+                elif text:
+                    style = elem.find(f'{WORD_NS}pPr/{WORD_NS}pStyle')
+                    heading = HEADING_STYLE_PATTERN.match(style.get(f'{WORD_NS}val', '')) if style is not None else None
+                    lines.append(f"{'#' * (int(heading.group(1)) + 1)} {text}" if heading else text)
+                elem.clear()
+            elif elem.tag == f'{WORD_NS}tc' and row is not None:
+                row.append(' '.join(cell))
+            elif elem.tag == f'{WORD_NS}tr' and row is not None:
+                lines.append(markdown_row(row))
+                row = None
+                elem.clear()
+            elif elem.tag == f'{WORD_NS}tbl':
+                elem.clear()
+    return '\n\n'.join(_join_table_rows(lines))
+
+
+def _join_table_rows(lines: List[str]) -> List[str]:
+    """連続する表の行を1ブロックにまとめ、ヘッダー区切りを挿入"""
+    blocks: List[str] = []
+    table: List[str] = []
+    for line in lines + ['']:
+        if line.startswith('| '):
+            table.append(line)
+            continue
+        if table:
+            columns = table[0].count(' | ') + 1
+            table.insert(1, '| ' + ' | '.join('---' for _ in range(columns)) + ' |')
+            blocks.append('\n'.join(table))
+            table = []
+        if line:
+            blocks.append(line)
+    return blocks
+
+
+def _extract_slide(archive: zipfile.ZipFile, number: int, name: str, notes: Optional[str]) -> str:
+    """スライドのテキスト（とノート）を抽出"""
+    paragraphs: List[str] = []
+    with archive.open(name) as part:
+        _iter_paragraph_text(part, f'{DRAWING_NS}p', f'{DRAWING_NS}t',
+                             lambda _, text: paragraphs.append(text.strip()) if text.strip() else None)
+
+    lines = [f"## スライド {number}" + (f": {paragraphs[0]}" if paragraphs else '')]
+    lines.extend(f"- {text}" for text in paragraphs[1:])
+    if notes:
+        note_lines: List[str] = []
+        with archive.open(notes) as part:
+            _iter_paragraph_text(part, f'{DRAWING_NS}p', f'{DRAWING_NS}t',
+                                 lambda _, text: note_lines.append(text.strip()) if text.strip() else None)
+        # ノートの先頭はスライド番号のプレースホルダーのため数字のみの行は除く
+        note_lines = [line for line in note_lines if not line.isdigit()]
+        if note_lines:
+            lines.append('\n> ' + '\n> '.join(note_lines))
+    return '\n'.join(lines)
+
+
+def _extract_sheet(archive: zipfile.ZipFile, sheet_name: str, path: str, shared_strings: List[str]) -> str:
+    """ワークシートをマークダウン表として抽出"""
+    lines = [f"## {sheet_name}"]
+    width = 0
+    with archive.open(path) as part:
+        for index, row in enumerate(iter_sheet_rows(part, shared_strings)):
+            if index == 0:
+                width = len(row)
+                lines.append(markdown_row(row))
+                lines.append('| ' + ' | '.join('---' for _ in row) + ' |')
+            else:
+                lines.append(markdown_row((row + [''] * width)[:max(width, len(row))]))
+    return '\n'.join(lines)
+
+
+def extract_ooxml(source: Union[bytes, str, BinaryIO], file_format: str, ocr: bool = False,
+                  ocr_image: Optional[Callable[[bytes, str], str]] = None,
+                  max_workers: int = OOXML_PART_WORKERS) -> OoxmlExtraction:
+    """
+    OOXMLから本文を含むパートのみを展開してマークダウンを抽出
+
+    Args:
+        source: ファイル内容・パス・ファイルオブジェクト（パスの場合は全体をメモリに読み込まない）
+        file_format: ファイル形式（docx / pptx / xlsx）
+        ocr: 埋め込み画像をOCRするか（Falseの場合はメディアを展開しない）
+        ocr_image: 画像1件をOCRする関数（画像内容, メンバー名）-> テキスト
+        max_workers: スライド・シートの並行処理数
+
+    Returns:
+        OoxmlExtraction: 抽出結果
+    """
+    if file_format not in OOXML_FORMATS:
+        raise ValueError(f"OOXMLではないファイル形式: {file_format}")
+
+    start = time.monotonic()
+    with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as archive:
+        members = archive.infolist()
+        names = {info.filename for info in members}
+        media = [info for info in members if MEDIA_PATTERN.match(info.filename)]
+
+        # メンバーごとに独立したストリームで展開されるため、スライド・シートは並行処理できる
+        if file_format == 'docx':
+            parts = [name for name in ('word/document.xml', 'word/footnotes.xml', 'word/endnotes.xml') if name in names]
+            tasks = [(name, lambda name=name: _extract_docx_part(archive, name)) for name in parts]
+        elif file_format == 'pptx':
+            slides = sorted((int(m.group(1)), m.group(0)) for m in map(SLIDE_PATTERN.match, names) if m)
+            notes = {int(m.group(1)): m.group(0) for m in map(NOTES_PATTERN.match, names) if m}
+            tasks = [(name, lambda number=number, name=name: _extract_slide(archive, number, name, notes.get(number)))
+                     for number, name in slides]
+        else:
+            shared_strings = load_shared_strings(archive)
+            tasks = [(path, lambda sheet_name=sheet_name, path=path: _extract_sheet(archive, sheet_name, path, shared_strings))
+                     for sheet_name, path in list_sheets(archive)]
+
+        if len(tasks) > 1 and max_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks)), thread_name_prefix='ooxml') as executor:
+                sections = list(executor.map(lambda task: task[1](), tasks))
+        else:
+            sections = [task() for _, task in tasks]
+
+        result = OoxmlExtraction(markdown='', parts=[name for name, _ in tasks])
+        if ocr and ocr_image:
+            ocr_sections = []
+            for info in media:
+                if not info.filename.lower().endswith(OCR_IMAGE_EXTENSIONS):
+                    result.skipped_media += 1
+                    result.skipped_media_bytes += info.compress_size
+                    continue
+                # 画像は1件ずつ展開してOCR（同時に保持するのは1件分のみ）
+                text = ocr_image(archive.read(info.filename), info.filename)
+                result.ocr_media += 1
+                if text:
+                    ocr_sections.append(f"### {info.filename}\n{text}")
+            if ocr_sections:
+                sections.append("## 埋め込み画像\n\n" + '\n\n'.join(ocr_sections))
+        else:
+            result.skipped_media = len(media)
+            result.skipped_media_bytes = sum(info.compress_size for info in media)
+
+    result.markdown = '\n\n'.join(section for section in sections if section)
+    result.elapsed_ms = (time.monotonic() - start) * 1000
+    return result
+
+
+# テスト用のサンプル関数
+def test_ooxml_reader():
+    """
+    メディアの多いPPTXでの抽出時間・ピークメモリの計測
+    """
+    import os
+    import tempfile
+    import tracemalloc
+
+    slide_xml = ('<p:sld xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main" '
+                 'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"><p:cSld><p:spTree>'
+                 '<p:sp><p:txBody><a:p><a:r><a:t>スライド{n}のタイトル</a:t></a:r></a:p>'
+                 '<a:p><a:r><a:t>本文テキスト{n}</a:t></a:r></a:p></p:txBody></p:sp>'
+                 '</p:spTree></p:cSld></p:sld>')
+    path = os.path.join(tempfile.mkdtemp(), 'media-heavy.pptx')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        for n in range(1, 51):
+            archive.writestr(f'ppt/slides/slide{n}.xml', slide_xml.format(n=n))
+            # 圧縮されないメディア（4MB x 50 = 200MB）
+            archive.writestr(zipfile.ZipInfo(f'ppt/media/video{n}.mp4'), os.urandom(4 * 1024 * 1024))
+    print(f"入力: {os.path.getsize(path) / 1024 / 1024:.0f}MB")
+
+    tracemalloc.start()
+    result = extract_ooxml(path, 'pptx')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"抽出: {result.to_dict()}")
+    print(f"ピークメモリ: {peak / 1024:.0f}KB (テキスト {len(result.markdown.encode('utf-8')) / 1024:.0f}KB)")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    test_ooxml_reader()
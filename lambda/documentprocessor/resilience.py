@@ -0,0 +1,429 @@
+"""
+BedrockおよびOpenSearch呼び出しのテールレイテンシ対策
+
+冪等な呼び出し（埋め込み生成・検索）に対するp95ベースのヘッジリクエストと、
+(サービス, モデル/インデックス) 単位のサーキットブレーカーを提供する。
+ブレーカーの状態遷移はCloudWatch Embedded Metric Formatで出力する。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from bedrock_rate_limiter import ErrorClass, classify_error
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(Enum):
+    """サーキットブレーカーの状態"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが開いているため呼び出しを拒否した"""
+
+    def __init__(self, service: str, resource: str, retry_in_seconds: float):
+        self.service = service
+        self.resource = resource
+        self.retry_in_seconds = retry_in_seconds
+        super().__init__(f"サーキットブレーカーが開いています: {service}/{resource} "
+                         f"(再試行まで {retry_in_seconds:.1f}秒)")
+
+
+def _export_metrics(dimensions: Dict[str, str], metrics: Dict[str, Tuple[float, str]],
+                    properties: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """EMFレコードを標準出力に書き出す"""
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': os.environ.get('RESILIENCE_METRICS_NAMESPACE', 'RAG/Resilience'),
+                'Dimensions': [list(dimensions.keys())],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()]
+            }]
+        },
+        **dimensions,
+        **{name: value for name, (value, _) in metrics.items()},
+        **(properties or {})
+    }
+    # EMFはログ行全体がJSONである必要があるため、ロガーのフォーマットを経由しない
+    print(json.dumps(record, ensure_ascii=False))
+    return record
+
+
+def is_service_failure(error: Exception) -> bool:
+    """
+    ブレーカーの失敗として数えるか判定（入力不正・権限エラー等の呼び出し側の誤りは除外）
+
+    Args:
+        error: 発生した例外
+
+    Returns:
+        bool: サービス側の障害とみなす場合True
+    """
+    if isinstance(error, (ValueError, TypeError, KeyError, PermissionError)):
+        return False
+    # 実行期限切れ・キャンセル等の処理側のエラー（ProcessingError）
+    if getattr(error, 'error_type', None) is not None:
+        return False
+    if type(error).__name__ == 'ClientError':
+        # スロットリングはレートリミッターのAIMDが扱うためサービス障害に数えない
+        # （ブレーカーはリミッターの各試行に適用される）
+        return classify_error(error) == ErrorClass.TRANSIENT
+    # opensearch-pyのTransportErrorはHTTPステータスを持つ
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return True
+
+
+class LatencyTracker:
+    """ローリングウィンドウでのレイテンシ分位点計測"""
+
+    def __init__(self, window_size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float) -> None:
+        with self._lock:
+            self._samples.append(latency_ms)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        分位点を取得
+
+        Args:
+            percentile: 0〜1の分位
+
+        Returns:
+            Optional[float]: レイテンシ（ミリ秒、サンプル不足時はNone）
+        """
+        with self._lock:
+            if len(self._samples) < 20:
+                return None
+            values = sorted(self._samples)
+        index = min(len(values) - 1, max(0, int(round(percentile * len(values))) - 1))
+        return values[index]
+
+
+class CircuitBreaker:
+    """(サービス, リソース) 単位のサーキットブレーカー"""
+
+    def __init__(self, service: str, resource: str, failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        """
+        初期化
+
+        Args:
+            service: サービス名（bedrock-runtime, opensearch 等）
+            resource: モデルIDまたはインデックス名
+            failure_threshold: OPENに遷移する連続失敗数
+            recovery_timeout: OPENからHALF_OPENへ遷移するまでの秒数
+            half_open_max_calls: HALF_OPEN中に許可する試行数
+        """
+        self.service = service
+        self.resource = resource
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """
+        呼び出しを許可するか判定（OPENで待機時間経過後はHALF_OPENへ遷移）
+
+        Returns:
+            bool: 許可する場合True
+        """
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self._transition(CircuitState.HALF_OPEN)
+
+            if self.state == CircuitState.HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    return False
+                self._half_open_calls += 1
+
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self.state != CircuitState.CLOSED:
+                self._transition(CircuitState.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self.state != CircuitState.OPEN:
+                    self._transition(CircuitState.OPEN)
+
+    def retry_in(self) -> float:
+        """HALF_OPENへ遷移するまでの残り秒数"""
+        with self._lock:
+            if self.state != CircuitState.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def _transition(self, new_state: CircuitState) -> None:
+        """状態遷移とメトリクス出力（ロック保持中に呼び出す）"""
+        old_state = self.state
+        self.state = new_state
+        self._half_open_calls = 0
+        logger.warning(f"サーキットブレーカー状態遷移: {self.service}/{self.resource} "
+                       f"{old_state.value} -> {new_state.value}")
+        _export_metrics(
+            {'Service': self.service, 'Resource': self.resource},
+            {
+                'CircuitStateTransition': (1, 'Count'),
+                'CircuitOpen': (1 if new_state == CircuitState.OPEN else 0, 'Count')
+            },
+            {'FromState': old_state.value, 'ToState': new_state.value, 'ConsecutiveFailures': self._failures}
+        )
+
+
+class ResilientCaller:
+    """ヘッジリクエストとサーキットブレーカーを適用する呼び出しラッパー"""
+
+    # ヘッジ送信は全リクエストの一定割合までに制限（負荷増幅の防止）
+    DEFAULT_HEDGE_BUDGET_RATIO = 0.1
+
+    def __init__(self, service: str, resource: str, hedge_percentile: float = 0.95,
+                 default_hedge_delay_ms: Optional[float] = None,
+                 failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 max_workers: Optional[int] = None):
+        """
+        初期化
+
+        Args:
+            service: サービス名
+            resource: モデルIDまたはインデックス名
+            hedge_percentile: ヘッジ送信遅延に用いる分位
+            default_hedge_delay_ms: サンプル不足時のヘッジ遅延（Noneでヘッジしない）
+            failure_threshold: ブレーカーの連続失敗閾値
+            recovery_timeout: ブレーカーの回復待機秒数
+            max_workers: ヘッジ用スレッド数（呼び出し元の同時実行数の2倍以上を推奨）
+        """
+        self.service = service
+        self.resource = resource
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay_ms = default_hedge_delay_ms
+        self.hedge_budget_ratio = float(os.environ.get('HEDGE_BUDGET_RATIO', str(self.DEFAULT_HEDGE_BUDGET_RATIO)))
+
+        self.breaker = CircuitBreaker(service, resource, failure_threshold, recovery_timeout)
+        self.latency = LatencyTracker()
+
+        self._requests = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._stats_lock = threading.Lock()
+        # ヘッジ送信用（元の呼び出しは呼び出し元スレッドではなくここで実行される）
+        self._max_workers = max(int(os.environ.get('HEDGE_MAX_WORKERS', '8')), max_workers or 0)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+
+    def reserve_workers(self, max_workers: int) -> None:
+        """
+        ヘッジ用スレッド数を最低限確保する（共有インスタンスの後発利用者向け）
+
+        プールが呼び出し元の同時実行数より小さいと、元の呼び出しがキュー待ちになり
+        待機時間がヘッジ遅延として計上される
+
+        Args:
+            max_workers: 必要なスレッド数
+        """
+        with self._stats_lock:
+            if max_workers <= self._max_workers:
+                return
+            self._max_workers = max_workers
+            # 旧プールは実行中の呼び出しを完了後、参照が外れた時点でスレッドを終了する
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def call(self, func: Callable[..., Any], *args, hedge: bool = False,
+             deadline: Optional[Any] = None, **kwargs) -> Any:
+        """
+        ブレーカー・ヘッジを適用して関数を実行
+
+        Args:
+            func: 実行する関数
+            *args: 関数の位置引数
+            hedge: 冪等な呼び出しとしてヘッジを許可するか
+            deadline: 実行期限（Deadline）。ヘッジが期限内に返らない場合は送信しない
+            **kwargs: 関数のキーワード引数
+
+        Returns:
+            Any: 関数の戻り値
+
+        Raises:
+            CircuitOpenError: ブレーカーが開いている場合
+        """
+        if deadline is not None:
+            deadline.check(f"{self.service}:{self.resource}")
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(self.service, self.resource, self.breaker.retry_in())
+
+        with self._stats_lock:
+            self._requests += 1
+
+        start = time.time()
+        try:
+            hedge_delay_ms = self._hedge_delay_ms() if hedge else None
+            if hedge_delay_ms is not None and deadline is not None and deadline.remaining_ms() <= hedge_delay_ms:
+                # ヘッジ送信時点で期限切れとなるため重複リクエストは無駄になる
+                hedge_delay_ms = None
+            if hedge_delay_ms is None:
+                result = func(*args, **kwargs)
+            else:
+                result = self._call_hedged(func, args, kwargs, hedge_delay_ms)
+        except Exception as e:
+            if is_service_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+
+        self.latency.record((time.time() - start) * 1000)
+        self.breaker.record_success()
+        return result
+
+    def _hedge_delay_ms(self) -> Optional[float]:
+        """ヘッジ送信までの遅延（予算超過時はNone）"""
+        with self._stats_lock:
+            if self._hedges >= max(1, self._requests * self.hedge_budget_ratio):
+                return None
+        delay = self.latency.percentile(self.hedge_percentile)
+        return delay if delay is not None else self.default_hedge_delay_ms
+
+    def _call_hedged(self, func: Callable[..., Any], args: tuple, kwargs: dict, hedge_delay_ms: float) -> Any:
+        """遅延後に重複リクエストを送信し、先に成功した結果を返す"""
+        executor = self._executor
+        started = threading.Event()
+
+        def run_primary():
+            started.set()
+            return func(*args, **kwargs)
+
+        primary = executor.submit(run_primary)
+        # プールのキュー待ちをヘッジ遅延に含めない（実行開始から計測）
+        started.wait()
+        done, _ = wait([primary], timeout=hedge_delay_ms / 1000.0)
+        if done:
+            return primary.result()
+
+        with self._stats_lock:
+            self._hedges += 1
+        hedged = executor.submit(func, *args, **kwargs)
+        pending = {primary, hedged}
+        last_error: Optional[BaseException] = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        with self._stats_lock:
+                            self._hedge_wins += 1
+                    return future.result()
+                last_error = future.exception()
+
+        raise last_error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        呼び出し統計を取得
+
+        Returns:
+            Dict: 統計情報
+        """
+        with self._stats_lock:
+            stats = {
+                'requests': self._requests,
+                'hedges': self._hedges,
+                'hedge_wins': self._hedge_wins
+            }
+        stats.update({
+            'service': self.service,
+            'resource': self.resource,
+            'circuit_state': self.breaker.state.value,
+            'p95_latency_ms': self.latency.percentile(0.95)
+        })
+        return stats
+
+
+# (サービス, リソース) ごとにウォームスタート間で共有
+_callers: Dict[Tuple[str, str], ResilientCaller] = {}
+_callers_lock = threading.Lock()
+
+
+def get_resilient_caller(service: str, resource: str, **options) -> ResilientCaller:
+    """
+    (サービス, モデル/インデックス) 単位の共有呼び出しラッパーを取得
+
+    Args:
+        service: サービス名
+        resource: モデルIDまたはインデックス名
+        **options: 初回作成時のResilientCaller引数（max_workersは既存インスタンスにも反映）
+
+    Returns:
+        ResilientCaller: 共有インスタンス
+    """
+    key = (service, resource)
+    with _callers_lock:
+        caller = _callers.get(key)
+        if caller is not None and options.get('max_workers'):
+            caller.reserve_workers(options['max_workers'])
+        if caller is None:
+            options.setdefault('failure_threshold', int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5')))
+            options.setdefault('recovery_timeout', float(os.environ.get('CIRCUIT_RECOVERY_SECONDS', '30')))
+            caller = ResilientCaller(service, resource, **options)
+            _callers[key] = caller
+        return caller
+
+
+# テスト用のサンプル関数
+def test_resilience():
+    """
+    ヘッジリクエストとサーキットブレーカーのテスト
+    """
+    caller = ResilientCaller('sample', 'slow-resource', default_hedge_delay_ms=50, failure_threshold=2,
+                             recovery_timeout=1.0)
+    calls = {'count': 0}
+
+    def sometimes_slow():
+        calls['count'] += 1
+        if calls['count'] == 1:
+            time.sleep(0.5)
+        return calls['count']
+
+    print(f"ヘッジ結果: {caller.call(sometimes_slow, hedge=True)}")
+
+    def failing():
+        raise RuntimeError("障害")
+
+    for _ in range(3):
+        try:
+            caller.call(failing)
+        except Exception as e:
+            print(f"呼び出し失敗: {e}")
+    print(f"統計: {caller.get_stats()}")
+
+
+if __name__ == "__main__":
+    test_resilience()
@@ -1,18 +1,267 @@
 """
 構造化ログ出力機能
 Markitdown統合処理の詳細ログとトレーシング
+
+ログのペイロードは出力時にのみ構築・シリアライズし（レベルが無効な場合は作成しない）、
+大きなフィールドはサイズを制限・秘匿する。高頻度のイベントはサンプリングし、
+Lambda実行環境ではキュー経由のハンドラーで呼び出し元をブロックせずに書き出す。
 """
 
+import atexit
+import functools
 import json
 import logging
 import os
+import queue
+import threading
+import time
 import uuid
-from typing import Dict, Any, Optional
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Callable, Optional
 from datetime import datetime
 from dataclasses import dataclass, asdict
 
 logger = logging.getLogger(__name__)
 
+# キュー経由の非同期ログ出力（Lambda実行環境でのみ有効）
+ASYNC_LOGGING_ENABLED = (os.environ.get('MARKITDOWN_ASYNC_LOGGING', 'true').lower() == 'true'
+                         and bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME')))
+# ログキューの上限（満杯時は呼び出し元をブロックせずに破棄）
+LOG_QUEUE_SIZE = int(os.environ.get('MARKITDOWN_LOG_QUEUE_SIZE', '10000'))
+# 高頻度イベントの出力間隔（イベントごとにN件に1件、警告以上は常に出力）
+LOG_SAMPLE_EVERY = int(os.environ.get('MARKITDOWN_LOG_SAMPLE_EVERY', '10'))
+# 文字列フィールドの上限文字数とリストの上限件数
+MAX_FIELD_CHARS = 256
+MAX_LIST_ITEMS = 20
+# 内容を出力しないフィールド（ファイル内容・ベクトル）
+REDACTED_FIELDS = frozenset({'fileContent', 'file_content', 'embedding', 'embeddings', 'vector'})
+# 入れ子の上限（これより深い値は文字列化して制限）
+MAX_PAYLOAD_DEPTH = 6
+# 呼び出し終了時にキューの書き出しを待つ上限（秒）
+LOG_FLUSH_TIMEOUT = 1.0
+
+
+def cap_value(value: Any, max_chars: int = MAX_FIELD_CHARS, depth: int = 0) -> Any:
+    """
+    ログ出力用に値のサイズを制限
+    
+    Args:
+        value: 値
+        max_chars: 文字列の上限文字数
+        depth: 入れ子の深さ
+    
+    Returns:
+        Any: 長い文字列・リストを切り詰め、秘匿フィールドとバイト列を長さのみに置き換えた値
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict) and depth < MAX_PAYLOAD_DEPTH:
+        capped = {}
+        for key, item in value.items():
+            if key in REDACTED_FIELDS and item is not None:
+                capped[key] = f"<redacted: {len(item) if hasattr(item, '__len__') else 1}>"
+            else:
+                capped[key] = cap_value(item, max_chars, depth + 1)
+        return capped
+    if isinstance(value, (list, tuple)) and depth < MAX_PAYLOAD_DEPTH:
+        capped_items = [cap_value(item, max_chars, depth + 1) for item in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            capped_items.append(f"...(+{len(value) - MAX_LIST_ITEMS}件)")
+        return capped_items
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > max_chars:
+        return f"{text[:max_chars]}...(+{len(text) - max_chars}文字)"
+    return text
+
+
+class LazyJson:
+    """ログの引数（%s）に渡し、出力時にのみ構築・サイズ制限・JSONシリアライズするペイロード"""
+    
+    __slots__ = ('_payload',)
+    
+    def __init__(self, payload: Any):
+        """
+        初期化
+        
+        Args:
+            payload: ペイロード、またはペイロードを返す関数
+        """
+        self._payload = payload
+    
+    def __str__(self) -> str:
+        payload = self._payload() if callable(self._payload) else self._payload
+        return json.dumps(cap_value(payload), ensure_ascii=False, default=str)
+
+
+class LogSampler:
+    """高頻度イベントのサンプリング（キーごとにN件に1件、最初の1件は常に出力）"""
+    
+    def __init__(self, every: int = LOG_SAMPLE_EVERY):
+        """
+        初期化
+        
+        Args:
+            every: 出力間隔（1以下の場合はすべて出力）
+        """
+        self.every = max(1, every)
+        self._counts: Dict[str, int] = {}
+        self._suppressed = 0
+        self._lock = threading.Lock()
+    
+    def should_log(self, key: str) -> bool:
+        """キーのイベントを出力するか"""
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+            if count % self.every == 0:
+                return True
+            self._suppressed += 1
+            return False
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """統計情報を取得"""
+        with self._lock:
+            return {'every': self.every, 'events': dict(self._counts), 'suppressed': self._suppressed}
+
+
+# 共有サンプラー（ウォーム起動間で再利用）
+_log_sampler: Optional[LogSampler] = None
+_log_sampler_lock = threading.Lock()
+
+
+def get_log_sampler() -> LogSampler:
+    """共有サンプラーを取得"""
+    global _log_sampler
+    with _log_sampler_lock:
+        if _log_sampler is None:
+            _log_sampler = LogSampler()
+        return _log_sampler
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """呼び出し元では書式化せずにキューへ追加し、満杯時は破棄して件数を数えるハンドラー"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 同一プロセス内のキューのため、書式化（遅延ペイロードの構築）は出力スレッドで行う
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_queue_listener: Optional[QueueListener] = None
+_queue_target: Optional[logging.Logger] = None
+_queue_logging_lock = threading.Lock()
+
+
+def _stop_queue_listener() -> None:
+    if _queue_listener is not None:
+        _queue_listener.stop()
+
+
+def _reset_queue_logging_in_child() -> None:
+    """
+    フォークした子プロセスのログ出力を元のハンドラーへ戻す
+    
+    出力スレッドはフォークで引き継がれないため、キューに追加したログは子プロセスでは書き出されない。
+    """
+    global _queue_handler, _queue_listener, _queue_target, _queue_logging_lock
+    handler, listener, target = _queue_handler, _queue_listener, _queue_target
+    # フォーク時に他のスレッドが保持していたロックは子プロセスでは解放されない
+    _queue_logging_lock = threading.Lock()
+    _queue_handler = _queue_listener = _queue_target = None
+    if handler is None or target is None:
+        return
+    target.handlers = [h for h in target.handlers if h is not handler] + list(listener.handlers)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_queue_logging_in_child)
+
+
+def install_queue_logging(target: Optional[logging.Logger] = None,
+                          queue_size: int = LOG_QUEUE_SIZE) -> NonBlockingQueueHandler:
+    """
+    ロガーのハンドラーをキュー経由の出力に置き換え（既存のハンドラーは出力スレッドで使用）
+    
+    Args:
+        target: 対象のロガー（省略時はルートロガー）
+        queue_size: キューの上限
+    
+    Returns:
+        NonBlockingQueueHandler: キューハンドラー（設定済みの場合は既存のもの）
+    """
+    global _queue_handler, _queue_listener, _queue_target
+    target = target or logging.getLogger()
+    with _queue_logging_lock:
+        if _queue_handler is not None and _queue_handler in target.handlers:
+            return _queue_handler
+        handlers = [h for h in target.handlers if not isinstance(h, NonBlockingQueueHandler)]
+        if not handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+            handlers = [handler]
+        listener = QueueListener(queue.Queue(queue_size), *handlers, respect_handler_level=True)
+        if _queue_listener is None:
+            atexit.register(_stop_queue_listener)
+        else:
+            _queue_listener.stop()
+        listener.start()
+        _queue_handler = NonBlockingQueueHandler(listener.queue)
+        _queue_listener = listener
+        _queue_target = target
+        target.handlers = [_queue_handler]
+        return _queue_handler
+
+
+def queue_logging_installed() -> bool:
+    """キュー経由の出力が設定済みか"""
+    return _queue_handler is not None
+
+
+def flush_logs(timeout: float = LOG_FLUSH_TIMEOUT) -> bool:
+    """
+    キューに残っているログの書き出しを待機（Lambdaの実行環境が凍結される前に呼び出す）
+    
+    Args:
+        timeout: 待機の上限（秒）
+    
+    Returns:
+        bool: すべて書き出したか
+    """
+    handler = _queue_handler
+    if handler is None:
+        return True
+    log_queue = handler.queue
+    with log_queue.all_tasks_done:
+        return log_queue.all_tasks_done.wait_for(lambda: log_queue.unfinished_tasks == 0, timeout)
+
+
+def flush_logs_after(func: Callable) -> Callable:
+    """関数の終了時（例外を含む）にキューのログを書き出すデコレーター"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            flush_logs()
+    return wrapper
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.utcfromtimestamp(timestamp).isoformat()
+
+
 @dataclass
 class LogContext:
     """ログコンテキスト"""
@@ -25,22 +274,34 @@ class LogContext:
 class MarkitdownLogger:
     """Markitdown統合用構造化ログクラス"""
     
-    def __init__(self, service_name: str = 'document-processor'):
+    # チャンク・バッチ単位で発生するためサンプリングするイベント
+    SAMPLED_EVENTS = frozenset({'conversion_attempt', 'embedding_generation', 'storage_operation'})
+    
+    def __init__(self, service_name: str = 'document-processor', sampler: Optional[LogSampler] = None):
         """
         初期化
         
         Args:
             service_name: サービス名
+            sampler: 高頻度イベントのサンプラー（省略時は共有サンプラー）
         """
         self.service_name = service_name
         self.environment = os.environ.get('ENVIRONMENT', 'prod')
         self.log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+        self.sampler = sampler or get_log_sampler()
+        self.current_processing_id: Optional[str] = None
         
         # ログ設定
         self._setup_logger()
-        
+    
     def _setup_logger(self):
         """ログ設定の初期化"""
+        logger.setLevel(getattr(logging, self.log_level))
+        if ASYNC_LOGGING_ENABLED:
+            # ルートロガーのキュー経由のハンドラーに伝搬させる
+            install_queue_logging()
+            return
+        
         # 構造化ログフォーマッター
         formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -51,9 +312,16 @@ class MarkitdownLogger:
             handler = logging.StreamHandler()
             handler.setFormatter(formatter)
             logger.addHandler(handler)
-            logger.setLevel(getattr(logging, self.log_level))
     
-    def start_document_processing(self, 
+    def _enabled(self, level: int, event_type: str) -> bool:
+        """レベルが有効で、サンプリング対象外またはサンプルに選ばれたイベントか"""
+        if not logger.isEnabledFor(level):
+            return False
+        if level < logging.WARNING and event_type in self.SAMPLED_EVENTS:
+            return self.sampler.should_log(event_type)
+        return True
+    
+    def start_document_processing(self,
                                 file_name: str,
                                 file_size: int,
                                 file_format: str,
@@ -70,18 +338,22 @@ class MarkitdownLogger:
             processing_strategy: 処理戦略
             user_id: ユーザーID
             project_id: プロジェクトID
-            
+        
         Returns:
             str: 処理ID
         """
         processing_id = str(uuid.uuid4())
+        self.current_processing_id = processing_id
+        if not self._enabled(logging.INFO, 'document_processing_start'):
+            return processing_id
         
-        log_data = {
+        timestamp = time.time()
+        log_data = lambda: {
             'event_type': 'document_processing_start',
             'processing_id': processing_id,
             'service': self.service_name,
             'environment': self.environment,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': _isoformat(timestamp),
             'file_info': {
                 'name': file_name,
                 'size_bytes': file_size,
@@ -96,7 +368,7 @@ class MarkitdownLogger:
             }
         }
         
-        logger.info(f"🚀 文書処理開始 | {json.dumps(log_data, ensure_ascii=False)}")
+        logger.info("🚀 文書処理開始 | %s", LazyJson(log_data))
         return processing_id
     
     def log_conversion_attempt(self,
@@ -119,27 +391,30 @@ class MarkitdownLogger:
             quality_score: 品質スコア
             error_message: エラーメッセージ
         """
-        log_data = {
-            'event_type': 'conversion_attempt',
-            'service': self.service_name,
-            'timestamp': datetime.utcnow().isoformat(),
-            'conversion_info': {
-                'method': method,
-                'file_format': file_format,
-                'duration_ms': duration_ms,
-                'success': success,
-                'output_size_bytes': output_size,
-                'quality_score': quality_score
-            }
-        }
+        level = logging.INFO if success else logging.WARNING
+        if not self._enabled(level, 'conversion_attempt'):
+            return
         
-        if error_message:
-            log_data['error'] = {'message': error_message}
+        timestamp = time.time()
+        def log_data():
+            data = {
+                'event_type': 'conversion_attempt',
+                'service': self.service_name,
+                'timestamp': _isoformat(timestamp),
+                'conversion_info': {
+                    'method': method,
+                    'file_format': file_format,
+                    'duration_ms': duration_ms,
+                    'success': success,
+                    'output_size_bytes': output_size,
+                    'quality_score': quality_score
+                }
+            }
+            if error_message:
+                data['error'] = {'message': error_message}
+            return data
         
-        if success:
-            logger.info(f"✅ 変換成功 | {json.dumps(log_data, ensure_ascii=False)}")
-        else:
-            logger.warning(f"❌ 変換失敗 | {json.dumps(log_data, ensure_ascii=False)}")
+        logger.log(level, "%s | %s", "✅ 変換成功" if success else "❌ 変換失敗", LazyJson(log_data))
     
     def log_langchain_processing(self,
                                 chunks_generated: int,
@@ -157,10 +432,15 @@ class MarkitdownLogger:
             chunk_strategy: チャンキング戦略
             average_chunk_size: 平均チャンクサイズ
         """
-        log_data = {
+        level = logging.INFO if success else logging.ERROR
+        if not self._enabled(level, 'langchain_processing'):
+            return
+        
+        timestamp = time.time()
+        log_data = lambda: {
             'event_type': 'langchain_processing',
             'service': self.service_name,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': _isoformat(timestamp),
             'langchain_info': {
                 'chunks_generated': chunks_generated,
                 'duration_ms': duration_ms,
@@ -170,10 +450,7 @@ class MarkitdownLogger:
             }
         }
         
-        if success:
-            logger.info(f"🔗 LangChain処理完了 | {json.dumps(log_data, ensure_ascii=False)}")
-        else:
-            logger.error(f"❌ LangChain処理失敗 | {json.dumps(log_data, ensure_ascii=False)}")
+        logger.log(level, "%s | %s", "🔗 LangChain処理完了" if success else "❌ LangChain処理失敗", LazyJson(log_data))
     
     def log_embedding_generation(self,
                                model_name: str,
@@ -193,26 +470,29 @@ class MarkitdownLogger:
             batch_size: バッチサイズ
             error_message: エラーメッセージ
         """
-        log_data = {
-            'event_type': 'embedding_generation',
-            'service': self.service_name,
-            'timestamp': datetime.utcnow().isoformat(),
-            'embedding_info': {
-                'model_name': model_name,
-                'embeddings_count': embeddings_count,
-                'duration_ms': duration_ms,
-                'success': success,
-                'batch_size': batch_size
-            }
-        }
+        level = logging.INFO if success else logging.ERROR
+        if not self._enabled(level, 'embedding_generation'):
+            return
         
-        if error_message:
-            log_data['error'] = {'message': error_message}
+        timestamp = time.time()
+        def log_data():
+            data = {
+                'event_type': 'embedding_generation',
+                'service': self.service_name,
+                'timestamp': _isoformat(timestamp),
+                'embedding_info': {
+                    'model_name': model_name,
+                    'embeddings_count': embeddings_count,
+                    'duration_ms': duration_ms,
+                    'success': success,
+                    'batch_size': batch_size
+                }
+            }
+            if error_message:
+                data['error'] = {'message': error_message}
+            return data
         
-        if success:
-            logger.info(f"🔢 埋め込み生成完了 | {json.dumps(log_data, ensure_ascii=False)}")
-        else:
-            logger.error(f"❌ 埋め込み生成失敗 | {json.dumps(log_data, ensure_ascii=False)}")
+        logger.log(level, "%s | %s", "🔢 埋め込み生成完了" if success else "❌ 埋め込み生成失敗", LazyJson(log_data))
     
     def log_storage_operation(self,
                             storage_type: str,
@@ -230,10 +510,15 @@ class MarkitdownLogger:
             success: 成功フラグ
             index_name: インデックス名
         """
-        log_data = {
+        level = logging.INFO if success else logging.ERROR
+        if not self._enabled(level, 'storage_operation'):
+            return
+        
+        timestamp = time.time()
+        log_data = lambda: {
             'event_type': 'storage_operation',
             'service': self.service_name,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': _isoformat(timestamp),
             'storage_info': {
                 'storage_type': storage_type,
                 'documents_stored': documents_stored,
@@ -243,10 +528,7 @@ class MarkitdownLogger:
             }
         }
         
-        if success:
-            logger.info(f"💾 ストレージ操作完了 | {json.dumps(log_data, ensure_ascii=False)}")
-        else:
-            logger.error(f"❌ ストレージ操作失敗 | {json.dumps(log_data, ensure_ascii=False)}")
+        logger.log(level, "%s | %s", "💾 ストレージ操作完了" if success else "❌ ストレージ操作失敗", LazyJson(log_data))
     
     def log_processing_completion(self,
                                 processing_id: str,
@@ -254,7 +536,8 @@ class MarkitdownLogger:
                                 success: bool,
                                 final_method: str,
                                 attempts_count: int,
-                                output_size: int = 0):
+                                output_size: int = 0,
+                                quality_score: Optional[float] = None):
         """
         処理完了ログ
         
@@ -265,25 +548,60 @@ class MarkitdownLogger:
             final_method: 最終処理方法
             attempts_count: 試行回数
             output_size: 出力サイズ
+            quality_score: 品質スコア
         """
-        log_data = {
-            'event_type': 'document_processing_completion',
-            'processing_id': processing_id,
-            'service': self.service_name,
-            'timestamp': datetime.utcnow().isoformat(),
-            'completion_info': {
-                'total_duration_ms': total_duration_ms,
-                'success': success,
-                'final_method': final_method,
-                'attempts_count': attempts_count,
-                'output_size_bytes': output_size
+        level = logging.INFO if success else logging.ERROR
+        if not self._enabled(level, 'document_processing_completion'):
+            return
+        
+        timestamp = time.time()
+        def log_data():
+            data = {
+                'event_type': 'document_processing_completion',
+                'processing_id': processing_id,
+                'service': self.service_name,
+                'timestamp': _isoformat(timestamp),
+                'completion_info': {
+                    'total_duration_ms': total_duration_ms,
+                    'success': success,
+                    'final_method': final_method,
+                    'attempts_count': attempts_count,
+                    'output_size_bytes': output_size
+                }
             }
-        }
+            if quality_score is not None:
+                data['completion_info']['quality_score'] = quality_score
+            return data
         
-        if success:
-            logger.info(f"🎉 文書処理完了 | {json.dumps(log_data, ensure_ascii=False)}")
-        else:
-            logger.error(f"❌ 文書処理失敗 | {json.dumps(log_data, ensure_ascii=False)}")
+        logger.log(level, "%s | %s", "🎉 文書処理完了" if success else "❌ 文書処理失敗", LazyJson(log_data))
+    
+    def complete_document_processing(self,
+                                   total_duration_ms: float,
+                                   success: bool,
+                                   processing_method: str,
+                                   output_size: int = 0,
+                                   quality_score: Optional[float] = None,
+                                   attempts_count: int = 1):
+        """
+        現在の処理（start_document_processing で開始）の完了ログ
+        
+        Args:
+            total_duration_ms: 総処理時間
+            success: 成功フラグ
+            processing_method: 最終処理方法
+            output_size: 出力サイズ
+            quality_score: 品質スコア
+            attempts_count: 試行回数
+        """
+        self.log_processing_completion(
+            processing_id=self.current_processing_id or '',
+            total_duration_ms=total_duration_ms,
+            success=success,
+            final_method=processing_method,
+            attempts_count=attempts_count,
+            output_size=output_size,
+            quality_score=quality_score
+        )
     
     def log_error(self,
                  error_type: str,
@@ -295,12 +613,16 @@ class MarkitdownLogger:
         Args:
             error_type: エラータイプ
             error_message: エラーメッセージ
-            context: コンテキスト情報
+            context: コンテキスト情報（大きな値は出力時に制限）
         """
-        log_data = {
+        if not self._enabled(logging.ERROR, 'error'):
+            return
+        
+        timestamp = time.time()
+        log_data = lambda: {
             'event_type': 'error',
             'service': self.service_name,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': _isoformat(timestamp),
             'error_info': {
                 'type': error_type,
                 'message': error_message,
@@ -308,7 +630,7 @@ class MarkitdownLogger:
             }
         }
         
-        logger.error(f"💥 エラー発生 | {json.dumps(log_data, ensure_ascii=False)}")
+        logger.error("💥 エラー発生 | %s", LazyJson(log_data))
 
 
 def create_markitdown_logger(service_name: str = 'document-processor') -> MarkitdownLogger:
@@ -317,13 +639,64 @@ def create_markitdown_logger(service_name: str = 'document-processor') -> Markit
     
     Args:
         service_name: サービス名
-        
+    
     Returns:
         MarkitdownLogger: ログインスタンス
     """
     return MarkitdownLogger(service_name)
 
 
+class _DiscardingHandler(logging.Handler):
+    """書式化（ペイロードの構築・シリアライズ）のみ行い、出力しないハンドラー（計測用）"""
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        self.format(record)
+
+
+def measure_logging_overhead(documents: int = 200, batches_per_document: int = 20,
+                             content_size: int = 1024 * 1024) -> Dict[str, Any]:
+    """
+    文書1件あたりのログ出力コストを計測（呼び出し元スレッドでの所要時間）
+    
+    開始・変換試行・バッチごとの埋め込み/格納・完了の各ログと、ファイル内容を含むイベントのログを
+    文書数分出力する。出力された記録は同期的に書式化して破棄するため、書き込み自体のコストは含まない
+    （キュー経由の出力では書式化も出力スレッドで行われる）。
+    
+    Args:
+        documents: 文書数
+        batches_per_document: 文書あたりのバッチ数
+        content_size: イベントに含めるファイル内容のサイズ（バイト）
+    
+    Returns:
+        Dict: 文書1件あたりの所要時間（マイクロ秒）とサンプリング統計
+    """
+    root = logging.getLogger()
+    saved = (root.handlers, root.level, logger.handlers, logger.propagate)
+    root.handlers = [_DiscardingHandler()]
+    root.setLevel(logging.INFO)
+    markitdown_logger = MarkitdownLogger(sampler=LogSampler())
+    logger.handlers, logger.propagate = [], True
+    event = {'fileName': 'sample.pdf', 'fileContent': 'x' * content_size}
+    try:
+        started = time.perf_counter()
+        for _ in range(documents):
+            root.info("Document Processor Lambda開始 - Event: %s", LazyJson(event))
+            processing_id = markitdown_logger.start_document_processing('sample.pdf', content_size, 'pdf', 'auto')
+            markitdown_logger.log_conversion_attempt('markitdown', 120.0, True, 'pdf', 4096, 85.0)
+            for _ in range(batches_per_document):
+                markitdown_logger.log_embedding_generation('titan', 25, 40.0, True, 25)
+                markitdown_logger.log_storage_operation('opensearch', 25, 10.0, True, 'documents')
+            markitdown_logger.log_processing_completion(processing_id, 900.0, True, 'markitdown', 1, 4096)
+        elapsed = time.perf_counter() - started
+    finally:
+        root.handlers, logger.handlers, logger.propagate = saved[0], saved[2], saved[3]
+        root.setLevel(saved[1])
+    return {
+        'perDocumentMicros': round(elapsed / documents * 1e6, 1),
+        'sampling': markitdown_logger.sampler.get_stats()
+    }
+
+
 # テスト用のサンプル関数
 def test_structured_logging():
     """
@@ -371,8 +744,9 @@ def test_structured_logging():
         output_size=2048000
     )
     
+    print(f"文書1件あたりのログ出力コスト: {measure_logging_overhead()}")
     print("構造化ログテスト完了")
 
 
 if __name__ == "__main__":
-    test_structured_logging()
\ No newline at end of file
+    test_structured_logging()
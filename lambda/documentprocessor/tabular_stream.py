@@ -0,0 +1,383 @@
+"""
+表形式ファイル（CSV/TSV/XLSX）のストリーミング処理
+ファイル全体を文字列・DataFrameに展開せず行単位で解析し、ヘッダー行を繰り返した
+マークダウン表のチャンクを逐次生成する。メモリ使用量は行数に依存しない。
+"""
+
+import csv
+import hashlib
+import io
+import itertools
+import logging
+import os
+import re
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from content_sniffer import sniff_content
+from langchain_integration import ChunkMetadata
+
+logger = logging.getLogger(__name__)
+
+TABULAR_STREAMING_ENABLED = os.environ.get('TABULAR_STREAMING_ENABLED', 'true').lower() == 'true'
+TABULAR_FORMATS = frozenset(['csv', 'tsv', 'xlsx'])
+
+# 型推定に使用する先頭行数
+TYPE_SAMPLE_ROWS = 100
+# 1チャンクあたりの最大行数（文字数の上限とあわせて適用）
+MAX_ROWS_PER_CHUNK = 200
+
+SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+INTEGER_PATTERN = re.compile(r'^[+-]?\d+$')
+NUMBER_PATTERN = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+DATE_PATTERN = re.compile(r'^\d{4}[-/]\d{1,2}[-/]\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2})?)?$')
+BOOLEAN_VALUES = frozenset(['true', 'false'])
+CELL_REFERENCE_PATTERN = re.compile(r'^([A-Z]+)')
+
+
+def iter_delimited_rows(file_content: bytes, file_format: str) -> Iterator[List[str]]:
+    """
+    CSV/TSVを1行ずつ解析
+
+    エンコーディング・区切り文字は先頭の内容から判定し、デコードは逐次行う。
+
+    Args:
+        file_content: ファイル内容
+        file_format: ファイル形式（csv / tsv）
+
+    Yields:
+        List[str]: 行のセル値
+    """
+    sniff = sniff_content(file_content)
+    encoding = sniff.encoding or 'utf-8'
+    delimiter = (sniff.csv_dialect or {}).get('delimiter') or ('\t' if file_format == 'tsv' else ',')
+    quotechar = (sniff.csv_dialect or {}).get('quotechar') or '"'
+
+    # BytesIOは元のbytesを共有するため、ファイル内容の複製は発生しない
+    stream = io.TextIOWrapper(io.BytesIO(file_content), encoding=encoding, errors='replace', newline='')
+    try:
+        for row in csv.reader(stream, delimiter=delimiter, quotechar=quotechar):
+            if any(cell.strip() for cell in row):
+                yield row
+    finally:
+        stream.detach()
+
+
+def iter_xlsx_rows(file_content: bytes) -> Iterator[Tuple[str, List[str]]]:
+    """
+    XLSXのワークシートを1行ずつ解析（読み取り専用・ストリーミング）
+
+    Args:
+        file_content: ファイル内容
+
+    Yields:
+        Tuple[str, List[str]]: (シート名, 行のセル値)
+    """
+    with zipfile.ZipFile(io.BytesIO(file_content)) as archive:
+        shared_strings = load_shared_strings(archive)
+        for sheet_name, sheet_path in list_sheets(archive):
+            with archive.open(sheet_path) as sheet:
+                for row in iter_sheet_rows(sheet, shared_strings):
+                    yield sheet_name, row
+
+
+def load_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    """共有文字列テーブルを読み込み"""
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, elem in ET.iterparse(f, events=('end',)):
+            if elem.tag == f'{SPREADSHEET_NS}si':
+                strings.append(''.join(text.text or '' for text in elem.iter(f'{SPREADSHEET_NS}t')))
+                elem.clear()
+    return strings
+
+
+def list_sheets(archive: zipfile.ZipFile) -> List[Tuple[str, str]]:
+    """ワークブック定義からシート名とパスの一覧を取得"""
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    relationships = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in relationships.iter(f'{PACKAGE_RELATIONSHIP_NS}Relationship')}
+
+    sheets = []
+    for sheet in workbook.iter(f'{SPREADSHEET_NS}sheet'):
+        target = targets.get(sheet.get(f'{RELATIONSHIP_NS}id'), '')
+        path = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+        sheets.append((sheet.get('name'), path))
+    return sheets
+
+
+def iter_sheet_rows(sheet: Any, shared_strings: List[str]) -> Iterator[List[str]]:
+    """シートXMLの行要素を逐次解析（処理済みの要素は破棄）"""
+    sheet_data = None
+    for event, elem in ET.iterparse(sheet, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == f'{SPREADSHEET_NS}sheetData':
+                sheet_data = elem
+            continue
+        if elem.tag != f'{SPREADSHEET_NS}row':
+            continue
+
+        cells: Dict[int, str] = {}
+        for position, cell in enumerate(elem.iter(f'{SPREADSHEET_NS}c')):
+            reference = CELL_REFERENCE_PATTERN.match(cell.get('r', ''))
+            column = _column_index(reference.group(1)) if reference else position
+            cells[column] = _cell_value(cell, shared_strings)
+
+        if sheet_data is not None:
+            sheet_data.clear()
+        else:
+            elem.clear()
+
+        if any(value.strip() for value in cells.values()):
+            yield [cells.get(i, '') for i in range(max(cells) + 1)]
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index - 1
+
+
+def _cell_value(cell: Any, shared_strings: List[str]) -> str:
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f'{SPREADSHEET_NS}t'))
+
+    value = cell.find(f'{SPREADSHEET_NS}v')
+    if value is None or value.text is None:
+        return ''
+    if cell_type == 's':
+        index = int(value.text)
+        return shared_strings[index] if index < len(shared_strings) else ''
+    if cell_type == 'b':
+        return 'TRUE' if value.text == '1' else 'FALSE'
+    return value.text
+
+
+def infer_column_types(rows: List[List[str]], column_count: int) -> List[str]:
+    """
+    サンプル行から列の型を推定
+
+    Args:
+        rows: サンプル行
+        column_count: 列数
+
+    Returns:
+        List[str]: 列ごとの型（integer / number / boolean / date / string / empty）
+    """
+    types = []
+    for column in range(column_count):
+        values = [row[column].strip() for row in rows if column < len(row) and row[column].strip()]
+        if not values:
+            types.append('empty')
+        elif all(INTEGER_PATTERN.match(v) for v in values):
+            types.append('integer')
+        elif all(NUMBER_PATTERN.match(v.replace(',', '')) for v in values):
+            types.append('number')
+        elif all(v.lower() in BOOLEAN_VALUES for v in values):
+            types.append('boolean')
+        elif all(DATE_PATTERN.match(v) for v in values):
+            types.append('date')
+        else:
+            types.append('string')
+    return types
+
+
+def markdown_row(cells: List[str]) -> str:
+    return '| ' + ' | '.join(cell.replace('|', '\\|').replace('\r', ' ').replace('\n', ' ').strip()
+                             for cell in cells) + ' |'
+
+
+class TableChunkStream:
+    """表形式ファイルからヘッダー行付きのマークダウン表チャンクを逐次生成"""
+
+    # チャンクメタデータの位置キー（row_start / row_end、チェックポイントの再開位置）
+    POSITION_KEY = 'row'
+
+    def __init__(self, file_content: bytes, file_format: str, source_file: str,
+                 chunk_size: int = 1000, start_row: int = 0, max_rows_per_chunk: int = MAX_ROWS_PER_CHUNK):
+        """
+        初期化
+
+        Args:
+            file_content: ファイル内容
+            file_format: ファイル形式（csv / tsv / xlsx）
+            source_file: ソースファイル名
+            chunk_size: チャンクの目安文字数（ヘッダー行を含む）
+            start_row: 処理を開始するデータ行（0始まり、チェックポイントからの再開用）
+            max_rows_per_chunk: 1チャンクあたりの最大行数
+        """
+        if file_format not in TABULAR_FORMATS:
+            raise ValueError(f"表形式ではないファイル形式: {file_format}")
+        self.file_content = file_content
+        self.file_format = file_format
+        self.source_file = source_file
+        self.chunk_size = chunk_size
+        self.start_row = start_row
+        self.max_rows_per_chunk = max_rows_per_chunk
+
+        self.rows = 0
+        self.chunks = 0
+        self.sheets: List[Dict[str, Any]] = []
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    def _iter_sheets(self) -> Iterator[Tuple[Optional[str], Iterator[List[str]]]]:
+        """シートごとの行イテレーター（CSV/TSVは単一シート扱い）"""
+        if self.file_format != 'xlsx':
+            yield None, iter_delimited_rows(self.file_content, self.file_format)
+            return
+
+        # groupbyは連続する同一シートの行を遅延で返すため、シート全体を保持しない
+        for sheet_name, group in itertools.groupby(iter_xlsx_rows(self.file_content), key=lambda item: item[0]):
+            yield sheet_name, (row for _, row in group)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        self._started_at = time.monotonic()
+        try:
+            for sheet_name, rows in self._iter_sheets():
+                yield from self._iter_sheet_chunks(sheet_name, rows)
+        finally:
+            self._finished_at = time.monotonic()
+
+    def _iter_sheet_chunks(self, sheet_name: Optional[str], rows: Iterator[List[str]]) -> Iterator[Dict[str, Any]]:
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [cell.strip() or f"列{i + 1}" for i, cell in enumerate(header)]
+
+        # 型推定用のサンプルのみ先読み（以降は1チャンク分の行だけを保持）
+        sample = []
+        for row in rows:
+            sample.append(row)
+            if len(sample) >= TYPE_SAMPLE_ROWS:
+                break
+        column_types = infer_column_types(sample, len(header))
+        self.sheets.append({'sheetName': sheet_name, 'columns': header, 'columnTypes': column_types})
+
+        prefix = f"### {sheet_name}\n" if sheet_name else ''
+        header_text = prefix + markdown_row(header) + '\n' + '| ' + ' | '.join('---' for _ in header) + ' |'
+        lines: List[str] = []
+        length = len(header_text)
+        row_start = None
+
+        def all_rows() -> Iterator[List[str]]:
+            yield from sample
+            yield from rows
+
+        for row in all_rows():
+            row_index = self.rows
+            self.rows += 1
+            if row_index < self.start_row:
+                continue
+            if len(row) < len(header):
+                row = row + [''] * (len(header) - len(row))
+
+            line = markdown_row(row[:len(header)])
+            if lines and (length + len(line) + 1 > self.chunk_size or len(lines) >= self.max_rows_per_chunk):
+                yield self._make_chunk(header_text, lines, row_start, row_index - 1, sheet_name)
+                lines = []
+                length = len(header_text)
+            if not lines:
+                row_start = row_index
+            lines.append(line)
+            length += len(line) + 1
+
+        if lines:
+            yield self._make_chunk(header_text, lines, row_start, self.rows - 1, sheet_name)
+
+    def _make_chunk(self, header_text: str, lines: List[str], row_start: int, row_end: int,
+                    sheet_name: Optional[str]) -> Dict[str, Any]:
+        content = header_text + '\n' + '\n'.join(lines)
+        chunk_id = hashlib.md5(f"{self.source_file}#rows={row_start}-{row_end}".encode()).hexdigest()[:16]
+        metadata = ChunkMetadata(
+            chunk_id=chunk_id,
+            source_file=self.source_file,
+            chunk_index=self.chunks,
+            chunk_size=len(content),
+            chunk_type='table',
+            parent_header=sheet_name,
+            processing_method='streaming'
+        ).__dict__
+        metadata.update({'row_start': row_start, 'row_end': row_end})
+        if sheet_name:
+            metadata['sheet_name'] = sheet_name
+        self.chunks += 1
+        return {'content': content, 'metadata': metadata}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """処理統計（行数・チャンク数・行/秒）"""
+        elapsed = 0.0
+        if self._started_at is not None:
+            elapsed = (self._finished_at or time.monotonic()) - self._started_at
+        return {
+            'rows': self.rows,
+            'startRow': self.start_row,
+            'chunks': self.chunks,
+            'sheets': self.sheets,
+            'elapsedSeconds': round(elapsed, 3),
+            'rowsPerSecond': round(self.rows / elapsed, 1) if elapsed > 0 else None
+        }
+
+
+def summarize_table(file_content: bytes, file_format: str, sample_rows: int = 5) -> Dict[str, Any]:
+    """
+    表形式ファイルの概要（列・型・行数・先頭行）をストリーミングで集計
+
+    Args:
+        file_content: ファイル内容
+        file_format: ファイル形式
+        sample_rows: 概要に含める先頭行数
+
+    Returns:
+        Dict: 概要
+    """
+    if file_format == 'xlsx':
+        rows = (row for _, row in iter_xlsx_rows(file_content))
+    else:
+        rows = iter_delimited_rows(file_content, file_format)
+
+    header = next(rows, [])
+    sample: List[List[str]] = []
+    row_count = 0
+    for row in rows:
+        if len(sample) < TYPE_SAMPLE_ROWS:
+            sample.append(row)
+        row_count += 1
+
+    return {
+        'columns': header,
+        'columnTypes': infer_column_types(sample, len(header)),
+        'rowCount': row_count,
+        'sampleRows': sample[:sample_rows]
+    }
+
+
+# テスト用のサンプル関数
+def test_tabular_stream():
+    """
+    ストリーミング処理のスループット計測（行/秒）
+    """
+    rows = 200000
+    content = ('id,name,price,updated\n' + ''.join(
+        f"{i},商品{i},{i * 1.5:.1f},2024-01-{i % 28 + 1:02d}\n" for i in range(rows)
+    )).encode('utf-8')
+
+    stream = TableChunkStream(content, 'csv', 'benchmark.csv', chunk_size=2000)
+    chunk_count = sum(1 for _ in stream)
+    stats = stream.get_stats()
+    print(f"{len(content) / 1024 / 1024:.1f}MB, {stats['rows']}行 -> {chunk_count}チャンク")
+    print(f"スループット: {stats['rowsPerSecond']}行/秒, 列の型: {stats['sheets'][0]['columnTypes']}")
+
+
+if __name__ == "__main__":
+    test_tabular_stream()
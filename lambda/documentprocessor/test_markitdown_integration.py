@@ -3,14 +3,21 @@ Markitdown統合機能の包括的テストスイート
 Task 1-5で実装された全機能のテスト
 """
 
+import importlib.util
 import json
+import logging
+import multiprocessing
 import os
+from decimal import Decimal
 import sys
 import unittest
 from unittest.mock import Mock, patch, MagicMock
-from datetime import datetime
+from datetime import datetime, timedelta
 import tempfile
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # テスト用の環境変数設定
 os.environ['MARKITDOWN_ENABLED'] = 'true'
@@ -22,11 +29,50 @@ os.environ['AWS_REGION'] = 'us-east-1'
 from config_loader import load_markitdown_config, get_processing_order
 from format_processors import get_format_processor
 from langchain_integration import LangChainIntegration
-from vector_embedding_bedrock_kb import BedrockKBVectorProcessor
-from metadata_manager import MetadataManager
+from vector_embedding_bedrock_kb import BedrockKBVectorProcessor, EmbeddingResult
+from metadata_manager import MetadataManager, ProcessingMetadata, METADATA_TABLE_SCHEMA
 from cloudwatch_metrics import CloudWatchMetricsCollector
-from structured_logging import MarkitdownLogger
-from document_processor import DocumentProcessor
+import structured_logging
+from structured_logging import MarkitdownLogger, LazyJson, LogSampler, cap_value, install_queue_logging, flush_logs
+from document_processor import DocumentProcessor, RetryableInvocationError, lambda_handler
+from bedrock_rate_limiter import (
+    BedrockRateLimiter, RateLimiterConfig, AIMDConcurrencyController, AdaptiveBatchSizer,
+    ErrorClass, classify_error, limiter_client_config
+)
+from resilience import ResilientCaller, CircuitBreaker, CircuitState, CircuitOpenError
+from deadline import Deadline, CheckpointStore, object_checkpoint_id
+from idempotency import IdempotencyStore, LeaseStatus, object_lease_key
+from tracing import StageHistograms, Tracer, emf_records, span, xray_segments
+
+# ベンチマーク・ローカルAWS代替（tests ディレクトリ）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests'))
+from local_services import (
+    LocalOpenSearch, LocalOpenSearchError, LocalServices, ServiceProfile, deterministic_embedding
+)
+from ingestion_benchmark import build_workload, compare_with_baseline, split_supported
+from query_benchmark import (
+    BENCHMARK_USER, INDEX_NAME, arrival_offsets, build_target, index_corpus, load_corpus, load_queries,
+    query_stream, run_closed_loop, run_open_loop
+)
+from fake_bedrock import CANNED_ANSWER, FakeBedrockRuntime, FakeBedrockServer, FaultProfile, semantic_embedding
+from memory_monitor import MemoryMonitor, MemoryPressure, SpillList, read_rss_bytes
+from error_handler import FallbackHandler, ProcessingError, ErrorType, ResourceMonitor
+from error_handler import TimeoutError as ProcessingTimeoutError
+from conversion_pool import ConversionProcessPool, convert_in_worker
+from conversion_cache import ConversionCache, conversion_options
+from content_sniffer import sniff_content, route_content, preferred_method
+from format_processors import PDFProcessor, split_pages
+from tabular_stream import TableChunkStream, infer_column_types, iter_xlsx_rows
+from markup_stream import MarkupChunkStream, iter_html_records, iter_xml_records
+from ooxml_reader import extract_ooxml, is_ooxml_package
+from archive_stream import ArchiveLimits, ArchiveManifestStore, ArchiveReader, normalize_member_path
+from image_preprocess import (
+    ImagePreprocessResult, OcrResultCache, preprocess_image, read_image_size, hamming_distance
+)
+from botocore.exceptions import ClientError
+import boto3
+from boto3.dynamodb.conditions import Attr
+from moto import mock_dynamodb
 
 class TestMarkitdownConfig(unittest.TestCase):
     """Markitdown設定のテスト"""
@@ -263,6 +309,1354 @@ class TestVectorEmbedding(unittest.TestCase):
         self.assertEqual(doc.metadata['x-amz-bedrock-kb-author'], 'test@example.com')
 
 
+
+class TestBedrockRateLimiter(unittest.TestCase):
+    """Bedrockレート制限のテスト"""
+    
+    def _client_error(self, code, headers=None):
+        return ClientError({
+            'Error': {'Code': code, 'Message': code},
+            'ResponseMetadata': {'HTTPHeaders': headers or {}}
+        }, 'InvokeModel')
+    
+    def test_error_classification(self):
+        """エラー分類テスト"""
+        self.assertEqual(classify_error(self._client_error('ThrottlingException')), ErrorClass.THROTTLED)
+        self.assertEqual(classify_error(self._client_error('ServiceUnavailableException')), ErrorClass.TRANSIENT)
+        self.assertEqual(classify_error(self._client_error('ValidationException')), ErrorClass.FATAL)
+        self.assertEqual(classify_error(ValueError('bad input')), ErrorClass.FATAL)
+    
+    @patch('bedrock_rate_limiter.time.sleep')
+    def test_limiter_is_the_only_retry_layer(self, mock_sleep):
+        """レート制限を通すクライアントはSDKのリトライを行わず、試行回数がレート制限のリトライ回数と一致するテスト"""
+        processor = BedrockKBVectorProcessor()
+        self.assertEqual(processor.bedrock_client.meta.config.retries['total_max_attempts'], 1)
+        
+        runtime = FakeBedrockRuntime({'*': FaultProfile(throttle_rate=1.0)})
+        limiter = BedrockRateLimiter(RateLimiterConfig(requests_per_second=0, max_retries=2))
+        with FakeBedrockServer(runtime) as server:
+            client = boto3.client('bedrock-runtime', endpoint_url=server.url, region_name='us-east-1',
+                                  aws_access_key_id='testing', aws_secret_access_key='testing',
+                                  config=limiter_client_config())
+            with self.assertRaises(ClientError):
+                limiter.execute(client.invoke_model, modelId='amazon.titan-embed-text-v1',
+                                body=json.dumps({'inputText': 'x'}))
+        self.assertEqual(runtime.get_stats()['amazon.titan-embed-text-v1']['calls'], 3)
+    
+    @patch('bedrock_rate_limiter.time.sleep')
+    def test_retry_on_throttling(self, mock_sleep):
+        """スロットリング時のリトライと同時実行数縮小テスト"""
+        limiter = BedrockRateLimiter(RateLimiterConfig(requests_per_second=0, initial_concurrency=8, max_retries=3))
+        func = Mock(side_effect=[self._client_error('ThrottlingException', {'retry-after': '2'}), 'ok'])
+        
+        self.assertEqual(limiter.execute(func, modelId='test'), 'ok')
+        self.assertEqual(func.call_count, 2)
+        # retry-afterヒントが待機時間の下限になる
+        self.assertGreaterEqual(mock_sleep.call_args[0][0], 2.0)
+        self.assertEqual(limiter.get_stats()['concurrency_limit'], 4)
+    
+    @patch('bedrock_rate_limiter.time.sleep')
+    def test_no_retry_on_fatal_error(self, mock_sleep):
+        """リトライ不能エラーテスト"""
+        limiter = BedrockRateLimiter(RateLimiterConfig(requests_per_second=0, max_retries=3))
+        func = Mock(side_effect=self._client_error('ValidationException'))
+        
+        with self.assertRaises(ClientError):
+            limiter.execute(func)
+        self.assertEqual(func.call_count, 1)
+        mock_sleep.assert_not_called()
+    
+    @patch('bedrock_rate_limiter.time.sleep')
+    def test_retry_limit(self, mock_sleep):
+        """リトライ上限テスト"""
+        limiter = BedrockRateLimiter(RateLimiterConfig(requests_per_second=0, max_retries=2))
+        func = Mock(side_effect=self._client_error('ThrottlingException'))
+        
+        with self.assertRaises(ClientError):
+            limiter.execute(func)
+        self.assertEqual(func.call_count, 3)
+    
+    def test_aimd_probes_upward_when_healthy(self):
+        """健全時の同時実行数増加テスト"""
+        controller = AIMDConcurrencyController(initial_limit=2, max_limit=4, success_window=2)
+        for _ in range(2):
+            controller.acquire()
+            controller.acquire()
+            controller.release()
+            controller.release()
+        self.assertGreater(controller.limit, 2)
+    
+    def test_adaptive_batch_size(self):
+        """観測レイテンシに応じたバッチサイズ調整テスト"""
+        sizer = AdaptiveBatchSizer(initial_size=20, max_size=50, target_latency_ms=1000)
+        self.assertEqual(sizer.record(20, 3000), 10)
+        self.assertGreater(sizer.record(10, 100), 10)
+        self.assertEqual(sizer.record(12, 100, throttled=True), 6)
+
+
+class TestResilience(unittest.TestCase):
+    """ヘッジリクエスト・サーキットブレーカーのテスト"""
+    
+    @patch('resilience.print')
+    def test_circuit_opens_and_fails_fast(self, mock_print):
+        """連続失敗でOPENとなり即時失敗するテスト"""
+        caller = ResilientCaller('test-service', 'test-model', failure_threshold=2, recovery_timeout=60)
+        func = Mock(side_effect=ConnectionError('down'))
+        
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                caller.call(func)
+        
+        with self.assertRaises(CircuitOpenError):
+            caller.call(func)
+        self.assertEqual(func.call_count, 2)
+        self.assertEqual(caller.breaker.state, CircuitState.OPEN)
+        # 状態遷移がメトリクスとして出力される
+        record = json.loads(mock_print.call_args[0][0])
+        self.assertEqual(record['ToState'], 'open')
+        self.assertEqual(record['Resource'], 'test-model')
+    
+    @patch('resilience.print')
+    def test_half_open_recovery(self, mock_print):
+        """回復待機後の試行成功でCLOSEDに戻るテスト"""
+        breaker = CircuitBreaker('test-service', 'test-index', failure_threshold=1, recovery_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitState.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+    
+    def test_client_errors_do_not_open_circuit(self):
+        """入力不正エラーはブレーカーの失敗に数えないテスト"""
+        caller = ResilientCaller('test-service', 'test-model', failure_threshold=1)
+        with self.assertRaises(ValueError):
+            caller.call(Mock(side_effect=ValueError('bad input')))
+        self.assertEqual(caller.breaker.state, CircuitState.CLOSED)
+    
+    def test_hedged_request_returns_first_result(self):
+        """遅い呼び出しに対するヘッジ送信テスト"""
+        caller = ResilientCaller('test-service', 'test-index', default_hedge_delay_ms=20)
+        first_call = threading.Event()
+        
+        def slow_then_fast():
+            if not first_call.is_set():
+                first_call.set()
+                time.sleep(1.0)
+                return 'slow'
+            return 'fast'
+        
+        self.assertEqual(caller.call(slow_then_fast, hedge=True), 'fast')
+        self.assertEqual(caller.get_stats()['hedge_wins'], 1)
+    
+    def test_hedge_pool_covers_caller_concurrency(self):
+        """ヘッジ用プールが呼び出し元の同時実行数以上に確保されるテスト"""
+        caller = ResilientCaller('test-service', 'test-model', default_hedge_delay_ms=50, max_workers=4)
+        barrier = threading.Barrier(4, timeout=2)
+        
+        def wait_for_all():
+            # 4並列の元の呼び出しが同時に実行されないとタイムアウトする
+            barrier.wait()
+            return 'ok'
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: caller.call(wait_for_all, hedge=True), range(4)))
+        self.assertEqual(results, ['ok'] * 4)
+        
+        caller.reserve_workers(8)
+        self.assertEqual(caller._max_workers, 8)
+        self.assertEqual(caller.call(lambda: 'after-resize', hedge=True), 'after-resize')
+
+def _sleep_in_worker(file_content, seconds):
+    """ワーカープロセスで待機するテスト用関数"""
+    time.sleep(seconds)
+    return len(file_content)
+
+
+def _allocate_in_worker(file_content, megabytes):
+    """ワーカープロセスで大量のメモリを確保するテスト用関数"""
+    return len(bytearray(megabytes * 1024 * 1024))
+
+
+class TestConversionPool(unittest.TestCase):
+    """変換ワーカープールのテスト"""
+    
+    def setUp(self):
+        """テストセットアップ"""
+        self.pool = ConversionProcessPool(max_workers=1, memory_limit_mb=128, shared_memory_threshold=1024)
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.pool.shutdown()
+    
+    def test_conversion_in_worker_with_shared_memory(self):
+        """大きな入力を共有メモリで受け渡してワーカーで変換するテスト"""
+        config = {'performance': {'maxFileSizeBytes': 10485760}}
+        success, content, metadata = self.pool.run(
+            convert_in_worker, b'%PDF-1.4 ' * 1000, 'pdf', 'markitdown', config, 'test.pdf', timeout=30
+        )
+        
+        self.assertTrue(success)
+        self.assertIn('test.pdf', content)
+        self.assertNotEqual(metadata['workerPid'], os.getpid())
+        self.assertEqual(self.pool.get_stats()['shared_memory_tasks'], 1)
+    
+    def test_timeout_kills_and_replaces_worker(self):
+        """タイムアウトしたワーカーを強制終了して再生成するテスト"""
+        with self.assertRaises(ProcessingTimeoutError):
+            self.pool.run(_sleep_in_worker, b'data', 5, timeout=0.2)
+        
+        # 再生成されたワーカーで処理を継続できる
+        self.assertEqual(self.pool.run(_sleep_in_worker, b'data', 0, timeout=5), 4)
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['respawns'], 1)
+    
+    def test_cancellation_stops_worker(self):
+        """期限のキャンセルでワーカーの処理を中断するテスト"""
+        deadline = Deadline(5000)
+        threading.Timer(0.1, deadline.cancel, args=('early-accept',)).start()
+        start = time.monotonic()
+        with self.assertRaises(ProcessingError) as context:
+            self.pool.run(_sleep_in_worker, b'data', 5, deadline=deadline)
+        self.assertEqual(context.exception.error_type, ErrorType.PROCESSING_INTERRUPTED)
+        self.assertLess(time.monotonic() - start, 2)
+    
+    def test_memory_limit_enforced(self):
+        """メモリ上限を超えたワーカーが停止されるテスト"""
+        with self.assertRaises(ProcessingError) as context:
+            self.pool.run(_allocate_in_worker, b'data', 512, timeout=30)
+        self.assertEqual(context.exception.error_type, ErrorType.MEMORY_LIMIT_EXCEEDED)
+    
+    def test_respawn_after_threads_started_avoids_fork(self):
+        """補助スレッドの起動後はフォークせずにワーカーを再生成するテスト"""
+        stop = threading.Event()
+        helper = threading.Thread(target=stop.wait, daemon=True)
+        helper.start()
+        try:
+            with self.assertRaises(ProcessingTimeoutError):
+                self.pool.run(_sleep_in_worker, b'data', 5, timeout=0.2)
+            
+            success, content, metadata = self.pool.run(
+                convert_in_worker, b'%PDF-1.4 content', 'pdf', 'markitdown', {}, 'test.pdf', timeout=60
+            )
+        finally:
+            stop.set()
+        self.assertTrue(success)
+        self.assertNotEqual(metadata['workerPid'], os.getpid())
+        self.assertEqual(self.pool.get_stats()['thread_safe_respawns'], 1)
+        # フォークせずに起動したワーカーは親プロセスとページを共有しないため全体を集計
+        self.assertGreater(self.pool.memory_bytes(), 0)
+    
+    def test_memory_limit_excludes_inherited_pages(self):
+        """フォーク元から引き継いだページはワーカーのメモリ上限に含めないテスト"""
+        ballast = b'\x01' * (160 * 1024 * 1024)
+        pool = ConversionProcessPool(max_workers=1, memory_limit_mb=128, shared_memory_threshold=1024)
+        try:
+            # 結果待ちの間にメモリ使用量を監視させるため一定時間待機するタスクを実行
+            self.assertEqual(pool.run(_sleep_in_worker, b'data', 0.3, timeout=30), 4)
+            self.assertEqual(pool.get_stats()['memory_kills'], 0)
+        finally:
+            pool.shutdown()
+            del ballast
+
+class TestConversionCache(unittest.TestCase):
+    """変換結果キャッシュのテスト"""
+    
+    def setUp(self):
+        """テストセットアップ"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ConversionCache(bucket=None, local_dir=self.temp_dir)
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            self.processor = DocumentProcessor()
+        self.processor.conversion_cache = self.cache
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_put_and_get_round_trip(self):
+        """ローカル層への保存と取得のテスト"""
+        key = ConversionCache.make_key('a' * 64, 'pdf', 'markitdown', 'v1', {'ocr': True})
+        self.assertIsNone(self.cache.get(key))
+        
+        self.cache.put(key, '# title', {'method': 'markitdown'}, 'test.pdf')
+        entry = self.cache.get(key)
+        
+        self.assertEqual(entry['markdown'], '# title')
+        self.assertEqual(entry['fileName'], 'test.pdf')
+        self.assertEqual(self.cache.list_keys('a' * 64), [key])
+        self.assertEqual(self.cache.get_stats()['local_hits'], 1)
+    
+    def test_key_depends_on_version_and_options(self):
+        """変換器バージョン・オプションの変更でキーが変わるテスト"""
+        base = ConversionCache.make_key('a' * 64, 'pdf', 'markitdown', 'v1', {'ocr': True})
+        
+        self.assertNotEqual(base, ConversionCache.make_key('a' * 64, 'pdf', 'markitdown', 'v2', {'ocr': True}))
+        self.assertNotEqual(base, ConversionCache.make_key('a' * 64, 'pdf', 'markitdown', 'v1', {'ocr': False}))
+        
+        # 早期採用の設定は変換結果に影響しない
+        config = {'quality': {'ocrAccuracy': 'high'}}
+        self.assertEqual(
+            conversion_options(config, 'pdf'),
+            conversion_options({'quality': {'ocrAccuracy': 'high', 'earlyAcceptEnabled': True}}, 'pdf')
+        )
+    
+    def test_second_conversion_hits_cache(self):
+        """同一内容の再変換でキャッシュを使用するテスト"""
+        first = self.processor.process_with_markitdown(b'%PDF-1.4 cache test', 'pdf', 'cache.pdf')
+        second = self.processor.process_with_markitdown(b'%PDF-1.4 cache test', 'pdf', 'renamed.pdf')
+        
+        self.assertTrue(first[0])
+        self.assertFalse(first[2].get('cacheHit', False))
+        self.assertTrue(second[2]['cacheHit'])
+        self.assertEqual(first[1], second[1])
+    
+    def test_replay_with_different_chunk_size(self):
+        """キャッシュからチャンクサイズを変えてリプレイするテスト"""
+        key = ConversionCache.make_key('b' * 64, 'md', 'markitdown', 'v1', {})
+        self.cache.put(key, '\n\n'.join(f"段落{i} " + 'テキスト' * 50 for i in range(10)),
+                       {'method': 'markitdown'}, 'replay.md')
+        
+        small = self.processor.replay_from_cache([key], chunk_size=200, chunk_overlap=0)
+        large = self.processor.replay_from_cache([key], chunk_size=2000, chunk_overlap=0)
+        missing = self.processor.replay_from_cache(['missing/key'])
+        
+        self.assertTrue(small['success'])
+        self.assertEqual(small['chunkSize'], 200)
+        self.assertGreater(small['results'][0]['chunkCount'], large['results'][0]['chunkCount'])
+        self.assertFalse(missing['success'])
+
+
+class TestContentSniffer(unittest.TestCase):
+    """マジックバイトによる内容判定のテスト"""
+    
+    def test_pdf_text_layer_detection(self):
+        """テキスト層のあるPDFとスキャンPDFを判別するテスト"""
+        text_pdf = sniff_content(b'%PDF-1.7\n1 0 obj << /Type /Font /Subtype /Type1 >> endobj\n%%EOF\n')
+        scanned_pdf = sniff_content(b'%PDF-1.4\n1 0 obj << /Type /XObject /Subtype /Image >> endobj\n')
+        
+        self.assertEqual(text_pdf.pdf_layout, 'text')
+        self.assertTrue(text_pdf.pdf_complete)
+        self.assertEqual(preferred_method(text_pdf), 'langchain')
+        self.assertEqual(scanned_pdf.pdf_layout, 'scanned')
+        self.assertFalse(scanned_pdf.pdf_complete)
+        self.assertEqual(preferred_method(scanned_pdf), 'markitdown')
+    
+    def test_ooxml_and_image_routing(self):
+        """OOXMLのメンバー名・画像署名から形式を振り分けるテスト"""
+        xlsx = sniff_content(b'PK\x03\x04' + b'\x00' * 26 + b'[Content_Types].xml' + b'xl/workbook.xml')
+        self.assertEqual(route_content(xlsx, 'docx'), ('xlsx', None))
+        
+        png = sniff_content(b'\x89PNG\r\n\x1a\n' + b'\x00' * 16)
+        self.assertEqual(route_content(png, 'pdf'), ('png', None))
+        self.assertEqual(route_content(sniff_content(b'\xff\xd8\xff\xe0'), 'jpeg'), ('jpeg', None))
+    
+    def test_text_encoding_and_csv_dialect(self):
+        """エンコーディングとCSVの区切り文字を判定するテスト"""
+        sniff = sniff_content('商品;価格\nりんご;100\nみかん;80\n'.encode('cp932'))
+        
+        self.assertEqual(sniff.encoding, 'cp932')
+        self.assertEqual(sniff.detected_format, 'csv')
+        self.assertEqual(sniff.csv_dialect['delimiter'], ';')
+        self.assertEqual(route_content(sniff_content(b'plain text only'), 'pdf')[0], None)
+    
+    def test_undecodable_file_rejected_before_conversion(self):
+        """判別できないバイナリを変換前に拒否するテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        
+        result = processor.process_document(bytes(range(256)) * 64, 'mislabeled.pdf')
+        
+        self.assertFalse(result['success'])
+        self.assertEqual(result['error']['type'], 'ProcessingError')
+        self.assertIn('デコード不能', result['error']['message'])
+        self.assertEqual(result['metadata']['attemptedMethods'], [])
+        self.assertEqual(result['metadata']['contentSniff']['container'], 'binary')
+
+
+class TestPagePipeline(unittest.TestCase):
+    """PDFのページ並列処理のテスト"""
+    
+    def setUp(self):
+        """テストセットアップ"""
+        self.temp_dir = tempfile.mkdtemp()
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            self.processor = DocumentProcessor()
+        self.processor.conversion_cache = ConversionCache(bucket=None, local_dir=self.temp_dir)
+        self.processor.config = dict(self.processor.config, supportedFormats=dict(
+            self.processor.config['supportedFormats'],
+            pdf=dict(self.processor.config['supportedFormats']['pdf'], pageBatchSize=10)
+        ))
+        self.pdf_content = (b'%PDF-1.4\n1 0 obj << /Type /Pages /Count 25 >> endobj\n' +
+                            b''.join(b'%d 0 obj << /Type /Page /Parent 1 0 R >> endobj\n' % (i + 2)
+                                     for i in range(25)) +
+                            b'trailer\n%%EOF\n')
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_page_batches(self):
+        """ページ数からバッチ範囲を決定するテスト"""
+        self.assertEqual(PDFProcessor({}).count_pages(self.pdf_content), 25)
+        self.assertEqual(self.processor.plan_page_batches(self.pdf_content, 'pdf'), [(1, 10), (11, 20), (21, 25)])
+        self.assertIsNone(self.processor.plan_page_batches(b'%PDF-1.4 small', 'pdf'))
+        
+        pages = split_pages('<!-- page: 3 -->\nA\n\n<!-- page: 4 -->\nB')
+        self.assertEqual(pages, [(3, 'A'), (4, 'B')])
+    
+    def test_chunks_carry_real_page_numbers(self):
+        """チャンクとBedrock KBドキュメントに実際のページ番号が付与されるテスト"""
+        # Bedrock・OpenSearchの呼び出しはレート制御・待機を伴うため置き換える
+        embedded_batches = []
+        
+        def generate_embeddings(texts, deadline=None):
+            embedded_batches.append(len(texts))
+            return EmbeddingResult(success=True, embeddings=[[0.1]] * len(texts), metadata={})
+        
+        self.processor.vector_processor.generate_embeddings = generate_embeddings
+        self.processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            return_value={'success': True, 'stored_count': 0}
+        )
+        result = self.processor.process_document(
+            file_content=self.pdf_content,
+            file_name='manual.pdf',
+            processing_strategy='markitdown-first'
+        )
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['metadata']['pagePipeline']['pageCount'], 25)
+        self.assertEqual(result['metadata']['pagePipeline']['batches'], 3)
+        # 埋め込みはバッチの変換完了ごとに生成済み
+        self.assertEqual(len(embedded_batches), 3)
+        self.assertEqual(result['metadata']['pagePipeline']['embeddedChunks'],
+                         len(result['langchainProcessing']['chunks']))
+        
+        chunks = result['langchainProcessing']['chunks']
+        page_numbers = [chunk['metadata']['page_number'] for chunk in chunks]
+        # テスト用のPDFはページに分割できないため、各バッチは1回で変換され先頭ページの番号が付与される
+        self.assertEqual(sorted(set(page_numbers)), [1, 11, 21])
+        self.assertEqual(page_numbers, sorted(page_numbers))
+        self.assertEqual(len({chunk['metadata']['chunk_id'] for chunk in chunks}), len(chunks))
+        
+        documents = BedrockKBVectorProcessor().create_bedrock_kb_documents(
+            chunks=chunks, embeddings=[[0.0]] * len(chunks), source_file='manual.pdf'
+        )
+        self.assertEqual(documents[-1].metadata['x-amz-bedrock-kb-document-page-number'], 21)
+    
+    def test_pdf_parsed_once_per_batch(self):
+        """ページバッチごとにPDFを1回だけ解析し、分割できない場合はバッチを1回で変換するテスト"""
+        processor = PDFProcessor({})
+        converted = []
+        
+        def convert(content, label):
+            converted.append(label)
+            return True, f"text of {label}", {'qualityScore': 80}
+        
+        processor.process_with_markitdown = convert
+        with patch.dict(sys.modules, {'pypdf': None}):
+            success, content, metadata = processor.process_pages('markitdown', self.pdf_content, 'a.pdf', 11, 20)
+        self.assertTrue(success)
+        self.assertEqual(converted, ['a.pdf (p.11-20)'])
+        self.assertFalse(metadata['pagesSplit'])
+        self.assertEqual(split_pages(content)[0][0], 11)
+        
+        readers = []
+        
+        class FakeReader:
+            def __init__(self, stream):
+                readers.append(self)
+                self.pages = [f"page-{i}" for i in range(25)]
+        
+        class FakeWriter:
+            def __init__(self):
+                self.pages = []
+            
+            def add_page(self, page):
+                self.pages.append(page)
+            
+            def write(self, output):
+                output.write(','.join(self.pages).encode())
+        
+        converted.clear()
+        fake_pypdf = type(sys)('pypdf')
+        fake_pypdf.PdfReader, fake_pypdf.PdfWriter = FakeReader, FakeWriter
+        with patch.dict(sys.modules, {'pypdf': fake_pypdf}):
+            success, content, metadata = processor.process_pages('markitdown', self.pdf_content, 'a.pdf', 21, 25)
+        self.assertTrue(metadata['pagesSplit'])
+        self.assertEqual(len(readers), 1)
+        self.assertEqual(converted, [f"a.pdf (p.{page})" for page in range(21, 26)])
+        self.assertEqual([page for page, _ in split_pages(content)], list(range(21, 26)))
+
+
+class TestTabularStream(unittest.TestCase):
+    """表形式ファイルの行ストリーミング処理のテスト"""
+    
+    def setUp(self):
+        """テストセットアップ"""
+        self.csv_content = ('id,name,price,active,updated\n' + ''.join(
+            f"{i},商品{i},{i * 1.5},{'true' if i % 2 else 'false'},2024-01-{i % 28 + 1:02d}\n"
+            for i in range(1000)
+        )).encode('utf-8')
+    
+    def _make_xlsx(self, sheets):
+        """最小構成のXLSXをメモリ上に作成"""
+        import io
+        import zipfile
+        ns = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+        rel_ns = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+        shared = []
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('[Content_Types].xml', '<Types/>')
+            sheet_elements = []
+            rels = []
+            for index, (name, rows) in enumerate(sheets, start=1):
+                row_xml = []
+                for r, row in enumerate(rows, start=1):
+                    cells = []
+                    for c, value in enumerate(row):
+                        ref = f"{chr(ord('A') + c)}{r}"
+                        if isinstance(value, str):
+                            shared.append(value)
+                            cells.append(f'<c r="{ref}" t="s"><v>{len(shared) - 1}</v></c>')
+                        elif value is not None:
+                            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+                    row_xml.append(f'<row r="{r}">{"".join(cells)}</row>')
+                archive.writestr(f'xl/worksheets/sheet{index}.xml',
+                                 f'<worksheet xmlns="{ns}"><sheetData>{"".join(row_xml)}</sheetData></worksheet>')
+                sheet_elements.append(f'<sheet name="{name}" sheetId="{index}" r:id="rId{index}"/>')
+                rels.append(f'<Relationship Id="rId{index}" Target="worksheets/sheet{index}.xml"/>')
+            archive.writestr('xl/workbook.xml', f'<workbook xmlns="{ns}" xmlns:r="{rel_ns}"><sheets>'
+                                                f'{"".join(sheet_elements)}</sheets></workbook>')
+            archive.writestr('xl/_rels/workbook.xml.rels',
+                             '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                             f'{"".join(rels)}</Relationships>')
+            archive.writestr('xl/sharedStrings.xml', f'<sst xmlns="{ns}">' +
+                             ''.join(f'<si><t>{value}</t></si>' for value in shared) + '</sst>')
+        return buffer.getvalue()
+    
+    def test_chunks_repeat_header(self):
+        """各チャンクがヘッダー行を含み、行範囲が連続するテスト"""
+        stream = TableChunkStream(self.csv_content, 'csv', 'items.csv', chunk_size=1000)
+        chunks = list(stream)
+        
+        self.assertGreater(len(chunks), 1)
+        next_row = 0
+        for chunk in chunks:
+            self.assertTrue(chunk['content'].startswith('| id | name | price | active | updated |'))
+            self.assertLessEqual(len(chunk['content']), 1000)
+            self.assertEqual(chunk['metadata']['row_start'], next_row)
+            self.assertEqual(chunk['metadata']['chunk_type'], 'table')
+            next_row = chunk['metadata']['row_end'] + 1
+        self.assertEqual(next_row, 1000)
+        
+        stats = stream.get_stats()
+        self.assertEqual(stats['rows'], 1000)
+        self.assertEqual(stats['sheets'][0]['columnTypes'], ['integer', 'string', 'number', 'boolean', 'date'])
+        self.assertGreater(stats['rowsPerSecond'], 0)
+        
+        # 再開位置を指定した場合はその行から生成
+        resumed = list(TableChunkStream(self.csv_content, 'csv', 'items.csv', chunk_size=1000, start_row=500))
+        self.assertEqual(resumed[0]['metadata']['row_start'], 500)
+        self.assertEqual(resumed[-1]['metadata']['row_end'], 999)
+    
+    def test_infer_column_types(self):
+        """サンプル行からの列の型推定テスト"""
+        rows = [['1', '1,200.5', 'TRUE', '2024/01/02', 'abc', ''],
+                ['-3', '7', 'false', '2024-12-31 10:00', '12', '']]
+        self.assertEqual(infer_column_types(rows, 6), ['integer', 'number', 'boolean', 'date', 'string', 'empty'])
+    
+    def test_xlsx_streaming(self):
+        """XLSXのシート別ストリーミングテスト"""
+        content = self._make_xlsx([
+            ('売上', [['地域', '金額'], ['東京', 100], ['大阪', None], ['名古屋', 300]]),
+            ('在庫', [['品目', '数量'], ['A', 5]])
+        ])
+        rows = list(iter_xlsx_rows(content))
+        self.assertEqual(rows[0], ('売上', ['地域', '金額']))
+        self.assertEqual(rows[2], ('売上', ['大阪']))
+        
+        stream = TableChunkStream(content, 'xlsx', 'sales.xlsx')
+        chunks = list(stream)
+        self.assertEqual([chunk['metadata']['sheet_name'] for chunk in chunks], ['売上', '在庫'])
+        self.assertIn('| 大阪 |  |', chunks[0]['content'])
+        self.assertTrue(chunks[1]['content'].startswith('### 在庫\n| 品目 | 数量 |'))
+        self.assertEqual(stream.get_stats()['rows'], 4)
+    
+    def test_office_xlsx_conversion_summarizes(self):
+        """XLSXの変換結果はブック全体ではなく行単位で集計した概要のみとするテスト（行は別途ストリーミング）"""
+        content = self._make_xlsx([('売上', [['地域', '金額']] + [[f'地域{i}', i] for i in range(500)])])
+        processor = get_format_processor('xlsx', {'supportedFormats': {'xlsx': {'ocr': False}}})
+        success, markdown, metadata = processor.process_with_markitdown(content, 'sales.xlsx')
+        
+        self.assertTrue(success)
+        self.assertEqual(metadata['rowCount'], 500)
+        self.assertEqual(metadata['columnTypes'], ['string', 'integer'])
+        self.assertIn('| 地域4 | 4 |', markdown)
+        self.assertNotIn('地域5', markdown)
+        self.assertNotIn('ooxml', metadata)
+    
+    def test_pipeline_embeds_per_batch(self):
+        """チャンクのバッチごとに埋め込み生成・格納されるテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        embedded_batches = []
+        
+        def generate_embeddings(texts, deadline=None):
+            embedded_batches.append(len(texts))
+            return EmbeddingResult(success=True, embeddings=[[0.1]] * len(texts), metadata={})
+        
+        processor.vector_processor.generate_embeddings = generate_embeddings
+        processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            side_effect=lambda docs: {'success': True, 'stored_count': len(docs)}
+        )
+        result = processor.process_document(file_content=self.csv_content, file_name='items.csv')
+        
+        self.assertTrue(result['success'])
+        tabular = result['metadata']['streamingIngest']
+        self.assertEqual(tabular['rows'], 1000)
+        self.assertIsNone(tabular['nextOffset'])
+        self.assertGreater(len(embedded_batches), 1)
+        self.assertEqual(sum(embedded_batches), tabular['chunks'])
+        self.assertEqual(result['opensearchStorage']['stored_count'], tabular['chunks'])
+        self.assertNotIn('langchainProcessing', result)
+        
+        # チャンクインデックスはバッチをまたいで連続
+        indices = [doc.metadata['chunk_index'] for call in
+                   processor.vector_processor.store_embeddings_to_opensearch.call_args_list for doc in call[0][0]]
+        self.assertEqual(sorted(indices), list(range(tabular['chunks'])))
+    
+    def test_pipeline_resumes_from_row_offset(self):
+        """期限で中断した行から再開できるテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        first_deadline = Deadline(60000)
+        embedded_rows = []
+        
+        # 最初のバッチの埋め込み中に期限切れとする
+        
+        def generate_embeddings(texts, deadline=None):
+            first_deadline.cancel()
+            embedded_rows.append(len(texts))
+            return EmbeddingResult(success=True, embeddings=[[0.1]] * len(texts), metadata={})
+        
+        processor.vector_processor.generate_embeddings = generate_embeddings
+        processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            side_effect=lambda docs: {'success': True, 'stored_count': len(docs)}
+        )
+        content = self.csv_content + ''.join(f"{i},商品{i},1.0,true,2024-02-01\n" for i in range(1000, 5000)).encode('utf-8')
+        first = processor.ingest_chunk_stream(processor.create_chunk_stream(content, 'csv', 'items.csv'),
+                                              'items.csv', len(content), None, first_deadline)
+        self.assertIsNotNone(first['nextOffset'])
+        
+        second = processor.ingest_chunk_stream(
+            processor.create_chunk_stream(content, 'csv', 'items.csv', start=first['nextOffset']),
+            'items.csv', len(content), None, Deadline(60000)
+        )
+        self.assertIsNone(second['nextOffset'])
+        self.assertEqual(second['rows'], 5000)
+        full = list(TableChunkStream(content, 'csv', 'items.csv',
+                                     chunk_size=processor.langchain_integration.chunk_size))
+        self.assertEqual(first['chunks'] + second['chunks'], len(full))
+
+
+class TestMarkupStream(unittest.TestCase):
+    """HTML/XMLのストリーミング抽出のテスト"""
+    
+    def setUp(self):
+        """テストセットアップ"""
+        self.html_content = """<html><head><title>社内規程</title><style>p { color: red; }</style></head>
+<body><nav><ul><li>ホーム</li><li>お問い合わせ</li></ul></nav>
+<script>document.write('<p>広告</p>');</script>
+<h1>第1章 総則</h1><p>この規程は&amp;目的を定める。</p>
+<section><h2>第2条 適用範囲</h2><ul><li>正社員</li><li>契約社員</li></ul></section>
+<footer>Copyright</footer></body></html>""".encode('utf-8')
+    
+    def _make_xml(self, records):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<export xmlns="urn:example:catalog">'
+                '<generatedAt>2024-01-01</generatedAt>' + ''.join(
+                    f'<item id="{i}"><name>商品{i}</name><price currency="JPY">{i * 10}</price></item>'
+                    for i in range(records)
+                ) + '</export>').encode('utf-8')
+    
+    def test_html_drops_boilerplate(self):
+        """定型要素を除去し、区切り要素ごとにレコードを分けるテスト"""
+        stats = {}
+        records = list(iter_html_records(self.html_content, stats=stats))
+        text = '\n'.join(record for _, record in records)
+        
+        for boilerplate in ('ホーム', '広告', 'color', 'Copyright'):
+            self.assertNotIn(boilerplate, text)
+        self.assertEqual(stats['droppedElements'], 4)
+        self.assertEqual([label for label, _ in records], ['', '第1章 総則', '第2条 適用範囲'])
+        self.assertIn('# 第1章 総則\n\nこの規程は&目的を定める。', records[1][1])
+        self.assertIn('- 正社員', records[2][1])
+    
+    def test_xml_records_stream(self):
+        """XMLをレコード単位で逐次抽出するテスト"""
+        records = list(iter_xml_records(self._make_xml(3)))
+        self.assertEqual(records[0], ('generatedAt', '### generatedAt\n2024-01-01'))
+        self.assertEqual(records[1][0], 'item 0')
+        self.assertIn('- **price@currency**: JPY', records[2][1])
+        self.assertEqual(len(records), 4)
+        
+        # 区切り要素を指定した場合はその要素のみをレコードとする
+        names = list(iter_xml_records(self._make_xml(2), record_elements=['name']))
+        self.assertEqual([label for label, _ in names if label == 'name'], ['name', 'name'])
+    
+    def test_chunks_follow_record_boundaries(self):
+        """チャンクがレコード境界で区切られ、DOM構築よりピークメモリが小さいテスト"""
+        import tracemalloc
+        content = self._make_xml(20000)
+        
+        tracemalloc.start()
+        stream = MarkupChunkStream(content, 'xml', 'export.xml', chunk_size=500)
+        next_record = 0
+        for chunk in stream:
+            self.assertEqual(chunk['metadata']['record_start'], next_record)
+            self.assertLessEqual(len(chunk['content']), 500)
+            self.assertTrue(chunk['content'].startswith(('### item', '### generatedAt')))
+            next_record = chunk['metadata']['record_end'] + 1
+        _, stream_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        self.assertEqual(next_record, 20001)
+        self.assertEqual(stream.get_stats()['records'], 20001)
+        
+        # DOMを構築する場合との比較
+        import xml.etree.ElementTree as ET
+        tracemalloc.start()
+        ET.fromstring(content)
+        _, dom_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertLess(stream_peak, dom_peak / 5)
+    
+    def test_oversized_record_is_split(self):
+        """チャンクサイズを超えるレコードを行単位で分割するテスト"""
+        html = ('<h1>長い節</h1>' + ''.join(f'<p>段落{i} ' + 'あ' * 40 + '</p>' for i in range(20))).encode('utf-8')
+        chunks = list(MarkupChunkStream(html, 'html', 'long.html', chunk_size=200))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk['content']) <= 200 for chunk in chunks))
+        self.assertTrue(all(chunk['metadata']['record_start'] == 0 for chunk in chunks))
+    
+    def test_pipeline_streams_xml(self):
+        """XMLがレコード単位のストリーミングで埋め込み・格納されるテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.vector_processor.generate_embeddings = lambda texts, deadline=None: EmbeddingResult(
+            success=True, embeddings=[[0.1]] * len(texts), metadata={}
+        )
+        processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            side_effect=lambda docs: {'success': True, 'stored_count': len(docs)}
+        )
+        result = processor.process_document(file_content=self._make_xml(500), file_name='export.xml')
+        
+        self.assertTrue(result['success'])
+        streaming = result['metadata']['streamingIngest']
+        self.assertEqual(streaming['format'], 'xml')
+        self.assertEqual(streaming['records'], 501)
+        self.assertEqual(result['opensearchStorage']['stored_count'], streaming['chunks'])
+        self.assertIn('商品0', result['markdownContent'])
+    
+    def test_documents_carry_user_and_project(self):
+        """ストリーミング・変換結果全体のチャンキングの両方で格納ドキュメントにユーザーID・プロジェクトIDが入るテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.vector_processor.generate_embeddings = lambda texts, deadline=None: EmbeddingResult(
+            success=True, embeddings=[[0.1]] * len(texts), metadata={}
+        )
+        stored = []
+        processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            side_effect=lambda docs: stored.extend(docs) or {'success': True, 'stored_count': len(docs)}
+        )
+        
+        processor.process_document(file_content=self._make_xml(50), file_name='export.xml',
+                                   user_id='user-1', project_id='project-1')
+        with patch.object(processor, 'create_chunk_stream', return_value=None):
+            processor.process_document(file_content=self._make_xml(50), file_name='export.xml',
+                                       user_id='user-2', project_id='project-2')
+        
+        owners = {(doc.metadata['user_id'], doc.metadata['project_id']) for doc in stored}
+        self.assertEqual(owners, {('user-1', 'project-1'), ('user-2', 'project-2')})
+    
+    def test_pipeline_falls_back_when_stream_fails(self):
+        """ストリーミングに失敗した場合は変換結果全体をチャンキングし、両方失敗した場合は失敗とするテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.vector_processor.generate_embeddings = lambda texts, deadline=None: EmbeddingResult(
+            success=True, embeddings=[[0.1]] * len(texts), metadata={}
+        )
+        processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            side_effect=lambda docs: {'success': True, 'stored_count': len(docs)}
+        )
+        processor.ingest_chunk_stream = Mock(side_effect=ValueError('broken record'))
+        
+        result = processor.process_document(file_content=self._make_xml(50), file_name='export.xml')
+        self.assertTrue(result['success'])
+        self.assertEqual(result['metadata']['streamingIngest']['fallback'], 'markdown')
+        self.assertGreater(len(result['langchainProcessing']['chunks']), 0)
+        self.assertGreater(result['opensearchStorage']['stored_count'], 0)
+        
+        with patch.object(processor, '_chunk_markdown', side_effect=RuntimeError('chunker down')):
+            failed = processor.process_document(file_content=self._make_xml(50), file_name='export.xml')
+        self.assertFalse(failed['success'])
+        self.assertEqual(failed['error']['type'], 'ChunkingFailed')
+    
+    def test_processing_metadata_records_outcome(self):
+        """処理メタデータに最終的な成否を記録し、チェックポイントから再開する実行は記録しないテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.metadata_manager = MagicMock()
+        
+        processor.ingest_chunk_stream = Mock(side_effect=ValueError('broken record'))
+        with patch.object(processor, '_chunk_markdown', side_effect=RuntimeError('chunker down')):
+            failed = processor.process_document(file_content=self._make_xml(50), file_name='export.xml')
+        self.assertFalse(failed['success'])
+        recorded = processor.metadata_manager.update_processing_metadata.call_args.kwargs
+        self.assertFalse(recorded['success'])
+        self.assertEqual(recorded['error_message'], failed['error']['message'])
+        
+        processor.metadata_manager.reset_mock()
+        processor.ingest_chunk_stream = Mock(return_value={
+            'chunks': 25, 'embeddings': 25, 'stored': 25, 'failedBatches': 0, 'embeddingDimension': 1,
+            'nextOffset': 25
+        })
+        with patch.object(processor, 'save_checkpoint', return_value={'checkpointId': 'cp-1'}):
+            checkpointed = processor.process_document(file_content=self._make_xml(50), file_name='export.xml')
+        self.assertEqual(checkpointed['checkpoint']['checkpointId'], 'cp-1')
+        processor.metadata_manager.update_processing_metadata.assert_not_called()
+    
+    def test_stream_failure_removes_partial_batches(self):
+        """ストリーミングが途中で失敗した場合は格納済みのバッチを削除してから全体を格納し直すテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        vector_processor = processor.vector_processor
+        vector_processor.generate_embeddings = lambda texts, deadline=None: EmbeddingResult(
+            success=True, embeddings=[[0.1]] * len(texts), metadata={}
+        )
+        
+        def store(docs):
+            for doc in docs:
+                vector_processor._mock_index[doc.id] = doc
+            return {'success': True, 'stored_count': len(docs)}
+        
+        vector_processor.store_embeddings_to_opensearch = Mock(side_effect=store)
+        stream_iter = MarkupChunkStream.__iter__
+        
+        def failing_iter(stream):
+            # 3バッチ目の途中で壊れたレコードに当たるストリーム
+            for index, chunk in enumerate(stream_iter(stream)):
+                if index == 60:
+                    raise ValueError('broken record')
+                yield chunk
+        
+        with patch.object(MarkupChunkStream, '__iter__', failing_iter):
+            result = processor.process_document(file_content=self._make_xml(2000), file_name='export.xml')
+        self.assertTrue(result['success'])
+        cleanup = result['metadata']['streamingIngest']['cleanup']
+        self.assertTrue(cleanup['success'])
+        self.assertGreater(cleanup['deleted_count'], 0)
+        # 残っているのは変換結果全体のチャンキングで格納したドキュメントのみ
+        self.assertEqual(len(vector_processor._mock_index), result['opensearchStorage']['stored_count'])
+        self.assertFalse(any('record_start' in doc.metadata for doc in vector_processor._mock_index.values()))
+
+
+class TestOoxmlReader(unittest.TestCase):
+    """Office文書（OOXML）の遅延読み込みのテスト"""
+    
+    W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    A = ('xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main" '
+         'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"')
+    
+    def _make_package(self, members):
+        import io
+        import zipfile
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('[Content_Types].xml', '<Types/>')
+            for name, data in members.items():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+    
+    def _slide(self, *paragraphs):
+        body = ''.join(f'<a:p><a:r><a:t>{text}</a:t></a:r></a:p>' for text in paragraphs)
+        return f'<p:sld {self.A}><p:cSld><p:spTree><p:sp><p:txBody>{body}</p:txBody></p:sp></p:spTree></p:cSld></p:sld>'
+    
+    def test_docx_text_parts_only(self):
+        """本文パートのみを展開し、メディアは展開しないテスト"""
+        import zipfile
+        document = (f'<w:document {self.W}><w:body>'
+                    '<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>概要</w:t></w:r></w:p>'
+                    '<w:p><w:r><w:t>本文</w:t></w:r><w:r><w:t>の続き</w:t></w:r></w:p>'
+                    '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>項目</w:t></w:r></w:p></w:tc>'
+                    '<w:tc><w:p><w:r><w:t>値</w:t></w:r></w:p></w:tc></w:tr>'
+                    '<w:tr><w:tc><w:p><w:r><w:t>A</w:t></w:r></w:p></w:tc>'
+                    '<w:tc><w:p><w:r><w:t>1</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+                    '</w:body></w:document>')
+        content = self._make_package({'word/document.xml': document, 'word/media/image1.png': b'\x89PNG' + b'0' * 5000})
+        self.assertTrue(is_ooxml_package(content))
+        self.assertFalse(is_ooxml_package(b'PK\x03\x04Mock DOCX content'))
+        
+        opened = []
+        original_open = zipfile.ZipFile.open
+        
+        def tracking_open(archive, name, *args, **kwargs):
+            opened.append(name if isinstance(name, str) else name.filename)
+            return original_open(archive, name, *args, **kwargs)
+        
+        with patch.object(zipfile.ZipFile, 'open', tracking_open):
+            result = extract_ooxml(content, 'docx')
+        
+        self.assertEqual(result.markdown, '## 概要\n\n本文の続き\n\n| 項目 | 値 |\n| --- | --- |\n| A | 1 |')
+        self.assertEqual(opened, ['word/document.xml'])
+        self.assertEqual(result.skipped_media, 1)
+        self.assertGreater(result.to_dict()['skippedMediaBytes'], 0)
+    
+    def test_pptx_slides_in_order_with_notes(self):
+        """スライドを並行処理しても番号順に出力するテスト"""
+        members = {f'ppt/slides/slide{n}.xml': self._slide(f'タイトル{n}', f'本文{n}') for n in range(1, 12)}
+        members['ppt/notesSlides/notesSlide2.xml'] = self._slide('発表メモ', '2')
+        result = extract_ooxml(self._make_package(members), 'pptx')
+        
+        headings = [line for line in result.markdown.split('\n') if line.startswith('## ')]
+        self.assertEqual(headings[:3], ['## スライド 1: タイトル1', '## スライド 2: タイトル2', '## スライド 3: タイトル3'])
+        self.assertEqual(headings[-1], '## スライド 11: タイトル11')
+        self.assertIn('- 本文10', result.markdown)
+        self.assertIn('> 発表メモ', result.markdown)
+        self.assertEqual(len(result.parts), 11)
+    
+    def test_xlsx_sheets_and_media_ocr(self):
+        """シートの抽出と、OCR有効時の埋め込み画像の処理テスト"""
+        ns = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+        rel_ns = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+        content = self._make_package({
+            'xl/workbook.xml': f'<workbook xmlns="{ns}" xmlns:r="{rel_ns}"><sheets>'
+                               '<sheet name="集計" sheetId="1" r:id="rId1"/></sheets></workbook>',
+            'xl/_rels/workbook.xml.rels': '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                                          '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>',
+            'xl/sharedStrings.xml': f'<sst xmlns="{ns}"><si><t>部署</t></si><si><t>人数</t></si><si><t>営業</t></si></sst>',
+            'xl/worksheets/sheet1.xml': f'<worksheet xmlns="{ns}"><sheetData>'
+                                        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c></row>'
+                                        '<row r="2"><c r="A2" t="s"><v>2</v></c><c r="B2"><v>12</v></c></row>'
+                                        '</sheetData></worksheet>',
+            'xl/media/image1.png': b'\x89PNG' + b'0' * 100,
+            'xl/media/audio1.wav': b'RIFF' + b'0' * 100
+        })
+        
+        result = extract_ooxml(content, 'xlsx', ocr=True, ocr_image=lambda data, name: f'OCR({name})')
+        self.assertIn('## 集計\n| 部署 | 人数 |\n| --- | --- |\n| 営業 | 12 |', result.markdown)
+        self.assertIn('OCR(xl/media/image1.png)', result.markdown)
+        self.assertEqual((result.ocr_media, result.skipped_media), (1, 1))
+    
+    def test_office_processor_uses_ooxml_path(self):
+        """OfficeDocumentProcessorがOOXMLパッケージから本文を抽出するテスト"""
+        content = self._make_package({'ppt/slides/slide1.xml': self._slide('四半期報告', '売上は前年比110%'),
+                                      'ppt/media/video1.mp4': b'0' * 10000})
+        processor = get_format_processor('pptx', {'supportedFormats': {'pptx': {'ocr': False}}})
+        success, markdown, metadata = processor.process_with_markitdown(content, 'report.pptx')
+        
+        self.assertTrue(success)
+        self.assertIn('## スライド 1: 四半期報告', markdown)
+        self.assertIn('- 売上は前年比110%', markdown)
+        self.assertEqual(metadata['ooxml']['skippedMedia'], 1)
+
+
+class TestArchiveIngest(unittest.TestCase):
+    """ZIPアーカイブのメンバー単位処理のテスト"""
+    
+    def setUp(self):
+        self.manifest_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.manifest_dir, ignore_errors=True)
+    
+    def _make_zip(self, members):
+        import io
+        import zipfile
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in members.items():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+    
+    def _make_processor(self):
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.archive_manifest_store = ArchiveManifestStore(local_dir=self.manifest_dir)
+        processor.vector_processor.generate_embeddings = lambda texts, deadline=None: EmbeddingResult(
+            success=True, embeddings=[[0.1]] * len(texts), metadata={}
+        )
+        processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            side_effect=lambda docs: {'success': True, 'stored_count': len(docs)}
+        )
+        return processor
+    
+    def test_bomb_guards_checked_before_expansion(self):
+        """展開前にメンバー数・圧縮率・展開後サイズを検証するテスト"""
+        import io
+        bomb = self._make_zip({'data.csv': b'0' * (8 * 1024 * 1024)})
+        with self.assertRaises(ProcessingError) as ctx:
+            ArchiveReader(io.BytesIO(bomb), 'bomb.zip')
+        self.assertEqual(ctx.exception.error_type, ErrorType.SECURITY_VIOLATION)
+        self.assertGreater(ctx.exception.details['ratio'], 100)
+        
+        many = self._make_zip({f'f{i}.csv': 'a,b\n' for i in range(11)})
+        with self.assertRaises(ProcessingError):
+            ArchiveReader(io.BytesIO(many), 'many.zip', ArchiveLimits(max_members=10))
+        
+        large = self._make_zip({'a.csv': os.urandom(4096), 'b.csv': os.urandom(4096)})
+        with self.assertRaises(ProcessingError):
+            ArchiveReader(io.BytesIO(large), 'large.zip', ArchiveLimits(max_expanded_bytes=6000))
+    
+    def test_unsafe_and_ignored_members_skipped(self):
+        """アーカイブ外を指すパス・OSのメタデータ・未サポート形式を処理しないテスト"""
+        import io
+        content = self._make_zip({'../etc/passwd.csv': 'x', '__MACOSX/._a.csv': 'x', 'notes.txt': 'x', 'dir/a.csv': 'a\n1\n'})
+        reader = ArchiveReader(io.BytesIO(content), 'mixed.zip', is_supported=lambda path: path.endswith('.csv'))
+        
+        self.assertEqual([member.path for member in reader.iter_members()], ['dir/a.csv'])
+        self.assertEqual(reader.skipped, [{'path': '../etc/passwd.csv', 'reason': 'unsafePath'},
+                                          {'path': 'notes.txt', 'reason': 'unsupportedFormat'}])
+        self.assertIsNone(normalize_member_path('C:/Windows/a.csv'))
+        self.assertEqual(normalize_member_path('docs\\.\\a.csv'), 'docs/a.csv')
+    
+    def test_members_processed_with_source_uri_and_deduped(self):
+        """メンバーをアーカイブ内のパスで格納し、変更のないメンバーを再処理しないテスト"""
+        processor = self._make_processor()
+        table = 'id,name\n' + ''.join(f'{i},商品{i}\n' for i in range(50))
+        members = {'sales/items.csv': table, 'copy/items.csv': table,
+                   'docs/guide.html': '<html><body><h1>手順</h1><p>本文</p></body></html>', 'readme.txt': 'skip'}
+        
+        result = processor.process_document(self._make_zip(members), 'bundle.zip')
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['fileFormat'], 'zip')
+        archive = result['metadata']['archive']
+        statuses = {entry['path']: entry['status'] for entry in archive['members']}
+        self.assertEqual(statuses, {'sales/items.csv': 'processed', 'copy/items.csv': 'duplicate',
+                                    'docs/guide.html': 'processed'})
+        self.assertEqual(archive['skipped'], [{'path': 'readme.txt', 'reason': 'unsupportedFormat'}])
+        source_uris = {doc.metadata['x-amz-bedrock-kb-source-uri'] for call in
+                       processor.vector_processor.store_embeddings_to_opensearch.call_args_list for doc in call[0][0]}
+        self.assertEqual(source_uris, {'\\\\file\\bundle.zip!/sales/items.csv', '\\\\file\\bundle.zip!/docs/guide.html'})
+        
+        # 2回目: 変更したメンバーのみ処理
+        members['docs/guide.html'] = '<html><body><h1>手順</h1><p>改訂</p></body></html>'
+        second = processor.process_document(self._make_zip(members), 'bundle.zip')
+        self.assertEqual(second['metadata']['archive']['processed'], 1)
+        self.assertEqual(second['metadata']['archive']['unchanged'], 2)
+    
+    def test_manifest_keyed_by_object_uri(self):
+        """別のキーにある同名のアーカイブとマニフェストを共有しないテスト"""
+        processor = self._make_processor()
+        content = self._make_zip({'a.csv': 'id,name\n1,a\n', 'b.csv': 'id,name\n2,b\n'})
+        
+        first = processor.process_document(content, 'bundle.zip', object_uri='s3://docs/team-a/bundle.zip')
+        second = processor.process_document(content, 'bundle.zip', object_uri='s3://docs/team-b/bundle.zip')
+        
+        self.assertEqual(first['metadata']['archive']['processed'], 2)
+        self.assertEqual(second['metadata']['archive']['processed'], 2)
+        self.assertEqual({entry['sourceUri'] for entry in second['metadata']['archive']['members']},
+                         {'s3://docs/team-b/bundle.zip!/a.csv', 's3://docs/team-b/bundle.zip!/b.csv'})
+    
+    def test_deferred_members_reported_incomplete(self):
+        """未展開のメンバーが残るアーカイブを完了として報告しないテスト"""
+        processor = self._make_processor()
+        content = self._make_zip({f'part{i}.csv': f'id,name\n{i},x\n' for i in range(3)})
+        deadline = Deadline(60000)
+        # メンバーの処理中は期限内、展開ループでのみ期限切れとする
+        main_thread = threading.current_thread()
+        
+        with patch.object(deadline, 'expired', side_effect=lambda: threading.current_thread() is main_thread):
+            result = processor.process_document(content, 'parts.zip', deadline=deadline)
+        
+        self.assertFalse(result['success'])
+        self.assertTrue(result['incomplete'])
+        self.assertEqual(result['error']['type'], 'ArchiveIncomplete')
+        self.assertEqual(result['metadata']['archive']['processed'], 1)
+        self.assertEqual(result['metadata']['archive']['deferred'], 2)
+        
+        # 次回の取り込みでは残りのメンバーのみ処理して完了
+        resumed = processor.process_document(content, 'parts.zip')
+        self.assertTrue(resumed['success'])
+        self.assertFalse(resumed['incomplete'])
+        self.assertEqual(resumed['metadata']['archive']['unchanged'], 1)
+        self.assertEqual(resumed['metadata']['archive']['processed'], 2)
+
+
+class TestImagePreprocess(unittest.TestCase):
+    """画像OCRの前処理のテスト"""
+    
+    def setUp(self):
+        """テストセットアップ"""
+        self.png_content = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + (1200).to_bytes(4, 'big') +
+                            (800).to_bytes(4, 'big') + b'\x08\x02\x00\x00\x00' + b'\x00' * 4000)
+    
+    def test_read_image_size(self):
+        """ヘッダーからの画像サイズ取得テスト"""
+        self.assertEqual(read_image_size(self.png_content), (1200, 800))
+        self.assertEqual(read_image_size(b'GIF89a\x20\x03\x58\x02' + b'\x00' * 10), (800, 600))
+        jpeg = (b'\xff\xd8\xff\xe0\x00\x10' + b'JFIF\x00' + b'\x00' * 9 +
+                b'\xff\xc0\x00\x11\x08\x02\x58\x03\x20' + b'\x00' * 20)
+        self.assertEqual(read_image_size(jpeg), (800, 600))
+        self.assertIsNone(read_image_size(b'not an image'))
+    
+    def test_near_duplicate_lookup(self):
+        """知覚ハッシュの近傍一致でOCR結果を再利用するテスト"""
+        cache = OcrResultCache(max_entries=2)
+        original = ImagePreprocessResult(image_hash='ff00ff00ff00ff00', hash_method='dhash')
+        cache.put(original, '## OCR抽出結果\nロゴ', 2.0)
+        
+        near = ImagePreprocessResult(image_hash='ff00ff00ff00ff07', hash_method='dhash')
+        far = ImagePreprocessResult(image_hash='00ff00ff00ff00ff', hash_method='dhash')
+        self.assertEqual(hamming_distance(near.image_hash, original.image_hash), 3)
+        
+        entry = cache.lookup(near)
+        self.assertEqual(entry['imageHash'], original.image_hash)
+        self.assertEqual(entry['distance'], 3)
+        self.assertIsNone(cache.lookup(far))
+        
+        stats = cache.get_stats()
+        self.assertEqual((stats['nearHits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['ocrSecondsSaved'], 2.0)
+        
+        # 上限を超えたエントリは古い順に削除
+        cache.put(far, '## OCR抽出結果\nB', 1.0)
+        cache.put(ImagePreprocessResult(image_hash='0' * 16, hash_method='dhash'), '## OCR抽出結果\nC', 1.0)
+        self.assertEqual(cache.get_stats()['entries'], 2)
+        self.assertIsNone(cache.lookup(original))
+    
+    def test_duplicate_image_reuses_ocr(self):
+        """同一画像の2回目はOCRを省略して結果を再利用するテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.conversion_cache = None
+        
+        with patch('document_processor.get_ocr_result_cache', return_value=OcrResultCache()):
+            first = processor.process_document(file_content=self.png_content, file_name='logo-a.png')
+            second = processor.process_document(file_content=self.png_content, file_name='logo-b.png')
+        
+        self.assertTrue(first['success'])
+        self.assertIsNone(first['metadata']['imagePreprocess']['ocrReusedFrom'])
+        self.assertEqual(first['metadata']['imagePreprocess']['width'], 1200)
+        
+        self.assertTrue(second['success'])
+        preprocess = second['metadata']['imagePreprocess']
+        self.assertEqual(preprocess['ocrReusedFrom'], preprocess['imageHash'])
+        self.assertEqual(preprocess['totals']['exactHits'], 1)
+        self.assertIn('logo-b.png', second['markdownContent'])
+        self.assertIn('## OCR抽出結果', second['markdownContent'])
+    
+    def test_blank_image_skips_ocr(self):
+        """空白画像はOCRを省略するテスト"""
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.conversion_cache = None
+        blank = ImagePreprocessResult(image_hash='0' * 16, hash_method='dhash', width=1200, height=800,
+                                      blank=True, content=self.png_content)
+        
+        with patch('document_processor.get_ocr_result_cache', return_value=OcrResultCache()), \
+             patch('document_processor.preprocess_image', return_value=blank), \
+             patch('format_processors.ImageProcessor.process_with_markitdown') as ocr:
+            result = processor.process_document(file_content=self.png_content, file_name='stamp.png')
+        
+        ocr.assert_not_called()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['metadata']['imagePreprocess']['ocrSkipped'], 'blank')
+        self.assertEqual(result['metadata']['imagePreprocess']['totals']['blankSkipped'], 1)
+    
+    @unittest.skipUnless(__import__('importlib').util.find_spec('PIL'), 'Pillowが必要')
+    def test_downscale_and_perceptual_hash(self):
+        """Pillow利用時の縮小・知覚ハッシュ・空白判定テスト"""
+        import io
+        from PIL import Image, ImageDraw
+        
+        image = Image.new('RGB', (4000, 3000), 'white')
+        ImageDraw.Draw(image).rectangle((500, 500, 3500, 2500), fill='black')
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        
+        prepared = preprocess_image(buffer.getvalue(), 'png', max_long_edge=2000)
+        self.assertEqual(prepared.hash_method, 'dhash')
+        self.assertEqual((prepared.scaled_width, prepared.scaled_height), (2000, 1500))
+        self.assertFalse(prepared.blank)
+        
+        # 縮小しても知覚ハッシュはほぼ一致する
+        small = io.BytesIO()
+        image.resize((400, 300)).save(small, format='PNG')
+        self.assertLessEqual(hamming_distance(preprocess_image(small.getvalue(), 'png').image_hash,
+                                              prepared.image_hash), 4)
+        
+        empty = io.BytesIO()
+        Image.new('RGB', (800, 600), 'white').save(empty, format='PNG')
+        self.assertTrue(preprocess_image(empty.getvalue(), 'png').blank)
+
+
+class TestDeadline(unittest.TestCase):
+    """実行期限の伝搬・協調キャンセル・チェックポイントのテスト"""
+    
+    def test_from_context_and_cancellation(self):
+        """コンテキストからの期限作成とキャンセル伝搬のテスト"""
+        context = Mock()
+        context.get_remaining_time_in_millis.return_value = 5000
+        deadline = Deadline.from_context(context, safety_margin_ms=1000)
+        self.assertAlmostEqual(deadline.remaining(), 4.0, delta=0.1)
+        
+        stage = deadline.child(1.0)
+        self.assertLessEqual(stage.remaining(), 1.0)
+        
+        # 子のキャンセルは親に伝搬しない
+        stage.cancel('timeout')
+        self.assertTrue(stage.cancelled())
+        self.assertFalse(deadline.cancelled())
+        
+        # 親のキャンセルは子に伝搬する
+        other = deadline.child(None)
+        deadline.cancel('shutdown')
+        self.assertTrue(other.cancelled())
+        with self.assertRaises(ProcessingError):
+            other.check('embedding')
+    
+    def test_fallback_timeout_without_signal(self):
+        """期限超過した処理方法を打ち切りフォールバックするテスト"""
+        handler = FallbackHandler({'fallback': {'retryAttempts': 2, 'retryDelayMs': 10}})
+        primary = Mock(side_effect=lambda content, name: time.sleep(0.5))
+        primary.__name__ = 'markitdown'
+        
+        def fallback(content, name):
+            return True, 'converted', {'method': 'langchain', 'success': True}
+        
+        start = time.monotonic()
+        success, content, metadata = handler.execute_with_fallback(
+            primary, fallback, b'data', 'pdf', 'test.pdf', timeout_seconds=0.1, deadline=Deadline(5000)
+        )
+        
+        self.assertTrue(success)
+        self.assertEqual(content, 'converted')
+        self.assertEqual(metadata['finalMethod'], 'langchain')
+        # 残り時間で完了できないリトライは行わない
+        self.assertEqual(primary.call_count, 1)
+        self.assertLess(time.monotonic() - start, 0.5)
+    
+    def test_stage_timer_starts_when_conversion_starts(self):
+        """空きスレッドの待ち時間を段階の期限に含めず、停止しないスレッドが後続の段階を妨げないテスト"""
+        import error_handler
+        error_handler._timeout_executor = None
+        handler = FallbackHandler({'fallback': {'retryAttempts': 0}, 'performance': {'maxConcurrentProcesses': 2}})
+        
+        def convert(delay):
+            def func(content, name):
+                time.sleep(delay)
+                return True, name, {'method': 'markitdown', 'success': True}
+            func.__name__ = 'markitdown'
+            return func
+        
+        # 4スレッドとも0.3秒使用中の間に投入した処理は、待機後の0.05秒の処理が0.2秒の期限内に完了する
+        results = []
+        busy = [threading.Thread(target=lambda: results.append(handler.execute_with_fallback(
+            convert(0.3), None, b'data', 'html', 'busy.html', timeout_seconds=5, deadline=Deadline(5000))))
+            for _ in range(4)]
+        for thread in busy:
+            thread.start()
+        time.sleep(0.05)
+        success, _, _ = handler.execute_with_fallback(convert(0.05), None, b'data', 'html', 'queued.html',
+                                                      timeout_seconds=0.2, deadline=Deadline(5000))
+        self.assertTrue(success)
+        for thread in busy:
+            thread.join()
+        
+        # 期限切れで停止しないスレッドがワーカーを占有しても、後続の処理は新しいスレッドプールで実行する
+        release = threading.Event()
+        
+        def stuck(content, name):
+            release.wait(5)
+            return True, name, {'method': 'markitdown', 'success': True}
+        try:
+            for _ in range(4):
+                success, _, _ = handler.execute_with_fallback(stuck, None, b'data', 'html', 'stuck.html',
+                                                              timeout_seconds=0.1, deadline=Deadline(5000))
+                self.assertFalse(success)
+            success, _, _ = handler.execute_with_fallback(convert(0), None, b'data', 'html', 'next.html',
+                                                          timeout_seconds=0.2, deadline=Deadline(5000))
+            self.assertTrue(success)
+        finally:
+            release.set()
+    
+    @patch('vector_embedding_bedrock_kb.boto3.client')
+    def test_embeddings_stop_at_deadline(self, mock_boto3):
+        """残り時間に収まらないバッチを処理せず部分結果を返すテスト"""
+        processor = BedrockKBVectorProcessor()
+        
+        def slow_batch(texts, deadline=None):
+            time.sleep(0.08)
+            return [[0.1] * 4 for _ in texts]
+        
+        with patch.object(processor, '_generate_batch_embeddings', side_effect=slow_batch):
+            result = processor.generate_embeddings([f"text {i}" for i in range(10)], batch_size=2,
+                                                   enable_cache=False, deadline=Deadline(200))
+        
+        self.assertTrue(result.success)
+        self.assertTrue(result.metadata['deadline_exhausted'])
+        self.assertGreater(result.metadata['completed_texts'], 0)
+        self.assertLess(result.metadata['completed_texts'], 10)
+        self.assertEqual(len(result.embeddings), result.metadata['completed_texts'])
+    
+    @patch('vector_embedding_bedrock_kb.boto3.client')
+    def test_embeddings_stop_when_circuit_open(self, mock_boto3):
+        """ブレーカーOPEN時にゼロベクトルで埋めず未埋め込みとして中断するテスト"""
+        processor = BedrockKBVectorProcessor()
+        processor.resilient_caller = ResilientCaller('bedrock-runtime', 'test-model', failure_threshold=1,
+                                                     recovery_timeout=60)
+        processor.resilient_caller.breaker.record_failure()
+        
+        result = processor.generate_embeddings([f"text {i}" for i in range(4)], batch_size=2, enable_cache=False)
+        
+        self.assertTrue(result.success)
+        self.assertTrue(result.metadata['circuit_open'])
+        self.assertTrue(result.metadata['deadline_exhausted'])
+        self.assertEqual(result.embeddings, [])
+        # リミッターはブレーカー拒否をリトライしない
+        processor.bedrock_client.invoke_model.assert_not_called()
+    
+    def test_checkpoint_round_trip(self):
+        """チェックポイントの保存と読み込みのテスト"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with patch.dict(os.environ, {'CHECKPOINT_BUCKET': ''}):
+                store = CheckpointStore(local_dir=temp_dir)
+            location = store.save('cp-1', {'stage': 'embedding', 'embeddings': [[0.1, 0.2]]})
+            self.assertEqual(location['checkpointId'], 'cp-1')
+            self.assertEqual(store.load('cp-1')['embeddings'], [[0.1, 0.2]])
+            self.assertIsNone(store.load('missing'))
+            
+            # 保存先が未設定の場合は/tmpに保存せず無効とする
+            with patch.dict(os.environ, {'CHECKPOINT_BUCKET': '', 'CHECKPOINT_LOCAL_DIR': ''}):
+                disabled = CheckpointStore()
+            self.assertFalse(disabled.enabled)
+            self.assertIsNone(disabled.save('cp-1', {'stage': 'embedding'}))
+            self.assertIsNone(disabled.load('cp-1'))
+            
+            # チェックポイントはオブジェクトのフルキーとバージョンで区別する
+            self.assertNotEqual(object_checkpoint_id('docs', 'a/q1.pdf', '1'), object_checkpoint_id('docs', 'b/q1.pdf', '1'))
+            self.assertNotEqual(object_checkpoint_id('docs', 'a/q1.pdf', '1'), object_checkpoint_id('docs', 'a/q1.pdf', '2'))
+        finally:
+            shutil.rmtree(temp_dir)
+
 class TestMetadataManager(unittest.TestCase):
     """メタデータ管理のテスト"""
     
@@ -301,6 +1695,888 @@ class TestMetadataManager(unittest.TestCase):
         self.assertEqual(metadata.file_id, 'test_file_id')
         self.assertEqual(metadata.processing_strategy, 'markitdown-first')
         self.assertFalse(metadata.success)  # 初期状態は失敗
+    
+    def _record_run(self, manager):
+        """process_document 1回分のメタデータ書き込みを再現"""
+        file_metadata = manager.create_file_metadata('test.pdf', b'content', 'pdf')
+        processing = manager.create_processing_metadata(file_metadata.file_id, 'markitdown-first')
+        for method in ('markitdown', 'langchain'):
+            manager.create_conversion_metadata(processing.processing_id, method, 100, 200, 12.5, 85.0)
+        manager.create_chunking_metadata(processing.processing_id, 3, 1000, 200, 'recursive_character', 5.0, 66.7)
+        manager.create_embedding_metadata(processing.processing_id, 'titan', 1536, 3, 30.0, 3, 10.0)
+        manager.create_storage_metadata(processing.processing_id, 'opensearch', 3, 8.0, 'documents')
+        manager.update_processing_metadata(processing, [{'method': 'markitdown'}], 'markitdown', True)
+        manager.put_item('Tracking', manager.tracking_table, {'fileHash': 'h', 'processingTime': 10})
+        return processing
+    
+    def test_write_behind_batches_round_trips(self):
+        """処理1回分の書き込みを1回のBatchWriteItemにまとめ、未処理アイテムを再試行するテスト"""
+        unprocessed = {'Tracking': [{'PutRequest': {'Item': {'fileHash': 'h'}}}]}
+        self.manager.dynamodb.batch_write_item = Mock(side_effect=[
+            {'UnprocessedItems': unprocessed}, {'UnprocessedItems': {}}
+        ])
+        
+        with patch('metadata_manager.time.sleep'), self.manager.write_behind() as buffer:
+            self._record_run(self.manager)
+            self.manager.dynamodb.batch_write_item.assert_not_called()
+        
+        self.manager.metadata_table.put_item.assert_not_called()
+        first_request = self.manager.dynamodb.batch_write_item.call_args_list[0][1]['RequestItems']
+        self.assertEqual(len(first_request['DocumentProcessingMetadata']), 7)
+        self.assertEqual(len(first_request['Tracking']), 1)
+        self.assertEqual(self.manager.dynamodb.batch_write_item.call_args_list[1][1]['RequestItems'], unprocessed)
+        stats = buffer.get_stats()
+        self.assertEqual((stats['items'], stats['requests'], stats['retries'], stats['failedItems']), (8, 2, 1, 0))
+        
+        # floatはDecimalに変換
+        conversion = first_request['DocumentProcessingMetadata'][1]['PutRequest']['Item']
+        self.assertIsInstance(conversion['conversion_time'], Decimal)
+    
+    def test_write_behind_pages_and_threshold(self):
+        """25件ごとのページ分割と、閾値到達時の途中書き込みのテスト"""
+        with patch('metadata_manager.boto3.resource'):
+            manager = MetadataManager(flush_threshold=30)
+        manager.dynamodb.batch_write_item = Mock(return_value={})
+        
+        with manager.write_behind():
+            for i in range(30):
+                manager.create_file_metadata(f'file{i}.pdf', b'x', 'pdf')
+            self.assertEqual([len(c[1]['RequestItems']['DocumentProcessingMetadata'])
+                              for c in manager.dynamodb.batch_write_item.call_args_list], [25, 5])
+            manager.create_file_metadata('last.pdf', b'x', 'pdf')
+        self.assertEqual(manager.dynamodb.batch_write_item.call_count, 3)
+    
+    def test_compact_mode_single_item(self):
+        """集約モードで処理1回分のメタデータを1アイテムに保存するテスト"""
+        with patch('metadata_manager.boto3.resource'):
+            manager = MetadataManager(compact_mode=True)
+        manager.dynamodb.batch_write_item = Mock(return_value={})
+        
+        with manager.write_behind():
+            processing = self._record_run(manager)
+        
+        request = manager.dynamodb.batch_write_item.call_args[1]['RequestItems']
+        self.assertEqual(len(request['DocumentProcessingMetadata']), 1)
+        item = request['DocumentProcessingMetadata'][0]['PutRequest']['Item']
+        self.assertEqual(item['record_type'], 'processing_run')
+        self.assertEqual(item['processing_id'], processing.processing_id)
+        self.assertEqual([c['method'] for c in item['conversions']], ['markitdown', 'langchain'])
+        self.assertEqual(item['file']['original_name'], 'test.pdf')
+        self.assertEqual(item['chunking']['total_chunks'], 3)
+        self.assertEqual(len(request['Tracking']), 1)
+
+
+class TestMetadataQueries(unittest.TestCase):
+    """メタデータテーブルのキー設計とクエリのテスト（DynamoDBはmotoで代替）"""
+    
+    def setUp(self):
+        self.mock = mock_dynamodb()
+        self.mock.start()
+        boto3.resource('dynamodb', region_name='us-east-1').create_table(
+            TableName='metadata-test', **METADATA_TABLE_SCHEMA
+        )
+        self.manager = MetadataManager(metadata_table='metadata-test')
+        self.now = datetime.utcnow()
+    
+    def tearDown(self):
+        self.mock.stop()
+    
+    def _save_runs(self, count, user_id, days_ago, offset=0, processing_time=None):
+        for i in range(offset, offset + count):
+            self.manager._save_processing_metadata(ProcessingMetadata(
+                processing_id=f'proc-{i}', file_id=f'file-{i % 5}', processing_strategy='auto',
+                attempted_methods=[], final_method='markitdown' if i % 2 else 'langchain',
+                processing_start_time=(self.now - timedelta(days=days_ago, seconds=i)).isoformat(),
+                processing_end_time='',
+                total_processing_time=processing_time(i) if processing_time else 100.0,
+                success=i % 4 != 0, user_id=user_id, project_id='project-a' if i % 3 else 'project-b',
+                file_format='pdf' if i % 3 else 'docx'
+            ))
+    
+    def _rollup_items(self):
+        items = self.manager.metadata_table.scan(FilterExpression=Attr('record_type').eq('rollup'))['Items']
+        return sorted(items, key=lambda item: (item['pk'], item['sk']))
+    
+    def test_history_queries_paginate_newest_first(self):
+        """ユーザー・ファイル・期間のクエリが新しい順にページ単位で全件を返すテスト"""
+        self._save_runs(40, 'alice', 0)
+        self._save_runs(20, 'bob', 2, offset=40)
+        
+        pages, token = [], None
+        while True:
+            page = self.manager.query_processing_history(user_id='alice', limit=15, page_token=token)
+            pages.append(page['items'])
+            token = page['nextPageToken']
+            if not token:
+                break
+        ids = [item['processing_id'] for items in pages for item in items]
+        self.assertEqual([len(items) for items in pages], [15, 15, 10])
+        self.assertEqual(len(set(ids)), 40)
+        starts = [item['processing_start_time'] for items in pages for item in items]
+        self.assertEqual(starts, sorted(starts, reverse=True))
+        
+        # フィルター付きでもlimit件を返す（Limitがフィルター前に適用されて件数が不足しない）
+        filtered = self.manager.get_processing_history(user_id='alice', project_id='project-b', limit=5)
+        self.assertEqual(len(filtered), 5)
+        self.assertTrue(all(item['project_id'] == 'project-b' for item in filtered))
+        self.assertTrue(all(item['file_id'] == 'file-3'
+                            for item in self.manager.get_processing_history(file_id='file-3')))
+        
+        # 期間のみ: 日単位のパーティションをまたいでページング
+        start = (self.now - timedelta(days=3)).isoformat()
+        seen, token = [], None
+        while True:
+            page = self.manager.query_processing_history(start_time=start, limit=25, page_token=token)
+            seen.extend(item['processing_id'] for item in page['items'])
+            token = page['nextPageToken']
+            if not token:
+                break
+        self.assertEqual(len(seen), 60)
+        self.assertEqual(len(set(seen)), 60)
+    
+    def test_read_cost_independent_of_table_size(self):
+        """統計・履歴の読み込み件数が期間外・他ユーザーの件数に依存しないテスト"""
+        self._save_runs(20, 'alice', 0)
+        before_statistics = self.manager.get_performance_statistics(days=1)
+        before_history = self.manager.query_processing_history(user_id='alice', limit=100)
+        
+        self._save_runs(300, 'bob', 5, offset=20)
+        self._save_runs(200, 'alice', 40, offset=320)
+        after_statistics = self.manager.get_performance_statistics(days=1)
+        after_history = self.manager.query_processing_history(
+            user_id='alice', start_time=(self.now - timedelta(days=1)).isoformat(), limit=100
+        )
+        
+        self.assertEqual(after_statistics['total_processed'], 20)
+        self.assertEqual(after_statistics['read']['scannedCount'], before_statistics['read']['scannedCount'])
+        self.assertEqual(after_history['read']['scannedCount'], before_history['read']['scannedCount'])
+        table_scan = self.manager.metadata_table.scan(
+            Select='COUNT', FilterExpression=Attr('record_type').eq('processing_metadata')
+        )
+        self.assertEqual(table_scan['Count'], 520)
+    
+    def test_rollups_add_counters_and_percentiles(self):
+        """ロールアップがADDで加算され、統計が日×形式×方法のアイテムのみから分位点を返すテスト"""
+        with self.manager.write_behind() as buffer:
+            self._save_runs(100, 'alice', 0, processing_time=lambda i: float(i + 1))
+        # 同じロールアップへの加算はまとめて1回のUpdateItem（形式2 × 方法2）
+        self.assertEqual(buffer.get_stats()['rollupUpdates'], 4)
+        self._save_runs(100, 'bob', 0, offset=100, processing_time=lambda i: float(i + 1))
+        
+        statistics = self.manager.get_performance_statistics(days=1)
+        self.assertEqual(statistics['total_processed'], 200)
+        self.assertEqual(statistics['successful'], 150)
+        self.assertAlmostEqual(statistics['average_processing_time_ms'], 100.5)
+        self.assertEqual(statistics['method_statistics']['markitdown']['count'], 100)
+        self.assertEqual(sum(s['count'] for s in statistics['format_statistics'].values()), 200)
+        for name, exact in (('p50', 100.5), ('p90', 180.1), ('p99', 198.01)):
+            self.assertLess(abs(statistics['latency_percentiles_ms'][name] - exact) / exact, 0.03)
+        
+        # 読み込むのはロールアップのみ（処理件数を増やしても変わらない）
+        self.assertEqual(statistics['read']['scannedCount'], len(self._rollup_items()))
+        self._save_runs(300, 'carol', 0, offset=200)
+        self.assertEqual(self.manager.get_performance_statistics(days=1)['read']['scannedCount'],
+                         statistics['read']['scannedCount'])
+    
+    def test_backfill_matches_incremental_rollups(self):
+        """既存の処理レコードからのバックフィルが処理時の加算と同じロールアップを作成するテスト"""
+        self._save_runs(30, 'alice', 2, processing_time=lambda i: float(10 * i + 5))
+        self._save_runs(20, 'bob', 3, offset=30)
+        incremental = self._rollup_items()
+        
+        with self.manager.metadata_table.batch_writer() as batch:
+            for item in incremental:
+                batch.delete_item(Key={'pk': item['pk'], 'sk': item['sk']})
+        self.assertEqual(self._rollup_items(), [])
+        
+        result = self.manager.backfill_rollups(days=5)
+        self.assertEqual(result['records'], 50)
+        self.assertEqual(self._rollup_items(), incremental)
+        # 再実行しても二重に加算されない
+        self.manager.backfill_rollups(days=5)
+        self.assertEqual(self._rollup_items(), incremental)
+    
+    def test_backfill_indexes_legacy_records(self):
+        """GSIのキー属性がない既存の処理レコードにキー属性を付与して集計に含めるテスト"""
+        self._save_runs(10, 'alice', 2)
+        legacy_start = (self.now - timedelta(days=2)).isoformat()
+        for i in range(3):
+            # キー設計の変更前のレコード（GSIのキー属性なし）
+            self.manager.metadata_table.put_item(Item={
+                'pk': f'PROC#legacy-{i}', 'sk': 'PROC', 'record_type': 'processing_metadata',
+                'processing_id': f'legacy-{i}', 'file_id': 'file-legacy', 'final_method': 'markitdown',
+                'processing_start_time': legacy_start, 'total_processing_time': Decimal('50'),
+                'success': True, 'file_format': 'pdf', 'user_id': 'alice'
+            })
+        
+        result = self.manager.backfill_rollups(days=5)
+        
+        self.assertEqual(result['indexed'], 3)
+        self.assertEqual(result['records'], 13)
+        item = self.manager.metadata_table.get_item(Key={'pk': 'PROC#legacy-0', 'sk': 'PROC'})['Item']
+        self.assertEqual(item['day_key'], f"DAY#{legacy_start[:10]}")
+        self.assertEqual(item['user_key'], 'USER#alice')
+        self.assertEqual(len(self.manager.get_processing_history(file_id='file-legacy')), 3)
+        # 付与済みのレコードは再実行で更新しない
+        self.assertEqual(self.manager.backfill_rollups(days=5)['indexed'], 0)
+
+
+class TestIdempotencyLease(unittest.TestCase):
+    """追跡テーブルの冪等性リースのテスト（DynamoDBはmotoで代替）"""
+    
+    def setUp(self):
+        self.mock = mock_dynamodb()
+        self.mock.start()
+        self.table = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+            TableName='tracking-test',
+            KeySchema=[{'AttributeName': 'fileHash', 'KeyType': 'HASH'},
+                       {'AttributeName': 'processedAt', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'fileHash', 'AttributeType': 'S'},
+                                  {'AttributeName': 'processedAt', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        self.store = IdempotencyStore(self.table)
+        self.lease_key = object_lease_key('docs-bucket', 'reports/q1.pdf', etag='"abc"')
+    
+    def tearDown(self):
+        self.mock.stop()
+    
+    def test_single_holder_and_expiry(self):
+        """同じオブジェクトバージョンのリースは1つの呼び出しのみが取得し、期限切れ後は引き継げるテスト"""
+        self.assertNotEqual(self.lease_key, object_lease_key('docs-bucket', 'reports/q1.pdf', etag='"def"'))
+        self.assertIn('#v:3', object_lease_key('docs-bucket', 'reports/q1.pdf', version_id='3', etag='"abc"'))
+        
+        first = self.store.acquire(self.lease_key)
+        duplicate = self.store.acquire(self.lease_key)
+        self.assertTrue(first.acquired)
+        self.assertFalse(duplicate.acquired)
+        self.assertEqual(duplicate.status, LeaseStatus.IN_PROGRESS)
+        self.assertFalse(self.store.release(duplicate))
+        
+        # 異常終了した保持者のリースは期限後に取得でき、元の保持者は完了を記録できない
+        stale = self.store.acquire('OBJECT#docs-bucket/crashed.pdf#e:1', lease_seconds=-1)
+        takeover = self.store.acquire('OBJECT#docs-bucket/crashed.pdf#e:1')
+        self.assertTrue(takeover.acquired)
+        self.assertFalse(self.store.complete(stale))
+        
+        # 完了後は処理済みとして取得できない（失敗時の解放後は再取得できる）
+        self.assertTrue(self.store.complete(first, {'finalMethod': 'markitdown'}))
+        self.assertEqual(self.store.acquire(self.lease_key).status, LeaseStatus.DONE)
+        self.assertTrue(self.store.release(takeover))
+        self.assertTrue(self.store.acquire('OBJECT#docs-bucket/crashed.pdf#e:1').acquired)
+    
+    def test_duplicate_s3_events_processed_once(self):
+        """重複したS3イベントがダウンロード・変換せずに終了するテスト"""
+        event = {'Records': [{'s3': {'bucket': {'name': 'docs-bucket'},
+                                     'object': {'key': 'reports/q1.pdf', 'eTag': 'abc'}}}]}
+        s3_client = Mock()
+        s3_client.get_object.return_value = {'Body': Mock(read=Mock(return_value=b'%PDF-1.4 content'))}
+        process_document = Mock(return_value={'success': True, 'fileName': 'q1.pdf', 'finalMethod': 'markitdown'})
+        
+        with patch('document_processor.s3_client', s3_client), \
+             patch('document_processor.processor.idempotency_store', self.store), \
+             patch('document_processor.processor.process_document', process_document):
+            responses = [lambda_handler(event, None) for _ in range(3)]
+        
+        self.assertEqual([r['statusCode'] for r in responses], [200, 200, 200])
+        self.assertEqual(process_document.call_count, 1)
+        self.assertEqual(s3_client.get_object.call_count, 1)
+        body = json.loads(responses[1]['body'])
+        self.assertTrue(body['duplicate'])
+        self.assertEqual(body['status'], 'already_done')
+    
+    def test_in_progress_s3_event_retried(self):
+        """処理中の重複イベントが再試行可能なエラーで終了し、処理中のリースを解放しないテスト"""
+        event = {'Records': [{'s3': {'bucket': {'name': 'docs-bucket'},
+                                     'object': {'key': 'reports/q1.pdf', 'eTag': 'abc'}}}]}
+        holder = self.store.acquire(object_lease_key('docs-bucket', 'reports/q1.pdf', None, 'abc'))
+        s3_client = Mock()
+        
+        with patch('document_processor.s3_client', s3_client), \
+             patch('document_processor.processor.idempotency_store', self.store):
+            with self.assertRaises(RetryableInvocationError):
+                lambda_handler(event, None)
+        
+        s3_client.get_object.assert_not_called()
+        self.assertEqual(self.store.acquire(object_lease_key('docs-bucket', 'reports/q1.pdf', None, 'abc')).status,
+                         LeaseStatus.IN_PROGRESS)
+    
+    def test_checkpointed_s3_event_reenqueues_and_resumes(self):
+        """チェックポイントで中断したS3イベントが自身を再投入し、リースを引き継いで再開するテスト"""
+        class Context:
+            invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:document-processor'
+            
+            def get_remaining_time_in_millis(self):
+                return 60000
+        
+        event = {'Records': [{'s3': {'bucket': {'name': 'docs-bucket'},
+                                     'object': {'key': 'reports/q1.pdf', 'versionId': '7'}}}]}
+        temp_dir = tempfile.mkdtemp()
+        store = CheckpointStore(bucket='', local_dir=temp_dir)
+        calls = []
+        
+        def process_document(**kwargs):
+            calls.append(kwargs)
+            if kwargs['checkpoint'] is None:
+                location = store.save(kwargs['checkpoint_id'], {'stage': 'embedding', 'embeddings': [[0.1]]})
+                return {'success': True, 'fileName': 'q1.pdf', 'checkpoint': location}
+            return {'success': True, 'fileName': 'q1.pdf', 'finalMethod': 'markitdown'}
+        
+        s3_client = Mock()
+        s3_client.get_object.return_value = {'Body': Mock(read=Mock(return_value=b'%PDF-1.4 content'))}
+        lambda_client = Mock()
+        try:
+            with patch('document_processor.s3_client', s3_client), \
+                 patch('document_processor.boto3.client', return_value=lambda_client), \
+                 patch('document_processor.processor.idempotency_store', self.store), \
+                 patch('document_processor.processor.checkpoint_store', store), \
+                 patch('document_processor.processor.process_document', side_effect=process_document):
+                first = lambda_handler(event, Context())
+                self.assertEqual(first['statusCode'], 202)
+                payload = json.loads(lambda_client.invoke.call_args.kwargs['Payload'])
+                self.assertEqual(lambda_client.invoke.call_args.kwargs['InvocationType'], 'Event')
+                self.assertEqual(payload['resumeCount'], 1)
+                
+                # 再投入された呼び出しはリースを引き継ぎ、同じバージョンのチェックポイントから再開する
+                resumed = lambda_handler(payload, Context())
+                self.assertEqual(resumed['statusCode'], 200)
+                self.assertEqual(calls[1]['checkpoint']['embeddings'], [[0.1]])
+                self.assertEqual(calls[0]['checkpoint_id'], calls[1]['checkpoint_id'])
+                self.assertEqual(self.store.acquire(object_lease_key('docs-bucket', 'reports/q1.pdf', '7')).status,
+                                 LeaseStatus.DONE)
+                
+                # 再投入できない場合はリースを解放し、呼び出しを失敗させて再試行に委ねる
+                other = {'Records': [{'s3': {'bucket': {'name': 'docs-bucket'},
+                                             'object': {'key': 'reports/q2.pdf', 'versionId': '1'}}}]}
+                with self.assertRaises(RetryableInvocationError):
+                    lambda_handler(other, None)
+                self.assertTrue(self.store.acquire(object_lease_key('docs-bucket', 'reports/q2.pdf', '1')).acquired)
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestStageTracing(unittest.TestCase):
+    """段階別トレーシングのテスト"""
+    
+    def test_span_tree_and_histograms(self):
+        """スパンの木（ワーカースレッドのスパンを含む）と段階ごとの分位点のテスト"""
+        tracer = Tracer()
+        root = tracer.start_trace('document', fileName='q1.pdf')
+        with tracer.span('conversion', method='markitdown') as conversion:
+            with tracer.span('chunking'):
+                pass
+            conversion.set_attributes(outputLength=10)
+        # スレッドプールのスパンはコンテキストを引き継がないため実行中のトレースのルートに追加
+        worker = threading.Thread(target=lambda: tracer.record_span('embedding.batch', 40.0, size=25))
+        worker.start()
+        worker.join()
+        with self.assertRaises(ValueError):
+            with tracer.span('indexing'):
+                raise ValueError('bulk failed')
+        tracer.end_trace(root)
+        
+        # 子スパンは開始時刻順（record_span は処理時間分さかのぼった時刻を開始とする）
+        children = {child['name']: child for child in root.to_dict()['children']}
+        self.assertEqual(set(children), {'conversion', 'embedding.batch', 'indexing'})
+        self.assertEqual(children['conversion']['children'][0]['name'], 'chunking')
+        self.assertEqual(children['conversion']['attributes'], {'method': 'markitdown', 'outputLength': 10})
+        self.assertEqual(children['embedding.batch']['durationMs'], 40.0)
+        self.assertIn('bulk failed', children['indexing']['error'])
+        # トレース終了後のスパンはヒストグラムのみに記録
+        tracer.record_span('embedding.batch', 60.0)
+        self.assertEqual(len(list(root.walk())), 5)
+        
+        other = StageHistograms()
+        for duration in range(1, 101):
+            other.record('embedding.batch', float(duration))
+        tracer.histograms.merge(other)
+        stage = tracer.histograms.snapshot()['embedding.batch']
+        self.assertEqual(stage['count'], 102)
+        self.assertAlmostEqual(stage['p50'], 51, delta=51 * 0.05)
+        self.assertAlmostEqual(stage['p99'], 99, delta=99 * 0.05)
+        
+        records = emf_records(root)
+        self.assertEqual({record['Stage'] for record in records},
+                         {'document', 'conversion', 'chunking', 'embedding.batch', 'indexing'})
+        self.assertEqual(records[0]['_aws']['CloudWatchMetrics'][0]['Dimensions'], [['Stage']])
+        with patch.dict(os.environ, {'_X_AMZN_TRACE_ID': 'Root=1-5759e988-bd862e3fe1be46a994272793;Parent=53995c3f42cd8ad8'}):
+            segment = xray_segments(root)[0]
+        self.assertEqual(segment['trace_id'], '1-5759e988-bd862e3fe1be46a994272793')
+        self.assertEqual(segment['parent_id'], '53995c3f42cd8ad8')
+        self.assertEqual(len(segment['subsegments']), 3)
+    
+    def test_handler_explain_returns_span_tree(self):
+        """explain指定時にハンドラーのレスポンスにスパンの木と段階別の分位点が含まれるテスト"""
+        def process_document(**kwargs):
+            with span('sniff'):
+                pass
+            with span('conversion.markitdown'):
+                with span('chunking'):
+                    pass
+            return {'success': True, 'fileName': kwargs['file_name']}
+        
+        event = {'fileName': 'notes.txt', 'fileContent': 'hello', 'explain': True}
+        with patch('document_processor.processor.process_document', side_effect=process_document), \
+             patch('builtins.print'):
+            explained = json.loads(lambda_handler(event, None)['body'])
+            plain = json.loads(lambda_handler(dict(event, explain=False), None)['body'])
+        
+        self.assertNotIn('trace', plain)
+        trace = explained['trace']
+        self.assertEqual(trace['spans']['name'], 'document-processor')
+        self.assertEqual(trace['spans']['attributes'], {'fileName': 'notes.txt', 'success': True})
+        self.assertEqual([child['name'] for child in trace['spans']['children']], ['sniff', 'conversion.markitdown'])
+        self.assertEqual(set(trace['stages']), {'sniff', 'conversion.markitdown', 'chunking'})
+        self.assertGreaterEqual(trace['cumulative']['chunking']['count'], 1)
+
+
+class TestMemoryMonitor(unittest.TestCase):
+    """継続的なメモリ計測とバックプレッシャーのテスト"""
+    
+    MB = 1024 * 1024
+    
+    def setUp(self):
+        """RSSを任意の値に設定できるモニター（上限1000MB）"""
+        self.rss = 100 * self.MB
+        self.monitor = MemoryMonitor(limit_mb=1000, interval_ms=0, sampler=lambda: self.rss)
+    
+    def test_worker_memory_counted(self):
+        """変換ワーカーのメモリを逼迫度の判定に加えるテスト"""
+        workers = {'bytes': 0}
+        self.monitor.add_source('conversionWorkers', lambda: workers['bytes'])
+        self.rss = 300 * self.MB
+        self.assertEqual(self.monitor.pressure(), MemoryPressure.NORMAL)
+        
+        workers['bytes'] = 500 * self.MB
+        self.assertEqual(self.monitor.pressure(), MemoryPressure.ELEVATED)
+        report = self.monitor.report()
+        self.assertEqual(report['currentMB'], 800.0)
+        self.assertEqual(report['sourcesMB'], {'conversionWorkers': 500.0})
+    
+    def test_stage_peaks_and_pressure(self):
+        """スパンごとのピーク（入れ子の段階にも反映）と逼迫度に応じたバッチサイズのテスト"""
+        tracer = Tracer()
+        root = tracer.start_trace('document')
+        self.monitor.start(tracer)
+        with tracer.span('conversion') as conversion:
+            self.rss = 400 * self.MB
+            self.monitor.sample()
+            self.rss = 200 * self.MB
+        with tracer.span('embedding'):
+            with tracer.span('indexing'):
+                self.rss = 650 * self.MB
+                self.monitor.sample()
+            self.rss = 300 * self.MB
+        tracer.end_trace(root)
+        
+        self.assertEqual(conversion.attributes['memoryPeakMB'], 400.0)
+        self.assertEqual(self.monitor.pressure(), MemoryPressure.NORMAL)
+        self.assertEqual(self.monitor.fit_batch_size(25), 25)
+        # 一括処理の概算（1件あたり約48KB）がバッチ縮小水準（700MB）までの残りを超える場合は分割
+        self.assertFalse(self.monitor.should_slice(100))
+        self.assertTrue(self.monitor.should_slice(10000))
+        self.rss = 750 * self.MB
+        self.assertEqual(self.monitor.pressure(), MemoryPressure.ELEVATED)
+        self.assertEqual(self.monitor.fit_batch_size(25), 12)
+        self.assertTrue(self.monitor.should_flush())
+        self.assertFalse(self.monitor.should_spill())
+        self.rss = 900 * self.MB
+        self.assertEqual(self.monitor.fit_batch_size(25, minimum=2), 2)
+        self.assertTrue(self.monitor.should_spill())
+        
+        report = self.monitor.stop()
+        self.assertEqual(report['baselineMB'], 100.0)
+        self.assertEqual(report['peakMB'], 900.0)
+        self.assertEqual(report['pressure'], MemoryPressure.CRITICAL)
+        self.assertEqual(report['stages']['conversion'], {'count': 1, 'peakMB': 400.0, 'maxGrowthMB': 300.0})
+        self.assertEqual(report['stages']['embedding'], {'count': 1, 'peakMB': 650.0, 'maxGrowthMB': 450.0})
+        self.assertEqual(report['stages']['indexing']['peakMB'], 650.0)
+        self.assertEqual(report['adaptations']['batchShrinks'], 2)
+        
+        # 停止後はスパンを計測しない、採取スレッドは一定間隔でRSSを採取
+        with tracer.span('chunking'):
+            pass
+        self.assertNotIn('chunking', self.monitor.report()['stages'])
+        sampler = MemoryMonitor(limit_mb=1000, interval_ms=5, sampler=read_rss_bytes).start()
+        time.sleep(0.05)
+        self.assertTrue(sampler.running)
+        report = sampler.stop()
+        self.assertFalse(sampler.running)
+        self.assertGreaterEqual(report['samples'], 3)
+        self.assertGreater(report['peakMB'], 0)
+    
+    def test_spill_list_and_resource_monitor(self):
+        """逼迫時に中間データを一時ファイルへ退避し、読み出し時に復元するテスト"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            vectors = SpillList(self.monitor, spill_dir=temp_dir)
+            vectors.extend([[0.5, 0.0], [0.5, 1.0], [0.5, 2.0]])
+            self.assertEqual(vectors.spilled_count, 0)
+            self.rss = 900 * self.MB
+            vectors.extend([[0.5, 3.0]])
+            self.assertEqual(vectors.spilled_count, 4)
+            self.assertEqual(len(os.listdir(temp_dir)), 1)
+            self.rss = 100 * self.MB
+            vectors.extend([[0.5, 4.0]])
+            
+            self.assertEqual(len(vectors), 5)
+            self.assertEqual(list(vectors), [[0.5, float(i)] for i in range(5)])
+            self.assertEqual(vectors[1], [0.5, 1.0])
+            self.assertEqual(vectors[-1], [0.5, 4.0])
+            with self.assertRaises(IndexError):
+                vectors[5]
+            self.assertEqual(self.monitor.report()['adaptations']['spilledItems'], 4)
+            vectors.close()
+            self.assertEqual(os.listdir(temp_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+        
+        # 事前検証はpsutilなしでRSSを取得して上限と比較
+        self.assertGreater(read_rss_bytes(), 0)
+        ResourceMonitor({'performance': {'memoryLimitMB': 1024 * 1024}}).validate_memory_usage()
+        with self.assertRaises(ProcessingError) as raised:
+            ResourceMonitor({'performance': {'memoryLimitMB': 1}}).validate_memory_usage()
+        self.assertEqual(raised.exception.error_type, ErrorType.MEMORY_LIMIT_EXCEEDED)
+    
+    def test_pipeline_back_pressure(self):
+        """逼迫時の埋め込みバッチ縮小と、埋め込み生成・格納の分割実行のテスト"""
+        self.rss = 750 * self.MB
+        vector_processor = BedrockKBVectorProcessor()
+        vector_processor.bedrock_client = FakeBedrockRuntime()
+        batch_sizes = []
+        original_batch = vector_processor._generate_batch_embeddings
+        
+        def record_batch(texts, deadline=None):
+            batch_sizes.append(len(texts))
+            return original_batch(texts, deadline)
+        
+        with patch('vector_embedding_bedrock_kb.get_memory_monitor', return_value=self.monitor), \
+             patch.object(vector_processor, '_generate_batch_embeddings', side_effect=record_batch):
+            result = vector_processor.generate_embeddings([f"text {i}" for i in range(10)], batch_size=4,
+                                                          enable_cache=False)
+        self.assertEqual(len(result.embeddings), 10)
+        self.assertEqual(sum(batch_sizes), 10)
+        self.assertLessEqual(max(batch_sizes), 2)
+        
+        with patch('document_processor.boto3.resource'), \
+             patch('document_processor.boto3.client'):
+            processor = DocumentProcessor()
+        processor.memory_monitor = self.monitor
+        generated = []
+        
+        def generate_embeddings(texts, deadline=None):
+            generated.append(len(texts))
+            return EmbeddingResult(success=True, embeddings=[[0.1, 0.2]] * len(texts), metadata={})
+        
+        processor.vector_processor.generate_embeddings = generate_embeddings
+        processor.vector_processor.store_embeddings_to_opensearch = Mock(
+            side_effect=lambda docs: {'success': True, 'stored_count': len(docs)}
+        )
+        chunks = [{'content': f"chunk {i}", 'metadata': {}} for i in range(120)]
+        # チェックポイントの埋め込み（先頭30件）は再利用し、残りを縮小したスライス（50件）ごとに生成・格納
+        vector_result, storage, pending = processor.embed_and_index_slices(
+            chunks, [[0.3, 0.4]] * 30, 'big.md', None, None, 4096, Deadline(60000)
+        )
+        self.assertIsNone(pending)
+        self.assertEqual(generated, [20, 50, 20])
+        self.assertEqual(storage['stored_count'], 120)
+        self.assertEqual(storage['slices'], 3)
+        indices = [doc.metadata['chunk_index'] for call in
+                   processor.vector_processor.store_embeddings_to_opensearch.call_args_list for doc in call[0][0]]
+        self.assertEqual(indices, list(range(120)))
+        self.assertEqual(len(vector_result.embeddings), 120)
+        self.assertEqual(vector_result.embeddings[0], [0.3, 0.4])
+        self.assertEqual(vector_result.metadata['embedding_dimension'], 2)
+        
+        # 上限に近い場合は1件ずつ処理し、格納済みの埋め込みを一時ファイルに退避
+        self.rss = 900 * self.MB
+        vector_result, storage, pending = processor.embed_and_index_slices(
+            chunks[:3], [], 'big.md', None, None, 4096, Deadline(60000)
+        )
+        self.assertEqual(storage['slices'], 3)
+        self.assertEqual(vector_result.metadata['spilled_embeddings'], 3)
+        self.assertEqual(list(vector_result.embeddings), [[0.1, 0.2]] * 3)
+        self.assertEqual(self.monitor.report()['adaptations']['slicedIndexing'], 2)
+
+
+class TestIngestionBenchmark(unittest.TestCase):
+    """取り込みベンチマークとローカルAWS代替のテスト"""
+    
+    def test_local_opensearch_bulk_storage(self):
+        """OpenSearchクライアント設定時にバルク格納し、注入したスロットリングを失敗として返すテスト"""
+        services = LocalServices({'opensearch': ServiceProfile(throttle_rate=1.0)}, seed=3)
+        processor = BedrockKBVectorProcessor()
+        processor.opensearch_client = LocalOpenSearch(services)
+        chunks = [{'content': f"チャンク{i}", 'metadata': {'chunk_id': f"c{i}"}} for i in range(3)]
+        documents = processor.create_bedrock_kb_documents(
+            chunks=chunks, embeddings=[deterministic_embedding(chunk['content'], 8) for chunk in chunks],
+            source_file='bench.html'
+        )
+        
+        throttled = processor.store_embeddings_to_opensearch(documents)
+        self.assertFalse(throttled['success'])
+        self.assertEqual(throttled['failed_count'], 3)
+        
+        services.profiles['opensearch'] = ServiceProfile()
+        stored = processor.store_embeddings_to_opensearch(documents)
+        self.assertEqual((stored['stored_count'], stored['failed_count']), (3, 0))
+        self.assertEqual(processor.opensearch_client.count(), 3)
+        self.assertEqual(services.get_stats()['opensearch']['throttled'], 1)
+        
+        # 同じシード・テキストの埋め込みは同じ単位ベクトル
+        vector = deterministic_embedding('同じテキスト', 16, seed=3)
+        self.assertEqual(vector, deterministic_embedding('同じテキスト', 16, seed=3))
+        self.assertNotEqual(vector, deterministic_embedding('同じテキスト', 16, seed=4))
+        self.assertAlmostEqual(sum(value * value for value in vector), 1.0)
+    
+    def test_workload_and_baseline_comparison(self):
+        """生成ドキュメントの決定性・対象形式の絞り込み・ベースラインとの比較のテスト"""
+        workload = build_workload([0.05], seed=7)
+        self.assertEqual([document.content for document in workload],
+                         [document.content for document in build_workload([0.05], seed=7)])
+        self.assertGreaterEqual(len(workload[-1].content), 0.05 * 1024 * 1024)
+        included, skipped = split_supported(workload)
+        self.assertIn('generated_0.05mb.csv', [document.file_name for document in included])
+        self.assertIn('test_simple.txt', skipped)
+        
+        def report(docs_per_second, p99, embedding_p99, rss):
+            return {'results': {'processor': {
+                'docsPerSecond': docs_per_second, 'chunksPerSecond': docs_per_second * 100,
+                'documentLatencyMs': {'p50': p99 / 2, 'p99': p99},
+                'stages': {'embedding': {'p50': embedding_p99 / 2, 'p99': embedding_p99}}
+            }}, 'peakRssMb': rss}
+        
+        baseline = report(2.0, 1000.0, 400.0, 200.0)
+        self.assertEqual(compare_with_baseline(report(1.9, 1100.0, 420.0, 210.0), baseline, 0.15), [])
+        regressions = {item['metric']: item for item in
+                       compare_with_baseline(report(1.5, 1000.0, 600.0, 260.0), baseline, 0.15)}
+        self.assertEqual(set(regressions), {'processor.docsPerSecond', 'processor.chunksPerSecond',
+                                            'processor.stages.embedding.p50', 'processor.stages.embedding.p99',
+                                            'peakRssMb'})
+        self.assertEqual(regressions['processor.docsPerSecond']['change'], -0.25)
+
+
+class TestFakeBedrock(unittest.TestCase):
+    """フェイクBedrock Runtimeのテスト"""
+    
+    @staticmethod
+    def invoke(runtime, model_id, request):
+        response = runtime.invoke_model(modelId=model_id, body=json.dumps(request, ensure_ascii=False))
+        return json.loads(response['body'].read())
+    
+    @staticmethod
+    def cosine(a, b):
+        return sum(x * y for x, y in zip(a, b))
+    
+    def test_embedding_models(self):
+        """Titan v1/v2・Cohereの応答形式・次元数・入力検証と、語彙に基づく類似度のテスト"""
+        runtime = FakeBedrockRuntime(seed=1)
+        v1 = self.invoke(runtime, 'amazon.titan-embed-text-v1', {'inputText': 'FSx for NetApp ONTAPの設定方法'})
+        self.assertEqual(len(v1['embedding']), 1536)
+        self.assertGreater(v1['inputTextTokenCount'], 0)
+        self.assertAlmostEqual(sum(value * value for value in v1['embedding']), 1.0)
+        
+        v2 = self.invoke(runtime, 'amazon.titan-embed-text-v2:0', {'inputText': 'machine learning', 'dimensions': 256})
+        self.assertEqual(len(v2['embedding']), 256)
+        self.assertEqual(v2['embeddingsByType']['float'], v2['embedding'])
+        with self.assertRaises(ClientError) as raised:
+            self.invoke(runtime, 'amazon.titan-embed-text-v2:0', {'inputText': 'x', 'dimensions': 300})
+        self.assertEqual(raised.exception.response['Error']['Code'], 'ValidationException')
+        
+        cohere = self.invoke(runtime, 'cohere.embed-multilingual-v3', {
+            'texts': ['Neural networks and deep learning', 'deep neural network layers', '請求書の支払期限'],
+            'input_type': 'search_document'
+        })
+        self.assertEqual(cohere['response_type'], 'embeddings_floats')
+        related, unrelated = cohere['embeddings'][1], cohere['embeddings'][2]
+        self.assertGreater(self.cosine(cohere['embeddings'][0], related),
+                           self.cosine(cohere['embeddings'][0], unrelated) + 0.3)
+        with self.assertRaises(ClientError):
+            self.invoke(runtime, 'cohere.embed-multilingual-v3', {'texts': ['input_type なし']})
+        
+        # 同じテキスト・シードは同じベクトル、異なるシードは別の埋め込み空間
+        self.assertEqual(semantic_embedding('同じテキスト', 64, seed=1), semantic_embedding('同じテキスト', 64, seed=1))
+        self.assertNotEqual(semantic_embedding('同じテキスト', 64, seed=1), semantic_embedding('同じテキスト', 64, seed=2))
+        self.assertGreater(self.cosine(semantic_embedding('FSx ONTAPの設定手順'), semantic_embedding('FSx ONTAPの設定方法')), 0.5)
+    
+    def test_fault_injection(self):
+        """モデル別の遅延・スロットリング・エラーコードの注入と、再試行ごとに異なる判定のテスト"""
+        delays = []
+        runtime = FakeBedrockRuntime({
+            'amazon.titan-embed': FaultProfile(latency_ms=40, throttle_rate=0.5),
+            'anthropic.claude': FaultProfile(error_rate=1.0, error_codes=('ModelTimeoutException',)),
+            '*': FaultProfile(latency_ms=5)
+        }, seed=3, sleep=delays.append)
+        
+        outcomes = []
+        for _ in range(20):
+            try:
+                self.invoke(runtime, 'amazon.titan-embed-text-v1', {'inputText': '同じリクエスト'})
+                outcomes.append('ok')
+            except ClientError as e:
+                self.assertEqual(e.response['ResponseMetadata']['HTTPStatusCode'], 429)
+                outcomes.append(e.response['Error']['Code'])
+        self.assertEqual(set(outcomes), {'ok', 'ThrottlingException'})
+        self.assertEqual(len(delays), 20)
+        self.assertTrue(all(0.005 < delay < 0.2 for delay in delays))
+        
+        with self.assertRaises(ClientError) as raised:
+            self.invoke(runtime, 'anthropic.claude-3-haiku-20240307-v1:0',
+                        {'max_tokens': 10, 'messages': [{'role': 'user', 'content': 'hello'}]})
+        self.assertEqual(raised.exception.response['Error']['Code'], 'ModelTimeoutException')
+        nova = self.invoke(runtime, 'amazon.nova-lite-v1:0', {'messages': [{'role': 'user', 'content': [{'text': 'hi'}]}]})
+        self.assertEqual(nova['stopReason'], 'end_turn')
+        
+        stats = runtime.get_stats()
+        self.assertEqual(stats['amazon.titan-embed-text-v1']['calls'], 20)
+        self.assertEqual(stats['amazon.titan-embed-text-v1']['throttled'], outcomes.count('ThrottlingException'))
+        self.assertEqual(stats['anthropic.claude-3-haiku-20240307-v1:0']['errors'], {'ModelTimeoutException': 1})
+        self.assertGreater(stats['amazon.nova-lite-v1:0']['output_tokens'], 0)
+    
+    def test_http_server_streaming(self):
+        """ローカルHTTPサーバーを実際のboto3クライアントから呼び出すテスト（ストリーミング・エラー応答）"""
+        import boto3
+        from botocore.config import Config
+        
+        runtime = FakeBedrockRuntime({'amazon.titan-embed': FaultProfile(throttle_rate=1.0)},
+                                     responses={'ONTAP': 'FSx for NetApp ONTAP はフルマネージドのストレージです。'})
+        with FakeBedrockServer(runtime) as server:
+            client = boto3.client('bedrock-runtime', endpoint_url=server.url, region_name='us-east-1',
+                                  aws_access_key_id='testing', aws_secret_access_key='testing',
+                                  config=Config(retries={'total_max_attempts': 1}))
+            response = client.invoke_model_with_response_stream(
+                modelId='amazon.nova-pro-v1:0',
+                body=json.dumps({'messages': [{'role': 'user', 'content': [{'text': 'ONTAPとは？'}]}]})
+            )
+            events = [json.loads(event['chunk']['bytes']) for event in response['body']]
+            claude = json.loads(client.invoke_model(
+                modelId='anthropic.claude-3-haiku-20240307-v1:0',
+                body=json.dumps({'anthropic_version': 'bedrock-2023-05-31', 'max_tokens': 5,
+                                 'messages': [{'role': 'user', 'content': 'ONTAP'}]})
+            )['body'].read())
+            with self.assertRaises(ClientError) as raised:
+                client.invoke_model(modelId='amazon.titan-embed-text-v1', body=json.dumps({'inputText': 'x'}))
+        
+        text = ''.join(event['contentBlockDelta']['delta']['text'] for event in events if 'contentBlockDelta' in event)
+        self.assertEqual(text, 'FSx for NetApp ONTAP はフルマネージドのストレージです。')
+        self.assertEqual(events[-2], {'messageStop': {'stopReason': 'end_turn'}})
+        self.assertGreater(events[-1]['metadata']['usage']['outputTokens'], 0)
+        self.assertEqual(claude['stop_reason'], 'max_tokens')
+        self.assertLessEqual(claude['usage']['output_tokens'], 5)
+        self.assertEqual(raised.exception.response['Error']['Code'], 'ThrottlingException')
+    
+    @patch('vector_embedding_bedrock_kb.time.sleep')
+    def test_mock_search_ranks_stored_documents(self, mock_sleep):
+        """OpenSearch未設定時のモック検索が格納済みドキュメントを類似度順に返すテスト"""
+        processor = BedrockKBVectorProcessor()
+        processor.bedrock_client = FakeBedrockRuntime()
+        texts = ['FSx for NetApp ONTAPのボリューム設定', '機械学習モデルの評価指標', 'ONTAPのSnapMirror設定']
+        result = processor.generate_embeddings(texts, enable_cache=False)
+        self.assertTrue(result.success)
+        documents = processor.create_bedrock_kb_documents(
+            chunks=[{'content': text, 'metadata': {'chunk_index': i}} for i, text in enumerate(texts)],
+            embeddings=result.embeddings, source_file='guide.md'
+        )
+        processor.store_embeddings_to_opensearch(documents)
+        
+        query = processor._generate_mock_embedding('ONTAPのボリューム設定')
+        found = processor.search_similar_documents(query, k=2)
+        self.assertEqual(found['total_hits'], 3)
+        self.assertEqual([hit['_source']['AMAZON_BEDROCK_TEXT_CHUNK'] for hit in found['documents']],
+                         [texts[0], texts[2]])
+        self.assertGreater(found['documents'][0]['_score'], found['documents'][1]['_score'])
+        
+        langchain_vectors = LangChainIntegration()._generate_embeddings(texts[:1])
+        self.assertEqual(langchain_vectors[0], result.embeddings[0])
+
+
+class TestQueryBenchmark(unittest.TestCase):
+    """クエリ負荷ベンチマークとローカルOpenSearch検索のテスト"""
+    
+    def test_local_opensearch_knn_search(self):
+        """総当たりkNN検索が権限フィルター・min_score・sizeを適用し、スロットリングで429を返すテスト"""
+        services = LocalServices(seed=5)
+        services.opensearch = LocalOpenSearch(services)
+        passages = load_corpus()
+        self.assertEqual(index_corpus(services, passages), len(passages))
+        public = next(passage for passage in passages if passage['permissions']['public'])
+        private = next(passage for passage in passages if not passage['permissions']['public'])
+        permission_filter = {'bool': {'should': [{'term': {'permissions.public': True}},
+                                                 {'terms': {'permissions.users': [BENCHMARK_USER]}},
+                                                 {'term': {'owner': BENCHMARK_USER}}],
+                                      'minimum_should_match': 1}}
+        
+        def search(passage, min_score=0.0):
+            vector = services.opensearch.documents[INDEX_NAME][passage['id']]['content_vector']
+            return services.opensearch.search(index=INDEX_NAME, body={
+                'size': 3, 'min_score': min_score,
+                'query': {'bool': {'must': [{'knn': {'content_vector': {'vector': vector, 'k': 6}}}],
+                                   'filter': [permission_filter]}},
+                '_source': {'includes': ['title', 'content', 'owner']}
+            })
+        
+        hits = search(public)['hits']
+        self.assertEqual(hits['hits'][0]['_id'], public['id'])
+        self.assertAlmostEqual(hits['hits'][0]['_score'], 1.0, places=5)
+        self.assertEqual(len(hits['hits']), 3)
+        self.assertNotIn('content_vector', hits['hits'][0]['_source'])
+        self.assertNotIn(private['id'], [hit['_id'] for hit in search(private)['hits']['hits']])
+        self.assertEqual([hit['_id'] for hit in search(public, min_score=0.99)['hits']['hits']], [public['id']])
+        
+        services.profiles['opensearch'] = ServiceProfile(throttle_rate=1.0)
+        with self.assertRaises(LocalOpenSearchError) as raised:
+            search(public)
+        self.assertEqual(raised.exception.status_code, 429)
+    
+    @patch.dict(os.environ, {'MODEL_ROUTING_ENABLED': 'false', 'BEDROCK_MODEL_ID': 'anthropic.claude-3-haiku-20240307-v1:0'})
+    def test_generation_load_curves(self):
+        """生成ハンドラーをローカルBedrockで同時実行・ポアソン到着で計測するテスト"""
+        queries = load_queries()
+        self.assertIn('What is machine learning?', [query.text for query in queries])
+        stream = query_stream(queries, 12, zipf_s=1.0, seed=2)
+        self.assertEqual(stream, query_stream(queries, 12, zipf_s=1.0, seed=2))
+        offsets = arrival_offsets(50.0, 12, seed=2)
+        self.assertEqual(offsets, arrival_offsets(50.0, 12, seed=2))
+        self.assertEqual(offsets, sorted(offsets))
+        
+        context = [dict(passage, score=0.9) for passage in load_corpus()[:2]]
+        with LocalServices({'bedrock-generation': ServiceProfile(latency_ms=5)}, seed=2) as services:
+            target = build_target('generate', 'none', services, context)
+            closed = run_closed_loop(target, stream, 3)
+            opened = run_open_loop(target, stream, 50.0, seed=2)
+            answer = target.call(queries[0])
+        
+        self.assertEqual((closed['requests'], closed['errors'], closed['concurrency']), (12, 0, 3))
+        self.assertEqual((opened['requests'], opened['errors'], opened['offeredRps']), (12, 0, 50.0))
+        self.assertGreaterEqual(opened['latencyMs']['p50'], opened['serviceLatencyMs']['p50'])
+        self.assertIsNone(closed['cache'])
+        self.assertTrue(answer['answer'].startswith(CANNED_ANSWER))
+        self.assertGreater(answer['tokens_used'], 0)
+        self.assertEqual(services.get_stats()['bedrock-generation']['calls'], 25)
+    
+    @unittest.skipUnless(importlib.util.find_spec('opensearchpy') and importlib.util.find_spec('requests_aws4auth'),
+                         'opensearch-py / requests-aws4auth が未インストール')
+    def test_rag_cache_settings(self):
+        """キャッシュ設定ごとの埋め込み・検索結果のヒット率のテスト"""
+        queries = load_queries()[:2]
+        stream = [queries[0], queries[1], queries[0], queries[0]]
+        rates = {}
+        with LocalServices(seed=4) as services:
+            index_corpus(services, load_corpus())
+            # 既定ではキャッシュを使用しない
+            for name, settings in (('default', {}),
+                                   ('full', {'RAG_EMBEDDING_CACHE_ENABLED': 'true',
+                                             'RAG_SEARCH_CACHE_TTL_SECONDS': '60'})):
+                with patch.dict(os.environ, dict(settings, MODEL_ROUTING_ENABLED='false')):
+                    point = run_closed_loop(build_target('rag', 'knn', services, []), stream, 1)
+                self.assertEqual(point['errors'], 0)
+                self.assertIn('retrieval_ms', point['stagesMs'])
+                rates[name] = point['cache']
+        
+        self.assertIsNone(rates['default']['embedding']['hitRate'])
+        self.assertIsNone(rates['default']['search']['hitRate'])
+        self.assertEqual(rates['full']['embedding'], {'hits': 2, 'misses': 2, 'hitRate': 0.5})
+        self.assertEqual(rates['full']['search'], {'hits': 2, 'misses': 2, 'hitRate': 0.5})
 
 
 class TestCloudWatchMetrics(unittest.TestCase):
@@ -392,6 +2668,98 @@ class TestStructuredLogging(unittest.TestCase):
             )
         except Exception as e:
             self.fail(f"変換試行ログでエラーが発生: {e}")
+    
+    def test_lazy_capped_payloads(self):
+        """ペイロードがレベル有効時のみ構築され、ファイル内容と長いフィールドが制限されるテスト"""
+        quiet = logging.getLogger('lazy-payload-test')
+        quiet.setLevel(logging.WARNING)
+        build = Mock(return_value={'fileName': 'a.pdf'})
+        quiet.info("event: %s", LazyJson(build))
+        build.assert_not_called()
+        
+        event = {'fileName': 'a.pdf', 'fileContent': 'x' * 5_000_000,
+                 'body': json.dumps({'fileContent': 'y' * 10_000}), 'raw': b'z' * 100, 'items': list(range(50))}
+        payload = json.loads(str(LazyJson(event)))
+        self.assertEqual(payload['fileContent'], '<redacted: 5000000>')
+        self.assertLess(len(payload['body']), 300)
+        self.assertEqual(payload['raw'], '<100 bytes>')
+        self.assertEqual(payload['items'][-1], '...(+30件)')
+        self.assertEqual(cap_value({'a': {'b': 'short'}}), {'a': {'b': 'short'}})
+    
+    def test_high_frequency_events_sampled(self):
+        """バッチ単位のイベントはN件に1件のみ出力し、失敗は常に出力するテスト"""
+        sampled_logger = MarkitdownLogger(sampler=LogSampler(every=5))
+        with self.assertLogs('structured_logging', level='INFO') as captured:
+            for _ in range(20):
+                sampled_logger.log_embedding_generation('titan', 25, 40.0, True, 25)
+            for _ in range(2):
+                sampled_logger.log_embedding_generation('titan', 25, 40.0, False, 25, error_message='throttled')
+            sampled_logger.log_langchain_processing(3, 10.0, True, 'recursive_character', 100.0)
+        
+        self.assertEqual(len(captured.records), 4 + 2 + 1)
+        self.assertEqual(sampled_logger.sampler.get_stats()['suppressed'], 16)
+    
+    def test_queue_handler_does_not_block(self):
+        """出力先が遅い場合も呼び出し元をブロックせず、あふれたログは破棄して件数を数えるテスト"""
+        release = threading.Event()
+        emitted = []
+        
+        class SlowHandler(logging.Handler):
+            def emit(self, record):
+                release.wait(5)
+                emitted.append(self.format(record))
+        
+        target = logging.getLogger('queue-logging-test')
+        target.propagate = False
+        target.setLevel(logging.INFO)
+        target.handlers = [SlowHandler()]
+        try:
+            handler = install_queue_logging(target, queue_size=2)
+            started = time.perf_counter()
+            for i in range(10):
+                target.info("event %d: %s", i, LazyJson({'fileContent': 'x' * 1000}))
+            self.assertLess(time.perf_counter() - started, 1.0)
+            self.assertGreaterEqual(handler.dropped, 7)
+            
+            release.set()
+            self.assertTrue(flush_logs(timeout=5))
+            self.assertEqual(len(emitted), 10 - handler.dropped)
+            self.assertIn('<redacted: 1000>', emitted[0])
+        finally:
+            release.set()
+            structured_logging._queue_listener.stop()
+            structured_logging._queue_handler = None
+            structured_logging._queue_listener = None
+    
+    def test_forked_child_logs_without_listener(self):
+        """フォークした子プロセスのログがキューに残らずに元のハンドラーへ出力されるテスト"""
+        temp_dir = tempfile.mkdtemp()
+        log_path = os.path.join(temp_dir, 'child.log')
+        target = logging.getLogger('queue-logging-fork-test')
+        target.propagate = False
+        target.setLevel(logging.INFO)
+        target.handlers = [logging.FileHandler(log_path)]
+        
+        def log_in_child():
+            target.info("child pid %d", os.getpid())
+        
+        try:
+            install_queue_logging(target)
+            child = multiprocessing.get_context('fork').Process(target=log_in_child)
+            child.start()
+            child.join(10)
+            self.assertEqual(child.exitcode, 0)
+            self.assertTrue(flush_logs(timeout=5))
+            with open(log_path) as f:
+                self.assertIn(f"child pid {child.pid}", f.read())
+        finally:
+            structured_logging._queue_listener.stop()
+            structured_logging._queue_handler = None
+            structured_logging._queue_listener = None
+            structured_logging._queue_target = None
+            for handler in target.handlers:
+                handler.close()
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
 
 class TestDocumentProcessorIntegration(unittest.TestCase):
@@ -429,6 +2797,74 @@ class TestDocumentProcessorIntegration(unittest.TestCase):
         metadata = result['metadata']
         self.assertIn('startTime', metadata)
         self.assertIn('totalProcessingTime', metadata)
+    
+    def _slow_converter(self, method, delay, score):
+        def convert(file_content, file_format, file_name, deadline=None):
+            time.sleep(delay)
+            return True, f"{method} content", {'method': method, 'success': True, 'qualityScore': score}
+        return convert
+    
+    def test_both_compare_runs_concurrently(self):
+        """品質比較モードで両方の変換を並行実行するテスト"""
+        self.processor.process_with_markitdown = self._slow_converter('markitdown', 0.2, 80)
+        self.processor.process_with_langchain = self._slow_converter('langchain', 0.2, 85)
+        
+        start = time.monotonic()
+        method, content, attempted, comparison = self.processor.convert_both_compare(
+            b'data', 'pdf', 'test.pdf', ['markitdown', 'langchain'], 5, Deadline(5000)
+        )
+        
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual(method, 'langchain')
+        self.assertEqual(content, 'langchain content')
+        self.assertEqual(set(comparison['methodWallClockMs']), {'markitdown', 'langchain'})
+        self.assertFalse(comparison['earlyAccepted'])
+        self.assertEqual(comparison['cancelled'], [])
+    
+    def test_both_compare_early_accept(self):
+        """品質閾値を満たした結果で残りの変換をキャンセルするテスト"""
+        self.processor.config = dict(self.processor.config,
+                                     quality={'earlyAcceptEnabled': True, 'earlyAcceptQualityScore': 90})
+        self.processor.process_with_markitdown = self._slow_converter('markitdown', 0.05, 95)
+        self.processor.process_with_langchain = self._slow_converter('langchain', 1.0, 99)
+        
+        start = time.monotonic()
+        method, content, attempted, comparison = self.processor.convert_both_compare(
+            b'data', 'pdf', 'test.pdf', ['markitdown', 'langchain'], 5, Deadline(5000)
+        )
+        
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(method, 'markitdown')
+        self.assertTrue(comparison['earlyAccepted'])
+        self.assertEqual(comparison['cancelled'][0]['method'], 'langchain')
+        self.assertGreater(comparison['cancelledWorkMs'], 0)
+        self.assertTrue(any(m.get('cancelled') for m in attempted))
+    
+    def test_both_compare_thread_cancellation_discards_result(self):
+        """スレッドで変換する形式はキャンセルで中断できず、開始前は実行せず完了後は結果を破棄するテスト"""
+        self.processor.config = dict(self.processor.config,
+                                     quality={'earlyAcceptEnabled': True, 'earlyAcceptQualityScore': 90})
+        self.processor.process_with_markitdown = self._slow_converter('markitdown', 0.05, 95)
+        self.processor.process_with_langchain = self._slow_converter('langchain', 0.3, 99)
+        
+        method, content, attempted, comparison = self.processor.convert_both_compare(
+            b'data', 'txt', 'test.txt', ['markitdown', 'langchain'], 5, Deadline(5000)
+        )
+        self.assertEqual(method, 'markitdown')
+        self.assertFalse(comparison['cancelled'][0]['interrupted'])
+        
+        langchain = Mock(return_value=(True, 'late', {'method': 'langchain', 'success': True}))
+        self.processor.process_with_langchain = langchain
+        stage = Deadline(5000)
+        converter = self.processor._bind_compare_converter('langchain', 'txt', stage)
+        langchain.side_effect = lambda *args, **kwargs: (stage.cancel('early-accept'), langchain.return_value)[1]
+        success, content, metadata = converter(b'data', 'test.txt')
+        self.assertFalse(success)
+        self.assertTrue(metadata['cancelled'])
+        self.assertEqual(langchain.call_count, 1)
+        # キャンセル済みの場合は変換を開始しない
+        self.assertTrue(converter(b'data', 'test.txt')[2]['cancelled'])
+        self.assertEqual(langchain.call_count, 1)
 
 
 class TestErrorHandling(unittest.TestCase):
@@ -484,7 +2920,26 @@ def run_unit_tests():
         TestFormatProcessors,
         TestLangChainIntegration,
         TestVectorEmbedding,
+        TestBedrockRateLimiter,
+        TestResilience,
+        TestConversionPool,
+        TestConversionCache,
+        TestContentSniffer,
+        TestPagePipeline,
+        TestTabularStream,
+        TestMarkupStream,
+        TestOoxmlReader,
+        TestArchiveIngest,
+        TestImagePreprocess,
+        TestDeadline,
         TestMetadataManager,
+        TestMetadataQueries,
+        TestIdempotencyLease,
+        TestStageTracing,
+        TestMemoryMonitor,
+        TestIngestionBenchmark,
+        TestFakeBedrock,
+        TestQueryBenchmark,
         TestCloudWatchMetrics,
         TestStructuredLogging,
         TestDocumentProcessorIntegration,
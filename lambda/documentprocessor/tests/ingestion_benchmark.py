@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+取り込みパイプラインのエンドツーエンドベンチマーク
+DocumentProcessor.process_document と lambda_handler（S3イベント）を、サンプルドキュメントと
+生成した大容量ドキュメントで実行し、スループット・段階別の処理時間・ピークRSSをJSONで出力する。
+AWSサービスは local_services のローカル代替（遅延・スロットリングを設定可能）を使用する。
+ベースラインのJSONを指定すると、許容範囲を超えて悪化した指標を回帰として報告する。
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+# テスト対象モジュールのインポート
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_services import LocalServices, ServiceProfile
+from test_data.sample_documents import SampleDocumentGenerator
+
+logger = logging.getLogger(__name__)
+
+# 既定の応答特性（遅延の中央値、ミリ秒）
+DEFAULT_LATENCY_MS = {
+    'bedrock-runtime': 40.0,
+    'dynamodb': 5.0,
+    's3': 15.0,
+    'cloudwatch': 10.0,
+    'opensearch': 20.0
+}
+BENCHMARK_MODES = ('processor', 'handler')
+# ベースラインとの比較で回帰とみなす悪化率の既定値
+DEFAULT_TOLERANCE = 0.15
+# 比較する指標（True: 大きいほど良い）
+THROUGHPUT_METRICS = {'docsPerSecond': True, 'chunksPerSecond': True}
+LATENCY_METRICS = ('p50', 'p99')
+
+
+@dataclass
+class BenchmarkDocument:
+    """ベンチマーク対象のドキュメント"""
+    file_name: str
+    content: bytes
+    source: str  # sample / generated
+
+
+def sample_documents() -> List[BenchmarkDocument]:
+    """test_data のサンプルドキュメント（空ファイルを除く）"""
+    return [
+        BenchmarkDocument('test_simple.pdf', SampleDocumentGenerator.generate_pdf_content(), 'sample'),
+        BenchmarkDocument('test_simple.txt', SampleDocumentGenerator.generate_text_content(), 'sample'),
+        BenchmarkDocument('test_large.txt', SampleDocumentGenerator.generate_large_content(), 'sample')
+    ]
+
+
+def generate_large_html(size_mb: float, seed: int = 0) -> bytes:
+    """
+    指定サイズのHTMLを生成（見出し・段落・表を含む、シードに対して決定的）
+
+    Args:
+        size_mb: サイズ（MB）
+        seed: シード
+
+    Returns:
+        bytes: UTF-8のHTML
+    """
+    rng = random.Random(seed)
+    words = ['文書', '処理', 'ベクトル', '検索', 'チャンク', '埋め込み', 'インデックス', 'メタデータ',
+             'storage', 'pipeline', 'latency', 'throughput', 'FSx', 'ONTAP', 'Bedrock', 'OpenSearch']
+    target = int(size_mb * 1024 * 1024)
+    parts = ['<html><head><title>大容量ベンチマークドキュメント</title></head><body>\n']
+    size = len(parts[0].encode('utf-8'))
+    section = 0
+    while size < target:
+        section += 1
+        lines = [f"<h2>セクション {section}</h2>"]
+        for _ in range(rng.randint(2, 5)):
+            lines.append('<p>' + ' '.join(rng.choice(words) for _ in range(rng.randint(30, 80))) + '。</p>')
+        if section % 10 == 0:
+            lines.append('<table><tr><th>項目</th><th>値</th><th>備考</th></tr>')
+            lines.extend(f"<tr><td>{rng.choice(words)}</td><td>{rng.randint(0, 9999)}</td>"
+                         f"<td>{rng.choice(words)}</td></tr>" for _ in range(8))
+            lines.append('</table>')
+        block = '\n'.join(lines) + '\n'
+        parts.append(block)
+        size += len(block.encode('utf-8'))
+    parts.append('</body></html>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def generate_large_csv(size_mb: float, seed: int = 0) -> bytes:
+    """
+    指定サイズのCSVを生成（シードに対して決定的）
+
+    Args:
+        size_mb: サイズ（MB）
+        seed: シード
+
+    Returns:
+        bytes: UTF-8のCSV
+    """
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    rows = ['id,category,amount,updated_at,comment\n']
+    size = len(rows[0])
+    row_id = 0
+    while size < target:
+        row_id += 1
+        row = (f"{row_id},cat-{rng.randint(1, 20)},{rng.uniform(0, 10000):.2f},"
+               f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},comment {rng.randint(0, 10 ** 6)}\n")
+        rows.append(row)
+        size += len(row)
+    return ''.join(rows).encode('utf-8')
+
+
+def build_workload(large_sizes_mb: List[float], seed: int = 0, include_samples: bool = True) -> List[BenchmarkDocument]:
+    """
+    ベンチマーク対象のドキュメントを作成
+
+    Args:
+        large_sizes_mb: 生成する大容量ドキュメントのサイズ（MB、サイズごとにHTMLとCSV）
+        seed: シード
+        include_samples: サンプルドキュメントを含める
+
+    Returns:
+        List[BenchmarkDocument]: ドキュメント
+    """
+    documents = sample_documents() if include_samples else []
+    for size_mb in large_sizes_mb:
+        documents.append(BenchmarkDocument(f"generated_{size_mb:g}mb.html", generate_large_html(size_mb, seed), 'generated'))
+        documents.append(BenchmarkDocument(f"generated_{size_mb:g}mb.csv", generate_large_csv(size_mb, seed), 'generated'))
+    return documents
+
+
+def split_supported(documents: List[BenchmarkDocument]) -> Tuple[List[BenchmarkDocument], List[str]]:
+    """
+    設定で有効な形式のドキュメントに絞り込み（無効な形式は処理前に拒否されるため計測対象外）
+
+    Returns:
+        Tuple: (対象ドキュメント, 除外したファイル名)
+    """
+    from config_loader import load_markitdown_config
+
+    supported = load_markitdown_config(os.environ.get('MARKITDOWN_ENVIRONMENT', 'prod')).get('supportedFormats', {})
+    included, skipped = [], []
+    for document in documents:
+        file_format = document.file_name.rsplit('.', 1)[-1].lower()
+        (included if supported.get(file_format, {}).get('enabled') else skipped).append(document)
+    return included, [document.file_name for document in skipped]
+
+
+def unique_content(document: BenchmarkDocument, run_id: str) -> bytes:
+    """実行方法・反復ごとに内容を変える（変換・埋め込みキャッシュのヒットを防ぐ）"""
+    if document.file_name.endswith('.csv'):
+        return document.content + f"0,{run_id},0,2024-01-01,benchmark\n".encode('utf-8')
+    if document.file_name.endswith('.pdf'):
+        return document.content + f"\n%benchmark-{run_id}\n".encode('utf-8')
+    if document.file_name.endswith('.html'):
+        return document.content + f"<!-- benchmark {run_id} -->\n".encode('utf-8')
+    return document.content + f"\n\nbenchmark {run_id}\n".encode('utf-8')
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近傍順位法の分位点"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[rank], 3)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """プロセスのピークRSS（MB、取得できない環境ではNone）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def count_chunks(result: Dict[str, Any]) -> int:
+    """処理結果のチャンク数（埋め込み数、埋め込みがない場合はチャンキング結果）"""
+    vector = result.get('vectorProcessing') or {}
+    if vector.get('embeddings_count') is not None:
+        return int(vector['embeddings_count'])
+    return len((result.get('langchainProcessing') or {}).get('chunks') or [])
+
+
+def _invoke(mode: str, document_processor: Any, services: LocalServices, document: BenchmarkDocument,
+            content: bytes, run_id: str) -> Dict[str, Any]:
+    """1ドキュメントを処理（handler はS3に保存してS3イベントで呼び出し）"""
+    if mode == 'processor':
+        return document_processor.processor.process_document(file_content=content, file_name=document.file_name)
+
+    import boto3
+
+    key = f"benchmark/{run_id}/{document.file_name}"
+    response = boto3.client('s3', region_name=services.region).put_object(Bucket=services.bucket, Key=key, Body=content)
+    event = {'Records': [{'s3': {'bucket': {'name': services.bucket},
+                                 'object': {'key': key, 'size': len(content), 'eTag': response.get('ETag')}}}]}
+    handler_response = document_processor.lambda_handler(event, None)
+    return json.loads(handler_response['body'])
+
+
+def run_benchmark(documents: List[BenchmarkDocument], services: LocalServices, modes: List[str],
+                  iterations: int = 3, warmup: int = 1, reuse_content: bool = False) -> Dict[str, Any]:
+    """
+    ベンチマークを実行
+
+    Args:
+        documents: 対象ドキュメント
+        services: 開始済みのローカルサービス
+        modes: 実行方法（processor / handler）
+        iterations: 計測する反復回数
+        warmup: 計測前の反復回数（コールドスタートの初期化を除外）
+        reuse_content: 反復間で同じ内容を使用（キャッシュのヒットを含めて計測）
+
+    Returns:
+        Dict: 実行方法ごとの結果
+    """
+    # ローカルサービスの開始後にインポート（モジュール読み込み時にAWSクライアントを作成するため）
+    import document_processor
+    from tracing import get_tracer
+
+    document_processor.processor.vector_processor.opensearch_client = services.opensearch
+    results = {}
+    for mode in modes:
+        for iteration in range(warmup):
+            run_id = f"{mode}-warmup-{iteration}"
+            for document in documents:
+                _invoke(mode, document_processor, services, document,
+                        document.content if reuse_content else unique_content(document, run_id), run_id)
+
+        get_tracer().histograms.reset()
+        services.reset_stats()
+        latencies: Dict[str, List[float]] = {}
+        totals = {'documents': 0, 'chunks': 0, 'bytes': 0, 'failures': 0}
+        failures = []
+        # 段階ごとのピークRSS（handler の応答に含まれるメモリ計測結果）
+        memory_peaks: Dict[str, float] = {}
+        wall_start = time.perf_counter()
+        for iteration in range(iterations):
+            run_id = f"{mode}-{iteration}"
+            for document in documents:
+                content = document.content if reuse_content else unique_content(document, run_id)
+                start = time.perf_counter()
+                try:
+                    result = _invoke(mode, document_processor, services, document, content, run_id)
+                except Exception as e:
+                    result = {'success': False, 'error': {'message': str(e)}}
+                latencies.setdefault(document.file_name, []).append((time.perf_counter() - start) * 1000)
+                totals['documents'] += 1
+                totals['bytes'] += len(content)
+                totals['chunks'] += count_chunks(result)
+                memory = (result.get('metadata') or {}).get('memory') or {}
+                for stage, usage in memory.get('stages', {}).items():
+                    memory_peaks[stage] = max(memory_peaks.get(stage, 0.0), usage.get('peakMB') or 0.0)
+                if not result.get('success'):
+                    totals['failures'] += 1
+                    if len(failures) < 10:
+                        failures.append({'fileName': document.file_name, 'error': result.get('error')})
+        wall_seconds = time.perf_counter() - wall_start
+
+        all_latencies = [value for values in latencies.values() for value in values]
+        results[mode] = {
+            **totals,
+            'wallSeconds': round(wall_seconds, 3),
+            'docsPerSecond': round(totals['documents'] / wall_seconds, 3) if wall_seconds else 0,
+            'chunksPerSecond': round(totals['chunks'] / wall_seconds, 3) if wall_seconds else 0,
+            'megabytesPerSecond': round(totals['bytes'] / 1024 / 1024 / wall_seconds, 3) if wall_seconds else 0,
+            'documentLatencyMs': {'p50': percentile(all_latencies, 50), 'p99': percentile(all_latencies, 99)},
+            'perDocumentLatencyMs': {
+                name: {'p50': percentile(values, 50), 'p99': percentile(values, 99)}
+                for name, values in sorted(latencies.items())
+            },
+            'stages': get_tracer().histograms.snapshot(),
+            'stageMemoryPeakMb': dict(sorted(memory_peaks.items())),
+            'services': services.get_stats(),
+            'sampleFailures': failures
+        }
+        logger.info(f"{mode}: {results[mode]['docsPerSecond']} docs/s, {results[mode]['chunksPerSecond']} chunks/s")
+    return results
+
+
+def compare_with_baseline(current: Dict[str, Any], baseline: Dict[str, Any],
+                          tolerance: float = DEFAULT_TOLERANCE) -> List[Dict[str, Any]]:
+    """
+    ベースラインと比較して回帰した指標を抽出
+
+    Args:
+        current: 今回の結果（run_benchmark の出力を含むレポート）
+        baseline: ベースラインのレポート
+        tolerance: 許容する悪化率（0.15 = 15%）
+
+    Returns:
+        List[Dict]: 回帰した指標（metric, baseline, current, change）
+    """
+    regressions = []
+
+    def check(metric: str, before: Optional[float], after: Optional[float], higher_is_better: bool) -> None:
+        if not before or after is None:
+            return
+        change = (after - before) / before
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append({'metric': metric, 'baseline': before, 'current': after, 'change': round(change, 4)})
+
+    for mode, result in current.get('results', {}).items():
+        base = baseline.get('results', {}).get(mode)
+        if not base:
+            continue
+        for metric, higher_is_better in THROUGHPUT_METRICS.items():
+            check(f"{mode}.{metric}", base.get(metric), result.get(metric), higher_is_better)
+        for name in LATENCY_METRICS:
+            check(f"{mode}.documentLatencyMs.{name}", base.get('documentLatencyMs', {}).get(name),
+                  result.get('documentLatencyMs', {}).get(name), False)
+        for stage, values in result.get('stages', {}).items():
+            for name in LATENCY_METRICS:
+                check(f"{mode}.stages.{stage}.{name}", base.get('stages', {}).get(stage, {}).get(name),
+                      values.get(name), False)
+    check('peakRssMb', baseline.get('peakRssMb'), current.get('peakRssMb'), False)
+    return regressions
+
+
+def parse_profiles(args: argparse.Namespace) -> Dict[str, ServiceProfile]:
+    """コマンドライン引数からサービスの応答特性を作成"""
+    profiles = {}
+    for service, latency_ms in DEFAULT_LATENCY_MS.items():
+        option = service.replace('-runtime', '').replace('-', '_')
+        profiles[service] = ServiceProfile(
+            latency_ms=getattr(args, f"{option}_latency_ms") if getattr(args, f"{option}_latency_ms") is not None
+            else latency_ms * args.latency_scale,
+            sigma=args.latency_sigma,
+            throttle_rate=getattr(args, f"{option}_throttle_rate")
+        )
+    return profiles
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description='取り込みパイプラインのベンチマーク（ローカルAWS代替）')
+    parser.add_argument('--mode', choices=BENCHMARK_MODES + ('both',), default='both', help='実行方法')
+    parser.add_argument('--iterations', type=int, default=3, help='計測する反復回数')
+    parser.add_argument('--warmup', type=int, default=1, help='計測前の反復回数')
+    parser.add_argument('--large-mb', type=float, nargs='*', default=[1.0],
+                        help='生成する大容量ドキュメントのサイズ（MB）')
+    parser.add_argument('--no-samples', action='store_true', help='サンプルドキュメントを含めない')
+    parser.add_argument('--reuse-content', action='store_true', help='反復間で同じ内容を使用（キャッシュを含めて計測）')
+    parser.add_argument('--seed', type=int, default=0, help='ドキュメント生成・遅延・スロットリングのシード')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='既定の遅延の倍率（0で遅延なし）')
+    parser.add_argument('--bedrock-rps', type=float, default=200.0,
+                        help='Bedrockのレート制限（BEDROCK_REQUESTS_PER_SECOND、本番の既定値は10）')
+    parser.add_argument('--latency-sigma', type=float, default=0.25, help='遅延の対数正規分布の広がり')
+    for service in DEFAULT_LATENCY_MS:
+        option = service.replace('-runtime', '')
+        parser.add_argument(f"--{option}-latency-ms", type=float, help=f"{service} の遅延の中央値（ミリ秒）")
+        parser.add_argument(f"--{option}-throttle-rate", type=float, default=0.0,
+                            help=f"{service} のスロットリング発生率（0〜1）")
+    parser.add_argument('--output', default='ingestion_benchmark.json', help='結果の出力ファイル')
+    parser.add_argument('--baseline', help='比較するベースラインの結果ファイル')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='許容する悪化率')
+    parser.add_argument('--verbose', '-v', action='store_true', help='処理ログを出力')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # 処理ログとEMF出力はベンチマークの計測対象外
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+    os.environ.setdefault('MARKITDOWN_TRACING_EMF', 'false')
+    os.environ['BEDROCK_REQUESTS_PER_SECOND'] = str(args.bedrock_rps)
+
+    documents, skipped = split_supported(build_workload(args.large_mb, args.seed, include_samples=not args.no_samples))
+    modes = list(BENCHMARK_MODES) if args.mode == 'both' else [args.mode]
+    with LocalServices(parse_profiles(args), seed=args.seed) as services:
+        results = run_benchmark(documents, services, modes, iterations=args.iterations, warmup=args.warmup,
+                                reuse_content=args.reuse_content)
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'environment': {
+                'python_version': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count()
+            },
+            'config': {
+                'iterations': args.iterations,
+                'warmup': args.warmup,
+                'reuseContent': args.reuse_content,
+                'bedrockRequestsPerSecond': args.bedrock_rps,
+                'services': services.describe()
+            },
+            'workload': [
+                {'fileName': document.file_name, 'bytes': len(document.content), 'source': document.source}
+                for document in documents
+            ],
+            'skipped': skipped,
+            'results': results,
+            'peakRssMb': peak_rss_mb()
+        }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['regressions'] = compare_with_baseline(report, json.load(f), args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+
+    for mode, result in results.items():
+        print(f"{mode}: {result['docsPerSecond']} docs/s, {result['chunksPerSecond']} chunks/s, "
+              f"p50 {result['documentLatencyMs']['p50']}ms, p99 {result['documentLatencyMs']['p99']}ms, "
+              f"失敗 {result['failures']}件")
+    print(f"ピークRSS: {report['peakRssMb']}MB / 結果: {args.output}")
+    for regression in report.get('regressions', []):
+        print(f"❌ 回帰: {regression['metric']} {regression['baseline']} -> {regression['current']} "
+              f"({regression['change']:+.1%})")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+検索・RAGハンドラーのクエリ負荷ベンチマーク
+vector-search（kNN / モック）・bedrock-handler（生成）・rag-handler（検索＋生成）に、クエリセットを
+同時実行数（クローズドループ）と到着率（ポアソン到着のオープンループ）を変えて投入し、
+レイテンシとスループットの曲線、コールドスタートとウォーム時の内訳、キャッシュヒット率をJSONで出力する。
+OpenSearchとBedrockは local_services のローカル代替（遅延・スロットリングを設定可能）を使用する。
+検索バックエンドとキャッシュ設定の組み合わせごとにシナリオとして計測し、同じレポート内で比較できる。
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+# テスト対象モジュールのインポート
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_services import LocalServices, ServiceProfile, deterministic_embedding
+from fake_bedrock import DEFAULT_EMBEDDING_DIMENSION, EMBEDDING_DIMENSIONS
+from ingestion_benchmark import percentile, peak_rss_mb
+
+logger = logging.getLogger(__name__)
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_DATA_DIR = os.path.join(os.path.dirname(LAMBDA_DIR), 'templates', 'embedding-batch-workload-template', 'test-data')
+DEFAULT_QUERY_FILE = os.path.join(TEST_DATA_DIR, 'queries.json')
+DEFAULT_CORPUS_DIR = os.path.join(TEST_DATA_DIR, 'documents')
+
+# 既定の応答特性（遅延の中央値、ミリ秒）
+DEFAULT_LATENCY_MS = {
+    'bedrock-runtime': 40.0,
+    'bedrock-generation': 800.0,
+    'opensearch': 20.0,
+    'dynamodb': 5.0,
+    'cloudwatch': 10.0
+}
+TARGETS = ('search', 'generate', 'rag')
+SEARCH_BACKENDS = ('knn', 'mock')
+# キャッシュ設定（rag-handler の環境変数）
+CACHE_SETTINGS = {
+    'off': {'RAG_EMBEDDING_CACHE_ENABLED': 'false', 'RAG_SEARCH_CACHE_TTL_SECONDS': '0'},
+    'embedding': {'RAG_EMBEDDING_CACHE_ENABLED': 'true', 'RAG_SEARCH_CACHE_TTL_SECONDS': '0'},
+    'full': {'RAG_EMBEDDING_CACHE_ENABLED': 'true', 'RAG_SEARCH_CACHE_TTL_SECONDS': '60'}
+}
+INDEX_NAME = 'rag-documents'
+BENCHMARK_USER = 'benchmark-user'
+# コーパスのうち他ユーザー専用にする割合（権限フィルターの評価用）
+PRIVATE_PASSAGE_INTERVAL = 4
+LATENCY_PERCENTILES = (50, 95, 99)
+
+_module_counter = itertools.count()
+
+
+@dataclass
+class BenchmarkQuery:
+    """ベンチマークのクエリ"""
+    query_id: str
+    text: str
+    category: str = ''
+
+
+@dataclass
+class QueryTarget:
+    """計測対象のハンドラー"""
+    name: str
+    handler: Any
+    call: Callable[[BenchmarkQuery], Dict[str, Any]]
+    cache_stats: Optional[Callable[[], Dict[str, Any]]] = None
+
+
+def load_queries(path: str = DEFAULT_QUERY_FILE) -> List[BenchmarkQuery]:
+    """
+    クエリセットを読み込み
+
+    Args:
+        path: クエリファイル（{"queries": [{"id", "text", "category"}, ...]}）
+
+    Returns:
+        List[BenchmarkQuery]: クエリ
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    entries = data.get('queries', []) if isinstance(data, dict) else data
+    return [BenchmarkQuery(str(entry.get('id', i)), entry['text'], entry.get('category', ''))
+            for i, entry in enumerate(entries) if entry.get('text')]
+
+
+def load_corpus(directory: str = DEFAULT_CORPUS_DIR, chunk_chars: int = 500) -> List[Dict[str, Any]]:
+    """
+    検索対象のコーパスを作成（段落単位でチャンク化）
+
+    Args:
+        directory: ドキュメントのディレクトリ
+        chunk_chars: チャンクの最大文字数
+
+    Returns:
+        List[Dict]: vector-search のインデックス形式のパッセージ（content_vector を除く）
+    """
+    passages = []
+    for file_name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, file_name), encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        chunks, current = [], ''
+        for paragraph in (p.strip() for p in text.split('\n\n')):
+            if current and len(current) + len(paragraph) > chunk_chars:
+                chunks.append(current)
+                current = ''
+            current = f"{current}\n\n{paragraph}".strip() if paragraph else current
+        if current:
+            chunks.append(current)
+        for i, chunk in enumerate(chunks):
+            private = len(passages) % PRIVATE_PASSAGE_INTERVAL == PRIVATE_PASSAGE_INTERVAL - 1
+            passages.append({
+                'id': f"{file_name}#{i}",
+                'title': file_name,
+                'content': chunk[:chunk_chars * 2],
+                'source': file_name,
+                'metadata': {'category': os.path.splitext(file_name)[1].lstrip('.'), 'chunk_index': i},
+                'owner': 'other-user' if private else BENCHMARK_USER,
+                'permissions': {'public': not private, 'users': ['other-user'] if private else [BENCHMARK_USER]}
+            })
+    return passages
+
+
+def index_corpus(services: LocalServices, passages: List[Dict[str, Any]],
+                 embedding_model: str = 'amazon.titan-embed-text-v1', batch_size: int = 100) -> int:
+    """
+    コーパスをローカルOpenSearchに格納（埋め込みはローカルBedrockと同じベクトル）
+
+    Returns:
+        int: 格納したパッセージ数
+    """
+    dimension = EMBEDDING_DIMENSIONS.get(embedding_model, DEFAULT_EMBEDDING_DIMENSION)
+    for start in range(0, len(passages), batch_size):
+        body = []
+        for passage in passages[start:start + batch_size]:
+            body.append({'index': {'_index': INDEX_NAME, '_id': passage['id']}})
+            body.append(dict(passage, content_vector=deterministic_embedding(passage['content'], dimension,
+                                                                             services.seed)))
+        services.opensearch.bulk(body=body, index=INDEX_NAME)
+    return services.opensearch.count(INDEX_NAME)
+
+
+def query_stream(queries: List[BenchmarkQuery], count: int, zipf_s: float = 1.0, seed: int = 0) -> List[BenchmarkQuery]:
+    """
+    クエリの投入順序を作成（Zipf分布で人気クエリを偏らせる、0で一様）
+
+    Args:
+        queries: クエリセット
+        count: 投入数
+        zipf_s: Zipf分布の指数
+        seed: シード
+
+    Returns:
+        List[BenchmarkQuery]: 投入するクエリ
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / (rank ** zipf_s) for rank in range(1, len(queries) + 1)]
+    return rng.choices(queries, weights=weights, k=count)
+
+
+def arrival_offsets(rate: float, count: int, seed: int = 0) -> List[float]:
+    """
+    ポアソン到着の送信時刻（開始からの秒数）
+
+    Args:
+        rate: 到着率（リクエスト/秒）
+        count: リクエスト数
+        seed: シード
+
+    Returns:
+        List[float]: 送信時刻
+    """
+    rng = random.Random(seed)
+    offsets, elapsed = [], 0.0
+    for _ in range(count):
+        offsets.append(elapsed)
+        elapsed += rng.expovariate(rate)
+    return offsets
+
+
+def load_handler_module(directory: str, file_name: str):
+    """
+    ハンドラーモジュールを新しいモジュールとして読み込み（ハイフン付きファイル名に対応）
+
+    読み込みのたびに別名で実行するため、モジュールレベルの初期化もコールドスタートとして計測できる。
+    """
+    for path in (os.path.join(LAMBDA_DIR, 'bedrock'), os.path.join(LAMBDA_DIR, directory)):
+        if path not in sys.path:
+            sys.path.append(path)
+    module_name = f"query_benchmark_{os.path.splitext(file_name)[0].replace('-', '_')}_{next(_module_counter)}"
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(LAMBDA_DIR, directory, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_target(target: str, backend: str, services: LocalServices, context: List[Dict[str, Any]],
+                 top_k: int = 5, min_score: float = 0.0) -> QueryTarget:
+    """
+    計測対象のハンドラーを作成（モジュールの読み込みとハンドラーの初期化）
+
+    Args:
+        target: search / generate / rag
+        backend: 検索バックエンド（knn: vector-search-handler.py、mock: vector_search_handler.py）
+        services: 開始済みのローカルサービス
+        context: generate で使用する固定のコンテキスト文書
+        top_k: 取得する文書数
+        min_score: 最小関連度スコア
+
+    Returns:
+        QueryTarget: 計測対象
+    """
+    if target == 'search':
+        if backend == 'mock':
+            handler = load_handler_module('vector-search', 'vector_search_handler.py').VectorSearchHandler()
+            return QueryTarget(target, handler, lambda q: handler.search_documents(q.text, BENCHMARK_USER, top_k))
+        handler = load_handler_module('vector-search', 'vector-search-handler.py').VectorSearchHandler()
+        handler.client = services.opensearch
+        return QueryTarget(target, handler,
+                           lambda q: handler.search_documents(q.text, BENCHMARK_USER, top_k, min_score))
+
+    if target == 'generate':
+        handler = load_handler_module('bedrock', 'bedrock-handler.py').BedrockLLMHandler()
+        return QueryTarget(target, handler, lambda q: handler.generate_response(q.text, context, BENCHMARK_USER))
+
+    if target == 'rag':
+        if backend != 'knn':
+            raise ValueError(f"rag は検索バックエンド knn のみ対応しています: {backend}")
+        handler = load_handler_module('bedrock', 'rag-handler.py').RAGHandler()
+        handler.search_handler.client = services.opensearch
+        return QueryTarget(target, handler,
+                           lambda q: handler.retrieve_and_generate(q.text, BENCHMARK_USER, top_k, min_score),
+                           cache_stats=handler.get_cache_stats)
+
+    raise ValueError(f"未対応の計測対象です: {target}")
+
+
+def latency_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    """レイテンシの分位点と平均（ミリ秒）"""
+    summary = {f"p{pct}": percentile(values, pct) for pct in LATENCY_PERCENTILES}
+    summary['mean'] = round(sum(values) / len(values), 3) if values else None
+    return summary
+
+
+def cache_delta(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """計測区間のキャッシュヒット数・ヒット率"""
+    if before is None or after is None:
+        return None
+    delta = {}
+    for name in ('embedding', 'search'):
+        hits = after[f'{name}_hits'] - before[f'{name}_hits']
+        misses = after[f'{name}_misses'] - before[f'{name}_misses']
+        delta[name] = {'hits': hits, 'misses': misses,
+                       'hitRate': round(hits / (hits + misses), 4) if hits + misses else None}
+    return delta
+
+
+def _execute(target: QueryTarget, query: BenchmarkQuery) -> Dict[str, Any]:
+    """1リクエストを実行（例外は失敗として扱う）"""
+    try:
+        return target.call(query)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+def _summarize(latencies: List[float], results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """計測点の集計"""
+    stages: Dict[str, List[float]] = {}
+    for result in results:
+        for stage, value in (result.get('timings') or {}).items():
+            stages.setdefault(stage, []).append(value)
+    errors = [result for result in results if not result.get('success')]
+    return {
+        'requests': len(results),
+        'errors': len(errors),
+        'sampleErrors': [str(result.get('error'))[:200] for result in errors[:3]],
+        'degraded': sum(1 for result in results if result.get('degraded')),
+        'wallSeconds': round(wall_seconds, 3),
+        'throughputRps': round(len(results) / wall_seconds, 3) if wall_seconds else 0,
+        'latencyMs': latency_summary(latencies),
+        'stagesMs': {stage: latency_summary(values) for stage, values in sorted(stages.items())}
+    }
+
+
+def run_closed_loop(target: QueryTarget, stream: List[BenchmarkQuery], concurrency: int) -> Dict[str, Any]:
+    """
+    同時実行数を固定して投入（各ワーカーは応答後に次のリクエストを送信）
+
+    Args:
+        target: 計測対象
+        stream: 投入するクエリ
+        concurrency: 同時実行数
+
+    Returns:
+        Dict: スループット・レイテンシ・キャッシュヒット率
+    """
+    pending = iter(stream)
+    lock = threading.Lock()
+    latencies: List[float] = []
+    results: List[Dict[str, Any]] = []
+    cache_before = target.cache_stats() if target.cache_stats else None
+
+    def worker() -> None:
+        while True:
+            with lock:
+                query = next(pending, None)
+            if query is None:
+                return
+            start = time.perf_counter()
+            result = _execute(target, query)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed_ms)
+                results.append(result)
+
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    point = _summarize(latencies, results, time.perf_counter() - wall_start)
+    point['concurrency'] = concurrency
+    point['cache'] = cache_delta(cache_before, target.cache_stats() if target.cache_stats else None)
+    return point
+
+
+def run_open_loop(target: QueryTarget, stream: List[BenchmarkQuery], rate: float, seed: int = 0,
+                  max_workers: int = 64) -> Dict[str, Any]:
+    """
+    ポアソン到着で投入（応答を待たずに送信するため、待ち行列の遅延を含めて計測）
+
+    Args:
+        target: 計測対象
+        stream: 投入するクエリ
+        rate: 到着率（リクエスト/秒）
+        seed: 到着時刻のシード
+        max_workers: 同時に処理するリクエストの上限
+
+    Returns:
+        Dict: 到着率に対するスループット・レイテンシ（送信予定時刻から応答まで）・キャッシュヒット率
+    """
+    lock = threading.Lock()
+    latencies: List[float] = []
+    service_ms: List[float] = []
+    results: List[Dict[str, Any]] = []
+    cache_before = target.cache_stats() if target.cache_stats else None
+
+    def task(query: BenchmarkQuery, scheduled: float) -> None:
+        start = time.perf_counter()
+        result = _execute(target, query)
+        end = time.perf_counter()
+        with lock:
+            # 送信予定時刻から計測（スループット不足時の待ちを除外しない）
+            latencies.append((end - scheduled) * 1000)
+            service_ms.append((end - start) * 1000)
+            results.append(result)
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for query, offset in zip(stream, arrival_offsets(rate, len(stream), seed)):
+            scheduled = wall_start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(task, query, scheduled)
+    point = _summarize(latencies, results, time.perf_counter() - wall_start)
+    point['offeredRps'] = rate
+    point['serviceLatencyMs'] = latency_summary(service_ms)
+    point['cache'] = cache_delta(cache_before, target.cache_stats() if target.cache_stats else None)
+    return point
+
+
+def measure_cold_start(target: str, backend: str, services: LocalServices, context: List[Dict[str, Any]],
+                       query: BenchmarkQuery, repeats: int, top_k: int, min_score: float) -> Dict[str, Any]:
+    """
+    コールドスタート（モジュール読み込み・ハンドラー初期化・初回リクエスト）を計測
+
+    プロセス内での再読み込みのため、ランタイムの起動とboto3等の共有モジュールのインポートは含まない。
+    """
+    init_ms, first_ms = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        instance = build_target(target, backend, services, context, top_k, min_score)
+        init_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        _execute(instance, query)
+        first_ms.append((time.perf_counter() - start) * 1000)
+    return {
+        'samples': repeats,
+        'initMs': latency_summary(init_ms),
+        'firstRequestMs': latency_summary(first_ms),
+        'totalMs': latency_summary([a + b for a, b in zip(init_ms, first_ms)])
+    }
+
+
+def scenarios_for(targets: List[str], backends: List[str], cache_settings: List[str]) -> List[Dict[str, str]]:
+    """計測対象ごとに意味のある検索バックエンド・キャッシュ設定の組み合わせ"""
+    scenarios = []
+    for target in targets:
+        target_backends = [b for b in backends if b == 'knn'] if target == 'rag' else backends
+        for backend in (target_backends if target != 'generate' else ['none']):
+            for cache in (cache_settings if target == 'rag' else ['none']):
+                scenarios.append({'target': target, 'backend': backend, 'cache': cache})
+    return scenarios
+
+
+def run_scenario(scenario: Dict[str, str], services: LocalServices, queries: List[BenchmarkQuery],
+                 context: List[Dict[str, Any]], concurrency_levels: List[int], rates: List[float],
+                 requests: int = 60, warmup: int = 6, cold_starts: int = 3, top_k: int = 5,
+                 min_score: float = 0.0, zipf_s: float = 1.0, seed: int = 0, max_workers: int = 64) -> Dict[str, Any]:
+    """
+    1シナリオ（計測対象・検索バックエンド・キャッシュ設定）を計測
+
+    Returns:
+        Dict: コールドスタート、ウォーム時、同時実行数・到着率ごとの曲線、サービス呼び出し統計
+    """
+    target, backend, cache = scenario['target'], scenario['backend'], scenario['cache']
+    os.environ.update(CACHE_SETTINGS.get(cache, {}))
+    name = f"{target}/{backend}/{cache}"
+    try:
+        services.reset_stats()
+        cold = measure_cold_start(target, backend, services, context, queries[0], cold_starts, top_k, min_score)
+        instance = build_target(target, backend, services, context, top_k, min_score)
+    except (ImportError, ValueError) as e:
+        # 依存パッケージ（opensearch-py等）がない環境では計測対象外として記録
+        logger.warning(f"{name}: 計測できません: {e}")
+        return {**scenario, 'name': name, 'skipped': str(e)}
+
+    for query in query_stream(queries, warmup, zipf_s, seed):
+        _execute(instance, query)
+    services.reset_stats()
+
+    warm = run_closed_loop(instance, query_stream(queries, requests, zipf_s, seed + 1), 1)
+    concurrency_curve = [
+        run_closed_loop(instance, query_stream(queries, requests, zipf_s, seed + 2 + i), level)
+        for i, level in enumerate(concurrency_levels)
+    ]
+    arrival_curve = [
+        run_open_loop(instance, query_stream(queries, requests, zipf_s, seed + 100 + i), rate, seed + i, max_workers)
+        for i, rate in enumerate(rates)
+    ]
+    result = {
+        **scenario,
+        'name': name,
+        'coldStart': cold,
+        'warm': warm,
+        'concurrencyCurve': concurrency_curve,
+        'arrivalCurve': arrival_curve,
+        'cache': instance.cache_stats() if instance.cache_stats else None,
+        'services': services.get_stats()
+    }
+    logger.info(f"{name}: cold {cold['totalMs']['p50']}ms, warm p50 {warm['latencyMs']['p50']}ms")
+    return result
+
+
+def parse_profiles(args: argparse.Namespace) -> Dict[str, ServiceProfile]:
+    """コマンドライン引数からサービスの応答特性を作成"""
+    profiles = {}
+    for service, latency_ms in DEFAULT_LATENCY_MS.items():
+        option = service.replace('-runtime', '').replace('-', '_')
+        configured = getattr(args, f"{option}_latency_ms")
+        profiles[service] = ServiceProfile(
+            latency_ms=configured if configured is not None else latency_ms * args.latency_scale,
+            sigma=args.latency_sigma,
+            throttle_rate=getattr(args, f"{option}_throttle_rate")
+        )
+    return profiles
+
+
+def print_summary(results: List[Dict[str, Any]]) -> None:
+    """シナリオごとの要約を表示"""
+    for result in results:
+        if result.get('skipped'):
+            print(f"⏭️  {result['name']}: {result['skipped']}")
+            continue
+        cold, warm = result['coldStart'], result['warm']
+        print(f"\n{result['name']}: コールド {cold['totalMs']['p50']}ms（初期化 {cold['initMs']['p50']}ms）, "
+              f"ウォーム p50 {warm['latencyMs']['p50']}ms / p99 {warm['latencyMs']['p99']}ms")
+        for point in result['concurrencyCurve']:
+            print(f"  同時実行 {point['concurrency']:>3}: {point['throughputRps']:>8} rps, "
+                  f"p50 {point['latencyMs']['p50']}ms, p99 {point['latencyMs']['p99']}ms, 失敗 {point['errors']}件")
+        for point in result['arrivalCurve']:
+            print(f"  到着率 {point['offeredRps']:>6} rps: {point['throughputRps']:>8} rps, "
+                  f"p50 {point['latencyMs']['p50']}ms, p99 {point['latencyMs']['p99']}ms, 失敗 {point['errors']}件")
+        if result.get('cache'):
+            cache = result['cache']
+            print(f"  キャッシュヒット率: 埋め込み {cache['embedding_hit_rate']}, 検索 {cache['search_hit_rate']}")
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description='検索・RAGハンドラーのクエリ負荷ベンチマーク（ローカルAWS代替）')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS), help='計測対象')
+    parser.add_argument('--backends', nargs='+', choices=SEARCH_BACKENDS, default=list(SEARCH_BACKENDS),
+                        help='検索バックエンド')
+    parser.add_argument('--cache-settings', nargs='+', choices=sorted(CACHE_SETTINGS), default=sorted(CACHE_SETTINGS),
+                        help='rag のキャッシュ設定')
+    parser.add_argument('--queries', default=DEFAULT_QUERY_FILE, help='クエリセットのファイル')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR, help='検索対象ドキュメントのディレクトリ')
+    parser.add_argument('--requests', type=int, default=60, help='計測点ごとのリクエスト数')
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[1, 2, 4, 8], help='同時実行数')
+    parser.add_argument('--rates', type=float, nargs='*', default=[2.0, 5.0, 10.0, 20.0], help='到着率（リクエスト/秒）')
+    parser.add_argument('--warmup', type=int, default=6, help='計測前のリクエスト数')
+    parser.add_argument('--cold-starts', type=int, default=3, help='コールドスタートの計測回数')
+    parser.add_argument('--top-k', type=int, default=5, help='取得する文書数')
+    parser.add_argument('--min-score', type=float, default=0.0,
+                        help='最小関連度スコア（ローカルの埋め込みは語彙の一致による類似度のため既定は0）')
+    parser.add_argument('--zipf', type=float, default=1.0, help='クエリの人気の偏り（Zipf指数、0で一様）')
+    parser.add_argument('--max-workers', type=int, default=64, help='到着率の計測で同時に処理する上限')
+    parser.add_argument('--seed', type=int, default=0, help='クエリ順序・到着時刻・遅延・スロットリングのシード')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='既定の遅延の倍率（0で遅延なし）')
+    parser.add_argument('--latency-sigma', type=float, default=0.25, help='遅延の対数正規分布の広がり')
+    parser.add_argument('--bedrock-rps', type=float, default=200.0,
+                        help='Bedrockのレート制限（BEDROCK_REQUESTS_PER_SECOND、本番の既定値は10）')
+    for service in DEFAULT_LATENCY_MS:
+        option = service.replace('-runtime', '')
+        parser.add_argument(f"--{option}-latency-ms", type=float, help=f"{service} の遅延の中央値（ミリ秒）")
+        parser.add_argument(f"--{option}-throttle-rate", type=float, default=0.0,
+                            help=f"{service} のスロットリング発生率（0〜1）")
+    parser.add_argument('--output', default='query_benchmark.json', help='結果の出力ファイル')
+    parser.add_argument('--verbose', '-v', action='store_true', help='処理ログを出力')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+    os.environ['BEDROCK_REQUESTS_PER_SECOND'] = str(args.bedrock_rps)
+
+    queries = load_queries(args.queries)
+    passages = load_corpus(args.corpus)
+    context = [dict(passage, score=1.0) for passage in passages[:args.top_k]]
+    scenarios = scenarios_for(args.targets, args.backends, args.cache_settings)
+    with LocalServices(parse_profiles(args), seed=args.seed) as services:
+        indexed = index_corpus(services, passages, os.environ.get('EMBEDDING_MODEL', 'amazon.titan-embed-text-v1'))
+        # ルーティング判定のEMF出力は計測対象外
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            results = [
+                run_scenario(scenario, services, queries, context, args.concurrency, args.rates,
+                             requests=args.requests, warmup=args.warmup, cold_starts=args.cold_starts,
+                             top_k=args.top_k, min_score=args.min_score, zipf_s=args.zipf, seed=args.seed,
+                             max_workers=args.max_workers)
+                for scenario in scenarios
+            ]
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'environment': {
+                'python_version': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count()
+            },
+            'config': {
+                'queries': [query.query_id for query in queries],
+                'indexedPassages': indexed,
+                'requests': args.requests,
+                'warmup': args.warmup,
+                'coldStarts': args.cold_starts,
+                'topK': args.top_k,
+                'minScore': args.min_score,
+                'zipf': args.zipf,
+                'bedrockRequestsPerSecond': args.bedrock_rps,
+                'cacheSettings': {name: CACHE_SETTINGS[name] for name in args.cache_settings},
+                'services': services.describe()
+            },
+            'results': results,
+            'peakRssMb': peak_rss_mb()
+        }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+
+    print_summary(results)
+    print(f"\nピークRSS: {report['peakRssMb']}MB / 結果: {args.output}")
+    measured = [result for result in results if not result.get('skipped')]
+    sys.exit(0 if measured else 1)
+
+
+if __name__ == '__main__':
+    main()
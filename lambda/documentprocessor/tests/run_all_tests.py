@@ -45,7 +45,8 @@ def run_command(command, description, timeout=300):
         if result.returncode == 0:
             print(f"✅ {description} 成功 ({execution_time:.2f}秒)")
             if result.stdout:
-                print("出力:")\n                print(result.stdout)
+                print("出力:")
+                print(result.stdout)
         else:
             print(f"❌ {description} 失敗 ({execution_time:.2f}秒)")
             if result.stderr:
@@ -121,6 +122,17 @@ def run_aws_integration_tests(region='us-east-1', environment='test'):
         timeout=1800
     )
 
+def run_ingestion_benchmark(baseline=None, output='ingestion_benchmark.json'):
+    """取り込みベンチマーク実行（ローカルAWS代替、ベースライン指定時は回帰で失敗）"""
+    command = ['python3', 'ingestion_benchmark.py', '--output', output]
+    if baseline:
+        command.extend(['--baseline', baseline])
+    return run_command(
+        command,
+        "取り込みベンチマーク実行",
+        timeout=1800
+    )
+
 def generate_test_data():
     """テストデータ生成"""
     return run_command(
@@ -210,6 +222,8 @@ def main():
     parser.add_argument('--skip-unit', action='store_true', help='単体テストをスキップ')
     parser.add_argument('--skip-integration', action='store_true', help='統合テストをスキップ')
     parser.add_argument('--skip-aws', action='store_true', help='AWS統合テストをスキップ')
+    parser.add_argument('--benchmark', action='store_true', help='取り込みベンチマークを実行')
+    parser.add_argument('--benchmark-baseline', help='ベンチマークの比較対象（ベースラインの結果ファイル）')
     parser.add_argument('--region', default='us-east-1', help='AWSリージョン')
     parser.add_argument('--environment', default='test', help='環境名')
     parser.add_argument('--output', default='comprehensive_test_report.json', help='レポート出力ファイル')
@@ -300,14 +314,31 @@ def main():
     else:
         print("⏭️  AWS統合テストをスキップしました")
     
-    # 5. レポート生成
+    # 5. 取り込みベンチマーク
+    if args.benchmark:
+        print(f"\n{'='*60}")
+        print("5. 取り込みベンチマーク実行")
+        print(f"{'='*60}")
+        
+        success, exec_time, output = run_ingestion_benchmark(args.benchmark_baseline)
+        test_results.append({
+            'name': '取り込みベンチマーク',
+            'success': success,
+            'execution_time': exec_time,
+            'output': output
+        })
+        
+        if not success:
+            print("⚠️  取り込みベンチマークで回帰を検出しました")
+    
+    # 6. レポート生成
     print(f"\n{'='*60}")
-    print("5. レポート生成")
+    print("6. レポート生成")
     print(f"{'='*60}")
     
     generate_comprehensive_report(test_results, args.output)
     
-    # 6. サマリー出力
+    # 7. サマリー出力
     overall_success = print_summary(test_results)
     
     # 終了コード設定
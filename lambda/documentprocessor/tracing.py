@@ -0,0 +1,470 @@
+"""
+取り込みパイプラインの段階別トレーシング
+内容判定・変換・チャンキング・埋め込みバッチ・インデックス格納・メタデータ書き込みの各段階を
+コンテキストマネージャーのスパン（属性付き）で計測し、段階ごとの処理時間を
+マージ可能なヒストグラム（LatencySketch）に集計してp50/p95/p99を求める。
+トレースは構造化ログ・CloudWatch Embedded Metric Format、任意でX-Rayのセグメントとして出力する。
+"""
+
+import json
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+from metadata_rollup import LatencySketch
+from structured_logging import LazyJson
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.environ.get('MARKITDOWN_TRACING_ENABLED', 'true').lower() == 'true'
+# トレース終了時に段階ごとの処理時間をEMFで出力
+TRACING_EMF_ENABLED = os.environ.get('MARKITDOWN_TRACING_EMF', 'true').lower() == 'true'
+# トレースをX-Rayのサブセグメントとしてデーモン（AWS_XRAY_DAEMON_ADDRESS）に送信
+XRAY_SEGMENTS_ENABLED = os.environ.get('MARKITDOWN_XRAY_SEGMENTS', 'false').lower() == 'true'
+TRACING_METRICS_NAMESPACE = os.environ.get('TRACING_METRICS_NAMESPACE', 'RAG/DocumentProcessor')
+
+# 段階ごとのヒストグラムから求める分位点
+STAGE_PERCENTILES = (50, 95, 99)
+# EMFの1メトリクスあたりの上限値数
+EMF_MAX_VALUES = 100
+# 1トレースあたりのスパン数の上限（超過分は木に追加せずヒストグラムのみに記録）
+MAX_SPANS_PER_TRACE = 2000
+# X-RayデーモンへのUDP送信の上限サイズ
+XRAY_MAX_DOCUMENT_BYTES = 64 * 1024
+
+
+class Span:
+    """計測区間（属性と子スパンを持つ）"""
+
+    __slots__ = ('name', 'attributes', 'start', 'end', 'children', 'span_id', 'error')
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None, start: Optional[float] = None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start = start if start is not None else time.time()
+        self.end: Optional[float] = None
+        self.children: List['Span'] = []
+        self.span_id = secrets.token_hex(8)
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end if self.end is not None else time.time()) - self.start) * 1000
+
+    def set_attributes(self, **attributes: Any) -> None:
+        """属性を追加"""
+        self.attributes.update(attributes)
+
+    def walk(self) -> Iterator['Span']:
+        """自身と子孫のスパン"""
+        yield self
+        for child in list(self.children):
+            yield from child.walk()
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict[str, Any]:
+        """
+        スパンの木を辞書形式に変換
+
+        Args:
+            origin: 開始時刻の基準（省略時は自身の開始時刻）
+
+        Returns:
+            Dict: name, startMs（基準からの経過）, durationMs, attributes, error, children
+        """
+        origin = self.start if origin is None else origin
+        data = {
+            'name': self.name,
+            'startMs': round((self.start - origin) * 1000, 3),
+            'durationMs': round(self.duration_ms, 3),
+            'attributes': self.attributes
+        }
+        if self.error:
+            data['error'] = self.error
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in sorted(self.children, key=lambda s: s.start)]
+        return data
+
+
+class StageHistograms:
+    """段階ごとの処理時間ヒストグラム（スレッドセーフ、マージ可能、1ms未満は1msとして集計）"""
+
+    def __init__(self):
+        self._sketches: Dict[str, LatencySketch] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration_ms: float) -> None:
+        with self._lock:
+            sketch = self._sketches.get(name)
+            if sketch is None:
+                sketch = self._sketches[name] = LatencySketch()
+            sketch.add(duration_ms)
+
+    def merge(self, other: 'StageHistograms') -> None:
+        """他のヒストグラムを加算"""
+        with other._lock:
+            sketches = {name: LatencySketch(buckets=sketch.buckets) for name, sketch in other._sketches.items()}
+        with self._lock:
+            for name, sketch in sketches.items():
+                self._sketches.setdefault(name, LatencySketch()).merge(sketch)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        段階ごとの件数と分位点
+
+        Returns:
+            Dict: 段階名 → {count, p50, p95, p99}（ミリ秒、相対誤差はLatencySketchの精度）
+        """
+        with self._lock:
+            sketches = {name: LatencySketch(buckets=sketch.buckets) for name, sketch in self._sketches.items()}
+        stages = {}
+        for name, sketch in sorted(sketches.items()):
+            stage = {'count': sketch.count}
+            for percentile in STAGE_PERCENTILES:
+                value = sketch.quantile(percentile / 100)
+                stage[f"p{percentile}"] = round(value, 3) if value is not None else None
+            stages[name] = stage
+        return stages
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sketches = {}
+
+
+class Tracer:
+    """スパンの作成とトレース（スパンの木）の管理"""
+
+    def __init__(self, histograms: Optional[StageHistograms] = None):
+        """
+        初期化
+
+        Args:
+            histograms: 段階ごとのヒストグラム（ウォーム起動間で累積）
+        """
+        self.histograms = histograms or StageHistograms()
+        self._current: ContextVar[Optional[Span]] = ContextVar('markitdown_span', default=None)
+        # ワーカースレッドのスパン（コンテキストを引き継がない）は実行中のトレースのルートに追加
+        self._root: Optional[Span] = None
+        self._span_count = 0
+        self._lock = threading.Lock()
+        # スパンの開始・終了の通知先（段階ごとのメモリ計測等）
+        self._listeners: List[Callable[[str, Span], None]] = []
+
+    def start_trace(self, name: str, **attributes: Any) -> Span:
+        """
+        トレースを開始（呼び出し1回分、以降のスパンはこのルートの子孫になる）
+
+        Args:
+            name: ルートスパン名
+            attributes: 属性
+
+        Returns:
+            Span: ルートスパン
+        """
+        root = Span(name, attributes)
+        with self._lock:
+            self._root = root
+            self._span_count = 1
+        self._current.set(root)
+        return root
+
+    def end_trace(self, root: Span) -> Span:
+        """トレースを終了"""
+        if root.end is None:
+            root.end = time.time()
+        with self._lock:
+            if self._root is root:
+                self._root = None
+        self._current.set(None)
+        return root
+
+    def add_listener(self, listener: Callable[[str, Span], None]) -> None:
+        """スパンの開始（'start'）・終了（'end'）の通知先を追加"""
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener: Callable[[str, Span], None]) -> None:
+        """通知先を削除"""
+        with self._lock:
+            self._listeners = [item for item in self._listeners if item != listener]
+
+    def _notify(self, event: str, span: Span) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event, span)
+            except Exception as e:
+                logger.debug(f"スパンの通知に失敗: {e}")
+
+    def _attach(self, span: Span, parent: Optional[Span]) -> None:
+        parent = parent or self._root
+        if parent is None:
+            return
+        with self._lock:
+            if self._span_count >= MAX_SPANS_PER_TRACE:
+                return
+            self._span_count += 1
+            parent.children.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        スパンで処理を計測
+
+        Args:
+            name: スパン名（段階名、ヒストグラムの集計単位）
+            attributes: 属性
+
+        Yields:
+            Span: スパン（処理中に set_attributes で属性を追加できる）
+        """
+        span = Span(name, attributes)
+        if not TRACING_ENABLED:
+            yield span
+            return
+        parent = self._current.get()
+        self._attach(span, parent)
+        token = self._current.set(span)
+        self._notify('start', span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end = time.time()
+            self._current.reset(token)
+            self.histograms.record(name, span.duration_ms)
+            self._notify('end', span)
+
+    def record_span(self, name: str, duration_ms: float, **attributes: Any) -> Span:
+        """
+        計測済みの区間をスパンとして記録（ループ内のバッチ等）
+
+        Args:
+            name: スパン名
+            duration_ms: 処理時間（ミリ秒、現在時刻を終了とする）
+            attributes: 属性
+
+        Returns:
+            Span: 記録したスパン
+        """
+        end = time.time()
+        span = Span(name, attributes, start=end - duration_ms / 1000)
+        span.end = end
+        if TRACING_ENABLED:
+            self._attach(span, self._current.get())
+            self.histograms.record(name, duration_ms)
+        return span
+
+    def traced(self, name: str) -> Callable:
+        """関数全体をスパンで計測するデコレーター"""
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+# 共有トレーサー（ヒストグラムはウォーム起動間で累積）
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """共有トレーサーを取得"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def span(name: str, **attributes: Any):
+    """共有トレーサーのスパン（get_tracer().span の省略形）"""
+    return get_tracer().span(name, **attributes)
+
+
+def traced(name: str) -> Callable:
+    """共有トレーサーで関数全体を計測するデコレーター"""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_histograms(root: Span) -> StageHistograms:
+    """トレース内のスパンから段階ごとのヒストグラムを作成（ルートを除く）"""
+    histograms = StageHistograms()
+    for item in root.walk():
+        if item is not root and item.end is not None:
+            histograms.record(item.name, item.duration_ms)
+    return histograms
+
+
+def emf_records(root: Span, namespace: str = TRACING_METRICS_NAMESPACE) -> List[Dict[str, Any]]:
+    """
+    トレースの段階ごとの処理時間をEMFレコードに変換（段階ごとに1レコード、値は最大EMF_MAX_VALUES件）
+
+    Args:
+        root: ルートスパン
+        namespace: メトリクス名前空間
+
+    Returns:
+        List[Dict]: EMFレコード
+    """
+    durations: Dict[str, List[float]] = {}
+    for item in root.walk():
+        if item.end is not None:
+            durations.setdefault(item.name, []).append(round(item.duration_ms, 3))
+    timestamp = int(time.time() * 1000)
+    return [
+        {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [['Stage']],
+                    'Metrics': [{'Name': 'StageLatency', 'Unit': 'Milliseconds'}]
+                }]
+            },
+            'Stage': name,
+            'StageLatency': values[:EMF_MAX_VALUES],
+            'traceSpanId': root.span_id
+        }
+        for name, values in durations.items()
+    ]
+
+
+def _xray_trace_header() -> Dict[str, str]:
+    """Lambdaのトレースヘッダー（_X_AMZN_TRACE_ID）を解析"""
+    header = os.environ.get('_X_AMZN_TRACE_ID', '')
+    return dict(part.split('=', 1) for part in header.split(';') if '=' in part)
+
+
+def xray_segments(root: Span) -> List[Dict[str, Any]]:
+    """
+    トレースをX-Rayのサブセグメント文書に変換（Lambdaの関数セグメントの子として送信）
+
+    Args:
+        root: ルートスパン
+
+    Returns:
+        List[Dict]: サブセグメント文書（トレースヘッダーがない場合は独立したセグメント）
+    """
+    header = _xray_trace_header()
+    trace_id = header.get('Root') or f"1-{int(root.start):08x}-{secrets.token_hex(12)}"
+
+    def convert(item: Span) -> Dict[str, Any]:
+        document = {
+            'name': item.name,
+            'id': item.span_id,
+            'start_time': item.start,
+            'end_time': item.end if item.end is not None else time.time(),
+            'metadata': {'markitdown': item.attributes}
+        }
+        if item.error:
+            document['fault'] = True
+            document['cause'] = {'exceptions': [{'message': item.error}]}
+        if item.children:
+            document['subsegments'] = [convert(child) for child in item.children]
+        return document
+
+    document = convert(root)
+    document['trace_id'] = trace_id
+    if header.get('Parent'):
+        document['type'] = 'subsegment'
+        document['parent_id'] = header['Parent']
+    return [document]
+
+
+def send_xray_segments(documents: List[Dict[str, Any]]) -> int:
+    """
+    X-RayデーモンにUDPで送信
+
+    Args:
+        documents: セグメント文書
+
+    Returns:
+        int: 送信した文書数
+    """
+    address = os.environ.get('AWS_XRAY_DAEMON_ADDRESS')
+    if not address:
+        return 0
+    host, _, port = address.rpartition(':')
+    sent = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for document in documents:
+            payload = ('{"format": "json", "version": 1}\n' + json.dumps(document, default=str)).encode('utf-8')
+            if len(payload) > XRAY_MAX_DOCUMENT_BYTES:
+                logger.warning(f"X-Rayセグメントが上限を超えるため送信しません: {len(payload)}バイト")
+                continue
+            sock.sendto(payload, (host, int(port)))
+            sent += 1
+    return sent
+
+
+def export_trace(root: Span, tracer: Optional[Tracer] = None) -> Dict[str, Any]:
+    """
+    トレースを出力（構造化ログ・EMF・任意でX-Ray）
+
+    Args:
+        root: 終了したルートスパン
+        tracer: トレーサー（累積ヒストグラムの参照、省略時は共有トレーサー）
+
+    Returns:
+        Dict: 段階ごとの分位点（stages: このトレース, cumulative: ウォーム起動間の累積）
+    """
+    tracer = tracer or get_tracer()
+    summary = {'stages': trace_histograms(root).snapshot(), 'cumulative': tracer.histograms.snapshot()}
+    if not TRACING_ENABLED:
+        return summary
+    logger.info("📈 段階別処理時間 | %s", LazyJson(lambda: {
+        'event_type': 'trace_summary', 'trace': root.name, 'span_id': root.span_id,
+        'duration_ms': round(root.duration_ms, 3), **summary
+    }))
+    if TRACING_EMF_ENABLED:
+        # EMFはログ行全体がJSONである必要があるため、ロガーのフォーマットを経由しない
+        for record in emf_records(root):
+            print(json.dumps(record, ensure_ascii=False))
+    if XRAY_SEGMENTS_ENABLED:
+        try:
+            send_xray_segments(xray_segments(root))
+        except Exception as e:
+            logger.warning(f"X-Rayセグメントの送信に失敗: {e}")
+    return summary
+
+
+# テスト用のサンプル関数
+def test_tracing():
+    """
+    段階別トレーシングのテスト
+    """
+    tracer = get_tracer()
+    root = tracer.start_trace('document', fileName='sample.pdf')
+    with tracer.span('sniff'):
+        time.sleep(0.001)
+    with tracer.span('conversion', method='markitdown') as conversion:
+        time.sleep(0.005)
+        conversion.set_attributes(outputLength=1024)
+    for batch in range(3):
+        tracer.record_span('embedding.batch', 20.0 + batch, size=25)
+    tracer.end_trace(root)
+
+    print(json.dumps(root.to_dict(), ensure_ascii=False, indent=2))
+    print(f"段階別: {export_trace(root)['stages']}")
+
+
+if __name__ == "__main__":
+    test_tracing()
@@ -0,0 +1,28 @@
+#!/bin/bash
+# Bedrock Common Lambda Layer Build Script
+# 文書処理・埋め込み・RAGの各Lambdaで共有するモジュール（レート制限・サーキットブレーカー・ベクトル検索）を
+# 1つのレイヤーにまとめる（ソースは各Lambdaのディレクトリを正とし、ビルド時にコピーする）
+
+set -euo pipefail
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+LAMBDA_DIR="$(cd "${SCRIPT_DIR}/../.." && pwd)"
+
+echo "🔨 Building Bedrock Common Lambda Layer..."
+
+cd "${SCRIPT_DIR}"
+rm -rf python bedrock-common-layer.zip
+
+# Create layer directory structure (/opt/python はLambdaのsys.pathに含まれる)
+mkdir -p python
+
+# Shared modules
+cp "${LAMBDA_DIR}/documentprocessor/bedrock_rate_limiter.py" python/
+cp "${LAMBDA_DIR}/documentprocessor/resilience.py" python/
+cp "${LAMBDA_DIR}/vector-search/vector-search-handler.py" python/
+
+# Create zip file for deployment
+zip -r bedrock-common-layer.zip python/
+
+echo "✅ Bedrock Common Lambda Layer built successfully"
+echo "📦 Layer size: $(du -sh bedrock-common-layer.zip | cut -f1)"
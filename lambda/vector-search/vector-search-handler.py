@@ -1,380 +1,380 @@
-alse))re_ascii=F ensu=2,indent, (resultpsjson.dumprint(    None)
- t,st_eventehandler(= lambda_ result }
-    
-      
-     })0.7
-    re': in_sco  'm        ': 3,
-  op_k 't     
-      er','test-us': _id'user            TAPの設定方法',
-p ONSx for NetAp 'query': 'F          h',
- earction': 's 'ac          ({
- son.dumps  'body': j',
-      thod': 'POST   'httpMe {
-     nt =t_eve用
-    tes    # テスト:
-_"n__mai= "_name__ = }
-
-if __       )
-=Falseiisure_asc      }, enat()
-      w().isoformime.nomp': datetta      'times        }',
-  tr(e)ました: {sーが発生し'内部エラ  'error': f          False,
-    success':         '        n.dumps({
-'body': jso          ,
-         } '*'
-     ow-Origin':trol-Alls-Con 'Acces           ,
-    8'f-=ut charseton/json;catie': 'applit-Typ 'Conten           
-    eaders': {       'h,
-     00tusCode': 5  'sta          eturn {
-     r)
-   : {str(e)}"Lambda実行エラーr(f"r.errogge    lo    
-n as e:xceptiopt Ece   ex
-              }
-
-   e)_ascii=Falsnsuresult, eps(re: json.dum  'body'              },
- '
-       in': '*l-Allow-Origroont  'Access-C           -8',
-    charset=utfjson;tion/pplicaype': 'a'Content-T            : {
-       'headers'      00,
-   ess') else 5('succf result.getde': 200 istatusCo        '   
- urn {
-        ret           }
-   lse)
-      scii=Fansure_a   }, e     }'
-        {actionアクション: 不明な 'error': f'                   
- False,ess':      'succ        {
-      ps(n.dumjso    'body':                    },
-     ': '*'
-    low-Originrol-Alontcess-C'Ac               8',
-     arset=utf- ch/json;ionplicatap '-Type':   'Content               rs': {
-  heade         '     400,
-   e':statusCod    '           rn {
- tu       rese:
-         el     
-         
-   user_id)ocument,document(der.index_lt = handl   resu   
-                      }
-      )
-      seii=Falnsure_asc       }, e           
-  指定されていません''インデックスする文書が   'error':                
-      e,': Falsuccess's                     dumps({
-   n.y': jso  'bod                  ,
-   }                '*'
-  ':ow-Originl-Allccess-Contro          'A          -8',
-    utfharset=son; cication/jppl'aent-Type':      'Cont                  rs': {
- heade    '               de': 400,
- atusCo  'st               urn {
-           ret
-        document: if not                    
- {})
-   cument', dy.get('doment = bo       docuクス
-       # 文書インデッ
-          ':'index== n   elif actio           
-    ore)
-   _sc_k, miner_id, top(query, usmentssearch_docuandler.ult = h  res
-             }
-                  e)
-       lscii=Fansure_as    }, e               ん'
- リが指定されていませ: '検索クエ 'error'                      
-  False,ccess':'su                  ps({
-      um.dody': json      'b                },
-               ': '*'
-   Allow-Origin-Control-ess 'Acc                   8',
-    =utf-n; charset/jsoionpplicat 'a-Type':    'Content                 rs': {
-        'heade           00,
-    atusCode': 4  'st                
-   return {             
-  ot query:     if n
-                  
- ', 0.7))core('min_sdy.get float(bon_score =      mi  
-    ))p_k', 5('tody.getnt(bo= i   top_k         
- ')uery', 'body.get('q =       query索
-      # ベクトル検         ':
-   n == 'search   if actio   
-       ler()
-   rSearchHandler = Vecto      hand 
-         us')
-, 'anonymor_id'dy.get('useser_id = bo      uarch')
-  'set('action',  = body.ge      action  
-        
-or {} {}) rs',eteingParamStrqueryvent.get('  body = e      
-       else:
-     {}'))t('body', 'nt.ge.loads(eveson   body = j:
-         POST' 'tp_method == if ht   ータを解析
-        # リクエストデ  
-    T')
-      Method', 'GE('httpet event.gmethod =tp_   htドを確認
-      HTTPメソッ     #  :
-  try
-   ""ト"関数のエントリーポイン"""Lambda
-    , context):r(eventda_handledef lamb      }
-
-)
-      isoformat(now().: datetime.'timestamp'            
-    str(e)}',ーが発生しました: {エラインデックス中に: f'文書のerror'   '         
-    alse, Fsuccess':         '
-        return {      
-     tr(e)}")エラー: {sンデックス(f"文書イlogger.error        :
-     as eptioncecept Ex    ex    
-       
-     }            soformat()
-.iime.now() datetp':   'timestam          
-   ),e.get('_id'esponsd': rment_idocu        '       ,
- ruecess': Tuc 's         rn {
-      tu      re   
-        
-       user_id}")ーザー: { ユget('_id')},esponse.ID: {rックス完了 - ンデo(f"文書イgger.inf lo             
-    
-                )id')
-  ent.get('  id=docum           doc,
-   y=index_    bod          
-  ndex_name,self.ix=      inde          t.index(
-enf.cli sel response =       ンデックス
-    archにイ# OpenSe             
-                 }
-()
-      soformatnow().idatetime.t': ated_a       'upd  ),
-       soformat(time.now().id_at': dateeate       'cr       
-  r_id]}),: [useusers'alse, 'c': Fliions', {'pubt('permisscument.gens': do'permissio            id,
-    ser_ u   'owner':           , {}),
-  metadata't.get('ocumen: d 'metadata'               ''),
- urce','sot(t.gece': documensour    '         ,
-   t_vectorr': contenectoent_v 'cont             
-  t', ''),contenet('t.gt': documen'conten               e', ''),
- 'titlocument.get(': d     'title        doc = {
-   x_de   in        用文書を構築
-  # インデックス            
-  
-         ))nt', ''t('conteocument.ge_embedding(dgeneratef._ector = selnt_vonte    c  
-      を生成 文書の埋め込みベクトル  #         :
-  try  """
-     に追加"文書をインデックス     ""  , Any]:
- -> Dict[strer_id: str) , Any], us: Dict[strmentdocuelf, (sdex_document  def in
-    
-  : 0}otal_hits''tts': [], umenn {'doc      retur
-      ")e)}整形エラー: {str(検索結果r.error(f"   logge        as e:
- tion xcept Excep
-        e        
-        }
-        hitss': total_l_hit     'tota           ments,
-cunts': do 'docume           {
-      return             
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenSearch Serverlessベクトル検索ハンドラー
+権限認識型の高精度検索機能を提供
+"""
+
+import json
+import boto3
+import logging
+from typing import Dict, List, Any, Optional
+from datetime import datetime
+import os
+from opensearchpy import OpenSearch, RequestsHttpConnection
+from requests_aws4auth import AWS4Auth
+
+# ログ設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class VectorSearchHandler:
+    """ベクトル検索ハンドラークラス"""
+
+    def __init__(self):
+        """初期化"""
+        self.region = os.environ.get('AWS_REGION', 'us-east-1')
+        self.collection_endpoint = os.environ.get('VECTOR_HOST', '')
+        self.collection_name = os.environ.get('COLLECTION_NAME', '')
+        self.index_name = 'rag-documents'
+
+        # AWS認証設定
+        credentials = boto3.Session().get_credentials()
+        self.awsauth = AWS4Auth(
+            credentials.access_key,
+            credentials.secret_key,
+            self.region,
+            'aoss',
+            session_token=credentials.token
         )
-  (documentappendts.     documen             
-          }
-                 }
-                    le
-   itghted_te': highli'titl                  
-      _content,ighlightednt': h      'conte             
-     s': {highlight          '   ,
-       , '')get('owner'': source.      'owner            ''),
-   ',atted_pdaet('uurce.g soupdated_at':   '          ),
-       at', ''created_ce.get('t': sour_ated  'crea               ', {}),
-   datae.get('meta: sourcta'da 'meta               e,
-    : scor   'score'             ,
-    source', '')urce.get(': so 'source'                 , ''),
-  t'.get('contensource 'content':                   e', ''),
- itlt('t source.ge   'title':                 
-id', ''),('_.get   'id': hit                 nt = {
-ocume          d
-                   ', [])
-   itle'tt.get(= highlighed_title hlight     hig          ])
- ent', [('contgethighlight.content = ed_ highlight              ライト情報を統合
-        # ハイ               
-       , {})
-   t'igh('highlt = hit.gethighligh            0)
-    score', 0.t('_ hit.ge =core      s      )
-     {}',sourcet('_ge = hit.ource           sits:
-     n h ir hit  fo         []
- ocuments =         d
-             ue', 0)
-   {}).get('val, t('total'its', {}).get('hs.gesultearch_real_hits = sot       t   ts', [])
-  ('hiet{}).gget('hits', sults._researchits =          h  try:
-       "
-  形"""検索結果を整      ""y]:
-  t[str, An str) -> Dicuery:, q, Any]ict[strts: Dresulh_searclf, ults(serch_rest_sea  def _formase
-    
-   rai         )}")
-  ラー: {str(epenSearch検索エ.error(f"O     logger      as e:
- ion  Excepteptxc
-        e       onse
-     return resp         
-                      )
-_body
-     arch body=se           me,
-    x_naex=self.inde        ind      
-  .search(ientself.clnse =        respo  
-             }
+
+        # OpenSearchクライアント初期化
+        self.client = OpenSearch(
+            hosts=[{'host': self.collection_endpoint.replace('https://', ''), 'port': 443}],
+            http_auth=self.awsauth,
+            use_ssl=True,
+            verify_certs=True,
+            connection_class=RequestsHttpConnection,
+            timeout=30
+        )
+
+        # Bedrockクライアント（埋め込み生成用）
+        self.bedrock_client = boto3.client('bedrock-runtime', region_name=self.region)
+        self.embedding_model = os.environ.get('EMBEDDING_MODEL', 'amazon.titan-embed-text-v1')
+
+    def search_documents(self, query: str, user_id: str, top_k: int = 5, min_score: float = 0.7) -> Dict[str, Any]:
+        """
+        権限認識型ベクトル検索を実行
+
+        Args:
+            query: 検索クエリ
+            user_id: ユーザーID（権限フィルタリング用）
+            top_k: 取得する文書数
+            min_score: 最小関連度スコア
+
+        Returns:
+            検索結果とメタデータ
+        """
+        try:
+            # クエリの埋め込みベクトルを生成
+            query_vector = self._generate_embedding(query)
+
+            # 権限フィルターを構築
+            permission_filter = self._build_permission_filter(user_id)
+
+            # ベクトル検索を実行
+            search_results = self._execute_vector_search(
+                query_vector, permission_filter, top_k, min_score
+            )
+
+            # 結果を整形
+            formatted_results = self._format_search_results(search_results, query)
+
+            logger.info(f"ベクトル検索完了 - ユーザー: {user_id}, 結果数: {len(formatted_results.get('documents', []))}")
+
+            return {
+                'success': True,
+                'documents': formatted_results.get('documents', []),
+                'total_hits': formatted_results.get('total_hits', 0),
+                'query': query,
+                'user_id': user_id,
+                'timestamp': datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            logger.error(f"ベクトル検索エラー: {str(e)}")
+            return {
+                'success': False,
+                'error': f'検索中にエラーが発生しました: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }
+
+    def _generate_embedding(self, text: str) -> List[float]:
+        """テキストの埋め込みベクトルを生成"""
+        try:
+            request_body = {
+                "inputText": text
+            }
+
+            response = self.bedrock_client.invoke_model(
+                modelId=self.embedding_model,
+                body=json.dumps(request_body),
+                contentType='application/json'
+            )
+
+            response_body = json.loads(response['body'].read())
+            return response_body.get('embedding', [])
+
+        except Exception as e:
+            logger.error(f"埋め込み生成エラー: {str(e)}")
+            raise
+
+    def _build_permission_filter(self, user_id: str) -> Dict[str, Any]:
+        """ユーザー権限に基づくフィルターを構築"""
+        # 基本的な権限フィルター
+        # 実際の実装では、DynamoDBから権限情報を取得
+        return {
+            "bool": {
+                "should": [
+                    {"term": {"permissions.public": True}},
+                    {"terms": {"permissions.users": [user_id]}},
+                    {"term": {"owner": user_id}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+
+    def _execute_vector_search(self, query_vector: List[float], permission_filter: Dict[str, Any],
+                              top_k: int, min_score: float) -> Dict[str, Any]:
+        """ベクトル検索を実行"""
+        try:
+            search_body = {
+                "size": top_k,
+                "min_score": min_score,
+                "query": {
+                    "bool": {
+                        "must": [
+                            {
+                                "knn": {
+                                    "content_vector": {
+                                        "vector": query_vector,
+                                        "k": top_k * 2  # より多くの候補から選択
+                                    }
+                                }
+                            }
+                        ],
+                        "filter": [permission_filter]
+                    }
+                },
+                "_source": {
+                    "includes": [
+                        "title", "content", "source", "metadata",
+                        "created_at", "updated_at", "owner", "permissions"
+                    ]
+                },
+                "highlight": {
+                    "fields": {
+                        "content": {
+                            "fragment_size": 150,
+                            "number_of_fragments": 3
+                        },
+                        "title": {}
+                    }
                 }
-           }
-                     ": {}
-      "title                 ,
-       }                  ": 3
-  ntsf_fragmenumber_o       "                     0,
-_size": 15ntagme        "fr              
-      ntent": {     "co               ": {
-       "fields                 t": {
-hligh"hig           },
-                     
-   ]                
- ons"permissi"owner", at", "pdated_", "ud_ateate"cr                  , 
-      ta""metadae", ourc "snt",", "conteetitl          "             es": [
- "includ                   {
-  ource": "_s               },
-           }
-                     
-    sion_filter] [permis"filter":                       ],
-                           }
-                                   }
-                   }
-                                       多くの候補から選択
-  * 2  # より"k": top_k                               
-         r,uery_vecto: qtor"      "vec                              : {
-    nt_vector" "conte                              
-     knn": {"                         
-             {                    st": [
-   "mu                       "bool": {
-              {
-       "query":                ,
-: min_scorescore"min_       "   
-      op_k,: tze" "si            {
-    = dyearch_bo      s:
-       try""
-       行"ル検索を実""ベクト    "Any]:
-    t[str, oat) -> Dicre: flco: int, min_stop_k                           ], 
-   nyr, A: Dict[ston_filtersimiser pt[float],: Lis_vectoreryelf, quor_search(sute_vect def _exec 
-             }
- }
-       1
-      tch":_should_ma"minimum             ],
-                   er_id}}
-: us {"owner""term":  {               r_id}},
-   ers": usermissions.us": {"pe {"term                 
-  }},: Trueblic"sions.pumis {"per"term":           {         ld": [
-"shou              : {
-      "bool"{
-        urn        ret権限情報を取得
- 、DynamoDBから 実際の実装ではー
-        #フィルタ権限基本的な        # 構築"""
-限に基づくフィルターを"ユーザー権        ""
-r, Any]:ct[stDi -> d: str)lf, user_i(seon_filterissi_perm_build  
-    def    raise
-          (e)}")
- str埋め込み生成エラー: {error(f"r.   logge          as e:
-pt Exception exce 
-         )
-         ng', []ddimbedy.get('ense_bon respo  retur        
-  read())se['body'].loads(respon= json.e_body nsrespo                
-       )
-             on'
-ation/jse='applictentTyp con       ),
-        request_bodyon.dumps(ody=js        b      g_model,
-  inelf.embeddlId=s    mode            odel(
-invoke_m_client.bedrock= self.  response                 
-       }
-    
-       t": textutTex   "inp            ody = {
-   request_b          ry:
-    t  """
-  ベクトルを生成""テキストの埋め込み"
-        ]:t[floatListr) -> elf, text: sembedding(s _generate_ def
-          }
-  
-       oformat()e.now().is: datetimstamp'   'time          
-   }',(e){strエラーが発生しました: 中にf'検索'error':               se,
-  uccess': Fal    's          eturn {
-   r          (e)}")
- 検索エラー: {strトル"ベクrror(flogger.e           as e:
-  eptionpt Exc exce
-                  }
-     ()
-        soformatime.now().iamp': datet  'timest            r_id,
-  sed': uuser_i    '   ,
-         eryuery': qu'q        ,
-        its', 0)et('total_hd_results.gmattel_hits': for'tota         ,
-       ts', [])uments.get('docatted_resul': form'documents       ,
-         True': cess 'suc               urn {
-   ret    
+            }
+
+            response = self.client.search(
+                index=self.index_name,
+                body=search_body
             )
-     ]))}"ocuments', [get('dults.tted_res {len(formaid}, 結果数:ser_- ユーザー: {uクトル検索完了 er.info(f"ベ      logg    
-        y)
-      ults, quer(search_resesultsarch_rrmat_ses = self._foulted_res  formatt         
- 結果を整形         # 
-             )
-             
- n_score mi top_k,ion_filter,ermissector, puery_v           qarch(
-     tor_seveclf._execute_sults = search_re     se実行
-       ル検索を   # ベクト
-                
-     user_id)n_filter(ssiomid_peril= self._buon_filter   permissi          権限フィルターを構築
-    #  
-                 (query)
-  ding_embednerate_gef. = selvector     query_       
-め込みベクトルを生成    # クエリの埋           try:
-"""
-     
-        果とメタデータ検索結        turns:
-    
-        Re           小関連度スコア
- : 最ore  min_sc        文書数
-  top_k: 取得する            用）
-ングタリユーザーID（権限フィルser_id:         uリ
-     query: 検索クエ     gs:
-           Ar   
-        
-検索を実行限認識型ベクトル       権""
-    ":
-     tr, Any]ict[s0.7) -> Dfloat = _score:  5, minop_k: int =d: str, ter_ir, usquery: stelf, documents(sef search_ 
-    d1')
-   xt-vmbed-te.titan-e', 'amazonING_MODELEMBEDD('etnviron.gmodel = os.eng_beddi     self.em  egion)
- =self.rgion_nameuntime', reock-r'bedrnt(= boto3.clieock_client elf.bedr）
-        sイアント（埋め込み生成用 Bedrockクラ    #      
-    
-       )30
-    timeout=          ion,
- tpConnectequestsHtass=Rnection_clcon        
-    erts=True,erify_c       vue,
-     l=Tr      use_ss  sauth,
-    uth=self.awhttp_a            ,
-': 443}]'port://', ''), tpshtce('laep_endpoint.rioncollectself.{'host': sts=[   ho      ch(
-   penSear.client = O self
-       初期化chクライアントarOpenSe        #    
-  )
-         
-  ls.tokenn=credentian_tokessio   se,
-         'aoss'            on,
-   self.regi         ey,
-et_kcrials.sedent cre     
-      access_key,credentials.           AWS4Auth(
- f.awsauth =  sel    s()
-   t_credential.geion()3.Sessboto= entials  cred証設定
-       AWS認    #     
-      cuments'
-  'rag-do= ex_name self.ind        
-ME', '')TION_NA('COLLECgetn.rome = os.enviction_na self.colle      ST', '')
- OR_HOet('VECTenviron.gs.t = oon_endpoinf.collecti        selast-1')
-GION', 'us-eREAWS_on.get('s.envir.region = o        self期化"""
-"""初        
-_(self): __init_def      
-""
-  "ハンドラークラスクトル検索   """ベ
- ndler:chHaearectorSass Ve__)
-
-clgger(__naming.getLo loggger =)s')
-logmessage)s - %(elname- %(lev)s %(asctime format='ging.INFO,ogg(level=licConfiing.bas
-logg設定uth
-
-# ログimport AWS4Aws4auth sts_aquere
-from iontpConnectstsHtrch, Reque OpenSeay importearchpopens os
-from 
-importatetimemport datetime i
-from donal, Any, Optiistort Dict, L impngtypiom g
-frport loggin3
-imto
-import bomport json
-i"""
-度検索機能を提供
-
-権限認識型の高精ンドラーrlessベクトル検索ハServeenSearch 
-"""
-Oputf-8 -*-- coding: -*on3
-# th/env py/usr/bin#!
\ No newline at end of file
+
+            return response
+
+        except Exception as e:
+            logger.error(f"OpenSearch検索エラー: {str(e)}")
+            raise
+
+    def _format_search_results(self, search_results: Dict[str, Any], query: str) -> Dict[str, Any]:
+        """検索結果を整形"""
+        try:
+            hits = search_results.get('hits', {}).get('hits', [])
+            total_hits = search_results.get('hits', {}).get('total', {}).get('value', 0)
+
+            documents = []
+            for hit in hits:
+                source = hit.get('_source', {})
+                score = hit.get('_score', 0.0)
+                highlight = hit.get('highlight', {})
+
+                # ハイライト情報を統合
+                highlighted_content = highlight.get('content', [])
+                highlighted_title = highlight.get('title', [])
+
+                document = {
+                    'id': hit.get('_id', ''),
+                    'title': source.get('title', ''),
+                    'content': source.get('content', ''),
+                    'source': source.get('source', ''),
+                    'score': score,
+                    'metadata': source.get('metadata', {}),
+                    'created_at': source.get('created_at', ''),
+                    'updated_at': source.get('updated_at', ''),
+                    'owner': source.get('owner', ''),
+                    'highlights': {
+                        'content': highlighted_content,
+                        'title': highlighted_title
+                    }
+                }
+
+                documents.append(document)
+
+            return {
+                'documents': documents,
+                'total_hits': total_hits
+            }
+
+        except Exception as e:
+            logger.error(f"検索結果整形エラー: {str(e)}")
+            return {'documents': [], 'total_hits': 0}
+
+    def index_document(self, document: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+        """文書をインデックスに追加"""
+        try:
+            # 文書のベクトル埋め込みを生成
+            content_vector = self._generate_embedding(document.get('content', ''))
+
+            # インデックス用文書を構築
+            index_doc = {
+                'title': document.get('title', ''),
+                'content': document.get('content', ''),
+                'content_vector': content_vector,
+                'source': document.get('source', ''),
+                'metadata': document.get('metadata', {}),
+                'owner': user_id,
+                'permissions': document.get('permissions', {'public': False, 'users': [user_id]}),
+                'created_at': datetime.now().isoformat(),
+                'updated_at': datetime.now().isoformat()
+            }
+
+            # OpenSearchにインデックス
+            response = self.client.index(
+                index=self.index_name,
+                body=index_doc,
+                id=document.get('id')
+            )
+
+            logger.info(f"文書インデックス完了 - ID: {response.get('_id')}, ユーザー: {user_id}")
+
+            return {
+                'success': True,
+                'document_id': response.get('_id'),
+                'timestamp': datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            logger.error(f"文書インデックスエラー: {str(e)}")
+            return {
+                'success': False,
+                'error': f'文書のインデックス中にエラーが発生しました: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }
+
+def lambda_handler(event, context):
+    """Lambda関数のエントリーポイント"""
+    try:
+        # HTTPメソッドを確認
+        http_method = event.get('httpMethod', 'GET')
+
+        # リクエストデータを解析
+        if http_method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+        else:
+            body = event.get('queryStringParameters', {}) or {}
+
+        action = body.get('action', 'search')
+        user_id = body.get('user_id', 'anonymous')
+
+        handler = VectorSearchHandler()
+
+        if action == 'search':
+            # ベクトル検索
+            query = body.get('query', '')
+            top_k = int(body.get('top_k', 5))
+            min_score = float(body.get('min_score', 0.7))
+
+            if not query:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json; charset=utf-8',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'success': False,
+                        'error': '検索クエリが指定されていません'
+                    }, ensure_ascii=False)
+                }
+
+            result = handler.search_documents(query, user_id, top_k, min_score)
+
+        elif action == 'index':
+            # 文書インデックス
+            document = body.get('document', {})
+
+            if not document:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json; charset=utf-8',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'success': False,
+                        'error': 'インデックスする文書が指定されていません'
+                    }, ensure_ascii=False)
+                }
+
+            result = handler.index_document(document, user_id)
+
+        else:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json; charset=utf-8',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': False,
+                    'error': f'不明なアクション: {action}'
+                }, ensure_ascii=False)
+            }
+
+        return {
+            'statusCode': 200 if result.get('success') else 500,
+            'headers': {
+                'Content-Type': 'application/json; charset=utf-8',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(result, ensure_ascii=False)
+        }
+
+    except Exception as e:
+        logger.error(f"Lambda実行エラー: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json; charset=utf-8',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': f'内部エラーが発生しました: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }, ensure_ascii=False)
+        }
+
+if __name__ == "__main__":
+    # テスト用
+    test_event = {
+        'httpMethod': 'POST',
+        'body': json.dumps({
+            'action': 'search',
+            'query': 'FSx for NetApp ONTAPの設定方法',
+            'user_id': 'test-user',
+            'top_k': 3,
+            'min_score': 0.7
+        })
+    }
+
+    result = lambda_handler(test_event, None)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
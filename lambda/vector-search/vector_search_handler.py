@@ -1,136 +1,136 @@
-      })
-  scii=Falseure_aens         }, ormat()
-   ow().isof datetime.n':estamp       'tim   )}',
-      (eました: {str発生しf'内部エラーが  'error':             e,
-  lsess': Fa 'succ            ({
-   mps json.dudy':'bo                },
-     n': '*'
-   llow-Origirol-As-Cont 'Acces          ',
-     rset=utf-8n; cha/jsotionca 'applit-Type': 'Conten               rs': {
-'heade         500,
-    usCode':tat          'srn {
-      retu")
-    )}str(eラー: {Lambda実行エr(f"rrologger.e        on as e:
-t Excepti  excep     
-      }
-   e)
-    ii=Fals ensure_ascs(result,: json.dump   'body'             },
-        igin': '*'
-w-OrAllo-Control-'Access                8',
-set=utf-son; charon/jplicatiype': 'apt-Tennt     'Co    {
-        ':eaders'h           500,
-  ess') elset.get('succsul00 if rede': 2statusCo '       n {
-         retur      
-   op_k)
-  , user_id, teryts(qu_documenler.search= hand result 
-       er()earchHandlorSer = Vectandl h           
-    }
-           alse)
- i=Fasci ensure_        },      れていません'
-  '検索クエリが指定さ 'error':             
-       ,seuccess': Fal 's               s({
-    n.dumpso 'body': j                    },
-          *'
- w-Origin': 'ol-Alloss-Contrcce  'A         
-         8',utf-harset=ion/json; cat'applicype': ontent-T'C                   
- ders': {   'hea            de': 400,
- Costatus           '     {
- rn   retu       query:
-     if not    
-      
-    )top_k', 5)get(' int(body.  top_k =  ous')
-     'anonym_id',t('userbody.ge_id =        user, '')
- query'get('body. query =      }'))
-  ('body', '{.gets(event.loadbody = json        エストデータを解析
-    # リク   
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenSearch Serverlessベクトル検索ハンドラー
+権限認識型の高精度検索機能を提供
+"""
+
+import json
+import boto3
+import logging
+from typing import Dict, List, Any, Optional
+from datetime import datetime
+import os
+
+# ログ設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class VectorSearchHandler:
+    """ベクトル検索ハンドラークラス"""
+
+    def __init__(self):
+        """初期化"""
+        self.region = os.environ.get('AWS_REGION', 'us-east-1')
+        self.collection_endpoint = os.environ.get('VECTOR_HOST', '')
+        self.collection_name = os.environ.get('COLLECTION_NAME', '')
+        self.index_name = 'rag-documents'
+
+        # Bedrockクライアント（埋め込み生成用）
+        self.bedrock_client = boto3.client('bedrock-runtime', region_name=self.region)
+        self.embedding_model = os.environ.get('EMBEDDING_MODEL', 'amazon.titan-embed-text-v1')
+
+    def search_documents(self, query: str, user_id: str, top_k: int = 5) -> Dict[str, Any]:
+        """
+        権限認識型ベクトル検索を実行
+
+        Args:
+            query: 検索クエリ
+            user_id: ユーザーID（権限フィルタリング用）
+            top_k: 取得する文書数
+
+        Returns:
+            検索結果とメタデータ
+        """
+        try:
+            # 簡易実装：模擬検索結果を返す
+            mock_results = [
+                {
+                    'id': 'doc1',
+                    'title': 'FSx for NetApp ONTAP概要',
+                    'content': 'Amazon FSx for NetApp ONTAPは、NetApp ONTAPファイルシステムを基盤とするフルマネージドサービスです。高い信頼性で高性能のストレージを提供し、エンタープライズアプリケーションに最適です。',
+                    'source': 'aws-documentation',
+                    'score': 0.95,
+                    'metadata': {'category': 'storage', 'language': 'ja'},
+                    'created_at': '2025-10-06T10:00:00Z',
+                    'owner': user_id
+                },
+                {
+                    'id': 'doc2',
+                    'title': 'FSx ONTAP設定ガイド',
+                    'content': 'FSx for NetApp ONTAPの設定手順について説明します。VPC設定、セキュリティグループの設定、アクセス権限が重要です。',
+                    'source': 'setup-guide',
+                    'score': 0.88,
+                    'metadata': {'category': 'configuration', 'language': 'ja'},
+                    'created_at': '2025-10-06T09:30:00Z',
+                    'owner': user_id
+                }
+            ]
+
+            logger.info(f"ベクトル検索完了 - ユーザー: {user_id}, 結果数: {len(mock_results)}")
+
+            return {
+                'success': True,
+                'documents': mock_results[:top_k],
+                'total_hits': len(mock_results),
+                'query': query,
+                'user_id': user_id,
+                'timestamp': datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            logger.error(f"ベクトル検索エラー: {str(e)}")
+            return {
+                'success': False,
+                'error': f'検索中にエラーが発生しました: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }
+
+def lambda_handler(event, context):
+    """Lambda関数のエントリーポイント"""
     try:
- ポイント"""bda関数のエントリー"Lam
-    "" context):(event,da_handler
-def lamb       }
-    rmat()
- ow().isofoatetime.ntamp': des      'tim        
-  ',r(e)}: {stーが発生しました'検索中にエラ 'error': f     
-          False,s':     'succes        {
-        return    }")
-     str(e): {"ベクトル検索エラー(for.errlogger           e:
- on as t Exceptiep  exc
-               }
-            ormat()
-   .isofime.now()': datet'timestamp                er_id,
-r_id': us    'use         
-   ery': query, 'qu              
- ck_results),its': len(mo  'total_h        _k],
-      lts[:topmock_resuocuments':      'd      ,
-     ccess': True        'su  
-      eturn {           r      
-       sults)}")
-_re(mock果数: {len_id}, 結 {userー:了 - ユーザ"ベクトル検索完o(f  logger.inf             
- ]
-                      }
-         
-     ': user_ider 'own          
-         0Z',6T09:30:025-01-0': '20eated_at    'cr              'ja'},
-   e':', 'languagrationfiguy': 'conategor {'ca':tadat      'me            8,
-  e': 0.8or        'sc           -guide',
- : 'setup  'source'           
-       す。',が重要で、アクセス権限の設定ープC設定、セキュリティグルます。VP明して説の設定手順につい ONTAPetApp: 'FSx for Nnt'   'conte           ド',
-      TAP設定ガイx ON'FS:     'title'                ', 
-': 'doc2      'id               {
-               },
-           
-     ': user_id'owner                    :00:00Z',
-01-06T10: '2025-ated_at'   'cre             },
-    : 'ja'age'ngutorage', 'lagory': 'sa': {'cate    'metadat             
-   ': 0.95,ore 'sc               ion',
-    atent 'aws-documource':   's            。',
-     プリケーションに最適ですイズアジを提供し、エンタープラで信頼性の高いストレー性能ージドサービスです。高ムを基盤とするフルマネステNTAPファイルシNetApp Op ONTAPは、x for NetApzon FS'Amant': onte'c                 ,
-   ONTAP概要'App Sx for Nettitle': 'F   '                
- doc1', '       'id':       
-          {         
-   lts = [ock_resu m           
-：模擬検索結果を返す# 簡易実装             try:
-    "
-    ""ータ
-         検索結果とメタデ         ns:
-       Retur  
-          る文書数
-  : 取得す   top_k         フィルタリング用）
-ユーザーID（権限d:       user_i  リ
-    : 検索クエ     query    
-   :    Args    
-      行
-  限認識型ベクトル検索を実 権  
-       """  ]:
-    ict[str, Any -> Dk: int = 5), top_r_id: strry: str, uses(self, querch_documentea 
-    def s1')
-   -vtextd-n.titan-embe 'amazoMODEL',DDING_n.get('EMBEnviroos.eg_model = lf.embeddin  se)
-      gioname=self.re_nme', regionrock-runti('bedoto3.clientnt = brock_clie.bedelf      s込み生成用）
-  イアント（埋めockクラ     # Bedr
-        ments'
-   ag-docux_name = 'rde.in self    ', '')
-   AMEOLLECTION_Nron.get('Cs.envion_name = olf.collecti    se, '')
-    OST''VECTOR_Hviron.get(.en osendpoint =tion_ self.collec       1')
-us-east-N', ''AWS_REGIOiron.get(n = os.envegioself.r     "
-   """"初期化":
-        _(self) __init_  def    
-  クラス"""
-ハンドラートル検索"ベク"
-    "chHandler:earass VectorS_)
-
-clgger(__name_getLogging.
-logger = loge)s')(messas - %me)navel%(le - '%(asctime)sformat=g.INFO, vel=logginConfig(leogging.basic設定
-l
-
-# ログ osme
-importeti import datrom datetimeal
-fAny, OptionDict, List,  import typingg
-from  loggino3
-importbotson
-import port j"
-
-im"提供
-"型の高精度検索機能を索ハンドラー
-権限認識クトル検essベ Serverl
-OpenSearch"""-8 -*-
- coding: utf3
-# -*-on pythusr/bin/env#!/
\ No newline at end of file
+        # リクエストデータを解析
+        body = json.loads(event.get('body', '{}'))
+        query = body.get('query', '')
+        user_id = body.get('user_id', 'anonymous')
+        top_k = int(body.get('top_k', 5))
+
+        if not query:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json; charset=utf-8',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': False,
+                    'error': '検索クエリが指定されていません'
+                }, ensure_ascii=False)
+            }
+
+        handler = VectorSearchHandler()
+        result = handler.search_documents(query, user_id, top_k)
+
+        return {
+            'statusCode': 200 if result.get('success') else 500,
+            'headers': {
+                'Content-Type': 'application/json; charset=utf-8',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(result, ensure_ascii=False)
+        }
+
+    except Exception as e:
+        logger.error(f"Lambda実行エラー: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json; charset=utf-8',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': f'内部エラーが発生しました: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }, ensure_ascii=False)
+        }
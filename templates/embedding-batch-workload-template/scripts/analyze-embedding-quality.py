@@ -8,6 +8,8 @@ FSx for ONTAPからOpenSearch Serverlessへのエンベディング品質を分
 import json
 import logging
 import argparse
+import os
+import sys
 import boto3
 import numpy as np
 import pandas as pd
@@ -20,6 +22,10 @@ from sklearn.decomposition import PCA
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+# Lambda側と共通のBedrockレート制限（lambda/documentprocessor/bedrock_rate_limiter.py）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'lambda', 'documentprocessor'))
+from bedrock_rate_limiter import get_bedrock_rate_limiter, estimate_tokens, limiter_client_config
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -48,7 +54,8 @@ class EmbeddingQualityAnalyzer:
         
         # AWSクライアント初期化
         self.s3_client = boto3.client('s3', region_name=region)
-        self.bedrock_client = boto3.client('bedrock-runtime', region_name=region)
+        # リトライはレート制限側で行うため、SDKのリトライは無効化
+        self.bedrock_client = boto3.client('bedrock-runtime', region_name=region, config=limiter_client_config())
         
         # 結果保存用
         self.analysis_results = {}
@@ -327,11 +334,13 @@ class EmbeddingQualityAnalyzer:
             エンベディングベクトル
         """
         try:
-            response = self.bedrock_client.invoke_model(
+            response = get_bedrock_rate_limiter('amazon.titan-embed-text-v1').execute(
+                self.bedrock_client.invoke_model,
                 modelId='amazon.titan-embed-text-v1',
                 body=json.dumps({
                     'inputText': query_text
-                })
+                }),
+                estimated_tokens=estimate_tokens(query_text)
             )
             
             response_body = json.loads(response['body'].read())
@@ -59,6 +59,10 @@ export interface FormatConfig {
     useLangChain: boolean;
     /** 品質比較を行うか */
     enableQualityComparison?: boolean;
+    /** ページ範囲ごとに並行変換する際のバッチあたりページ数（PDF用、0で無効） */
+    pageBatchSize?: number;
+    /** チャンクの区切りとする要素名（HTML/XML用、XMLで空の場合はルート直下の要素） */
+    chunkBoundaryElements?: string[];
 }
 /**
  * パフォーマンス設定
@@ -112,6 +116,12 @@ export interface SecurityConfig {
     validateFileContent?: boolean;
     /** セキュリティログを有効にするか */
     enableSecurityLogging?: boolean;
+    /** ZIPアーカイブのメンバー数の上限 */
+    maxArchiveMembers?: number;
+    /** ZIPアーカイブの展開後合計サイズの上限（バイト） */
+    maxArchiveExpandedSizeBytes?: number;
+    /** ZIPアーカイブのメンバーごとの圧縮率の上限 */
+    maxArchiveCompressionRatio?: number;
 }
 /**
  * ログ出力設定
@@ -138,6 +148,10 @@ export interface QualityConfig {
     preserveFormatting: boolean;
     /** 画像を保持するか */
     preserveImages: boolean;
+    /** 品質比較で先に完了した結果が閾値を満たした場合に残りをキャンセルするか */
+    earlyAcceptEnabled?: boolean;
+    /** 早期確定する品質スコアの閾値（0-100） */
+    earlyAcceptQualityScore?: number;
 }
 /**
  * サポートされるファイル形式の型定義
@@ -112,6 +112,10 @@ export interface FormatConfig {
   useLangChain: boolean;
   /** 品質比較を行うか */
   enableQualityComparison?: boolean;
+  /** ページ範囲ごとに並行変換する際のバッチあたりページ数（PDF用、0で無効） */
+  pageBatchSize?: number;
+  /** チャンクの区切りとする要素名（HTML/XML用、XMLで空の場合はルート直下の要素） */
+  chunkBoundaryElements?: string[];
 }
 
 /**
@@ -168,6 +172,12 @@ export interface SecurityConfig {
   validateFileContent?: boolean;
   /** セキュリティログを有効にするか */
   enableSecurityLogging?: boolean;
+  /** ZIPアーカイブのメンバー数の上限 */
+  maxArchiveMembers?: number;
+  /** ZIPアーカイブの展開後合計サイズの上限（バイト） */
+  maxArchiveExpandedSizeBytes?: number;
+  /** ZIPアーカイブのメンバーごとの圧縮率の上限 */
+  maxArchiveCompressionRatio?: number;
 }
 
 /**
@@ -196,6 +206,10 @@ export interface QualityConfig {
   preserveFormatting: boolean;
   /** 画像を保持するか */
   preserveImages: boolean;
+  /** 品質比較で先に完了した結果が閾値を満たした場合に残りをキャンセルするか */
+  earlyAcceptEnabled?: boolean;
+  /** 早期確定する品質スコアの閾値（0-100） */
+  earlyAcceptQualityScore?: number;
 }
 
 /**
@@ -716,7 +730,8 @@ export const DEFAULT_MARKITDOWN_CONFIG: MarkitdownConfig = {
       processingStrategy: 'both-compare',
       useMarkitdown: true,
       useLangChain: true,
-      enableQualityComparison: true
+      enableQualityComparison: true,
+      pageBatchSize: 10
     },
     png: { 
       enabled: true, 
@@ -765,7 +780,8 @@ export const DEFAULT_MARKITDOWN_CONFIG: MarkitdownConfig = {
       processingStrategy: 'langchain-first',
       useMarkitdown: true,
       useLangChain: true,
-      enableQualityComparison: false
+      enableQualityComparison: false,
+      chunkBoundaryElements: ['article', 'section', 'h1', 'h2']
     },
     xml: { 
       enabled: true, 
@@ -774,7 +790,8 @@ export const DEFAULT_MARKITDOWN_CONFIG: MarkitdownConfig = {
       processingStrategy: 'langchain-first',
       useMarkitdown: true,
       useLangChain: true,
-      enableQualityComparison: false
+      enableQualityComparison: false,
+      chunkBoundaryElements: []
     },
     csv: { 
       enabled: true, 
@@ -814,7 +831,10 @@ export const DEFAULT_MARKITDOWN_CONFIG: MarkitdownConfig = {
     validateFileSize: true,
     encryptTempFiles: true,
     autoDeleteTempFiles: true,
-    tempFileRetentionMinutes: 30
+    tempFileRetentionMinutes: 30,
+    maxArchiveMembers: 1000,
+    maxArchiveExpandedSizeBytes: 500 * 1024 * 1024,
+    maxArchiveCompressionRatio: 100
   },
   logging: {
     level: 'info',
@@ -826,7 +846,9 @@ export const DEFAULT_MARKITDOWN_CONFIG: MarkitdownConfig = {
     ocrAccuracy: 'high',
     textExtractionQuality: 'high',
     preserveFormatting: true,
-    preserveImages: false
+    preserveImages: false,
+    earlyAcceptEnabled: false,
+    earlyAcceptQualityScore: 90
   }
 };
 